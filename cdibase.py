@@ -23,9 +23,15 @@ import flask
 
 from flask_mail import Mail # type: ignore
 
+from prog_code.util import cache_util
+from prog_code.util import db_util
+from prog_code.util import legacy_csv_import_util
 from prog_code.util import session_util
+from prog_code.util import zip_import_util
 from prog_code.util import file_util
 from prog_code.util import mail_util
+from prog_code.util import prebuilt_export_util
+from prog_code.util import report_util
 from prog_code.util import session_util
 
 app = flask.Flask(__name__)
@@ -35,6 +41,29 @@ if not app.config['NO_MAIL']:
     mail_util.init_mail(app)
 elif app.config['DEBUG_PRINT_EMAIL']:
     mail_util.DEBUG_PRINT_EMAIL = True
+if app.config.get('CHILD_ID_BLOCK_SIZE'):
+    db_util.CHILD_ID_BLOCK_SIZE = app.config['CHILD_ID_BLOCK_SIZE']
+if app.config.get('LEGACY_IMPORT_CHUNK_SIZE'):
+    legacy_csv_import_util.IMPORT_CHUNK_SIZE = \
+        app.config['LEGACY_IMPORT_CHUNK_SIZE']
+if app.config.get('ZIP_IMPORT_MAX_WORKERS'):
+    zip_import_util.ZIP_IMPORT_MAX_WORKERS = app.config['ZIP_IMPORT_MAX_WORKERS']
+if 'REPORT_MAX_WORKERS' in app.config:
+    report_util.REPORT_MAX_WORKERS = app.config['REPORT_MAX_WORKERS']
+if app.config.get('DUPLICATE_SNAPSHOT_POLICY'):
+    db_util.DUPLICATE_SNAPSHOT_POLICY = app.config['DUPLICATE_SNAPSHOT_POLICY']
+if app.config.get('EXPORT_CACHE_DIR'):
+    cache_util.EXPORT_CACHE_DIR = app.config['EXPORT_CACHE_DIR']
+if 'EXPORT_CACHE_MAX_BYTES' in app.config:
+    cache_util.EXPORT_CACHE_MAX_BYTES = app.config['EXPORT_CACHE_MAX_BYTES']
+if app.config.get('PREBUILT_EXPORT_DIR'):
+    prebuilt_export_util.PREBUILT_EXPORT_DIR = app.config['PREBUILT_EXPORT_DIR']
+if app.config.get('PREBUILT_EXPORT_DEBOUNCE'):
+    prebuilt_export_util.PREBUILT_EXPORT_DEBOUNCE = \
+        app.config['PREBUILT_EXPORT_DEBOUNCE']
+if app.config.get('PREBUILT_EXPORT_FORMAT'):
+    prebuilt_export_util.PREBUILT_EXPORT_FORMAT = \
+        app.config['PREBUILT_EXPORT_FORMAT']
 
 from prog_code.controller import access_data_controllers
 from prog_code.controller import account_controllers
@@ -96,6 +125,19 @@ def terms_of_service():
     )
 
 
+def start_background_tasks():
+    """Start work which runs alongside the web server like rebuilding exports.
+
+    Not run on import as worker processes for ZIP imports and reports import
+    this module again and should not each start their own scheduler.
+    """
+    if prebuilt_export_util.PREBUILT_EXPORT_FORMAT == None:
+        return
+
+    if app.config.get('PREBUILT_EXPORT_SCHEDULER', True):
+        prebuilt_export_util.start_scheduler()
+
+
 def disable_email():
     mail_util.DEBUG_PRINT_EMAIL = False
     mail_util.disable_mail()
@@ -64,7 +64,10 @@ CREATE TABLE snapshots
     num_languages INTEGER,
     cdi_type TEXT,
     hard_of_hearing INTEGER,
-    deleted INTEGER
+    deleted INTEGER,
+    fingerprint TEXT,
+    birthday_day INTEGER,
+    session_date_day INTEGER
 );
 
 CREATE TABLE users
@@ -83,11 +86,47 @@ CREATE TABLE users
 );
 
 CREATE INDEX `snapshot_id_index` ON `snapshot_content` (`snapshot_id` ASC);
+CREATE INDEX `snapshots_participant_index` ON `snapshots` (`study` ASC, `study_id` ASC);
+CREATE INDEX `snapshots_child_id_index` ON `snapshots` (`child_id` ASC);
+CREATE INDEX `snapshots_fingerprint_index` ON `snapshots` (`fingerprint` ASC);
+CREATE INDEX `snapshots_birthday_day_index` ON `snapshots` (`birthday_day` ASC);
+CREATE INDEX `snapshots_session_date_day_index` ON `snapshots` (`session_date_day` ASC);
 
-CREATE TABLE reservation
+CREATE TABLE snapshot_languages
 (
-    timestamp TEXT
+    snapshot_id INTEGER,
+    language TEXT
 );
+CREATE INDEX `snapshot_languages_language_index` ON `snapshot_languages` (`language` ASC, `snapshot_id` ASC);
+CREATE INDEX `snapshot_languages_snapshot_index` ON `snapshot_languages` (`snapshot_id` ASC);
+
+CREATE TABLE snapshot_changes
+(
+    sequence INTEGER PRIMARY KEY,
+    snapshot_id INTEGER,
+    operation TEXT,
+    study TEXT
+);
+CREATE INDEX `snapshot_changes_snapshot_index` ON `snapshot_changes` (`snapshot_id` ASC, `sequence` ASC);
+
+CREATE TABLE snapshot_report_rows
+(
+    snapshot_id INTEGER,
+    format TEXT,
+    format_version TEXT,
+    row TEXT,
+    change_sequence INTEGER,
+    PRIMARY KEY (snapshot_id, format)
+);
+
+CREATE TABLE id_sequences
+(
+    name TEXT PRIMARY KEY,
+    next_value INTEGER
+);
+
+INSERT INTO id_sequences VALUES ('child_id', 1);
+INSERT INTO id_sequences VALUES ('data_version', 1);
 
 CREATE TABLE consent_settings (
     study TEXT,
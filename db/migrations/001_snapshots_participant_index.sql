@@ -0,0 +1 @@
+CREATE INDEX IF NOT EXISTS `snapshots_participant_index` ON `snapshots` (`study` ASC, `study_id` ASC);
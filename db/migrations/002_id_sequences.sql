@@ -0,0 +1,21 @@
+CREATE TABLE id_sequences
+(
+    name TEXT PRIMARY KEY,
+    next_value INTEGER
+);
+
+INSERT INTO id_sequences (name, next_value) SELECT 'child_id', MAX(
+    (SELECT COALESCE(MAX(rowid), 0) FROM reservation),
+    (
+        SELECT COALESCE(MAX(CAST(SUBSTR(child_id, 6) AS INTEGER)), 0)
+        FROM snapshots
+        WHERE child_id LIKE 'auto\_%' ESCAPE '\'
+    ),
+    (
+        SELECT COALESCE(MAX(CAST(SUBSTR(child_id, 6) AS INTEGER)), 0)
+        FROM parent_forms
+        WHERE child_id LIKE 'auto\_%' ESCAPE '\'
+    )
+) + 1;
+
+DROP TABLE reservation;
@@ -0,0 +1,3 @@
+ALTER TABLE snapshots ADD COLUMN fingerprint TEXT;
+
+CREATE INDEX IF NOT EXISTS `snapshots_fingerprint_index` ON `snapshots` (`fingerprint` ASC);
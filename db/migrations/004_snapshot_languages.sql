@@ -0,0 +1,22 @@
+CREATE TABLE snapshot_languages
+(
+    snapshot_id INTEGER,
+    language TEXT
+);
+CREATE INDEX IF NOT EXISTS `snapshot_languages_language_index` ON `snapshot_languages` (`language` ASC, `snapshot_id` ASC);
+CREATE INDEX IF NOT EXISTS `snapshot_languages_snapshot_index` ON `snapshot_languages` (`snapshot_id` ASC);
+
+WITH RECURSIVE split(snapshot_id, language, rest) AS (
+    SELECT id, '', languages || ',' FROM snapshots
+    UNION ALL
+    SELECT
+        snapshot_id,
+        SUBSTR(rest, 1, INSTR(rest, ',') - 1),
+        SUBSTR(rest, INSTR(rest, ',') + 1)
+    FROM split
+    WHERE rest != ''
+)
+INSERT INTO snapshot_languages (snapshot_id, language)
+SELECT DISTINCT snapshot_id, LOWER(TRIM(language))
+FROM split
+WHERE TRIM(language) != '';
@@ -0,0 +1,42 @@
+ALTER TABLE snapshots ADD COLUMN birthday_day INTEGER;
+ALTER TABLE snapshots ADD COLUMN session_date_day INTEGER;
+
+-- Dates are stored as YYYY/MM/DD but months and days may be unpadded (like
+-- 2013/1/5) so each part is split out on '/' and re-padded before parsing,
+-- matching interp_util.interpret_day_num.
+UPDATE snapshots SET
+    birthday_day = CAST(
+        julianday(printf(
+            '%04d-%02d-%02d',
+            CAST(SUBSTR(birthday, 1, INSTR(birthday, '/') - 1) AS INTEGER),
+            CAST(SUBSTR(
+                SUBSTR(birthday, INSTR(birthday, '/') + 1),
+                1,
+                INSTR(SUBSTR(birthday, INSTR(birthday, '/') + 1), '/') - 1
+            ) AS INTEGER),
+            CAST(SUBSTR(
+                SUBSTR(birthday, INSTR(birthday, '/') + 1),
+                INSTR(SUBSTR(birthday, INSTR(birthday, '/') + 1), '/') + 1
+            ) AS INTEGER)
+        )) - julianday('1970-01-01')
+        AS INTEGER
+    ),
+    session_date_day = CAST(
+        julianday(printf(
+            '%04d-%02d-%02d',
+            CAST(SUBSTR(session_date, 1, INSTR(session_date, '/') - 1) AS INTEGER),
+            CAST(SUBSTR(
+                SUBSTR(session_date, INSTR(session_date, '/') + 1),
+                1,
+                INSTR(SUBSTR(session_date, INSTR(session_date, '/') + 1), '/') - 1
+            ) AS INTEGER),
+            CAST(SUBSTR(
+                SUBSTR(session_date, INSTR(session_date, '/') + 1),
+                INSTR(SUBSTR(session_date, INSTR(session_date, '/') + 1), '/') + 1
+            ) AS INTEGER)
+        )) - julianday('1970-01-01')
+        AS INTEGER
+    );
+
+CREATE INDEX IF NOT EXISTS `snapshots_birthday_day_index` ON `snapshots` (`birthday_day` ASC);
+CREATE INDEX IF NOT EXISTS `snapshots_session_date_day_index` ON `snapshots` (`session_date_day` ASC);
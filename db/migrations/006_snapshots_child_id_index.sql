@@ -0,0 +1 @@
+CREATE INDEX IF NOT EXISTS `snapshots_child_id_index` ON `snapshots` (`child_id` ASC);
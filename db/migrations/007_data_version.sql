@@ -0,0 +1 @@
+INSERT INTO id_sequences (name, next_value) VALUES ('data_version', 1);
@@ -0,0 +1,12 @@
+CREATE TABLE snapshot_changes
+(
+    sequence INTEGER PRIMARY KEY,
+    snapshot_id INTEGER,
+    operation TEXT
+);
+
+INSERT INTO snapshot_changes (snapshot_id, operation)
+SELECT id, 'insert' FROM snapshots ORDER BY id;
+
+INSERT INTO snapshot_changes (snapshot_id, operation)
+SELECT id, 'delete' FROM snapshots WHERE deleted = 1 ORDER BY id;
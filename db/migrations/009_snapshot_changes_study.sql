@@ -0,0 +1,6 @@
+ALTER TABLE snapshot_changes ADD COLUMN study TEXT;
+
+UPDATE snapshot_changes SET study = (
+    SELECT snapshots.study FROM snapshots
+    WHERE snapshots.id = snapshot_changes.snapshot_id
+);
@@ -0,0 +1,8 @@
+CREATE TABLE snapshot_report_rows
+(
+    snapshot_id INTEGER,
+    format TEXT,
+    format_version TEXT,
+    row TEXT,
+    PRIMARY KEY (snapshot_id, format)
+);
@@ -0,0 +1,5 @@
+DELETE FROM snapshot_report_rows;
+
+ALTER TABLE snapshot_report_rows ADD COLUMN change_sequence INTEGER;
+
+CREATE INDEX `snapshot_changes_snapshot_index` ON `snapshot_changes` (`snapshot_id` ASC, `sequence` ASC);
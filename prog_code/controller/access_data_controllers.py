@@ -21,14 +21,19 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 @author: Sam Pottinger
 @license: GNU GPL v3
 """
+import itertools
 import json
+import os
+import typing
 
 import flask
 
+from ..util import cache_util
 from ..util import constants
 from ..util import db_util
 from ..util import filter_util
 from ..util import interp_util
+from ..util import prebuilt_export_util
 from ..util import report_util
 from ..util import session_util
 
@@ -47,16 +52,28 @@ FILTER_CREATED_MSG = 'Filter created.'
 FILTER_DELETED_MSG = 'Filter deleted.'
 FILTER_ALREADY_DELETED_MSG = 'Filter already deleted.'
 UNKNOWN_PRESENTATION_FORMAT_MSG = 'Unknown presentation format specified. Please try another format.'
+PREBUILT_EXPORT_NOT_FOUND_MSG = 'No prebuilt export is available for that study.'
 
 CONTENT_DISPOISTION_ZIP = 'attachment; filename=cdi_results.zip'
 CONTENT_DISPOISTION_CSV = 'attachment; filename=cdi_results.csv'
+CONTENT_DISPOSITION_LONG_CSV = 'attachment; filename=cdi_results_long.csv'
+CONTENT_DISPOSITION_PREBUILT = 'attachment; filename=%s'
 CSV_MIME_TYPE = 'text/csv'
 OCTET_MIME_TYPE = 'application/octet-stream'
 
+EXPORT_KIND_ZIP = 'zip'
+EXPORT_KIND_CSV = 'csv'
+
 CONSOLIDATED_FILE_URL = '/base/access_data/download_cdi_results.csv?deleted=%s'
 ARCHIVE_FILE_URL = '/base/access_data/download_cdi_results.zip?deleted=%s'
+LONG_FILE_URL = '/base/access_data/download_cdi_results_long.csv?deleted=%s'
 ACCESS_DATA_URL = '/base/access_data'
 
+PREBUILT_EXPORT_MIME_TYPES = {
+    prebuilt_export_util.EXPORT_KIND_ZIP: OCTET_MIME_TYPE,
+    prebuilt_export_util.EXPORT_KIND_CSV: CSV_MIME_TYPE
+}
+
 DOWNLOAD_WAITING_ATTR = 'is_waiting'
 ERROR_ATTR = constants.ERROR_ATTR
 
@@ -68,6 +85,25 @@ SNAPSHOTS_DB_TABLE = constants.SNAPSHOTS_DB_TABLE
 HTML_CHECKBOX_SELECTED = 'on'
 
 
+def get_download_etag(include_deleted: bool,
+        presentation_format: models.PresentationFormat) -> str:
+    """Get the entity tag for a download of the user's current query results.
+
+    @param include_deleted: Flag indicating if deleted snapshots are included.
+    @param presentation_format: The presentation format used to render values.
+    @returns: Entity tag which changes when the download type, filters,
+        presentation format (including its file being replaced), or snapshot
+        data change.
+    """
+    return cache_util.get_data_etag(
+        flask.request.path,
+        include_deleted,
+        session_util.get_filters_serialized(),
+        presentation_format.safe_name,
+        db_util.get_presentation_format_version(presentation_format)
+    )
+
+
 @app.route('/base/access_data')
 @session_util.require_login(access_data=True)
 def access_data() -> controller_types.ValidFlaskReturnTypes:
@@ -84,6 +120,7 @@ def access_data() -> controller_types.ValidFlaskReturnTypes:
         formats=formats,
         filters=map(interp_util.filter_to_str, session_util.get_filters()),
         studies=db_util.list_studies(),
+        prebuilt_exports=prebuilt_export_util.list_prebuilt_exports(),
         **session_util.get_standard_template_values()
     )
 
@@ -100,7 +137,8 @@ def execute_access_request() -> controller_types.ValidFlaskReturnTypes:
     provided via configuration file) as it will be saved to the session and
     used by execute_zip_access_request. The request should also include
     a consolidated_csv argument that, if equal to "on" will have the requset
-    redirected to the single consolidated CSV URL.
+    redirected to the single consolidated CSV URL. A long_format argument equal
+    to "on" instead redirects to the CSV with one row per word.
 
     @return: Redirect
     @rtype: flask.redirect
@@ -114,12 +152,19 @@ def execute_access_request() -> controller_types.ValidFlaskReturnTypes:
         ''
     )
 
+    use_long_format = flask.request.form.get(
+        'long_format',
+        ''
+    )
+
     include_deleted_str = flask.request.form.get(
         'deleted',
         'ignore'
     )
 
-    if use_consolidated == HTML_CHECKBOX_SELECTED:
+    if use_long_format == HTML_CHECKBOX_SELECTED:
+        return flask.redirect(LONG_FILE_URL % include_deleted_str)
+    elif use_consolidated == HTML_CHECKBOX_SELECTED:
         return flask.redirect(CONSOLIDATED_FILE_URL % include_deleted_str)
     else:
         return flask.redirect(ARCHIVE_FILE_URL % include_deleted_str)
@@ -244,6 +289,38 @@ def delete_filter(filter_index) -> controller_types.ValidFlaskReturnTypes:
         return flask.redirect(ACCESS_DATA_URL)
 
 
+def send_cached_export(cached_file: typing.BinaryIO, mimetype: str,
+        content_disposition: str, etag: str) -> flask.Response:
+    """Send a previously rendered download from the export cache.
+
+    @param cached_file: The file from cache_util.open_cached_export.
+    @param mimetype: The type of the download.
+    @param content_disposition: The Content-Disposition header value naming the
+        download.
+    @param etag: The entity tag of the download.
+    @return: Response streaming the cached file.
+    """
+    response = flask.send_file(cached_file, mimetype=mimetype)
+    response.headers['Content-Disposition'] = content_disposition
+    response.set_etag(etag)
+    return response
+
+
+def load_session_presentation_format() -> typing.Optional[models.PresentationFormat]:
+    """Load the presentation format selected for downloads, reporting errors.
+
+    @return: The presentation format or None if it could not be found, in which
+        case the error has been saved to the user session.
+    """
+    pres_format_name = flask.session[FORMAT_SESSION_ATTR]
+    presentation_format = db_util.load_presentation_model(pres_format_name)
+    if presentation_format == None:
+        session_util.set_waiting_on_download(False)
+        flask.session[ERROR_ATTR] = UNKNOWN_PRESENTATION_FORMAT_MSG
+
+    return presentation_format
+
+
 @app.route('/base/access_data/download_cdi_results.zip')
 @session_util.require_login(access_data=True)
 def execute_zip_access_request() -> controller_types.ValidFlaskReturnTypes:
@@ -253,7 +330,8 @@ def execute_zip_access_request() -> controller_types.ValidFlaskReturnTypes:
     the selected filters and the selected format. Will also reset the waiting
     on download flag. Will reject with an error message saved to the user
     session if no filters are supplied, an invalid format is specified, or
-    no data is available.
+    no data is available. Archives are served from the export cache when the
+    same query was recently downloaded and no data have changed since.
 
     @return: ZIP archive where each study with results has a CSV file.
     @rtype: flask.Response
@@ -267,35 +345,62 @@ def execute_zip_access_request() -> controller_types.ValidFlaskReturnTypes:
 
     include_deleted = request.args.get('deleted', 'ignore') == 'ignore'
 
+    presentation_format = load_session_presentation_format()
+    if presentation_format == None:
+        return flask.redirect(ACCESS_DATA_URL)
+
+    etag = get_download_etag(
+        include_deleted,
+        presentation_format # type: ignore
+    )
+    if cache_util.is_not_modified(etag):
+        session_util.set_waiting_on_download(False)
+        return cache_util.make_not_modified_response(etag)
+
+    filters_serialized = session_util.get_filters_serialized()
     db_util.report_usage(
         session_util.get_user_email(),
         "Download Data as zip",
         json.dumps({
             "include deleted": include_deleted,
-            "filters": session_util.get_filters_serialized()
+            "filters": filters_serialized
         })
     )
 
-    snapshots = filter_util.run_search_query(
+    cache_key = cache_util.get_export_key(
+        EXPORT_KIND_ZIP,
+        filters_serialized,
+        include_deleted,
+        presentation_format # type: ignore
+    )
+    cached_file = cache_util.open_cached_export(cache_key)
+    if cached_file != None:
+        session_util.set_waiting_on_download(False)
+        return send_cached_export(
+            cached_file, # type: ignore
+            OCTET_MIME_TYPE,
+            CONTENT_DISPOISTION_ZIP,
+            etag
+        )
+
+    snapshots = filter_util.iter_search_query(
         session_util.get_filters(),
         SNAPSHOTS_DB_TABLE,
         include_deleted
     )
 
-    if len(snapshots) == 0:
+    first_snapshot = next(snapshots, None)
+    if first_snapshot == None:
         session_util.set_waiting_on_download(False)
         flask.session[ERROR_ATTR] = NO_MATCHING_DATA_MSG
         return flask.redirect(ACCESS_DATA_URL)
 
-    pres_format_name = flask.session[FORMAT_SESSION_ATTR]
-    presentation_format = db_util.load_presentation_model(pres_format_name)
-    if presentation_format == None:
-        session_util.set_waiting_on_download(False)
-        flask.session[ERROR_ATTR] = UNKNOWN_PRESENTATION_FORMAT_MSG
-        return flask.redirect(ACCESS_DATA_URL)
-
-    zip_file = report_util.generate_study_report(snapshots, presentation_format)
+    zip_file = report_util.generate_study_report(
+        itertools.chain([first_snapshot], snapshots),
+        presentation_format
+    )
     zip_contents = zip_file.getvalue()
+    cache_util.put_cached_export(cache_key, zip_contents)
 
     response = flask.Response(
         zip_contents,
@@ -304,6 +409,7 @@ def execute_zip_access_request() -> controller_types.ValidFlaskReturnTypes:
     response.headers['Content-Type'] = OCTET_MIME_TYPE
     response.headers['Content-Disposition'] = CONTENT_DISPOISTION_ZIP
     response.headers['Content-Length'] = len(zip_contents)
+    response.set_etag(etag)
 
     session_util.set_waiting_on_download(False)
     return response
@@ -314,6 +420,9 @@ def execute_zip_access_request() -> controller_types.ValidFlaskReturnTypes:
 def execute_csv_access_request() -> controller_types.ValidFlaskReturnTypes:
     """Controller for finding and rendering archives of database query results.
 
+    Like execute_zip_access_request, repeated downloads are served from the
+    export cache.
+
     @return: ZIP archive where each study with results has a CSV file.
     @rtype: flask.Response
     """
@@ -326,39 +435,61 @@ def execute_csv_access_request() -> controller_types.ValidFlaskReturnTypes:
 
     include_deleted = request.args.get('deleted', 'ignore') == 'ignore'
 
+    presentation_format = load_session_presentation_format()
+    if presentation_format == None:
+        return flask.redirect(ACCESS_DATA_URL)
+
+    presentation_format_realized: models.PresentationFormat = presentation_format # type: ignore
+
+    etag = get_download_etag(include_deleted, presentation_format_realized)
+    if cache_util.is_not_modified(etag):
+        session_util.set_waiting_on_download(False)
+        return cache_util.make_not_modified_response(etag)
+
+    filters_serialized = session_util.get_filters_serialized()
     db_util.report_usage(
         session_util.get_user_email(),
         "Download Data as CSV",
         json.dumps({
             "include deleted": include_deleted,
-            "filters": session_util.get_filters_serialized()
+            "filters": filters_serialized
         })
     )
 
-    snapshots = filter_util.run_search_query(
+    cache_key = cache_util.get_export_key(
+        EXPORT_KIND_CSV,
+        filters_serialized,
+        include_deleted,
+        presentation_format_realized
+    )
+    cached_file = cache_util.open_cached_export(cache_key)
+    if cached_file != None:
+        session_util.set_waiting_on_download(False)
+        return send_cached_export(
+            cached_file, # type: ignore
+            CSV_MIME_TYPE,
+            CONTENT_DISPOISTION_CSV,
+            etag
+        )
+
+    snapshots = filter_util.iter_search_query(
         session_util.get_filters(),
         SNAPSHOTS_DB_TABLE,
         include_deleted
     )
 
-    if len(snapshots) == 0:
+    first_snapshot = next(snapshots, None)
+    if first_snapshot == None:
         session_util.set_waiting_on_download(False)
         flask.session[ERROR_ATTR] = NO_MATCHING_DATA_MSG
         return flask.redirect(ACCESS_DATA_URL)
 
-    pres_format_name = flask.session[FORMAT_SESSION_ATTR]
-    presentation_format = db_util.load_presentation_model(pres_format_name)
-    if presentation_format == None:
-        session_util.set_waiting_on_download(False)
-        flask.session[ERROR_ATTR] = UNKNOWN_PRESENTATION_FORMAT_MSG
-        return flask.redirect(ACCESS_DATA_URL)
-
-    presentation_format_realized: models.PresentationFormat = presentation_format # type: ignore
     csv_file = report_util.generate_consolidated_study_report(
-        snapshots,
+        itertools.chain([first_snapshot], snapshots),
         presentation_format_realized
     )
     csv_contents = csv_file.getvalue()
+    cache_util.put_cached_export(cache_key, csv_contents.encode('utf-8'))
 
     response = flask.Response(
         csv_contents,
@@ -367,6 +498,120 @@ def execute_csv_access_request() -> controller_types.ValidFlaskReturnTypes:
     response.headers['Content-Type'] = CSV_MIME_TYPE
     response.headers['Content-Disposition'] = CONTENT_DISPOISTION_CSV
     response.headers['Content-Length'] = len(csv_contents)
+    response.set_etag(etag)
+
+    session_util.set_waiting_on_download(False)
+    return response
+
+
+@app.route('/base/access_data/download_cdi_results_long.csv')
+@session_util.require_login(access_data=True)
+def execute_long_csv_access_request() -> controller_types.ValidFlaskReturnTypes:
+    """Controller for streaming query results with one row per word.
+
+    Each row holds a snapshot's metadata along with one of its words and the
+    value recorded for that word. Rows are written as they are read from the
+    database so memory use does not grow with the size of the results. Like
+    the other downloads, this requires at least one filter.
+
+    @return: CSV file with a row for every word of every matching snapshot.
+    @rtype: flask.Response
+    """
+    request = flask.request
+
+    if not session_util.get_filters():
+        session_util.set_waiting_on_download(False)
+        flask.session[ERROR_ATTR] = NO_FILTER_MESSAGE
+        return flask.redirect(ACCESS_DATA_URL)
+
+    include_deleted = request.args.get('deleted', 'ignore') == 'ignore'
+
+    presentation_format = load_session_presentation_format()
+    if presentation_format == None:
+        return flask.redirect(ACCESS_DATA_URL)
+
+    etag = get_download_etag(
+        include_deleted,
+        presentation_format # type: ignore
+    )
+    if cache_util.is_not_modified(etag):
+        session_util.set_waiting_on_download(False)
+        return cache_util.make_not_modified_response(etag)
+
+    db_util.report_usage(
+        session_util.get_user_email(),
+        "Download Data as long CSV",
+        json.dumps({
+            "include deleted": include_deleted,
+            "filters": session_util.get_filters_serialized()
+        })
+    )
+
+    snapshot_contents = filter_util.iter_search_contents_query(
+        session_util.get_filters(),
+        SNAPSHOTS_DB_TABLE,
+        include_deleted
+    )
+
+    first_snapshot = next(snapshot_contents, None)
+    if first_snapshot == None:
+        session_util.set_waiting_on_download(False)
+        flask.session[ERROR_ATTR] = NO_MATCHING_DATA_MSG
+        return flask.redirect(ACCESS_DATA_URL)
+
+    lines = report_util.generate_long_report_lines(
+        itertools.chain([first_snapshot], snapshot_contents),
+        presentation_format # type: ignore
+    )
+
+    response = flask.Response(lines, mimetype=CSV_MIME_TYPE)
+    response.headers['Content-Disposition'] = CONTENT_DISPOSITION_LONG_CSV
+    response.set_etag(etag)
 
     session_util.set_waiting_on_download(False)
     return response
+
+
+@app.route('/base/access_data/prebuilt_export')
+@session_util.require_login(access_data=True)
+def download_prebuilt_export() -> controller_types.ValidFlaskReturnTypes:
+    """Controller for downloading the latest prebuilt export of a study.
+
+    Serves the file written by prebuilt_export_util without rendering a report.
+    The request should include study and kind arguments where kind is zip or
+    csv. The file is sent by the web server if USE_X_SENDFILE is configured
+    and otherwise supports conditional and range requests so that interrupted
+    downloads can resume.
+
+    @return: The export or a redirect with an error saved to the user session
+        if no export is available.
+    @rtype: flask.Response
+    """
+    request = flask.request
+    study = request.args.get('study', None)
+    kind = request.args.get('kind', None)
+
+    if study == None or not kind in PREBUILT_EXPORT_MIME_TYPES:
+        flask.session[ERROR_ATTR] = PREBUILT_EXPORT_NOT_FOUND_MSG
+        return flask.redirect(ACCESS_DATA_URL)
+
+    path = prebuilt_export_util.get_export_path(study, kind) # type: ignore
+    if not os.path.isfile(path):
+        flask.session[ERROR_ATTR] = PREBUILT_EXPORT_NOT_FOUND_MSG
+        return flask.redirect(ACCESS_DATA_URL)
+
+    db_util.report_usage(
+        session_util.get_user_email(),
+        "Download Prebuilt Export",
+        json.dumps({"study": study, "kind": kind})
+    )
+
+    response = flask.send_file(
+        path,
+        mimetype=PREBUILT_EXPORT_MIME_TYPES[kind], # type: ignore
+        conditional=True
+    )
+    response.headers['Content-Disposition'] = CONTENT_DISPOSITION_PREBUILT % (
+        prebuilt_export_util.get_export_filename(study, kind) # type: ignore
+    )
+    return response
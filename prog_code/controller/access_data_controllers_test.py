@@ -16,6 +16,7 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 import json
+import tempfile
 import unittest
 import unittest.mock
 
@@ -27,6 +28,7 @@ from ..struct import models
 from ..util import constants
 from ..util import db_util
 from ..util import filter_util
+from ..util import prebuilt_export_util
 from ..util import report_util
 from ..util import session_util
 from ..util import user_util
@@ -45,6 +47,12 @@ TEST_USER = models.User(
     False,
     False
 )
+TEST_FORMAT_SPEC = models.PresentationFormat(
+    'Test format',
+    'test_format',
+    'test_format.yaml',
+    {}
+)
 ERROR_ATTR = constants.ERROR_ATTR
 CONFIRMATION_ATTR = constants.CONFIRMATION_ATTR
 
@@ -116,6 +124,26 @@ class TestAccessDataControllers(unittest.TestCase):
         self.__inject_test_user(callback)
         self.__assert_callback_called()
 
+    def test_execute_access_request_long_format(self):
+        def callback():
+            with self.app.test_client() as client:
+
+                with client.session_transaction() as sess:
+                    sess['email'] = TEST_EMAIL
+
+                resp = client.post(
+                    '/base/access_data/download_cdi_results',
+                    data={'long_format': 'on', 'deleted': 'include'}
+                )
+
+                self.assertEqual(resp.status_code, 302)
+                self.assertTrue(resp.headers['Location'].endswith(
+                    access_data_controllers.LONG_FILE_URL % 'include'
+                ))
+
+        self.__inject_test_user(callback)
+        self.__assert_callback_called()
+
     def test_execute_access_request_format(self):
         def callback():
             expected_url_combined = '/access_data/download_cdi_results.csv'
@@ -346,12 +374,13 @@ class TestAccessDataControllers(unittest.TestCase):
 
             # Prep return values
             mock_get_user.return_value = TEST_USER
-            mock_run_search_query.return_value = query_results
+            mock_run_search_query.side_effect = lambda *args: iter(query_results)
             mock_load_presentation.side_effect = [
-                'test_format_spec',
+                TEST_FORMAT_SPEC,
+                None,
+                TEST_FORMAT_SPEC,
                 None,
-                'test_format_spec',
-                None
+                TEST_FORMAT_SPEC
             ]
             mock_generate_study_report.side_effect = [
                 test_zip_file,
@@ -365,8 +394,8 @@ class TestAccessDataControllers(unittest.TestCase):
             # Test get user
             mock_get_user.assert_any_call(TEST_EMAIL)
 
-            # Test report usage
-            self.assertEqual(len(mock_report_usage.mock_calls), 4)
+            # Test report usage, skipped if the presentation format is bad
+            self.assertEqual(len(mock_report_usage.mock_calls), 2)
             mock_report_usage.assert_any_call(
                 'test_mail',
                 'Download Data as zip',
@@ -378,8 +407,8 @@ class TestAccessDataControllers(unittest.TestCase):
                 unittest.mock.ANY
             )
 
-            # Test run search query
-            self.assertEqual(len(mock_run_search_query.mock_calls), 4)
+            # Test run search query, skipped if the presentation format is bad
+            self.assertEqual(len(mock_run_search_query.mock_calls), 2)
             mock_run_search_query.assert_any_call(
                 unittest.mock.ANY,
                 'snapshots',
@@ -387,16 +416,19 @@ class TestAccessDataControllers(unittest.TestCase):
             )
 
             # Test load presentation model
-            self.assertEqual(len(mock_load_presentation.mock_calls), 4)
+            self.assertEqual(len(mock_load_presentation.mock_calls), 5)
             mock_load_presentation.assert_any_call('test_format')
             mock_load_presentation.assert_any_call('test_format_2')
 
             # Test generate report study
             self.assertEqual(len(mock_generate_study_report.mock_calls), 1)
-            mock_generate_consolidated_study_report.assert_any_call(
-                query_results,
-                'test_format_spec'
+            self.assertEqual(
+                len(mock_generate_consolidated_study_report.mock_calls),
+                1
             )
+            call_args = mock_generate_consolidated_study_report.call_args[0]
+            self.assertEqual(list(call_args[0]), query_results)
+            self.assertEqual(call_args[1], TEST_FORMAT_SPEC)
 
         def test_body():
             self.__executed = True
@@ -477,6 +509,7 @@ class TestAccessDataControllers(unittest.TestCase):
                     resp.data.decode('utf-8'),
                     test_csv_file.getvalue()
                 )
+                csv_etag = resp.headers['ETag']
 
                 with client.session_transaction() as sess:
                     self.assertFalse(session_util.is_waiting_on_download(sess))
@@ -491,23 +524,225 @@ class TestAccessDataControllers(unittest.TestCase):
                 with client.session_transaction() as sess:
                     self.assertTrue('presentation format' in sess[ERROR_ATTR])
                     self.assertFalse(session_util.is_waiting_on_download(sess))
+                    sess['format'] = 'test_format'
+
+                resp = client.get(
+                    '/base/access_data/download_cdi_results.csv',
+                    headers={'If-None-Match': csv_etag}
+                )
+                self.assertEqual(resp.status_code, 304)
+                self.assertEqual(resp.headers['ETag'], csv_etag)
 
         def execute(callback):
             with unittest.mock.patch('prog_code.util.user_util.get_user') as mock_get_user:
-                with unittest.mock.patch('prog_code.util.filter_util.run_search_query') as mock_run_search_query:
+                with unittest.mock.patch('prog_code.util.filter_util.iter_search_query') as mock_run_search_query:
                     with unittest.mock.patch('prog_code.util.db_util.load_presentation_model') as mock_load_presentation:
                         with unittest.mock.patch('prog_code.util.db_util.report_usage') as mock_report_usage:
                             with unittest.mock.patch('prog_code.util.report_util.generate_study_report') as mock_generate_study_report:
                                 with unittest.mock.patch('prog_code.util.report_util.generate_consolidated_study_report') as mock_generate_consolidated_study_report:
-                                    setup_mocks(
-                                        mock_get_user,
-                                        mock_run_search_query,
-                                        mock_load_presentation,
-                                        mock_report_usage,
-                                        mock_generate_study_report,
-                                        mock_generate_consolidated_study_report,
-                                        callback
-                                    )
+                                    with unittest.mock.patch('prog_code.util.db_util.get_data_version') as mock_get_data_version:
+                                        with unittest.mock.patch('prog_code.util.cache_util.get_export_key') as mock_get_export_key:
+                                            with unittest.mock.patch('prog_code.util.cache_util.open_cached_export') as mock_open_cached_export:
+                                                with unittest.mock.patch('prog_code.util.cache_util.put_cached_export') as mock_put_cached_export:
+                                                    mock_get_data_version.return_value = 1
+                                                    mock_get_export_key.return_value = 'test_key'
+                                                    mock_open_cached_export.return_value = None
+                                                    setup_mocks(
+                                                        mock_get_user,
+                                                        mock_run_search_query,
+                                                        mock_load_presentation,
+                                                        mock_report_usage,
+                                                        mock_generate_study_report,
+                                                        mock_generate_consolidated_study_report,
+                                                        callback
+                                                    )
+                                                    self.assertEqual(
+                                                        len(mock_put_cached_export.mock_calls),
+                                                        2
+                                                    )
 
         execute(test_body)
         self.assertTrue(self.__executed)
+
+    def test_get_download_etag_format_version(self):
+        url = '/base/access_data/download_cdi_results.csv'
+
+        with unittest.mock.patch('prog_code.util.db_util.get_data_version') as mock_version:
+            with unittest.mock.patch('prog_code.util.db_util.get_presentation_format_version') as mock_format_version:
+                mock_version.return_value = 1
+                mock_format_version.return_value = 10
+
+                with self.app.test_request_context(url):
+                    etag = access_data_controllers.get_download_etag(
+                        True,
+                        TEST_FORMAT_SPEC
+                    )
+                    self.assertEqual(
+                        etag,
+                        access_data_controllers.get_download_etag(
+                            True,
+                            TEST_FORMAT_SPEC
+                        )
+                    )
+
+                    mock_format_version.return_value = 11
+                    self.assertNotEqual(
+                        etag,
+                        access_data_controllers.get_download_etag(
+                            True,
+                            TEST_FORMAT_SPEC
+                        )
+                    )
+
+    def test_access_requests_export_cache(self):
+        presentation_format = models.PresentationFormat(
+            'Test format',
+            'test_format',
+            'test_format.yaml',
+            {}
+        )
+        url = '/base/access_data/download_cdi_results.csv'
+
+        def callback():
+            with tempfile.TemporaryDirectory() as directory:
+                with unittest.mock.patch('prog_code.util.cache_util.EXPORT_CACHE_DIR', directory):
+                    with unittest.mock.patch('prog_code.util.db_util.get_data_version') as mock_version:
+                        with unittest.mock.patch('prog_code.util.db_util.load_presentation_model') as mock_load_presentation:
+                            with unittest.mock.patch('prog_code.util.db_util.report_usage'):
+                                with unittest.mock.patch('prog_code.util.filter_util.iter_search_query') as mock_search:
+                                    with unittest.mock.patch('prog_code.util.report_util.generate_consolidated_study_report') as mock_report:
+                                        mock_version.return_value = 1
+                                        mock_load_presentation.return_value = presentation_format
+                                        mock_search.side_effect = lambda *args: iter(['snapshot'])
+                                        mock_report.return_value = TestCSVFile()
+
+                                        with self.app.test_client() as client:
+                                            with client.session_transaction() as sess:
+                                                sess['email'] = TEST_EMAIL
+                                                sess['format'] = 'test_format'
+                                                session_util.add_filter(
+                                                    models.Filter('val1', 'val2', 'val3'),
+                                                    sess
+                                                )
+
+                                            first_resp = client.get(url)
+                                            second_resp = client.get(url)
+                                            self.assertEqual(
+                                                second_resp.data,
+                                                first_resp.data
+                                            )
+                                            self.assertEqual(
+                                                second_resp.headers['Content-Disposition'],
+                                                access_data_controllers.CONTENT_DISPOISTION_CSV
+                                            )
+                                            self.assertEqual(
+                                                second_resp.mimetype,
+                                                access_data_controllers.CSV_MIME_TYPE
+                                            )
+                                            self.assertEqual(len(mock_search.mock_calls), 1)
+                                            second_resp.close()
+
+                                            mock_version.return_value = 2
+                                            client.get(url)
+                                            self.assertEqual(len(mock_search.mock_calls), 2)
+
+        self.__inject_test_user(callback)
+        self.__assert_callback_called()
+
+    def test_download_prebuilt_export(self):
+        def callback():
+            with tempfile.TemporaryDirectory() as directory:
+                with unittest.mock.patch('prog_code.util.prebuilt_export_util.PREBUILT_EXPORT_DIR', directory):
+                    with unittest.mock.patch('prog_code.util.db_util.report_usage'):
+                        path = prebuilt_export_util.get_export_path('a/b', 'csv')
+                        with open(path, 'w') as f:
+                            f.write('test CSV file contents')
+
+                        with self.app.test_client() as client:
+                            with client.session_transaction() as sess:
+                                sess['email'] = TEST_EMAIL
+
+                            url = '/base/access_data/prebuilt_export?study=a%2Fb&kind=csv'
+                            resp = client.get(url)
+                            self.assertEqual(resp.status_code, 200)
+                            self.assertEqual(resp.data, b'test CSV file contents')
+                            self.assertEqual(
+                                resp.headers['Content-Disposition'],
+                                'attachment; filename=a%2Fb.csv'
+                            )
+                            resp.close()
+
+                            resp = client.get(url, headers={'Range': 'bytes=5-7'})
+                            self.assertEqual(resp.status_code, 206)
+                            self.assertEqual(resp.data, b'CSV')
+                            resp.close()
+
+                            resp = client.get(
+                                '/base/access_data/prebuilt_export?study=other&kind=csv'
+                            )
+                            self.assertEqual(resp.status_code, 302)
+
+                            with client.session_transaction() as sess:
+                                self.assertEqual(
+                                    sess[ERROR_ATTR],
+                                    access_data_controllers.PREBUILT_EXPORT_NOT_FOUND_MSG
+                                )
+
+        self.__inject_test_user(callback)
+        self.__assert_callback_called()
+
+    def test_execute_long_csv_access_request(self):
+        presentation_format = models.PresentationFormat(
+            'Test format',
+            'test_format',
+            'test_format.yaml',
+            {}
+        )
+        url = '/base/access_data/download_cdi_results_long.csv'
+
+        def callback():
+            with unittest.mock.patch('prog_code.util.db_util.get_data_version') as mock_version:
+                with unittest.mock.patch('prog_code.util.db_util.load_presentation_model') as mock_load_presentation:
+                    with unittest.mock.patch('prog_code.util.db_util.report_usage'):
+                        with unittest.mock.patch('prog_code.util.filter_util.iter_search_contents_query') as mock_search:
+                            with unittest.mock.patch('prog_code.util.report_util.generate_long_report_lines') as mock_report:
+                                mock_version.return_value = 1
+                                mock_load_presentation.return_value = presentation_format
+                                mock_search.side_effect = lambda *args: iter(['snapshot'])
+                                mock_report.side_effect = lambda contents, x: map(
+                                    lambda y: y + '\n',
+                                    contents
+                                )
+
+                                with self.app.test_client() as client:
+                                    with client.session_transaction() as sess:
+                                        sess['email'] = TEST_EMAIL
+                                        sess['format'] = 'test_format'
+                                        session_util.add_filter(
+                                            models.Filter('val1', 'val2', 'val3'),
+                                            sess
+                                        )
+
+                                    resp = client.get(url)
+                                    self.assertEqual(resp.data, b'snapshot\n')
+                                    self.assertEqual(
+                                        resp.headers['Content-Disposition'],
+                                        access_data_controllers.CONTENT_DISPOSITION_LONG_CSV
+                                    )
+                                    self.assertEqual(
+                                        resp.mimetype,
+                                        access_data_controllers.CSV_MIME_TYPE
+                                    )
+
+                                    mock_search.side_effect = lambda *args: iter([])
+                                    resp = client.get(url)
+                                    self.assertEqual(resp.status_code, 302)
+
+                                    with client.session_transaction() as sess:
+                                        self.assertEqual(
+                                            sess[ERROR_ATTR],
+                                            access_data_controllers.NO_MATCHING_DATA_MSG
+                                        )
+
+        self.__inject_test_user(callback)
+        self.__assert_callback_called()
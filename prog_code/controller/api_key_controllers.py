@@ -26,6 +26,7 @@ import flask
 
 from ..struct import models
 from ..util import api_key_util
+from ..util import cache_util
 from ..util import constants
 from ..util import db_util
 from ..util import filter_util
@@ -33,6 +34,7 @@ from ..util import report_util
 from ..util import interp_util
 from ..util import parent_account_util
 from ..util import session_util
+from ..util import snapshot_ingest_util
 from ..util import user_util
 
 from . import controller_types
@@ -68,7 +70,11 @@ INTEGER_FIELDS = [
 
 INGORE_FIELDS = [
     'format',
-    'api_key'
+    'api_key',
+    'after',
+    'limit',
+    'output',
+    'include_words'
 ]
 
 SUCCESS_JSON_MSG = json.dumps({'msg': 'success'})
@@ -84,6 +90,8 @@ NO_API_KEY_MSG = 'No API key provided.'
 INVALID_API_KEY_MSG = 'Invalid API key provided.'
 USER_NOT_API_AUTHORIZED_MSG = 'User not authorized to use API keys.'
 USER_NOT_DB_AUTHORIZED_MSG = 'User not authorized to use access database.'
+USER_NOT_IMPORT_AUTHORIZED_MSG = 'User not authorized to import data.'
+INVALID_SNAPSHOTS_MSG = 'Invalid snapshots provided. Nothing was saved.'
 MISMATCHED_CSV_LENGTHS_MSG = 'Mismatched CSV list lengths.'
 MISSING_PARENT_EMAIL_MSG = 'Parent email required.'
 NEW_API_KEY_MSG = 'New API key generated.'
@@ -101,9 +109,32 @@ INVALID_INTERPRETATION_MSG = 'Invalid presentation format name provided.'
 ISO_PARSE_STR = '%Y-%m-%d'
 DATE_OUT_STR = '%Y/%m/%d'
 
+PAGE_AFTER_FIELD = 'after'
+PAGE_LIMIT_FIELD = 'limit'
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 10000
+INVALID_PAGE_MSG = 'after must be a database ID and limit must be between ' \
+    '1 and %d.' % MAX_PAGE_SIZE
+
+CHANGES_SINCE_FIELD = 'since'
+INVALID_CHANGES_SINCE_MSG = 'since must be a change sequence number.'
+
 CHILD_ID_FIELD = 'child_id'
 NO_CHILD_ID_MSG = 'No child ID provided.'
 
+BATCH_CHILD_IDS_FIELD = 'child_ids'
+BATCH_PARTICIPANTS_FIELD = 'participants'
+MAX_BATCH_LOOKUP_SIZE = 10000
+INVALID_BATCH_LOOKUP_MSG = 'Body must be a JSON object with a list of ' \
+    'child_ids and / or a list of participants with a study and study_id.'
+BATCH_LOOKUP_TOO_LARGE_MSG = 'At most %d child_ids and participants may be ' \
+    'looked up at once.' % MAX_BATCH_LOOKUP_SIZE
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+OUTPUT_FIELD = 'output'
+NDJSON_OUTPUT = 'ndjson'
+INCLUDE_WORDS_FIELD = 'include_words'
+
 INVALID_REQUEST_STATUS = 400
 UNAUTHORIZED_STATUS = 403
 
@@ -159,6 +190,53 @@ def generate_invalid_request_error(msg: str) -> typing.Tuple[str, int]:
     return generate_error(msg, INVALID_REQUEST_STATUS)
 
 
+def is_ndjson_output() -> bool:
+    """Determine if the current request asked for a streamed NDJSON response.
+
+    @return: True if output=ndjson was provided and False otherwise.
+    """
+    return flask.request.args.get(OUTPUT_FIELD, None) == NDJSON_OUTPUT
+
+
+def generate_ndjson_response(
+        snapshots: typing.Iterable[models.SnapshotMetadata],
+        presentation_format: typing.Optional[models.PresentationFormat],
+        include_words: bool) -> flask.Response:
+    """Stream snapshots to the API client one JSON object per line.
+
+    The response has no content length so it is sent with chunked transfer
+    encoding and each line is written as the snapshot is read from the
+    database.
+
+    @param snapshots: The snapshots to send. May be a lazy iterator.
+    @param presentation_format: The presentation format used to render special
+        values or None to send raw values.
+    @param include_words: Flag indicating if word values should be included.
+    @return: Flask response which serializes snapshots as it is sent.
+    """
+    lines = report_util.generate_ndjson_lines(
+        snapshots,
+        presentation_format=presentation_format,
+        include_words=include_words
+    )
+    return flask.Response(lines, mimetype=NDJSON_MIMETYPE)
+
+
+def convert_operand(value: str,
+        convert: typing.Callable[[str], typing.Any]) -> typing.Any:
+    """Convert a query value which may be a comma separated list of values.
+
+    @param value: The value provided by the API user.
+    @param convert: Function converting a single value like int or float.
+    @returns: The converted value or, if multiple values were given, the
+        converted values joined by commas.
+    """
+    if isinstance(value, str) and ',' in value:
+        return ','.join(map(lambda x: str(convert(x)), value.split(',')))
+    else:
+        return convert(value)
+
+
 def make_filter(field: str, value: str) -> models.Filter:
     """Add a filter to the serialized specification of a database query.
 
@@ -179,9 +257,9 @@ def make_filter(field: str, value: str) -> models.Filter:
     @return: Filter created
     """
     if field in FLOAT_FIELDS:
-        value = float(value) # type: ignore
+        value = convert_operand(value, float) # type: ignore
     elif field in INTEGER_FIELDS:
-        value = int(value) # type: ignore
+        value = convert_operand(value, int) # type: ignore
 
     filter_const_info = None
     if field in SPECIAL_API_QUERY_FIELDS:
@@ -845,8 +923,30 @@ def get_child_info_by_api() -> controller_types.ValidFlaskReturnTypes:
        // Only return CDIs taken from children of this age in months.
      - cdi_type
        // Only return CDIs of this type.
+     - limit
+       // Return at most this many CDIs (at most 10000) in order of database
+       // ID. Defaults to 1000 if after is provided.
+     - after
+       // Only return CDIs after this database ID. Use the next_cursor from
+       // the previous page.
+     - output
+       // Provide "ndjson" (without quotes) to stream one CDI per line as
+       // application/x-ndjson instead of a single JSON document.
+     - include_words
+       // With output=ndjson, provide "1" (without quotes) to include a "words"
+       // object from word to value in each CDI.
 
     All parameters should be provided as a URI query component.
+
+    Successful responses include an ETag. Send it back in If-None-Match to get
+    an empty 304 Not Modified response if no CDIs have changed since.
+
+    Without limit or after, all matching CDIs are returned as an object from
+    child ID to that child's CDIs. Otherwise, the response is an object with
+    that mapping under "children" and "next_cursor", the value of after for the
+    next page or null if there are no more pages. With output=ndjson, CDIs are
+    not grouped by child and the database_id of the last line is the value of
+    after for the next page.
     """
     api_key = flask.request.args.get(API_KEY_FIELD, None)
     if not api_key:
@@ -870,20 +970,63 @@ def get_child_info_by_api() -> controller_types.ValidFlaskReturnTypes:
         lambda x: x[0] not in INGORE_FIELDS,
         flask.request.args.items()
     )
-    db_filters = map(lambda x: make_filter(*x), fields)
+    db_filters = list(map(lambda x: make_filter(*x), fields))
+
+    after_str = flask.request.args.get(PAGE_AFTER_FIELD, None)
+    limit_str = flask.request.args.get(PAGE_LIMIT_FIELD, None)
+    paginate = after_str != None or limit_str != None
+    limit = None
+
+    if paginate:
+        after = interp_util.safe_int_interpret(after_str)
+        limit = interp_util.safe_int_interpret(limit_str)
 
-    present_format = flask.request.args.get(FORMAT_ATTR, None)
-    if present_format:
-        present_format = db_util.load_presentation_model(present_format)
+        if limit_str == None:
+            limit = DEFAULT_PAGE_SIZE
 
-    matching_snapshots = filter_util.run_search_query(
+        if limit == None or limit < 1 or limit > MAX_PAGE_SIZE:
+            return generate_invalid_request_error(INVALID_PAGE_MSG)
+
+        if after_str != None:
+            if after == None:
+                return generate_invalid_request_error(INVALID_PAGE_MSG)
+            db_filters.append(models.Filter('database_id', 'gt', after))
+
+    present_format_name = flask.request.args.get(FORMAT_ATTR, None)
+    present_format = None
+    if present_format_name:
+        present_format = db_util.load_presentation_model(present_format_name)
+
+    etag = cache_util.get_request_etag([API_KEY_FIELD], present_format)
+    if cache_util.is_not_modified(etag):
+        return cache_util.make_not_modified_response(etag)
+
+    matching_snapshots = filter_util.iter_search_query(
         db_filters,
         SNAPSHOTS_DB_TABLE,
-        True
+        True,
+        limit=limit
     )
+
+    if is_ndjson_output():
+        include_words = flask.request.args.get(INCLUDE_WORDS_FIELD, '') == '1'
+        return cache_util.add_etag(
+            generate_ndjson_response(
+                matching_snapshots,
+                present_format,
+                include_words
+            ),
+            etag
+        )
+
     serialized_snapshots_by_child_id: typing.Dict[int, typing.List[typing.Dict]] = {}
+    num_snapshots = 0
+    last_database_id = None
 
     for snapshot in matching_snapshots:
+        num_snapshots += 1
+        last_database_id = snapshot.database_id
+
         child_id_maybe = snapshot.child_id
         assert child_id_maybe != None
 
@@ -901,7 +1044,285 @@ def get_child_info_by_api() -> controller_types.ValidFlaskReturnTypes:
 
         serialized_snapshots_by_child_id[child_id].append(snapshot_serialized) # type: ignore
 
-    return json.dumps(serialized_snapshots_by_child_id)
+    if not paginate:
+        return cache_util.add_etag(
+            json.dumps(serialized_snapshots_by_child_id),
+            etag
+        )
+
+    if num_snapshots == limit:
+        next_cursor = last_database_id
+    else:
+        next_cursor = None
+
+    return cache_util.add_etag(
+        json.dumps({
+            'children': serialized_snapshots_by_child_id,
+            'next_cursor': next_cursor
+        }),
+        etag
+    )
+
+
+def parse_batch_lookup(body: typing.Any) -> typing.Optional[typing.Tuple[
+        typing.List[str], typing.List[typing.Tuple[str, str]]]]:
+    """Read the children and participants requested in a batch lookup.
+
+    @param body: The decoded JSON body of the request.
+    @returns: Tuple of the requested child IDs and (study, study ID) pairs or
+        None if the body is not a valid batch lookup.
+    """
+    if not isinstance(body, dict):
+        return None
+
+    raw_child_ids = body.get(BATCH_CHILD_IDS_FIELD, [])
+    raw_participants = body.get(BATCH_PARTICIPANTS_FIELD, [])
+    if not isinstance(raw_child_ids, list) or \
+            not isinstance(raw_participants, list):
+        return None
+
+    child_ids = []
+    for child_id in raw_child_ids:
+        if isinstance(child_id, bool) or \
+                not isinstance(child_id, (str, int)):
+            return None
+        child_id_str = str(child_id)
+        if child_id_str == '' or ',' in child_id_str:
+            return None
+        child_ids.append(child_id_str)
+
+    participants = []
+    for participant in raw_participants:
+        if not isinstance(participant, dict):
+            return None
+        study = participant.get('study', None)
+        study_id = participant.get('study_id', None)
+        if not isinstance(study, str) or not isinstance(study_id, str):
+            return None
+        participants.append((study, study_id))
+
+    return (child_ids, participants)
+
+
+@app.route('/base/api/v0/cdi_metadata_batch.json', methods=['POST'])
+def get_children_info_by_api() -> controller_types.ValidFlaskReturnTypes:
+    """Get information about many children in the CDI database at once.
+
+    Controller that allows other applications and services to look up CDI
+    metadata for a set of children in one request instead of calling
+    cdi_metadata.json once per child.
+
+    DESCRIPTION: Get summaries of the CDIs completed by the given children or
+                 study participants.
+
+    SUPPORTED METHODS: POST
+
+    REQUIRED PARAMETERS:
+     - api_key
+       // Executes this request on behalf of the user account with this API key.
+
+    OPTIONAL PARAMETERS:
+     - format
+       // The format to return responses in. Recommended: "standard" (without
+       // quotes).
+
+    Parameters should be provided as a URI query component. The body should be
+    a JSON object with:
+     - child_ids
+       // Optional list of Kelp Child IDs.
+     - participants
+       // Optional list of objects with a study and study_id.
+    At most 10000 child IDs and participants may be requested in total.
+
+    RESPONSE: JSON-encoded object with "children", an object from each
+        requested child ID to that child's CDIs, and "participants", an object
+        from study to an object from each requested study ID to the CDIs of that
+        participant. Requested children and participants without CDIs map to
+        empty lists.
+    """
+    api_key = flask.request.args.get(API_KEY_FIELD, None)
+    if not api_key:
+        return generate_invalid_request_error(NO_API_KEY_MSG)
+
+    api_key_record = db_util.get_api_key(api_key)
+    if not api_key_record:
+        return generate_invalid_request_error(INVALID_API_KEY_MSG)
+
+    user = user_util.get_user(api_key_record.user_id)
+    if not user:
+        return generate_invalid_request_error(INVALID_API_KEY_MSG)
+
+    if not user.can_use_api_key:
+        return generate_unauthorized_error(USER_NOT_API_AUTHORIZED_MSG)
+
+    if not user.can_access_data:
+        return generate_unauthorized_error(USER_NOT_DB_AUTHORIZED_MSG)
+
+    try:
+        body = json.loads(flask.request.get_data(as_text=True))
+    except ValueError:
+        return generate_invalid_request_error(INVALID_BATCH_LOOKUP_MSG)
+
+    lookup = parse_batch_lookup(body)
+    if lookup == None:
+        return generate_invalid_request_error(INVALID_BATCH_LOOKUP_MSG)
+
+    (child_ids, participants) = lookup # type: ignore
+    if len(child_ids) + len(participants) > MAX_BATCH_LOOKUP_SIZE:
+        return generate_invalid_request_error(BATCH_LOOKUP_TOO_LARGE_MSG)
+
+    present_format_name = flask.request.args.get(FORMAT_ATTR, None)
+    present_format = None
+    if present_format_name:
+        present_format = db_util.load_presentation_model(present_format_name)
+
+    def serialize(snapshot):
+        return report_util.serialize_snapshot(
+            snapshot,
+            presentation_format=present_format,
+            report_dict=True,
+            include_words=False
+        )
+
+    serialized_by_child_id: typing.Dict[str, typing.List[typing.Dict]] = \
+        dict(map(lambda x: (x, []), child_ids))
+    if len(child_ids) > 0:
+        matching_snapshots = filter_util.iter_search_query(
+            [models.Filter('child_id', 'eq', ','.join(child_ids))],
+            SNAPSHOTS_DB_TABLE,
+            True
+        )
+        for snapshot in matching_snapshots:
+            serialized_by_child_id.setdefault(str(snapshot.child_id), []).append(
+                serialize(snapshot)
+            )
+
+    serialized_by_participant: typing.Dict[
+        str, typing.Dict[str, typing.List[typing.Dict]]] = {}
+    for (study, study_id) in participants:
+        serialized_by_participant.setdefault(study, {})[study_id] = []
+    if len(participants) > 0:
+        matching_snapshots = filter_util.iter_participant_query(participants)
+        for snapshot in matching_snapshots:
+            serialized_by_participant[snapshot.study][snapshot.study_id].append(
+                serialize(snapshot)
+            )
+
+    return json.dumps({
+        'children': serialized_by_child_id,
+        'participants': serialized_by_participant
+    })
+
+
+@app.route('/base/api/v0/changes.json')
+def get_changes_by_api() -> controller_types.ValidFlaskReturnTypes:
+    """Get the CDIs added, changed, or removed since an earlier sync.
+
+    Controller that allows other applications and services to keep a copy of
+    the CDI database up to date by only downloading what changed.
+
+    DESCRIPTION: Get the log of changes to CDIs along with the current version
+                 of each CDI changed.
+
+    SUPPORTED METHODS: GET
+
+    REQUIRED PARAMETERS:
+     - api_key
+       // Executes this request on behalf of the user account with this API key.
+
+    OPTIONAL PARAMETERS:
+     - since
+       // Only return changes after this sequence number. Use the next_since
+       // from the previous page. Defaults to 0, returning every change.
+     - limit
+       // Return at most this many changes (at most 10000). Defaults to 1000.
+     - format
+       // The format to return CDIs in. Recommended: "standard" (without
+       // quotes).
+
+    All parameters should be provided as a URI query component.
+
+    RESPONSE: JSON-encoded object with "changes", a list of objects with the
+        sequence number, database_id, operation ("insert", "update", "delete",
+        "restore", or "hard_delete"), and the current version of the CDI under
+        "snapshot" or null if it has been permanently deleted. "next_since" is
+        the value of since for the next page and "has_more" is true if there are
+        more changes to read.
+    """
+    api_key = flask.request.args.get(API_KEY_FIELD, None)
+    if not api_key:
+        return generate_invalid_request_error(NO_API_KEY_MSG)
+
+    api_key_record = db_util.get_api_key(api_key)
+    if not api_key_record:
+        return generate_invalid_request_error(INVALID_API_KEY_MSG)
+
+    user = user_util.get_user(api_key_record.user_id)
+    if not user:
+        return generate_invalid_request_error(INVALID_API_KEY_MSG)
+
+    if not user.can_use_api_key:
+        return generate_unauthorized_error(USER_NOT_API_AUTHORIZED_MSG)
+
+    if not user.can_access_data:
+        return generate_unauthorized_error(USER_NOT_DB_AUTHORIZED_MSG)
+
+    since = interp_util.safe_int_interpret(
+        flask.request.args.get(CHANGES_SINCE_FIELD, '0')
+    )
+    if since == None or since < 0:
+        return generate_invalid_request_error(INVALID_CHANGES_SINCE_MSG)
+
+    limit = interp_util.safe_int_interpret(
+        flask.request.args.get(PAGE_LIMIT_FIELD, str(DEFAULT_PAGE_SIZE))
+    )
+    if limit == None or limit < 1 or limit > MAX_PAGE_SIZE:
+        return generate_invalid_request_error(INVALID_PAGE_MSG)
+
+    present_format_name = flask.request.args.get(FORMAT_ATTR, None)
+    present_format = None
+    if present_format_name:
+        present_format = db_util.load_presentation_model(present_format_name)
+
+    # Read one extra change to learn if there is another page
+    changes = db_util.load_snapshot_changes(since, limit + 1) # type: ignore
+    has_more = len(changes) > limit # type: ignore
+    changes = changes[:limit]
+
+    changed_ids = sorted(set(map(lambda x: x.snapshot_id, changes)))
+    snapshots_by_id: typing.Dict[int, typing.Dict] = {}
+    if len(changed_ids) > 0:
+        changed_snapshots = filter_util.iter_search_query(
+            [models.Filter('database_id', 'eq', ','.join(map(str, changed_ids)))],
+            SNAPSHOTS_DB_TABLE,
+            False
+        )
+        for snapshot in changed_snapshots:
+            snapshots_by_id[snapshot.database_id] = report_util.serialize_snapshot( # type: ignore
+                snapshot,
+                presentation_format=present_format,
+                report_dict=True,
+                include_words=False
+            )
+
+    if len(changes) > 0:
+        next_since = changes[-1].sequence
+    else:
+        next_since = since
+
+    return json.dumps({
+        'changes': [
+            {
+                'sequence': change.sequence,
+                'database_id': change.snapshot_id,
+                'operation': change.operation,
+                'snapshot': snapshots_by_id.get(change.snapshot_id, None)
+            }
+            for change in changes
+        ],
+        'next_since': next_since,
+        'has_more': has_more
+    })
 
 
 @app.route('/base/api/v0/get_child_words.json', methods=['GET', 'POST'])
@@ -922,7 +1343,16 @@ def get_child_words_by_api() -> controller_types.ValidFlaskReturnTypes:
      - child_id
        // Kelp Child ID.
 
+    OPTIONAL PARAMETERS:
+     - output
+       // Provide "ndjson" (without quotes) to stream each of the child's CDIs,
+       // including their word values, one per line as application/x-ndjson
+       // instead of the summary of when words were first reported.
+
     All parameters should be provided as a URI query component.
+
+    Successful responses include an ETag. Send it back in If-None-Match to get
+    an empty 304 Not Modified response if no CDIs have changed since.
     """
     # Pull parameters
     api_key = flask.request.args.get(API_KEY_FIELD, None)
@@ -948,17 +1378,147 @@ def get_child_words_by_api() -> controller_types.ValidFlaskReturnTypes:
     if not user.can_access_data:
         return generate_unauthorized_error(USER_NOT_DB_AUTHORIZED_MSG)
 
+    etag = cache_util.get_request_etag([API_KEY_FIELD])
+    if cache_util.is_not_modified(etag):
+        return cache_util.make_not_modified_response(etag)
+
     # Pull data
     db_filters = [ models.Filter('child_id', 'eq', child_id) ]
 
-    matching_snapshot_metadata = filter_util.run_search_query(
+    matching_snapshot_metadata = filter_util.iter_search_query(
         db_filters,
         SNAPSHOTS_DB_TABLE,
         True
     )
 
+    if is_ndjson_output():
+        return cache_util.add_etag(
+            generate_ndjson_response(matching_snapshot_metadata, None, True),
+            etag
+        )
+
     # Serialize data
     ret_serialization = report_util.summarize_snapshots(
         matching_snapshot_metadata
     )
-    return json.dumps({'words': ret_serialization})
+    return cache_util.add_etag(json.dumps({'words': ret_serialization}), etag)
+
+
+@app.route('/base/api/v0/send_snapshots', methods=['POST'])
+def send_snapshots_by_api() -> controller_types.ValidFlaskReturnTypes:
+    """Save a batch of CDI snapshots sent by an external application.
+
+    Controller that allows data collection applications to save completed CDIs
+    without generating a CSV file. The batch is saved in a single transaction:
+    if any snapshot is invalid, nothing is saved and every problem found is
+    reported.
+
+    DESCRIPTION: Save many completed CDIs at once.
+
+    SUPPORTED METHODS: POST
+
+    REQUIRED PARAMETERS:
+     - api_key
+       // Executes this request on behalf of the user account with this API key.
+
+    OPTIONAL PARAMETERS:
+     - format
+       // The presentation format used to interpret gender and hard of hearing
+       // values. Defaults to "standard" (without quotes).
+
+    Parameters should be provided as a URI query component. The body should be
+    a JSON list of snapshots or, with a Content-Type of application/x-ndjson,
+    one snapshot per line. Each snapshot is an object with:
+     - study, study_id, cdi_type
+       // Required strings.
+     - gender
+       // Required. Value from the presentation format or a gender constant.
+     - birthday, session_date
+       // Required ISO 8601 dates (ex: 2013-10-12).
+     - session_num
+       // Required integer.
+     - words
+       // Required object mapping every word on the CDI to its value.
+     - child_id
+       // Optional. A new child ID is assigned if not provided.
+     - total_num_sessions, items_excluded, extra_categories
+       // Optional integers. Default to session_num, 0, and 0 respectively.
+     - languages
+       // Optional list of strings. Defaults to ["english"].
+     - hard_of_hearing
+       // Optional. Value from the presentation format, true, or false.
+
+    Age, words spoken, and percentile are calculated by the server.
+
+    RESPONSE: JSON-encoded object with the database IDs of the new snapshots
+        and of those which duplicate existing snapshots. Objects representing
+        an error have that message in an "error" attribute and, if snapshots
+        were invalid, an "errors" list with the index and field of each.
+    """
+    request = flask.request
+    api_key = request.args.get(API_KEY_FIELD, None)
+    if not api_key:
+        return generate_invalid_request_error(NO_API_KEY_MSG)
+
+    api_key_record = db_util.get_api_key(api_key)
+    if not api_key_record:
+        return generate_invalid_request_error(INVALID_API_KEY_MSG)
+
+    user = user_util.get_user(api_key_record.user_id)
+    if not user:
+        return generate_invalid_request_error(INVALID_API_KEY_MSG)
+
+    if not user.can_use_api_key:
+        return generate_unauthorized_error(USER_NOT_API_AUTHORIZED_MSG)
+
+    if not user.can_import_data:
+        return generate_unauthorized_error(USER_NOT_IMPORT_AUTHORIZED_MSG)
+
+    interpretation_format_name = request.args.get(FORMAT_ATTR,
+        DEFAULT_INTERPRETATION_FORMAT)
+    interpretation_format_maybe = db_util.load_presentation_model(
+        interpretation_format_name)
+    if interpretation_format_maybe == None:
+        return generate_invalid_request_error(INVALID_INTERPRETATION_MSG)
+
+    interpretation_format: models.PresentationFormat = interpretation_format_maybe # type: ignore
+
+    try:
+        raw_records = snapshot_ingest_util.load_batch(
+            request.get_data(as_text=True),
+            request.mimetype == NDJSON_MIMETYPE
+        )
+    except snapshot_ingest_util.BatchFormatError as e:
+        return generate_invalid_request_error(str(e))
+
+    results = snapshot_ingest_util.interpret_snapshots(
+        raw_records,
+        interpretation_format.details
+    )
+
+    if len(results['errors']) > 0:
+        serialized_errors = map(
+            lambda x: {'index': x.row, 'field': x.field, 'error': x.message},
+            results['errors']
+        )
+        return json.dumps({
+            ERROR_ATTR: INVALID_SNAPSHOTS_MSG,
+            'errors': list(serialized_errors)
+        }), INVALID_REQUEST_STATUS
+
+    try:
+        summary = db_util.insert_snapshots(results['records'])
+    except db_util.DuplicateSnapshotError as e:
+        return generate_invalid_request_error(str(e))
+
+    db_util.report_usage(
+        user.email,
+        'API Import',
+        json.dumps({'global_ids': summary.database_ids})
+    )
+
+    return json.dumps({
+        'msg': 'success',
+        'database_ids': summary.database_ids,
+        'duplicate_ids': summary.duplicate_ids
+    })
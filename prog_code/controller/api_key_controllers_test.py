@@ -15,9 +15,11 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
+import copy
 import json
 import math
 import unittest
+import unittest.mock
 import urllib
 
 import cdibase
@@ -179,22 +181,27 @@ class TestAPIKeyControllers(unittest.TestCase):
                                     with unittest.mock.patch('prog_code.util.filter_util.run_search_query') as mock_run_search_query:
                                         with unittest.mock.patch('prog_code.util.db_util.insert_parent_form') as mock_insert_parent_form:
                                             with unittest.mock.patch('prog_code.util.report_util.summarize_snapshots') as mock_summarize_snapshots:
-                                                mocks = {
-                                                    'get_user': mock_get_user,
-                                                    'get_user_id': mock_get_user_id,
-                                                    'create_new_api_key': mock_create_new_api_key,
-                                                    'get_api_key': mock_get_api_key,
-                                                    'load_cdi_model': mock_load_cdi_model,
-                                                    'load_presentation_model': mock_load_presentation_model,
-                                                    'generate_unique_cdi_form_id': mock_generate_unique_cdi_form_id,
-                                                    'run_search_query': mock_run_search_query,
-                                                    'insert_parent_form': mock_insert_parent_form,
-                                                    'summarize_snapshots': mock_summarize_snapshots
-                                                }
-                                                on_start(mocks)
-                                                body()
-                                                on_end(mocks)
-                                                self.__callback_called = True
+                                                with unittest.mock.patch('prog_code.util.filter_util.iter_search_query') as mock_iter_search_query:
+                                                    with unittest.mock.patch('prog_code.util.db_util.get_data_version') as mock_get_data_version:
+                                                        mock_get_data_version.return_value = 1
+                                                        mocks = {
+                                                            'get_user': mock_get_user,
+                                                            'get_user_id': mock_get_user_id,
+                                                            'create_new_api_key': mock_create_new_api_key,
+                                                            'get_api_key': mock_get_api_key,
+                                                            'load_cdi_model': mock_load_cdi_model,
+                                                            'load_presentation_model': mock_load_presentation_model,
+                                                            'generate_unique_cdi_form_id': mock_generate_unique_cdi_form_id,
+                                                            'run_search_query': mock_run_search_query,
+                                                            'insert_parent_form': mock_insert_parent_form,
+                                                            'summarize_snapshots': mock_summarize_snapshots,
+                                                            'iter_search_query': mock_iter_search_query,
+                                                            'get_data_version': mock_get_data_version
+                                                        }
+                                                        on_start(mocks)
+                                                        body()
+                                                        on_end(mocks)
+                                                        self.__callback_called = True
 
     def __assert_callback(self):
         self.assertTrue(self.__callback_called)
@@ -238,6 +245,9 @@ class TestAPIKeyControllers(unittest.TestCase):
         self.assertEqual(filterModel.operand, 100)
         self.assertEqual(filterModel.operator, 'eq')
 
+        filterModel = api_key_controllers.make_filter('child_id', '100, 101')
+        self.assertEqual(filterModel.operand, '100,101')
+
     def test_create_api_key(self):
         def body():
             with self.app.test_client() as client:
@@ -934,6 +944,283 @@ class TestAPIKeyControllers(unittest.TestCase):
         self.__run_with_mocks(on_start, body, on_end)
         self.__assert_callback()
 
+    def test_get_child_info_by_api_paginated(self):
+        def body():
+            with self.app.test_client() as client:
+
+                resp = client.get('/base/api/v0/cdi_metadata.json?' +
+                    urllib.parse.urlencode({
+                        'api_key': TEST_API_KEY,
+                        'study': TEST_STUDY,
+                        'after': 5,
+                        'limit': 1
+                    })
+                )
+
+                resp_info = json.loads(resp.data)
+                self.assertEqual(resp_info['next_cursor'], TEST_SNAPSHOT_ID)
+                self.assertEqual(
+                    list(resp_info['children'].keys()),
+                    [str(TEST_DB_ID)]
+                )
+
+                resp = client.get('/base/api/v0/cdi_metadata.json?' +
+                    urllib.parse.urlencode({
+                        'api_key': TEST_API_KEY,
+                        'limit': 2
+                    })
+                )
+
+                resp_info = json.loads(resp.data)
+                self.assertEqual(resp_info['next_cursor'], None)
+
+                resp = client.get('/base/api/v0/cdi_metadata.json?' +
+                    urllib.parse.urlencode({
+                        'api_key': TEST_API_KEY,
+                        'limit': api_key_controllers.MAX_PAGE_SIZE + 1
+                    })
+                )
+                self.assertEqual(resp.status_code, 400)
+
+        def on_start(mocks):
+            mocks['get_api_key'].return_value = TEST_API_KEY_ENTRY
+            mocks['get_user'].return_value = TEST_USER
+            mocks['iter_search_query'].side_effect = lambda *args, **kwargs: \
+                iter([TEST_SNAPSHOT])
+
+        def on_end(mocks):
+            self.assertEqual(len(mocks['iter_search_query'].mock_calls), 2)
+
+            first_call = mocks['iter_search_query'].mock_calls[0]
+            self.assertEqual(list(first_call[1][0]), [
+                models.Filter('study', 'eq', TEST_STUDY),
+                models.Filter('database_id', 'gt', 5)
+            ])
+            self.assertEqual(first_call[2]['limit'], 1)
+
+            second_call = mocks['iter_search_query'].mock_calls[1]
+            self.assertEqual(list(second_call[1][0]), [])
+            self.assertEqual(second_call[2]['limit'], 2)
+
+        self.__run_with_mocks(on_start, body, on_end)
+        self.__assert_callback()
+
+    def test_get_child_info_by_api_ndjson(self):
+        contents = [models.SnapshotContent(TEST_SNAPSHOT_ID, 'ball', 1, 1)]
+
+        def body():
+            with unittest.mock.patch('prog_code.util.db_util.load_snapshot_contents_batch') as mock_load_contents:
+                mock_load_contents.return_value = {TEST_SNAPSHOT_ID: contents}
+
+                with self.app.test_client() as client:
+
+                    resp = client.get('/base/api/v0/cdi_metadata.json?' +
+                        urllib.parse.urlencode({
+                            'api_key': TEST_API_KEY,
+                            'study': TEST_STUDY,
+                            'output': 'ndjson',
+                            'include_words': '1'
+                        })
+                    )
+
+                    self.assertEqual(
+                        resp.mimetype,
+                        api_key_controllers.NDJSON_MIMETYPE
+                    )
+                    lines = resp.get_data(as_text=True).splitlines()
+                    self.assertEqual(len(lines), 2)
+
+                    records = list(map(json.loads, lines))
+                    self.assertEqual(records[0]['database_id'], TEST_SNAPSHOT_ID)
+                    self.assertEqual(records[0]['words'], {'ball': 1})
+
+                self.assertEqual(len(mock_load_contents.mock_calls), 1)
+                self.assertEqual(
+                    list(mock_load_contents.mock_calls[0][1][0]),
+                    [TEST_SNAPSHOT_ID, TEST_SNAPSHOT_ID]
+                )
+
+        def on_start(mocks):
+            mocks['get_api_key'].return_value = TEST_API_KEY_ENTRY
+            mocks['get_user'].return_value = TEST_USER
+            mocks['iter_search_query'].return_value = iter(
+                [TEST_SNAPSHOT, TEST_SNAPSHOT]
+            )
+
+        def on_end(mocks):
+            first_call = mocks['iter_search_query'].mock_calls[0]
+            self.assertEqual(
+                list(first_call[1][0]),
+                [models.Filter('study', 'eq', TEST_STUDY)]
+            )
+
+        self.__run_with_mocks(on_start, body, on_end)
+        self.__assert_callback()
+
+    def test_get_children_info_by_api(self):
+        other_snapshot = copy.copy(TEST_SNAPSHOT)
+        other_snapshot.study = 'other study'
+        other_snapshot.study_id = 'p1'
+
+        def body():
+            with unittest.mock.patch('prog_code.util.filter_util.iter_participant_query') as mock_participant_query:
+                mock_participant_query.return_value = iter([other_snapshot])
+
+                with self.app.test_client() as client:
+                    url = '/base/api/v0/cdi_metadata_batch.json?' + \
+                        urllib.parse.urlencode({'api_key': TEST_API_KEY})
+
+                    resp = client.post(url, data=json.dumps({
+                        'child_ids': [TEST_DB_ID, 'auto_5'],
+                        'participants': [
+                            {'study': 'other study', 'study_id': 'p1'},
+                            {'study': 'other study', 'study_id': 'p2'}
+                        ]
+                    }))
+
+                    resp_info = json.loads(resp.data)
+                    children = resp_info['children']
+                    self.assertEqual(len(children[str(TEST_DB_ID)]), 1)
+                    self.assertEqual(
+                        children[str(TEST_DB_ID)][0]['database_id'],
+                        TEST_SNAPSHOT_ID
+                    )
+                    self.assertEqual(children['auto_5'], [])
+
+                    participants = resp_info['participants']['other study']
+                    self.assertEqual(len(participants['p1']), 1)
+                    self.assertEqual(participants['p2'], [])
+
+                    resp = client.post(url, data='{"child_ids": "123"}')
+                    self.assertEqual(resp.status_code, 400)
+
+                    resp = client.post(url, data='not json')
+                    self.assertEqual(resp.status_code, 400)
+
+                    resp = client.post(url, data=json.dumps({
+                        'child_ids': list(range(
+                            api_key_controllers.MAX_BATCH_LOOKUP_SIZE + 1
+                        ))
+                    }))
+                    self.assertEqual(resp.status_code, 400)
+
+                mock_participant_query.assert_called_once_with([
+                    ('other study', 'p1'),
+                    ('other study', 'p2')
+                ])
+
+        def on_start(mocks):
+            mocks['get_api_key'].return_value = TEST_API_KEY_ENTRY
+            mocks['get_user'].return_value = TEST_USER
+            mocks['iter_search_query'].return_value = iter([TEST_SNAPSHOT])
+
+        def on_end(mocks):
+            self.assertEqual(len(mocks['iter_search_query'].mock_calls), 1)
+            first_call = mocks['iter_search_query'].mock_calls[0]
+            self.assertEqual(
+                list(first_call[1][0]),
+                [models.Filter('child_id', 'eq', '%s,auto_5' % TEST_DB_ID)]
+            )
+
+        self.__run_with_mocks(on_start, body, on_end)
+        self.__assert_callback()
+
+    def test_get_child_info_by_api_not_modified(self):
+        def body():
+            with self.app.test_client() as client:
+                url = '/base/api/v0/cdi_metadata.json?' + \
+                    urllib.parse.urlencode({
+                        'api_key': TEST_API_KEY,
+                        'study': TEST_STUDY
+                    })
+
+                resp = client.get(url)
+                self.assertEqual(resp.status_code, 200)
+                etag = resp.headers['ETag']
+
+                resp = client.get(url, headers={'If-None-Match': etag})
+                self.assertEqual(resp.status_code, 304)
+                self.assertEqual(resp.data, b'')
+
+                other_url = '/base/api/v0/cdi_metadata.json?' + \
+                    urllib.parse.urlencode({
+                        'api_key': TEST_API_KEY,
+                        'study': 'other study'
+                    })
+                resp = client.get(other_url, headers={'If-None-Match': etag})
+                self.assertEqual(resp.status_code, 200)
+
+        def on_start(mocks):
+            mocks['get_api_key'].return_value = TEST_API_KEY_ENTRY
+            mocks['get_user'].return_value = TEST_USER
+            mocks['iter_search_query'].side_effect = lambda *args, **kwargs: \
+                iter([TEST_SNAPSHOT])
+
+        def on_end(mocks):
+            self.assertEqual(len(mocks['iter_search_query'].mock_calls), 2)
+
+        self.__run_with_mocks(on_start, body, on_end)
+        self.__assert_callback()
+
+    def test_get_changes_by_api(self):
+        changes = [
+            db_util.SnapshotChange(5, TEST_SNAPSHOT_ID, db_util.CHANGE_UPDATE),
+            db_util.SnapshotChange(6, 790, db_util.CHANGE_HARD_DELETE),
+            db_util.SnapshotChange(7, 791, db_util.CHANGE_INSERT)
+        ]
+
+        def body():
+            with unittest.mock.patch('prog_code.util.db_util.load_snapshot_changes') as mock_load_changes:
+                mock_load_changes.return_value = changes
+
+                with self.app.test_client() as client:
+
+                    resp = client.get('/base/api/v0/changes.json?' +
+                        urllib.parse.urlencode({
+                            'api_key': TEST_API_KEY,
+                            'since': 4,
+                            'limit': 2
+                        })
+                    )
+
+                    resp_info = json.loads(resp.data)
+                    self.assertEqual(resp_info['next_since'], 6)
+                    self.assertTrue(resp_info['has_more'])
+                    self.assertEqual(
+                        [(x['sequence'], x['operation']) for x in resp_info['changes']],
+                        [(5, 'update'), (6, 'hard_delete')]
+                    )
+                    self.assertEqual(
+                        resp_info['changes'][0]['snapshot']['database_id'],
+                        TEST_SNAPSHOT_ID
+                    )
+                    self.assertEqual(resp_info['changes'][1]['snapshot'], None)
+
+                    resp = client.get('/base/api/v0/changes.json?' +
+                        urllib.parse.urlencode({
+                            'api_key': TEST_API_KEY,
+                            'since': 'x'
+                        })
+                    )
+                    self.assertEqual(resp.status_code, 400)
+
+                mock_load_changes.assert_called_once_with(4, 3)
+
+        def on_start(mocks):
+            mocks['get_api_key'].return_value = TEST_API_KEY_ENTRY
+            mocks['get_user'].return_value = TEST_USER
+            mocks['iter_search_query'].return_value = iter([TEST_SNAPSHOT])
+
+        def on_end(mocks):
+            mocks['iter_search_query'].assert_called_once_with(
+                [models.Filter('database_id', 'eq', '789,790')],
+                'snapshots',
+                False
+            )
+
+        self.__run_with_mocks(on_start, body, on_end)
+        self.__assert_callback()
+
     def test_get_child_words_by_api(self):
         def body():
             with self.app.test_client() as client:
@@ -955,13 +1242,13 @@ class TestAPIKeyControllers(unittest.TestCase):
         def on_start(mocks):
             mocks['get_api_key'].return_value = TEST_API_KEY_ENTRY
             mocks['get_user'].return_value = TEST_USER
-            mocks['run_search_query'].return_value = [TEST_SNAPSHOT]
+            mocks['iter_search_query'].return_value = [TEST_SNAPSHOT]
             mocks['summarize_snapshots'].return_value = {'word1': None, 'word2': '2015/01/02'}
 
         def on_end(mocks):
             mocks['get_api_key'].assert_called_with(TEST_API_KEY)
             mocks['get_user'].assert_called_with(TEST_EMAIL)
-            mocks['run_search_query'].assert_called_with(
+            mocks['iter_search_query'].assert_called_with(
                 unittest.mock.ANY,
                 'snapshots',
                 True
@@ -970,3 +1257,126 @@ class TestAPIKeyControllers(unittest.TestCase):
 
         self.__run_with_mocks(on_start, body, on_end)
         self.__assert_callback()
+
+    def test_send_snapshots_by_api(self):
+        import_user = copy.copy(TEST_USER)
+        import_user.can_import_data = True
+        records = [(TEST_SNAPSHOT, {'ball': 1})]
+        url = '/base/api/v0/send_snapshots?' + urllib.parse.urlencode({
+            'api_key': TEST_API_KEY
+        })
+
+        def body():
+            with unittest.mock.patch('prog_code.util.snapshot_ingest_util.interpret_snapshots') as mock_interpret:
+                with unittest.mock.patch('prog_code.util.db_util.insert_snapshots') as mock_insert:
+                    with unittest.mock.patch('prog_code.util.db_util.report_usage') as mock_report_usage:
+                        mock_interpret.return_value = {
+                            'records': records,
+                            'errors': []
+                        }
+                        mock_insert.return_value = db_util.BulkInsertSummary(
+                            [5, 6],
+                            2,
+                            2,
+                            0,
+                            [6]
+                        )
+
+                        with self.app.test_client() as client:
+                            resp = client.post(
+                                url,
+                                data='{"a": 1}\n{"a": 2}\n',
+                                content_type=api_key_controllers.NDJSON_MIMETYPE
+                            )
+
+                        self.assertEqual(resp.status_code, 200)
+                        resp_info = json.loads(resp.data)
+                        self.assertEqual(resp_info['database_ids'], [5, 6])
+                        self.assertEqual(resp_info['duplicate_ids'], [6])
+
+                        mock_interpret.assert_called_with(
+                            [{'a': 1}, {'a': 2}],
+                            TEST_PRESENTATION_FORMAT_METADATA.details
+                        )
+                        mock_insert.assert_called_with(records)
+                        self.assertTrue(mock_report_usage.called)
+
+        def on_start(mocks):
+            mocks['get_api_key'].return_value = TEST_API_KEY_ENTRY
+            mocks['get_user'].return_value = import_user
+            mocks['load_presentation_model'].return_value = TEST_PRESENTATION_FORMAT_METADATA
+
+        def on_end(mocks):
+            mocks['load_presentation_model'].assert_called_with('standard')
+
+        self.__run_with_mocks(on_start, body, on_end)
+        self.__assert_callback()
+
+    def test_send_snapshots_by_api_invalid(self):
+        import_user = copy.copy(TEST_USER)
+        import_user.can_import_data = True
+        url = '/base/api/v0/send_snapshots?' + urllib.parse.urlencode({
+            'api_key': TEST_API_KEY
+        })
+
+        def body():
+            with unittest.mock.patch('prog_code.util.snapshot_ingest_util.interpret_snapshots') as mock_interpret:
+                with unittest.mock.patch('prog_code.util.db_util.insert_snapshots') as mock_insert:
+                    mock_interpret.return_value = {
+                        'records': [],
+                        'errors': [
+                            models.ImportValidationError(1, None, 'bad', 'gender')
+                        ]
+                    }
+
+                    with self.app.test_client() as client:
+                        resp = client.post(url, data='not json')
+                        self.assertEqual(resp.status_code, 400)
+                        self.assertFalse(mock_interpret.called)
+
+                        resp = client.post(url, data='[{"a": 1}, {"a": 2}]')
+                        self.assertEqual(resp.status_code, 400)
+                        resp_info = json.loads(resp.data)
+                        self.assertEqual(
+                            resp_info['errors'],
+                            [{'index': 1, 'field': 'gender', 'error': 'bad'}]
+                        )
+
+                    self.assertFalse(mock_insert.called)
+
+        def on_start(mocks):
+            mocks['get_api_key'].return_value = TEST_API_KEY_ENTRY
+            mocks['get_user'].return_value = import_user
+            mocks['load_presentation_model'].return_value = TEST_PRESENTATION_FORMAT_METADATA
+
+        def on_end(mocks):
+            pass
+
+        self.__run_with_mocks(on_start, body, on_end)
+        self.__assert_callback()
+
+    def test_send_snapshots_by_api_unauthorized(self):
+        def body():
+            with self.app.test_client() as client:
+                resp = client.post(
+                    '/base/api/v0/send_snapshots?' + urllib.parse.urlencode({
+                        'api_key': TEST_API_KEY
+                    }),
+                    data='[]'
+                )
+
+            self.assertEqual(resp.status_code, 403)
+            self.assertEqual(
+                json.loads(resp.data)['error'],
+                api_key_controllers.USER_NOT_IMPORT_AUTHORIZED_MSG
+            )
+
+        def on_start(mocks):
+            mocks['get_api_key'].return_value = TEST_API_KEY_ENTRY
+            mocks['get_user'].return_value = TEST_USER
+
+        def on_end(mocks):
+            pass
+
+        self.__run_with_mocks(on_start, body, on_end)
+        self.__assert_callback()
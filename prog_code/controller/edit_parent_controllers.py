@@ -35,7 +35,6 @@ from ..util import filter_util
 from ..util import interp_util
 from ..util import math_util
 from ..util import parent_account_util
-from ..util import recalc_util
 from ..util import session_util
 from ..util import user_util
 from ..util import type_util
@@ -65,6 +64,10 @@ INVALID_EXTRA_CATEGORIES_MSG = 'Extra categories invalid. Please enter a number.
 LANGUAGES_NOT_PROVIDED_MSG = 'Languages list not provided. Please enter languages separated by a comma.'
 COULD_NOT_FIND_PERCENTILES_MSG = 'Could not find percentile information.'
 SUBMITTED_MSG = 'Form submitted to the lab.'
+DUPLICATE_CDI_MSG = 'Form submitted to the lab. These responses were already ' \
+    'on file as CDI record %d so they were not added again.'
+DUPLICATE_CDI_LOG_MSG = 'Parent form %s duplicates CDI record %d and was not ' \
+    'added again.'
 PARENT_ACCOUNT_CONTROLS_URL = '/base/parent_accounts'
 WORD_RESPONSE_ID_TEMPL = '%s_report'
 BIRTHDAY_INVALID_MSG = 'Birthday invalid: %s'
@@ -603,13 +606,6 @@ def handle_parent_cdi_form(form_id: str) -> controller_types.ValidFlaskReturnTyp
         else:
             percentile = -1
 
-        # Find prior entries in study
-        if study != None and study_id != None:
-            session_number = recalc_util.get_session_number(study, study_id) # type: ignore
-
-        if not total_num_sessions:
-            total_num_sessions = session_number
-
         # Check all required values resolved
         study_id_realized = type_util.assert_not_none(study_id)
         study_realized = type_util.assert_not_none(study)
@@ -619,8 +615,12 @@ def handle_parent_cdi_form(form_id: str) -> controller_types.ValidFlaskReturnTyp
         items_excluded_realized = type_util.assert_not_none(items_excluded)
         extra_categories_realized = type_util.assert_not_none(extra_categories)
         hard_of_hearing_realized = type_util.assert_not_none(hard_of_hearing)
+        total_num_sessions_realized = type_util.assert_not_none(
+            total_num_sessions
+        )
 
-        # Put in snapshot metadata
+        # Put in snapshot metadata. Session number (and total sessions if 0)
+        # are assigned from prior entries in the study as part of the insert.
         new_snapshot = models.SnapshotMetadata(
             None,
             str(database_id),
@@ -630,8 +630,8 @@ def handle_parent_cdi_form(form_id: str) -> controller_types.ValidFlaskReturnTyp
             age_realized,
             birthday_realized,
             datetime.date.today().strftime(DATE_OUT_STR),
-            session_number,
-            total_num_sessions,
+            0,
+            total_num_sessions_realized,
             words_spoken,
             items_excluded_realized,
             percentile,
@@ -643,10 +643,25 @@ def handle_parent_cdi_form(form_id: str) -> controller_types.ValidFlaskReturnTyp
             hard_of_hearing_realized,
             False
         )
-        db_util.insert_snapshot(new_snapshot, word_entries)
+        # A duplicate means this form was already submitted so its contents
+        # are saved either way.
+        confirmation_msg = SUBMITTED_MSG
+        try:
+            db_util.insert_snapshot(
+                new_snapshot,
+                word_entries,
+                assign_session_num=True
+            )
+        except db_util.DuplicateSnapshotError as e:
+            flask.current_app.logger.warning(
+                DUPLICATE_CDI_LOG_MSG,
+                form_id,
+                e.existing_id
+            )
+            confirmation_msg = DUPLICATE_CDI_MSG % e.existing_id
         db_util.remove_parent_form(form_id)
 
-        flask.session[constants.CONFIRMATION_ATTR] = SUBMITTED_MSG
+        flask.session[constants.CONFIRMATION_ATTR] = confirmation_msg
         flask.session['SAVED_WORDS'] = None
         return flask.redirect(THANK_YOU_MSG_URL)
 
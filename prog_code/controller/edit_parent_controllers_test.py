@@ -22,6 +22,7 @@ import unittest
 import unittest.mock
 
 import cdibase
+from ..controller import edit_parent_controllers
 from ..util import constants
 from ..util import db_util
 from ..util import filter_util
@@ -215,7 +216,6 @@ TEST_PERCENTILE_CLASS = collections.namedtuple('TestPercentileTable',
     ['details'])
 TEST_PERCENTILE_TABLE = TEST_PERCENTILE_CLASS('test details')
 TODAY = date.today()
-TEST_SESSION_NUM = 1
 TEST_WORDS_SPOKEN = 5
 TEST_AGE = 21
 EXPECTED_SNAPSHOT = models.SnapshotMetadata(
@@ -227,8 +227,8 @@ EXPECTED_SNAPSHOT = models.SnapshotMetadata(
     TEST_AGE,
     TEST_BIRTHDAY_ISO,
     TODAY.strftime('%Y/%m/%d'),
-    TEST_SESSION_NUM,
-    TEST_SESSION_NUM,
+    0,
+    0,
     TEST_WORDS_SPOKEN,
     TEST_ITEMS_EXCLUDED,
     TEST_PERCENTILE,
@@ -249,8 +249,8 @@ EXPECTED_SNAPSHOT_MOD = models.SnapshotMetadata(
     TEST_AGE,
     TEST_BIRTHDAY_ISO_MOD,
     TODAY.strftime('%Y/%m/%d'),
-    TEST_SESSION_NUM,
-    TEST_SESSION_NUM,
+    0,
+    0,
     TEST_WORDS_SPOKEN,
     TEST_ITEMS_EXCLUDED_MOD,
     TEST_PERCENTILE,
@@ -849,13 +849,43 @@ class TestEditParentControllers(unittest.TestCase):
                 TEST_AGE,
                 6
             )
-            mocks['run_search_query'].assert_called_with(
+            mocks['insert_snapshot'].assert_called_with(
+                EXPECTED_SNAPSHOT,
                 unittest.mock.ANY,
-                'snapshots'
+                assign_session_num=True
+            )
+            mocks['remove_parent_form'].assert_called_with(
+                str(TEST_PARENT_FORM_ID)
             )
+
+        self.__run_with_mocks(on_start, body, on_end)
+        self.__assert_callback()
+
+    def test_submit_parent_form_duplicate(self):
+        def body():
+            with self.app.test_client() as client:
+                client.post(PARENT_CDI_FORM_URL, data=TEMPLATE_WORD_SPOKEN_VALUES)
+
+                with client.session_transaction() as sess:
+                    self.assertEqual(
+                        sess[constants.CONFIRMATION_ATTR],
+                        edit_parent_controllers.DUPLICATE_CDI_MSG % 5
+                    )
+
+        def on_start(mocks):
+            mocks['get_parent_form_by_id'].return_value = EXPECTED_PARENT_FORM
+            mocks['get_snapshot_chronology_for_db_id'].return_value = [TEST_SNAPSHOT]
+            mocks['load_cdi_model'].return_value = TEST_FORMAT
+            mocks['load_percentile_model'].return_value = TEST_PERCENTILE_TABLE
+            mocks['monthdelta'].return_value = TEST_AGE
+            mocks['find_percentile'].return_value = TEST_PERCENTILE
+            mocks['insert_snapshot'].side_effect = db_util.DuplicateSnapshotError(5)
+
+        def on_end(mocks):
             mocks['insert_snapshot'].assert_called_with(
                 EXPECTED_SNAPSHOT,
-                unittest.mock.ANY
+                unittest.mock.ANY,
+                assign_session_num=True
             )
             mocks['remove_parent_form'].assert_called_with(
                 str(TEST_PARENT_FORM_ID)
@@ -913,13 +943,10 @@ class TestEditParentControllers(unittest.TestCase):
                 TEST_AGE,
                 6
             )
-            mocks['run_search_query'].assert_called_with(
-                unittest.mock.ANY,
-                'snapshots'
-            )
             mocks['insert_snapshot'].assert_called_with(
                 EXPECTED_SNAPSHOT_MOD,
-                unittest.mock.ANY
+                unittest.mock.ANY,
+                assign_session_num=True
             )
             mocks['remove_parent_form'].assert_called_with(
                 str(TEST_PARENT_FORM_ID)
@@ -973,13 +1000,10 @@ class TestEditParentControllers(unittest.TestCase):
                 TEST_AGE,
                 6
             )
-            mocks['run_search_query'].assert_called_with(
-                unittest.mock.ANY,
-                'snapshots'
-            )
             mocks['insert_snapshot'].assert_called_with(
                 EXPECTED_SNAPSHOT,
-                TEMPLATE_WORD_SPOKEN_RECORD
+                TEMPLATE_WORD_SPOKEN_RECORD,
+                assign_session_num=True
             )
             mocks['remove_parent_form'].assert_called_with(
                 str(TEST_PARENT_FORM_ID)
@@ -67,6 +67,8 @@ WORD_VALUE_INVALID_MSG = '%s value invalid. Please check and try again.'
 CDI_ADDED_MSG = 'CDI record added for participant %s.'
 ENTER_DATA_URL = '/base/enter_data'
 NEW_CHILD_CDI_ADDED_MSG = 'New child and CDI added.'
+DUPLICATE_CDI_MSG = 'This CDI was not added because it duplicates existing CDI record %d.'
+DUPLICATE_CDI_WARN_MSG = ' Note that it duplicates existing CDI record %d.'
 DATE_REGEX = re.compile('\d{4}/\d{1,2}/\d{1,2}')
 
 
@@ -322,12 +324,22 @@ def enter_data_form(format_name: str) -> controller_types.ValidFlaskReturnTypes:
             })
         )
 
-        db_util.insert_snapshot(new_snapshot, word_entries)
+        try:
+            duplicate_id = db_util.insert_snapshot(new_snapshot, word_entries)
+        except db_util.DuplicateSnapshotError as e:
+            flask.session[constants.ERROR_ATTR] = DUPLICATE_CDI_MSG % (
+                e.existing_id
+            )
+            return flask.redirect(request.path)
 
         if global_id != None:
             msg = CDI_ADDED_MSG % global_id
         else:
             msg = NEW_CHILD_CDI_ADDED_MSG
+
+        if duplicate_id != None:
+            msg += DUPLICATE_CDI_WARN_MSG % duplicate_id
+
         flask.session[constants.CONFIRMATION_ATTR] = msg
 
         return flask.redirect(request.path)
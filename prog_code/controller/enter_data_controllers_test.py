@@ -28,6 +28,7 @@ import unittest.mock
 
 import cdibase
 from ..struct import models
+from ..controller import enter_data_controllers
 from ..util import constants
 from ..util import db_util
 from ..util import filter_util
@@ -530,6 +531,7 @@ class EnterDataControllersTests(unittest.TestCase):
             mocks['load_cdi_model'].return_value = TEST_FORMAT
             mocks['load_percentile_model'].return_value = TEST_PERCENTILE_MODEL
             mocks['find_percentile'].return_value = TEST_PERCENTILE
+            mocks['insert_snapshot'].return_value = None
 
         def on_end(mocks):
             mocks['get_user'].assert_called_with(TEST_EMAIL)
@@ -556,6 +558,48 @@ class EnterDataControllersTests(unittest.TestCase):
         self.__run_with_mocks(on_start, body, on_end)
         self.__assert_callback()
 
+    def test_enter_data_duplicate(self):
+
+        def body():
+            target_url = '/base/enter_data/%s' % TEST_CDI_FORMAT_NAME
+
+            with self.app.test_client() as client:
+
+                with client.session_transaction() as sess:
+                    sess['email'] = TEST_EMAIL
+
+                client.post(target_url, data=TEST_SUCCESSFUL_PARAMS)
+
+                with client.session_transaction() as sess:
+                    self.assertEqual(sess.get(constants.ERROR_ATTR, None), None)
+                    self.assertTrue(sess[constants.CONFIRMATION_ATTR].endswith(
+                        enter_data_controllers.DUPLICATE_CDI_WARN_MSG % 5
+                    ))
+
+                client.post(target_url, data=TEST_SUCCESSFUL_PARAMS)
+
+                with client.session_transaction() as sess:
+                    self.assertEqual(
+                        sess[constants.ERROR_ATTR],
+                        enter_data_controllers.DUPLICATE_CDI_MSG % 5
+                    )
+
+        def on_start(mocks):
+            mocks['get_user'].return_value = TEST_USER
+            mocks['load_cdi_model'].return_value = TEST_FORMAT
+            mocks['load_percentile_model'].return_value = TEST_PERCENTILE_MODEL
+            mocks['find_percentile'].return_value = TEST_PERCENTILE
+            mocks['insert_snapshot'].side_effect = [
+                5,
+                db_util.DuplicateSnapshotError(5)
+            ]
+
+        def on_end(mocks):
+            self.assertEqual(mocks['insert_snapshot'].call_count, 2)
+
+        self.__run_with_mocks(on_start, body, on_end)
+        self.__assert_callback()
+
     def test_lookup_studies_by_global_id(self):
 
         def body():
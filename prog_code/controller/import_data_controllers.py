@@ -21,6 +21,8 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import io
 import json
+import os
+import typing
 
 import flask
 
@@ -31,10 +33,47 @@ from ..util import legacy_csv_import_util
 from ..util import new_csv_import_util
 from ..util import db_util
 from ..util import session_util
+from ..util import zip_import_util
+
+from ..struct import models
 
 from . import controller_types
 
 CONFIRM_MSG = 'CSV imported into the database.'
+BULK_CONFIRM_MSG = (
+    'CSV imported into the database: %d snapshots with %d word entries in '
+    '%.1f seconds.'
+)
+VALIDATION_CONFIRM_MSG = (
+    'CSV checked without saving: %d valid snapshots and %d cells read in %.1f '
+    'seconds.'
+)
+VALIDATION_ERROR_MSG = 'CSV checked without saving: found %d problem(s)%s. %s'
+VALIDATION_TRUNCATED_MSG = ' before stopping'
+VALIDATION_ERROR_POSITION_MSG = '(row %s, column %s) %s'
+ZIP_CONFIRM_MSG = (
+    'ZIP imported into the database: %d files with %d snapshots and %d word '
+    'entries.'
+)
+ZIP_ERROR_MSG = 'ZIP not imported. Problems found in %d file(s): %s'
+ZIP_FILE_ERROR_MSG = '%s: %s'
+ZIP_VALIDATION_UNSUPPORTED_MSG = 'ZIP uploads cannot be checked without saving.'
+DUPLICATES_WARN_MSG = (
+    ' Note that %d of the snapshots duplicate snapshots already saved.'
+)
+
+
+def describe_duplicates(duplicate_ids: typing.List[int]) -> str:
+    """Describe the duplicate snapshots saved by an import, if any.
+
+    @param duplicate_ids: The database IDs of new snapshots which duplicate
+        snapshots already saved.
+    @returns: Text to append to the import's confirmation message.
+    """
+    if len(duplicate_ids) == 0:
+        return ''
+    else:
+        return DUPLICATES_WARN_MSG % len(duplicate_ids)
 
 
 @app.route('/base/import_data', methods=['GET', 'POST'])
@@ -61,73 +100,213 @@ def import_data() -> controller_types.ValidFlaskReturnTypes:
         )
 
     else:
-        contents = flask.request.files['file'].read()
+        upload = flask.request.files['file']
         cdi_type = flask.request.form.get('cdi-type', '')
         file_format = flask.request.form['file-format']
 
-        if file_format == "new":
-            return import_data_new(contents)
+        is_zip = (upload.filename or '').lower().endswith('.zip')
+
+        if flask.request.form.get('validate-only', '') == 'on':
+            if is_zip:
+                flask.session[constants.ERROR_ATTR] = \
+                    ZIP_VALIDATION_UNSUPPORTED_MSG
+                return flask.redirect('/base/import_data')
+            return validate_data(upload.stream, file_format, cdi_type)
+        elif is_zip:
+            return import_data_zip(upload.stream, file_format, cdi_type)
+        elif file_format == "new":
+            return import_data_new(upload.stream)
         else:
-            return import_data_legacy(contents, cdi_type)
+            return import_data_legacy(upload.stream, cdi_type)
 
 
-def import_data_new(contents: str) -> controller_types.ValidFlaskReturnTypes:
+def import_data_new(upload: typing.IO[bytes]) -> controller_types.ValidFlaskReturnTypes:
     """Strategy to import data from the "new" CSV format.
 
-    @param: Contents to parse.
+    The upload is spooled to disk and parsed column by column, with each
+    parsed record written to a second file on disk, so memory use is bounded
+    by the column block size and insert chunk size rather than the number of
+    participants. Parsing finishes before the database is opened for writing
+    so that other requests are not blocked while the file is read. Records
+    are then read back and saved in a single transaction so nothing is saved
+    if any column fails to parse.
+
+    @param: Stream with the contents to parse.
     @returns: Redirect
     """
-    results = new_csv_import_util.process_csv(contents)
+    spool_path = new_csv_import_util.spool_upload(upload)
+    records_path = None
 
-    if results.had_error:
-        flask.session[constants.ERROR_ATTR] = results.error_msg
+    try:
+        records_path = new_csv_import_util.spool_records(
+            new_csv_import_util.process_csv_file(spool_path)
+        )
+        with db_util.get_cursor() as cursor:
+            summary = db_util.insert_snapshots(
+                new_csv_import_util.iter_spooled_records(records_path),
+                cursor
+            )
+    except (new_csv_import_util.CSVParseError,
+            db_util.DuplicateSnapshotError) as e:
+        flask.session[constants.ERROR_ATTR] = str(e)
         return flask.redirect('/base/import_data')
-
-    impacted_ids = []
-    for record in results.records:
-        db_util.insert_snapshot(record.meta, record.contents)
-        impacted_ids.append(record.meta.database_id)
+    finally:
+        os.remove(spool_path)
+        if records_path != None:
+            os.remove(records_path)
 
     db_util.report_usage(
         session_util.get_user_email(),
         "Import Data",
         json.dumps({
-            "global_ids": impacted_ids
+            "global_ids": summary.database_ids
         })
     )
 
-    flask.session[constants.CONFIRMATION_ATTR] = CONFIRM_MSG
+    flask.session[constants.CONFIRMATION_ATTR] = BULK_CONFIRM_MSG % (
+        summary.num_snapshots,
+        summary.num_words,
+        summary.seconds
+    ) + describe_duplicates(summary.duplicate_ids)
     return flask.redirect('/base/import_data')
 
 
-def import_data_legacy(contents: str, cdi_type: str) -> controller_types.ValidFlaskReturnTypes:
-    """Strategy to import data from the "legacy" CSV format.
+def import_data_zip(upload: typing.IO[bytes], file_format: str,
+        cdi_type: str) -> controller_types.ValidFlaskReturnTypes:
+    """Strategy to import a ZIP archive of CSV files in the same format.
 
-    @param: Contents to parse.
+    @param upload: Stream with the contents of the archive.
+    @param file_format: The format of the CSV files ("new" or "legacy").
+    @param cdi_type: The type of CDI in the files if legacy format.
     @returns: Redirect
     """
-    results = legacy_csv_import_util.parse_csv(
-        contents,
-        cdi_type,
-        ['english'],
-        constants.EXPLICIT_FALSE,
-        True
-    )
+    results = zip_import_util.import_zip(upload, file_format, cdi_type)
 
-    if results['error']:
-        flask.session[constants.ERROR_ATTR] = results['error']
+    if results.num_files == 0:
+        flask.session[constants.ERROR_ATTR] = results.file_errors[0][1]
+        return flask.redirect('/base/import_data')
+
+    if results.summary == None:
+        file_errors = map(
+            lambda x: x[1] if x[0] == None else ZIP_FILE_ERROR_MSG % x,
+            results.file_errors
+        )
+        flask.session[constants.ERROR_ATTR] = ZIP_ERROR_MSG % (
+            len(results.file_errors),
+            ' '.join(file_errors)
+        )
         return flask.redirect('/base/import_data')
-    else:
-        flask.session[constants.CONFIRMATION_ATTR] = CONFIRM_MSG
 
     db_util.report_usage(
         session_util.get_user_email(),
         "Import Data",
         json.dumps({
-            "global_ids": results["ids"]
+            "global_ids": results.summary.database_ids
         })
     )
 
+    flask.session[constants.CONFIRMATION_ATTR] = ZIP_CONFIRM_MSG % (
+        results.num_files,
+        results.summary.num_snapshots,
+        results.summary.num_words
+    ) + describe_duplicates(results.summary.duplicate_ids)
+
+    if cdi_type != '':
+        flask.session['last_format_used'] = cdi_type
+
+    return flask.redirect('/base/import_data')
+
+
+def validate_data(upload: typing.IO[bytes], file_format: str,
+        cdi_type: str) -> controller_types.ValidFlaskReturnTypes:
+    """Strategy to check an upload for errors without saving it.
+
+    @param upload: Stream with the contents to check.
+    @param file_format: The format of the upload ("new" or "legacy").
+    @param cdi_type: The type of CDI in the upload if legacy format.
+    @returns: Redirect
+    """
+    report: models.ImportValidationReport
+
+    if file_format == "new":
+        spool_path = new_csv_import_util.spool_upload(upload)
+        try:
+            report = new_csv_import_util.validate_csv_file(spool_path)
+        finally:
+            os.remove(spool_path)
+    else:
+        report = legacy_csv_import_util.validate_csv(
+            io.TextIOWrapper(upload, encoding='utf-8', newline=''),
+            cdi_type,
+            True
+        )
+
+    if len(report.errors) > 0:
+        error_descriptions = map(
+            lambda x: VALIDATION_ERROR_POSITION_MSG % (
+                '?' if x.row == None else x.row,
+                '?' if x.column == None else x.column,
+                x.message
+            ),
+            report.errors
+        )
+        flask.session[constants.ERROR_ATTR] = VALIDATION_ERROR_MSG % (
+            len(report.errors),
+            VALIDATION_TRUNCATED_MSG if report.truncated else '',
+            ' '.join(error_descriptions)
+        )
+    else:
+        flask.session[constants.CONFIRMATION_ATTR] = VALIDATION_CONFIRM_MSG % (
+            report.num_records,
+            report.num_cells,
+            report.seconds
+        )
+
+    if cdi_type != '':
+        flask.session['last_format_used'] = cdi_type
+
+    return flask.redirect('/base/import_data')
+
+
+def import_data_legacy(upload: typing.IO[bytes], cdi_type: str) -> controller_types.ValidFlaskReturnTypes:
+    """Strategy to import data from the "legacy" CSV format.
+
+    The upload is spooled to disk and imported in chunks of participants, each
+    saved in its own transaction.
+
+    @param: Stream with the contents to parse.
+    @returns: Redirect
+    """
+    spool_path = new_csv_import_util.spool_upload(upload)
+
+    try:
+        results = legacy_csv_import_util.parse_csv_file(
+            spool_path,
+            cdi_type,
+            ['english'],
+            constants.EXPLICIT_FALSE
+        )
+    finally:
+        os.remove(spool_path)
+
+    # Chunks saved before an error are kept so are reported either way.
+    if len(results['ids']) > 0:
+        db_util.report_usage(
+            session_util.get_user_email(),
+            "Import Data",
+            json.dumps({
+                "global_ids": results["ids"]
+            })
+        )
+
+    if results['error']:
+        flask.session[constants.ERROR_ATTR] = results['error']
+        return flask.redirect('/base/import_data')
+    else:
+        flask.session[constants.CONFIRMATION_ATTR] = (
+            CONFIRM_MSG + describe_duplicates(results['duplicates'])
+        )
+
     if cdi_type != '':
         flask.session['last_format_used'] = cdi_type
 
@@ -181,6 +181,30 @@ class SnapshotMetadata:
     child development inventory.
     """
 
+    # Searches can return many of these records so avoid a dict per instance.
+    __slots__ = [
+        'database_id',
+        'child_id',
+        'study_id',
+        'study',
+        'gender',
+        'age',
+        'birthday',
+        'session_date',
+        'session_num',
+        'total_num_sessions',
+        'words_spoken',
+        'items_excluded',
+        'percentile',
+        'extra_categories',
+        'revision',
+        'languages',
+        'num_languages',
+        'cdi_type',
+        'hard_of_hearing',
+        'deleted'
+    ]
+
     def __init__(self, database_id: typing.Optional[int], child_id: typing.Optional[str],
             study_id: str, study: str, gender: int, age: float, birthday: str, session_date: str,
             session_num: int, total_num_sessions: int, words_spoken: int, items_excluded: int,
@@ -329,6 +353,9 @@ class SnapshotMetadata:
 class SnapshotContent:
     """Record of a single CDI word as part of a snapshot."""
 
+    # Snapshots have hundreds of these records so avoid a dict per instance.
+    __slots__ = ['snapshot_id', 'word', 'value', 'revision']
+
     def __init__(self, snapshot_id: typing.Optional[int], word: str, value: int, revision: int):
         """Creates a new SnapshotContent instance.
 
@@ -617,3 +644,46 @@ class ConsentFormFiling:
         self.other_options = other_options
         self.email = email
         self.access_key = access_key
+
+
+class ImportValidationError:
+    """Record of an invalid value found while checking an upload."""
+
+    def __init__(self, row: typing.Optional[int],
+            column: typing.Optional[int], message: str,
+            field: typing.Optional[str] = None):
+        """Create a new record of a problem found in an uploaded CSV file.
+
+        @param row: The 1-indexed row of the invalid value or None if the
+            problem is not specific to a single row.
+        @param column: The 1-indexed column of the invalid value or None if the
+            problem is not specific to a single column.
+        @param message: Human readable description of the problem.
+        @param field: The name of the invalid field for uploads without
+            columns or None if not applicable.
+        """
+        self.row = row
+        self.column = column
+        self.message = message
+        self.field = field
+
+
+class ImportValidationReport:
+    """Results of parsing an upload without saving it to the database."""
+
+    def __init__(self, num_records: int, num_cells: int, seconds: float,
+            errors: typing.List[ImportValidationError], truncated: bool):
+        """Create a new summary of checking an upload.
+
+        @param num_records: The number of snapshots parsed without error.
+        @param num_cells: The number of CSV cells read.
+        @param seconds: Wall clock time spent parsing the upload.
+        @param errors: The problems found in the order encountered.
+        @param truncated: True if parsing stopped early because the maximum
+            number of errors was found. False if the full file was checked.
+        """
+        self.num_records = num_records
+        self.num_cells = num_cells
+        self.seconds = seconds
+        self.errors = errors
+        self.truncated = truncated
@@ -0,0 +1,242 @@
+"""Logic for answering repeated requests for unchanged data.
+
+Copyright (C) 2014 A. Samuel Pottinger ("Sam Pottinger", gleap.org)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+@author: Sam Pottinger
+@license: GNU GPL v3
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import typing
+
+import flask
+
+from ..struct import models
+
+import prog_code.util.db_util as db_util
+import prog_code.util.file_util as file_util
+
+NOT_MODIFIED_STATUS = 304
+
+EXPORT_CACHE_DIR = os.path.join(file_util.ROOT_DIR, 'export_cache')
+EXPORT_CACHE_SUFFIX = '.export'
+
+# Total size of cached exports before the least recently used are removed.
+# Set to 0 to disable the cache.
+EXPORT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+EXPORT_CACHE_LOCK = threading.Lock()
+
+
+def compute_etag(data_version: int, parts: typing.Iterable[typing.Any]) -> str:
+    """Hash the data version and everything else a response depends on.
+
+    @param data_version: The data version from db_util.get_data_version.
+    @param parts: JSON serializable values describing the request.
+    @returns: Entity tag for the response.
+    """
+    serialized = json.dumps([data_version, list(parts)], sort_keys=True)
+    return hashlib.sha1(serialized.encode('utf-8')).hexdigest()
+
+
+def get_data_etag(*parts: typing.Any) -> str:
+    """Get the entity tag for a response derived from the current data.
+
+    Only reads the data version so that a matching tag can be answered without
+    touching the snapshot tables.
+
+    @param parts: JSON serializable values describing the request.
+    @returns: Entity tag which changes whenever snapshot data change.
+    """
+    return compute_etag(db_util.get_data_version(), parts)
+
+
+def get_request_etag(ignore_fields: typing.Iterable[str],
+        presentation_format: typing.Optional[models.PresentationFormat] = None
+        ) -> str:
+    """Get the entity tag for the current request and data.
+
+    @param ignore_fields: Query parameters which do not affect the response.
+    @param presentation_format: The presentation format used to render the
+        response or None if values are sent raw.
+    @returns: Entity tag which changes whenever the path, the other query
+        parameters, the presentation format file, or snapshot data change.
+    """
+    request = flask.request
+    ignore_fields_set = set(ignore_fields)
+    args = sorted(filter(
+        lambda x: x[0] not in ignore_fields_set,
+        request.args.items(multi=True)
+    ))
+
+    if presentation_format == None:
+        return get_data_etag(request.path, args)
+    else:
+        return get_data_etag(
+            request.path,
+            args,
+            db_util.get_presentation_format_version(
+                presentation_format # type: ignore
+            )
+        )
+
+
+def is_not_modified(etag: str) -> bool:
+    """Determine if the client already has the response with the given tag.
+
+    @param etag: The entity tag of the current response.
+    @returns: True if the request's If-None-Match includes etag.
+    """
+    return flask.request.if_none_match.contains_weak(etag)
+
+
+def make_not_modified_response(etag: str) -> flask.Response:
+    """Tell the client to reuse its copy of the response.
+
+    @param etag: The entity tag of the current response.
+    @returns: Empty 304 response with the entity tag.
+    """
+    response = flask.Response(status=NOT_MODIFIED_STATUS)
+    response.set_etag(etag)
+    return response
+
+
+def add_etag(response_body: typing.Any, etag: str) -> flask.Response:
+    """Attach an entity tag to a response.
+
+    @param response_body: Anything a Flask view may return.
+    @param etag: The entity tag of the response.
+    @returns: Response with an ETag header.
+    """
+    response = flask.make_response(response_body)
+    response.set_etag(etag)
+    return response
+
+
+def get_export_key(kind: str, filters_serialized: typing.List[typing.Dict],
+        include_deleted: bool,
+        presentation_format: models.PresentationFormat) -> str:
+    """Get the name under which a download of query results is cached.
+
+    @param kind: Name of the type of download like "csv" or "zip".
+    @param filters_serialized: The filters of the query as primitives. Order
+        does not matter.
+    @param include_deleted: Flag indicating if deleted snapshots are included.
+    @param presentation_format: The presentation format used to render the
+        results. The modification time of its file is included so that editing
+        the format replaces earlier exports.
+    @returns: Key which changes when any input or snapshot data change.
+    """
+    filters_normalized = sorted(map(
+        lambda x: json.dumps(x, sort_keys=True),
+        filters_serialized
+    ))
+
+    return compute_etag(db_util.get_data_version(), [
+        kind,
+        filters_normalized,
+        include_deleted,
+        presentation_format.safe_name,
+        db_util.get_presentation_format_version(presentation_format)
+    ])
+
+
+def get_export_path(key: str) -> str:
+    """Get where the cached export with the given key is stored.
+
+    @param key: The key from get_export_key.
+    @returns: Path to the cache file, which may not exist.
+    """
+    return os.path.join(EXPORT_CACHE_DIR, key + EXPORT_CACHE_SUFFIX)
+
+
+def open_cached_export(key: str) -> typing.Optional[typing.BinaryIO]:
+    """Open a previously cached export and mark it as recently used.
+
+    @param key: The key from get_export_key.
+    @returns: The cached file opened for binary reading or None if the export
+        is not cached.
+    """
+    if EXPORT_CACHE_MAX_BYTES <= 0:
+        return None
+
+    path = get_export_path(key)
+    try:
+        cached_file = open(path, 'rb')
+    except OSError:
+        return None
+
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+    return cached_file
+
+
+def put_cached_export(key: str, contents: bytes) -> None:
+    """Save an export so that later identical downloads can reuse it.
+
+    The file is written under a temporary name and renamed into place so that
+    readers never see a partial export.
+
+    @param key: The key from get_export_key.
+    @param contents: The rendered export.
+    """
+    if EXPORT_CACHE_MAX_BYTES <= 0 or len(contents) > EXPORT_CACHE_MAX_BYTES:
+        return
+
+    os.makedirs(EXPORT_CACHE_DIR, exist_ok=True)
+
+    (handle, temp_path) = tempfile.mkstemp(dir=EXPORT_CACHE_DIR)
+    with os.fdopen(handle, 'wb') as f:
+        f.write(contents)
+    os.replace(temp_path, get_export_path(key))
+
+    evict_exports(EXPORT_CACHE_MAX_BYTES)
+
+
+def evict_exports(max_bytes: int) -> None:
+    """Remove the least recently used exports until the cache fits.
+
+    @param max_bytes: The total size the cached exports may take.
+    """
+    with EXPORT_CACHE_LOCK:
+        entries = []
+        for name in os.listdir(EXPORT_CACHE_DIR):
+            if not name.endswith(EXPORT_CACHE_SUFFIX):
+                continue
+
+            path = os.path.join(EXPORT_CACHE_DIR, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total_bytes = sum(map(lambda x: x[1], entries))
+        for (_, size, path) in sorted(entries):
+            if total_bytes <= max_bytes:
+                break
+
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_bytes -= size
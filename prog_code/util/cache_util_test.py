@@ -0,0 +1,144 @@
+"""Tests for answering repeated requests for unchanged data.
+
+Copyright (C) 2014 A. Samuel Pottinger ("Sam Pottinger", gleap.org)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import tempfile
+import unittest
+import unittest.mock
+
+import cdibase
+
+from ..struct import models
+
+import prog_code.util.cache_util as cache_util
+
+
+class CacheUtilTests(unittest.TestCase):
+
+    def test_compute_etag(self):
+        etag = cache_util.compute_etag(1, ['/path', [('a', '1')]])
+        self.assertEqual(
+            etag,
+            cache_util.compute_etag(1, ['/path', [('a', '1')]])
+        )
+        self.assertNotEqual(
+            etag,
+            cache_util.compute_etag(2, ['/path', [('a', '1')]])
+        )
+        self.assertNotEqual(
+            etag,
+            cache_util.compute_etag(1, ['/path', [('a', '2')]])
+        )
+
+    def test_get_request_etag(self):
+        with unittest.mock.patch('prog_code.util.db_util.get_data_version') as mock_version:
+            mock_version.return_value = 1
+
+            with cdibase.app.test_request_context('/path?b=2&a=1&api_key=x'):
+                etag = cache_util.get_request_etag(['api_key'])
+
+            with cdibase.app.test_request_context('/path?a=1&b=2&api_key=y'):
+                self.assertEqual(etag, cache_util.get_request_etag(['api_key']))
+                self.assertFalse(cache_util.is_not_modified(etag))
+
+            headers = {'If-None-Match': '"%s"' % etag}
+            with cdibase.app.test_request_context('/path', headers=headers):
+                self.assertTrue(cache_util.is_not_modified(etag))
+
+                response = cache_util.make_not_modified_response(etag)
+                self.assertEqual(
+                    response.status_code,
+                    cache_util.NOT_MODIFIED_STATUS
+                )
+                self.assertEqual(response.get_etag(), (etag, False))
+
+    def test_get_request_etag_presentation_format(self):
+        presentation_format = models.PresentationFormat(
+            'Test format',
+            'test_format',
+            'test_format.yaml',
+            {}
+        )
+
+        with unittest.mock.patch('prog_code.util.db_util.get_data_version') as mock_version:
+            with unittest.mock.patch('prog_code.util.db_util.get_presentation_format_version') as mock_format_version:
+                mock_version.return_value = 1
+                mock_format_version.return_value = 10
+
+                with cdibase.app.test_request_context('/path?format=test_format'):
+                    etag = cache_util.get_request_etag([], presentation_format)
+                    self.assertEqual(
+                        etag,
+                        cache_util.get_request_etag([], presentation_format)
+                    )
+
+                    mock_format_version.return_value = 11
+                    self.assertNotEqual(
+                        etag,
+                        cache_util.get_request_etag([], presentation_format)
+                    )
+
+    def test_export_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with unittest.mock.patch('prog_code.util.cache_util.EXPORT_CACHE_DIR', directory):
+                self.assertEqual(cache_util.open_cached_export('a'), None)
+
+                cache_util.put_cached_export('a', b'12345')
+                cache_util.put_cached_export('b', b'67890')
+                os.utime(cache_util.get_export_path('a'), (1, 1))
+                os.utime(cache_util.get_export_path('b'), (2, 2))
+
+                with cache_util.open_cached_export('a') as f:
+                    self.assertEqual(f.read(), b'12345')
+
+                cache_util.evict_exports(8)
+                self.assertEqual(cache_util.open_cached_export('b'), None)
+
+                with cache_util.open_cached_export('a') as f:
+                    self.assertEqual(f.read(), b'12345')
+
+    def test_get_export_key(self):
+        presentation_format = models.PresentationFormat(
+            'Test format',
+            'test_format',
+            'missing.yaml',
+            {}
+        )
+        filters = [{'field': 'a'}, {'field': 'b'}]
+
+        with unittest.mock.patch('prog_code.util.db_util.get_data_version') as mock_version:
+            mock_version.return_value = 1
+            key = cache_util.get_export_key('csv', filters, True,
+                presentation_format)
+
+            self.assertEqual(
+                key,
+                cache_util.get_export_key('csv', filters[::-1], True,
+                    presentation_format)
+            )
+            self.assertNotEqual(
+                key,
+                cache_util.get_export_key('zip', filters, True,
+                    presentation_format)
+            )
+
+            mock_version.return_value = 2
+            self.assertNotEqual(
+                key,
+                cache_util.get_export_key('csv', filters, True,
+                    presentation_format)
+            )
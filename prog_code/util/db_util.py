@@ -19,8 +19,11 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 @license: GNU GPL v3
 """
 
+import collections
 import csv
 import datetime
+import hashlib
+import itertools
 import os
 import json
 import sqlite3
@@ -34,6 +37,8 @@ from ..struct import models
 
 import prog_code.util.constants as constants
 import prog_code.util.file_util as file_util
+import prog_code.util.interp_util as interp_util
+import prog_code.util.type_util as type_util
 
 OptionalCursor = typing.Optional[sqlite3.Cursor]
 
@@ -60,6 +65,89 @@ SNAPSHOT_METADATA_COLS = [
     'deleted'
 ]
 
+# Birthday and session date as days since interp_util.DAY_NUM_EPOCH. These
+# shadow the text date columns so that date ranges can use an index.
+SNAPSHOT_DAY_COLS = ['birthday_day', 'session_date_day']
+
+# Metadata columns followed by columns only written when a snapshot is created
+# and then derived columns.
+SNAPSHOT_INSERT_COLS = (
+    SNAPSHOT_METADATA_COLS +
+    ['fingerprint'] +
+    SNAPSHOT_DAY_COLS
+)
+
+DUPLICATE_REJECT = 'reject'
+DUPLICATE_WARN = 'warn'
+DUPLICATE_ALLOW = 'allow'
+
+# How new snapshots with the same fingerprint as an existing snapshot are
+# handled: rejected with DuplicateSnapshotError, saved and reported to the
+# caller, or saved without checking.
+DUPLICATE_SNAPSHOT_POLICY = DUPLICATE_WARN
+
+DUPLICATE_SNAPSHOT_MSG = 'The snapshot duplicates existing snapshot %d.'
+
+SESSION_COUNT_QUERY = (
+    'SELECT COUNT(*) FROM snapshots WHERE study=? AND study_id=? AND deleted=0'
+)
+
+NEXT_SESSION_NUM_SUBQUERY = '((%s) + 1)' % SESSION_COUNT_QUERY
+
+CHILD_ID_SEQUENCE = 'child_id'
+CHILD_ID_TEMPLATE = 'auto_%d'
+
+# Sequence advanced by every write to snapshots so that cached responses can
+# be checked for staleness without reading the snapshot tables.
+DATA_VERSION_SEQUENCE = 'data_version'
+
+# Operations recorded in the snapshot_changes log.
+CHANGE_INSERT = 'insert'
+CHANGE_UPDATE = 'update'
+CHANGE_DELETE = 'delete'
+CHANGE_RESTORE = 'restore'
+CHANGE_HARD_DELETE = 'hard_delete'
+
+SnapshotChange = collections.namedtuple(
+    'SnapshotChange',
+    ['sequence', 'snapshot_id', 'operation']
+)
+
+ReportSources = collections.namedtuple(
+    'ReportSources',
+    ['contents', 'snapshot_rows', 'change_sequences']
+)
+
+# Number of snapshots written per executemany batch during bulk inserts.
+BULK_INSERT_CHUNK_SIZE = 250
+
+BulkInsertSummary = collections.namedtuple(
+    'BulkInsertSummary',
+    ['database_ids', 'num_snapshots', 'num_words', 'seconds', 'duplicate_ids']
+)
+
+
+class DuplicateSnapshotError(Exception):
+    """Error raised when a new snapshot duplicates an existing snapshot."""
+
+    def __init__(self, existing_id: int):
+        """Create a new error for a rejected duplicate snapshot.
+
+        @param existing_id: The database ID of the snapshot duplicated.
+        """
+        super().__init__(DUPLICATE_SNAPSHOT_MSG % existing_id)
+        self.existing_id = existing_id
+
+
+# If True, this process opens the application database read-only, like the
+# worker processes which render reports.
+DB_READ_ONLY = False
+
+# Number of child IDs each process claims from the database at a time when not
+# participating in a caller's transaction. Values above 1 avoid a write per new
+# participant at the cost of gaps in the IDs handed out.
+CHILD_ID_BLOCK_SIZE = 1
+
 
 class SharedConnection:
     """Singleton wrapper around a database connection.
@@ -92,7 +180,13 @@ class SharedConnection:
         wrapper / singleton. This should only be called by SharedConnection
         itself.
         """
-        self.__connection = sqlite3.connect('./db/cdi.db')
+        if DB_READ_ONLY:
+            self.__connection = sqlite3.connect(
+                'file:./db/cdi.db?mode=ro',
+                uri=True
+            )
+        else:
+            self.__connection = sqlite3.connect('./db/cdi.db')
         self.__lock = threading.Lock()
 
     def cursor(self) -> sqlite3.Cursor:
@@ -104,6 +198,15 @@ class SharedConnection:
         self.__lock.acquire(True)
         return self.__connection.cursor()
 
+    def acquire(self) -> None:
+        """With thread-saftey, resume using a cursor acquired earlier.
+
+        Wait for the connection to be available again after releasing it with
+        close while still holding a cursor, such as between batches of a
+        query's results.
+        """
+        self.__lock.acquire(True)
+
     def commit(self) -> None:
         """Commit changes made to the database.
 
@@ -112,6 +215,10 @@ class SharedConnection:
         """
         self.__connection.commit()
 
+    def rollback(self) -> None:
+        """Discard changes made to the database since the last commit."""
+        self.__connection.rollback()
+
     def close(self) -> None:
         """Release the current thread's aquired connection.
 
@@ -149,10 +256,77 @@ class RealizedCursor:
         return self.__cursor
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        """Clean up the cursor allocation if it was needed."""
+        """Clean up the cursor allocation if it was needed.
+
+        Changes are committed unless the block raised, in which case they are
+        rolled back.
+        """
         if not self.__cursor_provided:
-            self.__connection.commit()
-            self.__connection.close()
+            try:
+                if exc_type == None:
+                    self.__connection.commit()
+                else:
+                    self.__connection.rollback()
+            finally:
+                self.__connection.close()
+
+
+class IdBlockAllocator:
+    """Process-local cache of values claimed from a database sequence.
+
+    Values are claimed from the named sequence in blocks so that a process can
+    hand out several IDs while only writing to the sequence once. Blocks are
+    only cached when claimed in their own committed transaction. Otherwise a
+    rollback in the caller's transaction could cause the same values to be
+    handed out again by another process.
+    """
+
+    def __init__(self, sequence_name: str):
+        """Create a new allocator without any values claimed.
+
+        @param sequence_name: The name of the sequence in id_sequences from
+            which values should be claimed.
+        """
+        self.__sequence_name = sequence_name
+        self.__lock = threading.Lock()
+        self.__pid: typing.Optional[int] = None
+        self.__available: typing.List[int] = []
+
+    def allocate(self, count: int, block_size: int,
+            cursor_maybe: OptionalCursor = None) -> typing.List[int]:
+        """Get new unique values from the sequence.
+
+        @param count: The number of values requested.
+        @param block_size: The minimum number of values to claim from the
+            database if the local cache needs to be refilled.
+        @param cursor_maybe: The cursor to use in executing the operation or
+            None if a new cursor should be created. If provided, values are
+            claimed within that cursor's transaction and none are cached.
+        @returns: List of newly allocated values.
+        """
+        if cursor_maybe != None or block_size <= 1:
+            return list(advance_sequence(
+                self.__sequence_name,
+                count,
+                cursor_maybe
+            ))
+
+        with self.__lock:
+            # Do not share a block with a forked worker process.
+            if self.__pid != os.getpid():
+                self.__pid = os.getpid()
+                self.__available = []
+
+            if len(self.__available) < count:
+                needed = count - len(self.__available)
+                self.__available.extend(advance_sequence(
+                    self.__sequence_name,
+                    max(block_size, needed)
+                ))
+
+            ret_val = self.__available[:count]
+            self.__available = self.__available[count:]
+            return ret_val
 
 
 def get_db_connection() -> SharedConnection:
@@ -276,6 +450,10 @@ def delete_presentation_model(metadataModelName: str,
             'DELETE FROM presentation_formats WHERE safe_name=?',
             (metadataModelName,)
         )
+        cursor.execute(
+            'DELETE FROM snapshot_report_rows WHERE format=?',
+            (metadataModelName,)
+        )
 
 
 def load_presentation_model_listing(
@@ -340,6 +518,24 @@ def load_presentation_model(
     )
 
 
+def get_presentation_format_version(
+        presentation_format: models.PresentationFormat) -> typing.Optional[float]:
+    """Get a value which changes when a presentation format file is replaced.
+
+    @param presentation_format: The presentation format to check.
+    @return: Modification time of the format's file or None if the file could
+        not be found.
+    """
+    filename = os.path.join(
+        file_util.UPLOAD_FOLDER,
+        presentation_format.filename
+    )
+    try:
+        return os.path.getmtime(filename)
+    except OSError:
+        return None
+
+
 def save_percentile_model(
         newMetadataModel: models.PercentileTableMetadata,
         cursor_maybe: OptionalCursor = None) -> None:
@@ -459,6 +655,130 @@ def load_snapshot_contents(snapshot: models.SnapshotMetadata,
     return ret_val
 
 
+def load_snapshot_contents_batch(snapshot_ids: typing.Iterable[int],
+        cursor_maybe: OptionalCursor = None) -> typing.Dict[
+            int, typing.List[models.SnapshotContent]]:
+    """Load word statuses for many snapshots with a few queries.
+
+    @param snapshot_ids: The database IDs of the snapshots to get contents for.
+    @param cursor_maybe: The cursor to use or None to get a new cursor.
+    @return: Mapping from snapshot database ID to the details of that CDI
+        snapshot. Snapshots without contents map to an empty list.
+    """
+    snapshot_ids_realized = list(snapshot_ids)
+    ret_val = dict(map(lambda x: (x, []), snapshot_ids_realized)) # type: typing.Dict[int, typing.List[models.SnapshotContent]]
+
+    with get_realized_cursor(cursor_maybe) as cursor:
+        for i in range(0, len(snapshot_ids_realized), CONTENT_QUERY_SIZE):
+            batch = snapshot_ids_realized[i:i + CONTENT_QUERY_SIZE]
+            cursor.execute(
+                LOAD_SNAPSHOT_CONTENTS_BATCH_QUERY % ', '.join('?' * len(batch)),
+                batch
+            )
+            for row in cursor.fetchall():
+                content = models.SnapshotContent(*row)
+                snapshot_id = type_util.assert_not_none(content.snapshot_id)
+                ret_val[snapshot_id].append(content)
+
+    return ret_val
+
+
+def load_report_sources(snapshot_ids: typing.Iterable[int],
+        cursor_maybe: OptionalCursor = None) -> ReportSources:
+    """Load what is needed to render and save report rows for snapshots.
+
+    Everything is read within one transaction so that the contents, metadata
+    and change sequence numbers agree with each other.
+
+    @param snapshot_ids: The database IDs of the snapshots to render.
+    @param cursor_maybe: The cursor to use or None to get a new cursor.
+    @return: The snapshots' contents, current snapshots table rows, and latest
+        change sequence numbers (0 if no change was logged) by database ID.
+        Snapshots which no longer exist have no row.
+    """
+    snapshot_ids_realized = list(snapshot_ids)
+    snapshot_rows: typing.Dict[int, typing.Tuple] = {}
+    change_sequences = dict(map(lambda x: (x, 0), snapshot_ids_realized))
+
+    with get_realized_cursor(cursor_maybe) as cursor:
+        connection = getattr(cursor, 'connection', None)
+        if connection != None and not connection.in_transaction:
+            cursor.execute('BEGIN')
+
+        contents = load_snapshot_contents_batch(snapshot_ids_realized, cursor)
+
+        for i in range(0, len(snapshot_ids_realized), CONTENT_QUERY_SIZE):
+            batch = snapshot_ids_realized[i:i + CONTENT_QUERY_SIZE]
+            placeholders = ', '.join('?' * len(batch))
+
+            cursor.execute(LOAD_SNAPSHOTS_BY_ID_QUERY % placeholders, batch)
+            for row in cursor.fetchall():
+                snapshot_rows[row[0]] = row
+
+            cursor.execute(LOAD_CHANGE_SEQUENCES_QUERY % placeholders, batch)
+            change_sequences.update(cursor.fetchall())
+
+    return ReportSources(contents, snapshot_rows, change_sequences)
+
+
+def load_report_rows(snapshot_ids: typing.Iterable[int], format_name: str,
+        format_version: str,
+        cursor_maybe: OptionalCursor = None) -> typing.Dict[int, str]:
+    """Load report rows saved for snapshots by earlier exports.
+
+    @param snapshot_ids: The database IDs of the snapshots to get rows for.
+    @param format_name: The safe name of the presentation format used to render
+        the rows.
+    @param format_version: The version of the presentation format, see
+        get_presentation_format_version. Rows rendered with other versions are
+        ignored.
+    @param cursor_maybe: The cursor to use or None to get a new cursor.
+    @return: Mapping from snapshot database ID to serialized row for the
+        snapshots with saved rows which are still current.
+    """
+    snapshot_ids_realized = list(snapshot_ids)
+    ret_val: typing.Dict[int, str] = {}
+
+    with get_realized_cursor(cursor_maybe) as cursor:
+        for i in range(0, len(snapshot_ids_realized), CONTENT_QUERY_SIZE):
+            batch = snapshot_ids_realized[i:i + CONTENT_QUERY_SIZE]
+            cursor.execute(
+                LOAD_REPORT_ROWS_QUERY % ', '.join('?' * len(batch)),
+                [format_name, format_version, *batch]
+            )
+            ret_val.update(cursor.fetchall())
+
+    return ret_val
+
+
+def save_report_rows(rows: typing.Iterable[typing.Tuple[int, int, str]],
+        format_name: str, format_version: str,
+        cursor_maybe: OptionalCursor = None) -> None:
+    """Save report rows so that later exports need not render them again.
+
+    Saved rows are removed when their snapshot changes (see
+    record_snapshot_changes) or their presentation format is deleted. Rows for
+    snapshots changed since they were rendered are not saved.
+
+    @param rows: Tuples of snapshot database ID, the snapshot's change sequence
+        number from load_report_sources, and serialized row.
+    @param format_name: The safe name of the presentation format used to render
+        the rows.
+    @param format_version: The version of the presentation format, see
+        get_presentation_format_version.
+    @param cursor_maybe: The cursor to use or None to get a new cursor.
+    """
+    with get_realized_cursor(cursor_maybe) as cursor:
+        cursor.executemany(
+            SAVE_REPORT_ROW_CMD,
+            map(
+                lambda x: (x[0], format_name, format_version, x[1], x[2],
+                    x[0], x[1]),
+                rows
+            )
+        )
+
+
 def load_user_model(
         identifier: typing.Union[int, str],
         cursor_maybe: OptionalCursor = None) -> typing.Optional[models.User]:
@@ -847,7 +1167,14 @@ def update_participant_metadata(child_id: str, gender: int, birthday_str: str,
     @type languages: list of str
     """
     with get_realized_cursor(cursor) as cursor_realized:
-        cols = ['gender', 'birthday', 'hard_of_hearing', 'languages']
+        cols = [
+            'gender',
+            'birthday',
+            'hard_of_hearing',
+            'languages',
+            'birthday_day'
+        ]
+        birthday_day = interp_util.safe_interpret_day_num(birthday_str)
         cmd_template = None
         if snapshot_ids:
             cmd_template = 'UPDATE snapshots SET %s WHERE child_id=? AND '
@@ -868,8 +1195,8 @@ def update_participant_metadata(child_id: str, gender: int, birthday_str: str,
         if snapshot_ids:
             for snapshot_id in snapshot_ids:
                 params = (gender, birthday_str, hard_of_hearing,
-                    ','.join(languages), child_id, snapshot_id['study'],
-                    snapshot_id['id'])
+                    ','.join(languages), birthday_day, child_id,
+                    snapshot_id['study'], snapshot_id['id'])
                 run_metadata_update(params)
         else:
             params = (
@@ -877,10 +1204,220 @@ def update_participant_metadata(child_id: str, gender: int, birthday_str: str,
                 birthday_str,
                 hard_of_hearing,
                 ','.join(languages),
+                birthday_day,
                 child_id
             )
             run_metadata_update(params)
 
+        language_vals = prepare_language_rows(None, languages)
+        where_params: typing.List[typing.Tuple]
+        if snapshot_ids:
+            where_clause = 'child_id=? AND study=? AND session_num=?'
+            where_params = [
+                (child_id, x['study'], x['id']) for x in snapshot_ids
+            ]
+        else:
+            where_clause = 'child_id=?'
+            where_params = [(child_id,)]
+
+        delete_cmd = REPLACE_LANGUAGES_DELETE_CMD % where_clause
+        insert_cmd = REPLACE_LANGUAGES_INSERT_CMD % where_clause
+        for where_param in where_params:
+            cursor_realized.execute(delete_cmd, where_param)
+            for (_, language) in language_vals:
+                cursor_realized.execute(insert_cmd, (language,) + where_param)
+            cursor_realized.execute(
+                RECORD_MATCHING_CHANGES_CMD % where_clause,
+                (CHANGE_UPDATE,) + where_param
+            )
+            cursor_realized.execute(
+                CLEAR_MATCHING_REPORT_ROWS_CMD % where_clause,
+                where_param
+            )
+            refresh_snapshot_fingerprints(
+                where_clause,
+                where_param,
+                cursor_realized
+            )
+
+        bump_data_version(cursor_realized)
+
+
+def count_participant_sessions(study: str, study_id: str,
+        cursor_maybe: OptionalCursor = None) -> int:
+    """Count the non-deleted snapshots on file for a study participant.
+
+    Uses the (study, study_id) index so that the count does not require
+    loading the participant's prior snapshots.
+
+    @param study: The name of the study.
+    @param study_id: The ID of the participant within the study.
+    @param cursor_maybe: The cursor to use in executing the operation or None if
+        a new cursor should be created.
+    @returns: Number of snapshots for the participant that are not deleted.
+    """
+    with get_realized_cursor(cursor_maybe) as cursor:
+        cursor.execute(SESSION_COUNT_QUERY, (study, study_id))
+        return cursor.fetchone()[0]
+
+
+def advance_sequence(name: str, count: int = 1,
+        cursor_maybe: OptionalCursor = None) -> range:
+    """Atomically claim the next values from a named sequence.
+
+    The sequence row is advanced before it is read so that the values are
+    reserved for this transaction as soon as the write lock is taken.
+
+    @param name: The name of the sequence in id_sequences.
+    @param count: The number of values to claim.
+    @param cursor_maybe: The cursor to use in executing the operation or None if
+        a new cursor should be created.
+    @returns: Range over the values claimed.
+    """
+    with get_realized_cursor(cursor_maybe) as cursor:
+        cursor.execute(
+            'UPDATE id_sequences SET next_value=next_value+? WHERE name=?',
+            (count, name)
+        )
+        cursor.execute(
+            'SELECT next_value FROM id_sequences WHERE name=?',
+            (name,)
+        )
+        result = cursor.fetchone()
+
+    if result == None:
+        raise RuntimeError('Sequence %s not found.' % name)
+
+    end = result[0]
+    return range(end - count, end)
+
+
+def bump_data_version(cursor_maybe: OptionalCursor = None) -> None:
+    """Record that snapshot data has changed.
+
+    Should be called in the same transaction as the change so that readers
+    never see new data with the old version.
+
+    @param cursor_maybe: The cursor to use in executing the operation or None if
+        a new cursor should be created.
+    """
+    with get_realized_cursor(cursor_maybe) as cursor:
+        cursor.execute(
+            'UPDATE id_sequences SET next_value=next_value+1 WHERE name=?',
+            (DATA_VERSION_SEQUENCE,)
+        )
+
+
+def record_snapshot_changes(snapshot_ids: typing.Iterable[int],
+        operation: str, cursor_maybe: OptionalCursor = None) -> None:
+    """Append to the log of changes made to snapshots.
+
+    Should be called in the same transaction as the change and, for hard
+    deletes, before the snapshots are removed so that their study is recorded.
+    Also discards the report rows saved for the snapshots.
+
+    @param snapshot_ids: The database IDs of the snapshots changed.
+    @param operation: One of the CHANGE_ constants describing the change.
+    @param cursor_maybe: The cursor to use in executing the operation or None if
+        a new cursor should be created.
+    """
+    snapshot_ids_realized = list(snapshot_ids)
+
+    with get_realized_cursor(cursor_maybe) as cursor:
+        cursor.executemany(
+            RECORD_SNAPSHOT_CHANGE_CMD,
+            map(lambda x: (operation, x), snapshot_ids_realized)
+        )
+        cursor.executemany(
+            CLEAR_REPORT_ROWS_CMD,
+            map(lambda x: (x,), snapshot_ids_realized)
+        )
+
+
+def load_snapshot_changes(since: int, limit: int,
+        cursor_maybe: OptionalCursor = None) -> typing.List[SnapshotChange]:
+    """Read the log of changes made to snapshots.
+
+    @param since: Only changes with a sequence number after this are returned.
+    @param limit: The maximum number of changes to return.
+    @param cursor_maybe: The cursor to use or None to get a new cursor.
+    @returns: Changes in the order they were made.
+    """
+    with get_realized_cursor(cursor_maybe) as cursor:
+        cursor.execute(LOAD_SNAPSHOT_CHANGES_QUERY, (since, limit))
+        ret_val = list(map(lambda x: SnapshotChange(*x), cursor.fetchall()))
+
+    return ret_val
+
+
+def get_latest_change_sequence(cursor_maybe: OptionalCursor = None) -> int:
+    """Get the sequence number of the most recent change made to snapshots.
+
+    @param cursor_maybe: The cursor to use or None to get a new cursor.
+    @returns: The largest sequence number in the change log or 0 if no changes
+        have been recorded.
+    """
+    with get_realized_cursor(cursor_maybe) as cursor:
+        cursor.execute('SELECT MAX(sequence) FROM snapshot_changes')
+        result = cursor.fetchone()
+
+    if result == None or result[0] == None:
+        return 0
+    else:
+        return result[0]
+
+
+def load_changed_studies(since: int, until: int,
+        cursor_maybe: OptionalCursor = None) -> typing.List[str]:
+    """Find the studies with snapshots changed within a range of the change log.
+
+    @param since: Only changes with a sequence number after this are included.
+    @param until: Only changes with a sequence number up to and including this
+        are included.
+    @param cursor_maybe: The cursor to use or None to get a new cursor.
+    @returns: Names of the studies with changed snapshots.
+    """
+    with get_realized_cursor(cursor_maybe) as cursor:
+        cursor.execute(LOAD_CHANGED_STUDIES_QUERY, (since, until))
+        ret_val = sorted(map(lambda x: x[0], cursor.fetchall()))
+
+    return ret_val
+
+
+def get_data_version(cursor_maybe: OptionalCursor = None) -> int:
+    """Get a number which changes whenever snapshot data are changed.
+
+    @param cursor_maybe: The cursor to use or None to get a new cursor.
+    @returns: The current data version.
+    """
+    with get_realized_cursor(cursor_maybe) as cursor:
+        cursor.execute(
+            'SELECT next_value FROM id_sequences WHERE name=?',
+            (DATA_VERSION_SEQUENCE,)
+        )
+        result = cursor.fetchone()
+
+    if result == None:
+        raise RuntimeError('Sequence %s not found.' % DATA_VERSION_SEQUENCE)
+
+    return result[0]
+
+
+CHILD_ID_ALLOCATOR = IdBlockAllocator(CHILD_ID_SEQUENCE)
+
+
+def reserve_child_ids(count: int,
+        cursor: OptionalCursor = None) -> typing.List[str]:
+    """Reserve multiple unique child IDs.
+
+    @param count: The number of IDs to reserve.
+    @param cursor: The cursor to use to execute the operation or None if one
+        should be created.
+    @returns: New child ids.
+    """
+    new_ids = CHILD_ID_ALLOCATOR.allocate(count, CHILD_ID_BLOCK_SIZE, cursor)
+    return [CHILD_ID_TEMPLATE % x for x in new_ids]
+
 
 def reserve_child_id(cursor: OptionalCursor = None) -> str:
     """Reserve a unique child ID.
@@ -888,14 +1425,7 @@ def reserve_child_id(cursor: OptionalCursor = None) -> str:
     @param cursor: The cursor to use to execute the operation or None if one should be created.
     @returns: New child id.
     """
-    with get_realized_cursor(cursor) as cursor_realized:
-        cmd = 'INSERT INTO reservation VALUES (?)'
-        cursor_realized.execute(
-            cmd,
-            (int(time.time()),)
-        )
-        new_id = cursor_realized.lastrowid
-        return 'auto_%d' % new_id
+    return reserve_child_ids(1, cursor)[0]
 
 
 def update_snapshot(snapshot_metadata: models.SnapshotMetadata,
@@ -909,9 +1439,11 @@ def update_snapshot(snapshot_metadata: models.SnapshotMetadata,
     @param snapshot_metadata: The metadata to update.
     @param cursor: The cursor to use to execute the operation.
     """
+    database_id = type_util.assert_not_none(snapshot_metadata.database_id)
+
     with get_realized_cursor(cursor) as cursor_realized:
         if snapshot_metadata.child_id == None:
-            child_id = reserve_child_id(cursor)
+            child_id = reserve_child_id(cursor_realized)
         else:
             child_id = snapshot_metadata.child_id # type: ignore
 
@@ -925,8 +1457,20 @@ def update_snapshot(snapshot_metadata: models.SnapshotMetadata,
             raise RuntimeError('Languages must be a list.')
 
         languages_val = ','.join(snapshot_metadata.languages)
+        (birthday_day, session_date_day) = prepare_day_values(snapshot_metadata)
 
-        non_db_id_cols = SNAPSHOT_METADATA_COLS[1:]
+        # If the snapshot is moving to another study, log the change under the
+        # study it is leaving too so that study's exports are rebuilt.
+        cursor_realized.execute(
+            RECORD_MOVED_SNAPSHOT_CHANGE_CMD,
+            (
+                CHANGE_UPDATE,
+                snapshot_metadata.database_id,
+                snapshot_metadata.study
+            )
+        )
+
+        non_db_id_cols = SNAPSHOT_METADATA_COLS[1:] + SNAPSHOT_DAY_COLS
         col_statements = map(lambda x: x + '=?', non_db_id_cols)
         cmd = 'UPDATE snapshots SET %s WHERE id=?' % ','.join(col_statements)
         cursor_realized.execute(
@@ -951,10 +1495,29 @@ def update_snapshot(snapshot_metadata: models.SnapshotMetadata,
                 snapshot_metadata.cdi_type,
                 snapshot_metadata.hard_of_hearing,
                 snapshot_metadata.deleted,
+                birthday_day,
+                session_date_day,
                 snapshot_metadata.database_id
             )
         )
 
+        replace_snapshot_languages(
+            database_id,
+            snapshot_metadata.languages,
+            cursor_realized
+        )
+        refresh_snapshot_fingerprints(
+            'id=?',
+            (snapshot_metadata.database_id,),
+            cursor_realized
+        )
+
+        record_snapshot_changes(
+            [database_id],
+            CHANGE_UPDATE,
+            cursor_realized
+        )
+        bump_data_version(cursor_realized)
 
 
 def delete_snapshot(snapshot_id: int,
@@ -966,6 +1529,7 @@ def delete_snapshot(snapshot_id: int,
         a new cursor should be created.
     """
     with get_realized_cursor(cursor_maybe) as cursor:
+        record_snapshot_changes([snapshot_id], CHANGE_HARD_DELETE, cursor)
         cursor.execute(
             '''DELETE FROM snapshots WHERE id = ?''',
             (snapshot_id,)
@@ -974,15 +1538,361 @@ def delete_snapshot(snapshot_id: int,
             '''DELETE FROM snapshot_content WHERE snapshot_id = ?''',
             (snapshot_id,)
         )
+        delete_snapshot_languages([snapshot_id], cursor)
+        bump_data_version(cursor)
+
+
+def delete_snapshot_languages(snapshot_ids: typing.Iterable[int],
+        cursor_maybe: OptionalCursor = None) -> None:
+    """Remove the snapshot_languages rows for snapshots being hard deleted.
+
+    @param snapshot_ids: The database IDs of the snapshots whose languages
+        should be removed.
+    @param cursor_maybe: The cursor to use in executing the operation or None if
+        a new cursor should be created.
+    """
+    with get_realized_cursor(cursor_maybe) as cursor:
+        cursor.executemany(
+            DELETE_SNAPSHOT_LANGUAGES_CMD,
+            map(lambda x: (x,), snapshot_ids)
+        )
+
+
+def replace_snapshot_languages(snapshot_id: int,
+        languages: typing.Iterable[str],
+        cursor_maybe: OptionalCursor = None) -> None:
+    """Overwrite the languages recorded for a snapshot in snapshot_languages.
+
+    @param snapshot_id: The database ID of the snapshot to update.
+    @param languages: The languages now recorded on the snapshot.
+    @param cursor_maybe: The cursor to use in executing the operation or None if
+        a new cursor should be created.
+    """
+    with get_realized_cursor(cursor_maybe) as cursor:
+        cursor.execute(DELETE_SNAPSHOT_LANGUAGES_CMD, (snapshot_id,))
+        for row in prepare_language_rows(snapshot_id, languages):
+            cursor.execute(INSERT_SNAPSHOT_LANGUAGE_CMD, row)
+
+
+def prepare_snapshot_row(snapshot_metadata: models.SnapshotMetadata,
+        child_id: typing.Any,
+        database_id: typing.Optional[int] = None) -> typing.List[typing.Any]:
+    """Standardize a snapshot's metadata and get it as a snapshots table row.
+
+    Note that this standardizes the dates on snapshot_metadata in place.
+
+    @param snapshot_metadata: The metadata to be written.
+    @param child_id: The global ID of the participant to record.
+    @param database_id: The ID to give the new row or None to have the database
+        assign one.
+    @returns: Values in the order of SNAPSHOT_METADATA_COLS.
+    """
+    # Standardize date
+    snapshot_metadata.birthday = clean_up_date_force(snapshot_metadata.birthday)
+    snapshot_metadata.session_date = clean_up_date_force(
+        snapshot_metadata.session_date
+    )
+
+    if isinstance(snapshot_metadata.languages, str):
+        raise RuntimeError('Languages must be a list.')
+
+    languages_val = ','.join(snapshot_metadata.languages)
+
+    return [
+        database_id,
+        child_id,
+        snapshot_metadata.study_id,
+        snapshot_metadata.study,
+        snapshot_metadata.gender,
+        snapshot_metadata.age,
+        snapshot_metadata.birthday,
+        snapshot_metadata.session_date,
+        snapshot_metadata.session_num,
+        snapshot_metadata.total_num_sessions,
+        snapshot_metadata.words_spoken,
+        snapshot_metadata.items_excluded,
+        snapshot_metadata.percentile,
+        snapshot_metadata.extra_categories,
+        snapshot_metadata.revision,
+        languages_val,
+        snapshot_metadata.num_languages,
+        snapshot_metadata.cdi_type,
+        snapshot_metadata.hard_of_hearing,
+        snapshot_metadata.deleted
+    ]
+
+
+def prepare_day_values(snapshot_metadata: models.SnapshotMetadata
+        ) -> typing.Tuple[typing.Optional[int], typing.Optional[int]]:
+    """Get the values of SNAPSHOT_DAY_COLS for a snapshot.
+
+    @param snapshot_metadata: The metadata with standardized dates.
+    @returns: Birthday and session date as day numbers or None for dates that
+        cannot be interpreted.
+    """
+    return (
+        interp_util.safe_interpret_day_num(snapshot_metadata.birthday),
+        interp_util.safe_interpret_day_num(snapshot_metadata.session_date)
+    )
+
+
+def prepare_content_rows(snapshot_id: int,
+        word_entries: typing.Union[
+            typing.Mapping[str, int],
+            typing.Iterable[models.SnapshotContent]
+        ]) -> typing.List[typing.Tuple[int, str, int, int]]:
+    """Get the snapshot_content table rows for a snapshot's words.
+
+    @param snapshot_id: The database ID of the snapshot the words belong to.
+    @param word_entries: Collection of records indicating what words were
+        spoken and what words were not. If dict, keys should be words and values
+        are status indicators showing if those words were spoken or not.
+        Othwerwise should be collection of models.SnapshotContent
+    @returns: Rows for the snapshot_content table.
+    """
+    if type(word_entries) is dict:
+        word_entries_dict: dict
+        word_entries_dict = word_entries # type: ignore
+        return [
+            (snapshot_id, word.lower(), val, 0)
+            for (word, val) in word_entries_dict.items()
+        ]
+    else:
+        word_entries_obj: typing.Iterable[models.SnapshotContent]
+        word_entries_obj = word_entries # type: ignore
+        return [
+            (
+                snapshot_id,
+                word_entry.word.lower(),
+                word_entry.value,
+                word_entry.revision
+            )
+            for word_entry in word_entries_obj
+        ]
+
+
+def prepare_language_rows(snapshot_id: typing.Optional[int],
+        languages: typing.Iterable[str]) -> typing.List[typing.Tuple[typing.Any, str]]:
+    """Get the snapshot_languages table rows for a snapshot's languages.
+
+    Languages are lower cased and stripped so that filters can match them with
+    an indexed equality check. Blanks and repeats are dropped.
+
+    @param snapshot_id: The database ID of the snapshot the languages belong to.
+    @param languages: The languages recorded on the snapshot.
+    @returns: Rows for the snapshot_languages table.
+    """
+    seen = set()
+    rows = []
+    for language in languages:
+        language_clean = language.strip().lower()
+        if language_clean != '' and not language_clean in seen:
+            seen.add(language_clean)
+            rows.append((snapshot_id, language_clean))
+
+    return rows
+
+
+INSERT_SNAPSHOT_CONTENT_CMD = 'INSERT INTO snapshot_content VALUES (?, ?, ?, ?)'
+
+INSERT_SNAPSHOT_LANGUAGE_CMD = (
+    'INSERT INTO snapshot_languages (snapshot_id, language) VALUES (?, ?)'
+)
+
+DELETE_SNAPSHOT_LANGUAGES_CMD = (
+    'DELETE FROM snapshot_languages WHERE snapshot_id = ?'
+)
+
+REPLACE_LANGUAGES_DELETE_CMD = (
+    'DELETE FROM snapshot_languages WHERE snapshot_id IN '
+    '(SELECT id FROM snapshots WHERE %s)'
+)
+
+REPLACE_LANGUAGES_INSERT_CMD = (
+    'INSERT INTO snapshot_languages (snapshot_id, language) '
+    'SELECT id, ? FROM snapshots WHERE %s'
+)
+
+INSERT_SNAPSHOT_CMD = 'INSERT INTO snapshots (%s) VALUES (%s)'
+
+RECORD_SNAPSHOT_CHANGE_CMD = (
+    'INSERT INTO snapshot_changes (snapshot_id, operation, study) '
+    'SELECT id, ?, study FROM snapshots WHERE id = ?'
+)
+
+RECORD_MOVED_SNAPSHOT_CHANGE_CMD = (
+    'INSERT INTO snapshot_changes (snapshot_id, operation, study) '
+    'SELECT id, ?, study FROM snapshots WHERE id = ? AND study IS NOT ?'
+)
+
+RECORD_MATCHING_CHANGES_CMD = (
+    'INSERT INTO snapshot_changes (snapshot_id, operation, study) '
+    'SELECT id, ?, study FROM snapshots WHERE %s ORDER BY id'
+)
+
+CLEAR_REPORT_ROWS_CMD = 'DELETE FROM snapshot_report_rows WHERE snapshot_id = ?'
+
+CLEAR_MATCHING_REPORT_ROWS_CMD = (
+    'DELETE FROM snapshot_report_rows WHERE snapshot_id IN '
+    '(SELECT id FROM snapshots WHERE %s)'
+)
+
+LATEST_CHANGE_SUBQUERY = (
+    'COALESCE((SELECT MAX(sequence) FROM snapshot_changes '
+    'WHERE snapshot_changes.snapshot_id = %s), 0)'
+)
+
+# Rows are only reused while no change has been logged for their snapshot
+# since they were rendered.
+LOAD_REPORT_ROWS_QUERY = (
+    'SELECT snapshot_id, row FROM snapshot_report_rows '
+    'WHERE format = ? AND format_version = ? AND snapshot_id IN (%s) AND '
+    'change_sequence = ' + (
+        LATEST_CHANGE_SUBQUERY % 'snapshot_report_rows.snapshot_id'
+    )
+)
+
+# Rows are only saved if no change has been logged for their snapshot since
+# the values they were rendered from were read.
+SAVE_REPORT_ROW_CMD = (
+    'INSERT OR REPLACE INTO snapshot_report_rows '
+    '(snapshot_id, format, format_version, change_sequence, row) '
+    'SELECT ?, ?, ?, ?, ? WHERE ' + (LATEST_CHANGE_SUBQUERY % '?') + ' = ?'
+)
+
+LOAD_SNAPSHOTS_BY_ID_QUERY = 'SELECT * FROM snapshots WHERE id IN (%s)'
+
+LOAD_CHANGE_SEQUENCES_QUERY = (
+    'SELECT snapshot_id, MAX(sequence) FROM snapshot_changes '
+    'WHERE snapshot_id IN (%s) GROUP BY snapshot_id'
+)
+
+LOAD_CHANGED_STUDIES_QUERY = (
+    'SELECT DISTINCT study FROM snapshot_changes '
+    'WHERE sequence > ? AND sequence <= ?'
+)
+
+LOAD_SNAPSHOT_CHANGES_QUERY = (
+    'SELECT sequence, snapshot_id, operation FROM snapshot_changes '
+    'WHERE sequence > ? ORDER BY sequence LIMIT ?'
+)
+
+FIND_FINGERPRINTS_QUERY = (
+    'SELECT fingerprint, id FROM snapshots WHERE deleted=0 AND '
+    'fingerprint IN (%s) ORDER BY id'
+)
+
+# Maximum number of fingerprints looked up per query, staying under SQLite's
+# default limit on bound parameters.
+FINGERPRINT_QUERY_SIZE = 500
+
+LOAD_SNAPSHOT_CONTENTS_BATCH_QUERY = (
+    'SELECT * FROM snapshot_content WHERE snapshot_id IN (%s)'
+)
+
+# Maximum number of snapshots whose contents are loaded per query.
+CONTENT_QUERY_SIZE = 500
+
+FINGERPRINT_VALUES_QUERY = (
+    'SELECT snapshots.id, snapshots.study, snapshots.study_id, '
+    'snapshots.session_date, snapshots.cdi_type, snapshot_content.word, '
+    'snapshot_content.value FROM snapshots LEFT JOIN snapshot_content ON '
+    'snapshot_content.snapshot_id = snapshots.id WHERE %s ORDER BY snapshots.id'
+)
+
+BACKFILL_FINGERPRINTS_QUERY = (
+    FINGERPRINT_VALUES_QUERY % 'snapshots.fingerprint IS NULL'
+)
+
+UPDATE_FINGERPRINT_CMD = 'UPDATE snapshots SET fingerprint=? WHERE id=?'
+
+FIND_DUPLICATE_SNAPSHOTS_QUERY = (
+    'SELECT fingerprint, id FROM snapshots WHERE deleted=0 AND fingerprint IN '
+    '(SELECT fingerprint FROM snapshots WHERE deleted=0 AND '
+    'fingerprint IS NOT NULL GROUP BY fingerprint HAVING COUNT(*) > 1) '
+    'ORDER BY fingerprint, id'
+)
+
+DuplicateSnapshotGroup = collections.namedtuple(
+    'DuplicateSnapshotGroup',
+    ['fingerprint', 'database_ids']
+)
+
+
+def compute_snapshot_fingerprint(study: str, study_id: str, session_date: str,
+        cdi_type: str,
+        content_rows: typing.Iterable[typing.Tuple[typing.Any, str, int, int]]) -> str:
+    """Hash the values which identify a snapshot for duplicate detection.
+
+    Snapshots with the same study, participant study ID, session date, CDI type,
+    and word values have the same fingerprint regardless of word order.
+
+    @param study: The name of the study the snapshot is part of.
+    @param study_id: The participant's study specific ID.
+    @param session_date: The standardized date of the session.
+    @param cdi_type: The name of the CDI format used.
+    @param content_rows: The snapshot's words as returned by
+        prepare_content_rows.
+    @returns: Hex digest identifying the snapshot.
+    """
+    words = sorted(map(lambda x: (x[1], x[2]), content_rows))
+    serialized = json.dumps([
+        str(study),
+        str(study_id),
+        str(session_date),
+        str(cdi_type),
+        words
+    ])
+    return hashlib.sha1(serialized.encode('utf-8')).hexdigest()
+
+
+def find_snapshots_by_fingerprint(fingerprints: typing.Iterable[str],
+        cursor_maybe: OptionalCursor = None) -> typing.Dict[str, int]:
+    """Find existing snapshots with the given fingerprints.
+
+    @param fingerprints: The fingerprints to look up.
+    @param cursor_maybe: The cursor to use or None to get a new cursor.
+    @returns: Mapping from each fingerprint found to the database ID of a
+        snapshot (not deleted) with that fingerprint.
+    """
+    fingerprints_realized = list(fingerprints)
+    found: typing.Dict[str, int] = {}
+    if len(fingerprints_realized) == 0:
+        return found
+
+    with get_realized_cursor(cursor_maybe) as cursor:
+        for i in range(0, len(fingerprints_realized), FINGERPRINT_QUERY_SIZE):
+            batch = fingerprints_realized[i:i + FINGERPRINT_QUERY_SIZE]
+            cursor.execute(
+                FIND_FINGERPRINTS_QUERY % ', '.join('?' * len(batch)),
+                batch
+            )
+            for (fingerprint, snapshot_id) in cursor.fetchall():
+                found.setdefault(fingerprint, snapshot_id)
+
+    return found
+
+
+def get_duplicate_policy(duplicate_policy: typing.Optional[str]) -> str:
+    """Get the duplicate policy to use for an insert.
+
+    @param duplicate_policy: The policy requested or None to use the default.
+    @returns: DUPLICATE_REJECT, DUPLICATE_WARN, or DUPLICATE_ALLOW.
+    """
+    if duplicate_policy == None:
+        return DUPLICATE_SNAPSHOT_POLICY
+    else:
+        return duplicate_policy # type: ignore
 
 
-# TODO: Combined for transaction
 def insert_snapshot(snapshot_metadata: models.SnapshotMetadata,
         word_entries: typing.Union[
             typing.Mapping[str, int],
             typing.Iterable[models.SnapshotContent]
         ],
-        cursor : OptionalCursor = None) -> None:
+        cursor : OptionalCursor = None,
+        assign_session_num: bool = False,
+        duplicate_policy: typing.Optional[str] = None) -> typing.Optional[int]:
     """Insert a new CDI snapshot.
 
     @param snapshot_metadata: The metadata for this snapshot that should be
@@ -993,81 +1903,357 @@ def insert_snapshot(snapshot_metadata: models.SnapshotMetadata,
         are status indicators showing if those words were spoken or not.
         Othwerwise should be collection of models.SnapshotContent
     @type: dict or list
+    @param assign_session_num: If True, the session number is calculated from
+        the participant's prior snapshots within the insert statement itself so
+        that concurrent submissions for the same participant cannot be given the
+        same number. The assigned value is written back to snapshot_metadata.
+        If total_num_sessions is not provided, it takes on the same value.
+    @type assign_session_num: bool
+    @param duplicate_policy: How to handle a snapshot with the same fingerprint
+        as an existing snapshot or None to use DUPLICATE_SNAPSHOT_POLICY.
+    @returns: The database ID of the existing snapshot duplicated or None if no
+        duplicate was found or duplicates were not checked.
+    @raises DuplicateSnapshotError: Raised if a duplicate is found and the
+        policy is DUPLICATE_REJECT.
     """
     with get_realized_cursor(cursor) as cursor_realized:
         if snapshot_metadata.child_id == None:
-            cursor_realized.execute('SELECT MAX(child_id) FROM snapshots')
-            child_id = cursor_realized.fetchone()[0] + 1
+            child_id = reserve_child_id(cursor_realized)
         else:
             child_id = snapshot_metadata.child_id
 
-        # Standardize date
-        snapshot_metadata.birthday = clean_up_date_force(snapshot_metadata.birthday)
-        snapshot_metadata.session_date = clean_up_date_force(
-            snapshot_metadata.session_date
+        values = prepare_snapshot_row(snapshot_metadata, child_id)
+        content_rows = prepare_content_rows(0, word_entries)
+        fingerprint = compute_snapshot_fingerprint(
+            snapshot_metadata.study,
+            snapshot_metadata.study_id,
+            snapshot_metadata.session_date,
+            snapshot_metadata.cdi_type,
+            content_rows
         )
 
-        if isinstance(snapshot_metadata.languages, str):
-            raise RuntimeError('Languages must be a list.')
-
-        languages_val = ','.join(snapshot_metadata.languages)
-
-        cmd = 'INSERT INTO snapshots VALUES (%s)' % (', '.join('?' * 20))
-        cursor_realized.execute(
-            cmd,
-            (
-                None,
-                child_id,
-                snapshot_metadata.study_id,
-                snapshot_metadata.study,
-                snapshot_metadata.gender,
-                snapshot_metadata.age,
-                snapshot_metadata.birthday,
-                snapshot_metadata.session_date,
-                snapshot_metadata.session_num,
-                snapshot_metadata.total_num_sessions,
-                snapshot_metadata.words_spoken,
-                snapshot_metadata.items_excluded,
-                snapshot_metadata.percentile,
-                snapshot_metadata.extra_categories,
-                snapshot_metadata.revision,
-                languages_val,
-                snapshot_metadata.num_languages,
-                snapshot_metadata.cdi_type,
-                snapshot_metadata.hard_of_hearing,
-                snapshot_metadata.deleted
+        policy = get_duplicate_policy(duplicate_policy)
+        duplicate_id = None
+        if policy != DUPLICATE_ALLOW:
+            duplicate_id = find_snapshots_by_fingerprint(
+                [fingerprint],
+                cursor_realized
+            ).get(fingerprint, None)
+
+        if duplicate_id != None and policy == DUPLICATE_REJECT:
+            raise DuplicateSnapshotError(duplicate_id) # type: ignore
+
+        values.append(fingerprint)
+        values.extend(prepare_day_values(snapshot_metadata))
+        placeholders = ['?'] * len(values)
+
+        if assign_session_num:
+            participant = [snapshot_metadata.study, snapshot_metadata.study_id]
+            session_num_index = SNAPSHOT_METADATA_COLS.index('session_num')
+            total_index = SNAPSHOT_METADATA_COLS.index('total_num_sessions')
+            placeholders[session_num_index] = NEXT_SESSION_NUM_SUBQUERY
+            placeholders[total_index] = 'COALESCE(?, %s)' % (
+                NEXT_SESSION_NUM_SUBQUERY
+            )
+            values = (
+                values[:session_num_index] +
+                participant +
+                [values[total_index] or None] +
+                participant +
+                values[total_index + 1:]
             )
+
+        cmd = INSERT_SNAPSHOT_CMD % (
+            ', '.join(SNAPSHOT_INSERT_COLS),
+            ', '.join(placeholders)
         )
-        new_snapshot_id = cursor_realized.lastrowid
+        cursor_realized.execute(cmd, values)
+        new_snapshot_id = type_util.assert_not_none(cursor_realized.lastrowid)
         snapshot_metadata.database_id=new_snapshot_id
 
+        if assign_session_num:
+            cursor_realized.execute(
+                'SELECT session_num, total_num_sessions FROM snapshots WHERE id=?',
+                (new_snapshot_id,)
+            )
+            assigned = cursor_realized.fetchone()
+            snapshot_metadata.session_num = assigned[0]
+            snapshot_metadata.total_num_sessions = assigned[1]
+
         # Put in snapshot contents
-        if type(word_entries) is dict:
-            word_entries_dict: dict
-            word_entries_dict = word_entries # type: ignore
-            for (word, val) in word_entries_dict.items():
-                cursor_realized.execute(
-                    'INSERT INTO snapshot_content VALUES (?, ?, ?, ?)',
-                    (
-                        new_snapshot_id,
-                        word.lower(),
-                        val,
-                        0
-                    )
+        cursor_realized.executemany(
+            INSERT_SNAPSHOT_CONTENT_CMD,
+            map(lambda x: (new_snapshot_id,) + x[1:], content_rows)
+        )
+        cursor_realized.executemany(
+            INSERT_SNAPSHOT_LANGUAGE_CMD,
+            prepare_language_rows(new_snapshot_id, snapshot_metadata.languages)
+        )
+
+        record_snapshot_changes(
+            [new_snapshot_id],
+            CHANGE_INSERT,
+            cursor_realized
+        )
+        bump_data_version(cursor_realized)
+
+    return duplicate_id
+
+
+def insert_snapshots(records: typing.Iterable[typing.Tuple[
+            models.SnapshotMetadata,
+            typing.Union[
+                typing.Mapping[str, int],
+                typing.Iterable[models.SnapshotContent]
+            ]
+        ]],
+        cursor: OptionalCursor = None,
+        chunk_size: int = BULK_INSERT_CHUNK_SIZE,
+        duplicate_policy: typing.Optional[str] = None) -> BulkInsertSummary:
+    """Insert many new CDI snapshots within a single transaction.
+
+    Records are consumed lazily and written in chunks of chunk_size snapshots,
+    each chunk using one executemany each for its words and its languages. IDs
+    are assigned by the database as each snapshot's metadata is written. If a
+    cursor is not provided, all records are committed together at the end and
+    nothing is kept if any record fails.
+
+    Records are checked for duplicates of existing snapshots and of earlier
+    records with one query per chunk.
+
+    @param records: Iterable over (metadata, word entries) pairs like those
+        given to insert_snapshot. The database ID of each metadata record is
+        updated after it is written.
+    @param cursor: The cursor to use or None to get a new cursor.
+    @param chunk_size: The number of snapshots to write per batch.
+    @param duplicate_policy: How to handle records with the same fingerprint as
+        an existing snapshot or None to use DUPLICATE_SNAPSHOT_POLICY.
+    @returns: Summary of what was written including the database IDs of new
+        snapshots which duplicate another snapshot.
+    @raises DuplicateSnapshotError: Raised if a duplicate is found and the
+        policy is DUPLICATE_REJECT.
+    """
+    start_time = time.time()
+    database_ids: typing.List[int] = []
+    duplicate_ids: typing.List[int] = []
+    num_words = 0
+
+    policy = get_duplicate_policy(duplicate_policy)
+    fingerprints_written: typing.Dict[str, int] = {}
+
+    with get_realized_cursor(cursor) as cursor_realized:
+        # Writing first takes the write lock, even within a deferred transaction
+        # the caller already opened, so that the duplicate checks below see
+        # every snapshot committed before these are written.
+        bump_data_version(cursor_realized)
+
+        snapshot_cmd = INSERT_SNAPSHOT_CMD % (
+            ', '.join(SNAPSHOT_INSERT_COLS),
+            ', '.join('?' * len(SNAPSHOT_INSERT_COLS))
+        )
+
+        def write_chunk(chunk):
+            nonlocal num_words
+
+            needing_ids = [x for x in chunk if x[0].child_id == None]
+            new_child_ids = iter(reserve_child_ids(
+                len(needing_ids),
+                cursor_realized
+            )) if needing_ids else iter([])
+
+            prepared = []
+            for (metadata, word_entries) in chunk:
+                if metadata.child_id == None:
+                    child_id = next(new_child_ids)
+                else:
+                    child_id = metadata.child_id
+
+                snapshot_row = prepare_snapshot_row(metadata, child_id)
+                snapshot_content_rows = prepare_content_rows(0, word_entries)
+                fingerprint = compute_snapshot_fingerprint(
+                    metadata.study,
+                    metadata.study_id,
+                    metadata.session_date,
+                    metadata.cdi_type,
+                    snapshot_content_rows
                 )
-        else:
-            word_entries_obj: typing.Iterable[models.SnapshotContent]
-            word_entries_obj = word_entries # type: ignore
-            for word_entry in word_entries_obj:
-                cursor_realized.execute(
-                    'INSERT INTO snapshot_content VALUES (?, ?, ?, ?)',
-                    (
-                        new_snapshot_id,
-                        word_entry.word.lower(),
-                        word_entry.value,
-                        word_entry.revision
-                    )
+                snapshot_row.append(fingerprint)
+                snapshot_row.extend(prepare_day_values(metadata))
+
+                prepared.append(
+                    (metadata, snapshot_row, snapshot_content_rows, fingerprint)
+                )
+
+            existing: typing.Dict[str, int] = {}
+            if policy != DUPLICATE_ALLOW:
+                existing = find_snapshots_by_fingerprint(
+                    set(map(lambda x: x[3], prepared)),
+                    cursor_realized
+                )
+
+            # Snapshot rows are written one at a time so that the database
+            # assigns each ID, which is then used for its words and languages.
+            content_rows: typing.List[typing.Tuple[int, str, int, int]] = []
+            language_rows: typing.List[typing.Tuple[typing.Any, str]] = []
+            for (metadata, snapshot_row, snapshot_content_rows, fingerprint) in prepared:
+                duplicate_id = existing.get(
+                    fingerprint,
+                    fingerprints_written.get(fingerprint, None)
                 )
+                if duplicate_id != None and policy == DUPLICATE_REJECT:
+                    raise DuplicateSnapshotError(duplicate_id)
+
+                cursor_realized.execute(snapshot_cmd, snapshot_row)
+                database_id = type_util.assert_not_none(
+                    cursor_realized.lastrowid
+                )
+                metadata.database_id = database_id
+                database_ids.append(database_id)
+
+                if duplicate_id != None:
+                    duplicate_ids.append(database_id)
+                elif policy != DUPLICATE_ALLOW:
+                    fingerprints_written[fingerprint] = database_id
+
+                content_rows.extend(map(
+                    lambda x: (database_id,) + x[1:],
+                    snapshot_content_rows
+                ))
+                language_rows.extend(
+                    prepare_language_rows(database_id, metadata.languages)
+                )
+
+            cursor_realized.executemany(
+                INSERT_SNAPSHOT_CONTENT_CMD,
+                content_rows
+            )
+            cursor_realized.executemany(
+                INSERT_SNAPSHOT_LANGUAGE_CMD,
+                language_rows
+            )
+            num_words += len(content_rows)
+
+        chunk: typing.List[typing.Any] = []
+        for record in records:
+            chunk.append(record)
+            if len(chunk) >= chunk_size:
+                write_chunk(chunk)
+                chunk = []
+
+        if chunk:
+            write_chunk(chunk)
+
+        record_snapshot_changes(database_ids, CHANGE_INSERT, cursor_realized)
+
+    return BulkInsertSummary(
+        database_ids,
+        len(database_ids),
+        num_words,
+        time.time() - start_time,
+        duplicate_ids
+    )
+
+
+def compute_saved_fingerprints(query: str, params: typing.Sequence,
+        cursor: sqlite3.Cursor) -> typing.List[typing.Tuple[str, int]]:
+    """Compute the fingerprints of saved snapshots from their stored values.
+
+    Rows are fetched CONTENT_QUERY_SIZE at a time so that only one snapshot's
+    words are held at once.
+
+    @param query: FINGERPRINT_VALUES_QUERY filled in with a where clause.
+    @param params: The values to bind to the where clause's placeholders.
+    @param cursor: The cursor to use.
+    @returns: (fingerprint, database ID) pairs for the matching snapshots.
+    """
+    cursor.execute(query, params)
+
+    def iter_rows():
+        while True:
+            rows = cursor.fetchmany(CONTENT_QUERY_SIZE)
+            if not rows:
+                return
+            yield from rows
+
+    fingerprints = []
+    for (snapshot_id, snapshot_rows) in itertools.groupby(
+            iter_rows(), lambda x: x[0]):
+        snapshot_rows_realized = list(snapshot_rows)
+        (study, study_id, session_date, cdi_type) = (
+            snapshot_rows_realized[0][1:5]
+        )
+        content_rows = [
+            (snapshot_id, x[5], x[6], 0)
+            for x in snapshot_rows_realized
+            if x[5] != None
+        ]
+        fingerprint = compute_snapshot_fingerprint(
+            study,
+            study_id,
+            session_date,
+            cdi_type,
+            content_rows
+        )
+        fingerprints.append((fingerprint, snapshot_id))
+
+    return fingerprints
+
+
+def refresh_snapshot_fingerprints(where_clause: str,
+        where_params: typing.Sequence,
+        cursor_maybe: OptionalCursor = None) -> None:
+    """Recompute the fingerprints of snapshots after they are edited.
+
+    @param where_clause: SQL condition on the snapshots table selecting the
+        snapshots to refresh.
+    @param where_params: The values to bind to the clause's placeholders.
+    @param cursor_maybe: The cursor to use or None to get a new cursor.
+    """
+    query = FINGERPRINT_VALUES_QUERY % (
+        'snapshots.id IN (SELECT id FROM snapshots WHERE %s)' % where_clause
+    )
+
+    with get_realized_cursor(cursor_maybe) as cursor:
+        updates = compute_saved_fingerprints(query, where_params, cursor)
+        cursor.executemany(UPDATE_FINGERPRINT_CMD, updates)
+
+
+def backfill_snapshot_fingerprints(cursor_maybe: OptionalCursor = None) -> int:
+    """Compute fingerprints for snapshots saved before fingerprints existed.
+
+    @param cursor_maybe: The cursor to use or None to get a new cursor.
+    @returns: The number of snapshots updated.
+    """
+    with get_realized_cursor(cursor_maybe) as cursor:
+        updates = compute_saved_fingerprints(
+            BACKFILL_FINGERPRINTS_QUERY,
+            [],
+            cursor
+        )
+        cursor.executemany(UPDATE_FINGERPRINT_CMD, updates)
+
+    return len(updates)
+
+
+def find_duplicate_snapshots(
+        cursor_maybe: OptionalCursor = None) -> typing.List[DuplicateSnapshotGroup]:
+    """Find groups of snapshots (not deleted) which share a fingerprint.
+
+    @param cursor_maybe: The cursor to use or None to get a new cursor.
+    @returns: One group per fingerprint shared by more than one snapshot with
+        database IDs in ascending order.
+    """
+    with get_realized_cursor(cursor_maybe) as cursor:
+        cursor.execute(FIND_DUPLICATE_SNAPSHOTS_QUERY)
+        rows = cursor.fetchall()
+
+    groups: typing.List[DuplicateSnapshotGroup] = []
+    for (fingerprint, snapshot_id) in rows:
+        if len(groups) == 0 or groups[-1].fingerprint != fingerprint:
+            groups.append(DuplicateSnapshotGroup(fingerprint, []))
+        groups[-1].database_ids.append(snapshot_id)
+
+    return groups
 
 
 def insert_parent_form(form_metadata: models.ParentForm,
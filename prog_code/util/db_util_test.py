@@ -17,8 +17,12 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 import copy
 import datetime
+import os
 import re
+import sqlite3
+import tempfile
 import unittest
+import unittest.mock
 
 from ..struct import models
 
@@ -30,6 +34,7 @@ TEST_DB_ID = 123
 TEST_STUDY_ID = 456
 TEST_STUDY = 'test study'
 TEST_BIRTHDAY = '2011/09/12'
+TEST_BIRTHDAY_DAY = 15229
 TEST_ITEMS_EXCLUDED = 3
 TEST_EXTRA_CATEGORIES = 4
 TEST_NUM_LANGUAGES = 2
@@ -73,6 +78,10 @@ class FakeCursor:
         self.commands.append((command, params))
         self.committed = False
 
+    def executemany(self, command, params_seq):
+        for params in params_seq:
+            self.execute(command, params)
+
     def commit(self):
         self.committed = True
 
@@ -87,6 +96,11 @@ class FakeCursor:
             self.result_i += 1
             return val
 
+    def fetchmany(self, size):
+        val = self.results[self.result_i:self.result_i + size]
+        self.result_i += len(val)
+        return val
+
     def fetchall(self):
         return self.results
 
@@ -97,6 +111,23 @@ class FakeConnection:
         self.cursor = cursor
 
 
+def create_memory_cursor():
+    """Create a cursor into an empty in-memory copy of the application DB."""
+    schema_path = os.path.join(
+        os.path.dirname(__file__),
+        '..',
+        '..',
+        'db',
+        'create_local_db.sql'
+    )
+    with open(schema_path) as f:
+        schema = f.read()
+
+    connection = sqlite3.connect(':memory:')
+    connection.executescript(schema)
+    return connection.cursor()
+
+
 class DBUtilTests(unittest.TestCase):
 
     def test_clean_up_date(self):
@@ -108,25 +139,63 @@ class DBUtilTests(unittest.TestCase):
 
         db_util.update_snapshot(TEST_SNAPSHOT, fake_cursor)
 
-        self.assertEqual(len(fake_cursor.commands), 1)
+        self.assertEqual(len(fake_cursor.commands), 9)
 
         test_command = fake_cursor.commands[0]
+        self.assertEqual(
+            test_command[0],
+            db_util.RECORD_MOVED_SNAPSHOT_CHANGE_CMD
+        )
+        self.assertEqual(
+            test_command[1],
+            (db_util.CHANGE_UPDATE, TEST_SNAPSHOT_ID, TEST_SNAPSHOT.study)
+        )
+
+        test_command = fake_cursor.commands[1]
         self.assertTrue('child_id=?,' in test_command[0])
         self.assertEqual(TEST_SNAPSHOT.child_id, test_command[1][0])
         self.assertEqual(TEST_SNAPSHOT.languages, test_command[1][14].split(','))
 
+        test_command = fake_cursor.commands[2]
+        self.assertEqual(test_command[0], db_util.DELETE_SNAPSHOT_LANGUAGES_CMD)
+        self.assertEqual(test_command[1], (TEST_SNAPSHOT_ID,))
+
+        self.assertEqual(
+            [x[1] for x in fake_cursor.commands[3:5]],
+            [(TEST_SNAPSHOT_ID, 'english'), (TEST_SNAPSHOT_ID, 'spanish')]
+        )
+
+        test_command = fake_cursor.commands[5]
+        self.assertTrue('snapshot_content.word' in test_command[0])
+        self.assertEqual(test_command[1], (TEST_SNAPSHOT_ID,))
+
+        test_command = fake_cursor.commands[6]
+        self.assertEqual(test_command[0], db_util.RECORD_SNAPSHOT_CHANGE_CMD)
+        self.assertEqual(
+            test_command[1],
+            (db_util.CHANGE_UPDATE, TEST_SNAPSHOT_ID)
+        )
+
+        test_command = fake_cursor.commands[7]
+        self.assertEqual(test_command[0], db_util.CLEAR_REPORT_ROWS_CMD)
+        self.assertEqual(test_command[1], (TEST_SNAPSHOT_ID,))
+
+        test_command = fake_cursor.commands[8]
+        self.assertTrue('UPDATE id_sequences' in test_command[0])
+        self.assertEqual(test_command[1], (db_util.DATA_VERSION_SEQUENCE,))
+
     def test_update_snapshot_new_id(self):
-        fake_cursor = FakeCursor()
+        fake_cursor = FakeCursor([(11,)])
 
         snapshot = copy.copy(TEST_SNAPSHOT)
         snapshot.child_id = None
         db_util.update_snapshot(snapshot, fake_cursor)
 
-        self.assertEqual(len(fake_cursor.commands), 2)
+        self.assertEqual(len(fake_cursor.commands), 11)
 
-        test_command = fake_cursor.commands[1]
+        test_command = fake_cursor.commands[3]
         self.assertTrue('child_id=?,' in test_command[0])
-        self.assertNotEqual(TEST_SNAPSHOT.child_id, test_command[1][1])
+        self.assertEqual('auto_10', test_command[1][0])
         self.assertEqual(TEST_SNAPSHOT.languages, test_command[1][14].split(','))
 
     def test_update_participant_metadata_all(self):
@@ -141,7 +210,7 @@ class DBUtilTests(unittest.TestCase):
             cursor=fake_cursor
         )
 
-        self.assertEqual(len(fake_cursor.commands), 1)
+        self.assertEqual(len(fake_cursor.commands), 8)
 
         test_command = fake_cursor.commands[0]
         self.assertTrue('child_id=?' in test_command[0])
@@ -149,7 +218,36 @@ class DBUtilTests(unittest.TestCase):
         self.assertEqual(TEST_SNAPSHOT.birthday, test_command[1][1])
         self.assertEqual(TEST_SNAPSHOT.hard_of_hearing, test_command[1][2])
         self.assertEqual(TEST_SNAPSHOT.languages, test_command[1][3].split(','))
-        self.assertEqual(TEST_SNAPSHOT.child_id, test_command[1][4])
+        self.assertEqual(TEST_BIRTHDAY_DAY, test_command[1][4])
+        self.assertEqual(TEST_SNAPSHOT.child_id, test_command[1][5])
+
+        test_command = fake_cursor.commands[1]
+        self.assertTrue('DELETE FROM snapshot_languages' in test_command[0])
+        self.assertEqual(test_command[1], (TEST_SNAPSHOT.child_id,))
+
+        self.assertEqual(
+            [x[1] for x in fake_cursor.commands[2:4]],
+            [
+                ('english', TEST_SNAPSHOT.child_id),
+                ('spanish', TEST_SNAPSHOT.child_id)
+            ]
+        )
+
+        test_command = fake_cursor.commands[4]
+        self.assertTrue('INSERT INTO snapshot_changes' in test_command[0])
+        self.assertEqual(
+            test_command[1],
+            (db_util.CHANGE_UPDATE, TEST_SNAPSHOT.child_id)
+        )
+
+        test_command = fake_cursor.commands[5]
+        self.assertTrue('DELETE FROM snapshot_report_rows' in test_command[0])
+        self.assertEqual(test_command[1], (TEST_SNAPSHOT.child_id,))
+
+        test_command = fake_cursor.commands[6]
+        self.assertTrue('snapshot_content.word' in test_command[0])
+        self.assertEqual(test_command[1], (TEST_SNAPSHOT.child_id,))
+        self.assertTrue('UPDATE id_sequences' in fake_cursor.commands[7][0])
 
     def test_update_participant_metadata_select(self):
         fake_cursor = FakeCursor()
@@ -167,20 +265,663 @@ class DBUtilTests(unittest.TestCase):
             ]
         )
 
-        self.assertEqual(len(fake_cursor.commands), 2)
+        self.assertEqual(len(fake_cursor.commands), 15)
 
         test_command = fake_cursor.commands[0]
         self.assertEqual(TEST_SNAPSHOT.gender, test_command[1][0])
         self.assertEqual(TEST_SNAPSHOT.birthday, test_command[1][1])
         self.assertEqual(TEST_SNAPSHOT.hard_of_hearing, test_command[1][2])
         self.assertEqual(TEST_SNAPSHOT.languages, test_command[1][3].split(','))
-        self.assertEqual(TEST_SNAPSHOT.child_id, test_command[1][4])
-        self.assertEqual('test-study-1', test_command[1][5])
-        self.assertEqual(1, test_command[1][6])
+        self.assertEqual(TEST_BIRTHDAY_DAY, test_command[1][4])
+        self.assertEqual(TEST_SNAPSHOT.child_id, test_command[1][5])
+        self.assertEqual('test-study-1', test_command[1][6])
+        self.assertEqual(1, test_command[1][7])
 
         test_command = fake_cursor.commands[1]
-        self.assertEqual('test-study-1', test_command[1][5])
-        self.assertEqual(2, test_command[1][6])
+        self.assertEqual('test-study-1', test_command[1][6])
+        self.assertEqual(2, test_command[1][7])
+
+        test_command = fake_cursor.commands[5]
+        self.assertTrue('INSERT INTO snapshot_changes' in test_command[0])
+        self.assertEqual(
+            test_command[1],
+            (db_util.CHANGE_UPDATE, TEST_SNAPSHOT.child_id, 'test-study-1', 1)
+        )
+
+        test_command = fake_cursor.commands[6]
+        self.assertTrue('DELETE FROM snapshot_report_rows' in test_command[0])
+
+        test_command = fake_cursor.commands[7]
+        self.assertTrue('snapshot_content.word' in test_command[0])
+
+        test_command = fake_cursor.commands[8]
+        self.assertTrue('DELETE FROM snapshot_languages' in test_command[0])
+        self.assertEqual(
+            test_command[1],
+            (TEST_SNAPSHOT.child_id, 'test-study-1', 2)
+        )
+
+    def test_snapshot_day_numbers(self):
+        cursor = create_memory_cursor()
+
+        first = copy.copy(TEST_SNAPSHOT)
+        db_util.insert_snapshot(first, {}, cursor)
+
+        second = copy.copy(TEST_SNAPSHOT)
+        second.study_id = 'other_participant'
+        second.session_date = '2013/10/13'
+        db_util.insert_snapshots([(second, {})], cursor)
+
+        def get_days():
+            cursor.execute(
+                'SELECT birthday_day, session_date_day FROM snapshots ORDER BY id'
+            )
+            return cursor.fetchall()
+
+        self.assertEqual(get_days(), [
+            (TEST_BIRTHDAY_DAY, 15990),
+            (TEST_BIRTHDAY_DAY, 15991)
+        ])
+
+        second.birthday = '2011/9/13'
+        db_util.update_snapshot(second, cursor)
+        self.assertEqual(get_days()[1], (TEST_BIRTHDAY_DAY + 1, 15991))
+
+        db_util.update_participant_metadata(
+            TEST_DB_ID,
+            TEST_SNAPSHOT.gender,
+            '2011/09/02',
+            TEST_SNAPSHOT.hard_of_hearing,
+            TEST_SNAPSHOT.languages,
+            cursor=cursor
+        )
+        self.assertEqual(get_days(), [
+            (TEST_BIRTHDAY_DAY - 10, 15990),
+            (TEST_BIRTHDAY_DAY - 10, 15991)
+        ])
+
+    def test_snapshot_day_numbers_migration(self):
+        cursor = create_memory_cursor()
+        cursor.executescript(
+            'DROP INDEX snapshots_birthday_day_index;'
+            'DROP INDEX snapshots_session_date_day_index;'
+            'ALTER TABLE snapshots DROP COLUMN birthday_day;'
+            'ALTER TABLE snapshots DROP COLUMN session_date_day;'
+        )
+
+        dates = [
+            ('2011/09/12', '2013/10/12'),
+            ('2013/1/5', '2013/10/5'),
+            ('2013/13/5', None)
+        ]
+        cursor.executemany(
+            'INSERT INTO snapshots (birthday, session_date) VALUES (?, ?)',
+            dates
+        )
+
+        migration_path = os.path.join(
+            os.path.dirname(__file__),
+            '..',
+            '..',
+            'db',
+            'migrations',
+            '005_snapshot_day_numbers.sql'
+        )
+        with open(migration_path) as f:
+            cursor.executescript(f.read())
+
+        cursor.execute(
+            'SELECT birthday_day, session_date_day FROM snapshots ORDER BY id'
+        )
+        self.assertEqual(cursor.fetchall(), [
+            (TEST_BIRTHDAY_DAY, 15990),
+            (15710, 15983),
+            (None, None)
+        ])
+
+    def test_snapshot_languages(self):
+        cursor = create_memory_cursor()
+
+        first = copy.copy(TEST_SNAPSHOT)
+        first.languages = ['English', ' spanish', 'english', '']
+        db_util.insert_snapshot(first, {}, cursor)
+
+        second = copy.copy(TEST_SNAPSHOT)
+        second.study_id = 'other_participant'
+        second.child_id = 'other_child'
+        db_util.insert_snapshots([(second, {})], cursor)
+
+        def get_languages():
+            cursor.execute(
+                'SELECT * FROM snapshot_languages ORDER BY snapshot_id, language'
+            )
+            return cursor.fetchall()
+
+        self.assertEqual(get_languages(), [
+            (1, 'english'),
+            (1, 'spanish'),
+            (2, 'english'),
+            (2, 'spanish')
+        ])
+
+        second.languages = ['french']
+        db_util.update_snapshot(second, cursor)
+        self.assertEqual(get_languages(), [
+            (1, 'english'),
+            (1, 'spanish'),
+            (2, 'french')
+        ])
+
+        db_util.update_participant_metadata(
+            TEST_DB_ID,
+            TEST_SNAPSHOT.gender,
+            TEST_SNAPSHOT.birthday,
+            TEST_SNAPSHOT.hard_of_hearing,
+            ['german'],
+            cursor=cursor
+        )
+        self.assertEqual(get_languages(), [(1, 'german'), (2, 'french')])
+
+        db_util.delete_snapshot(2, cursor)
+        self.assertEqual(get_languages(), [(1, 'german')])
+
+    def test_load_snapshot_contents_batch(self):
+        cursor = create_memory_cursor()
+
+        first = copy.copy(TEST_SNAPSHOT)
+        db_util.insert_snapshot(first, {'ball': 1, 'cat': 0}, cursor)
+
+        second = copy.copy(TEST_SNAPSHOT)
+        second.study_id = 'other_participant'
+        db_util.insert_snapshot(second, {'dog': 1}, cursor)
+
+        with unittest.mock.patch('prog_code.util.db_util.CONTENT_QUERY_SIZE', 1):
+            contents = db_util.load_snapshot_contents_batch(
+                [first.database_id, second.database_id, 100],
+                cursor
+            )
+
+        self.assertEqual(
+            sorted(map(lambda x: (x.word, x.value), contents[first.database_id])),
+            [('ball', 1), ('cat', 0)]
+        )
+        self.assertEqual(
+            list(map(lambda x: x.word, contents[second.database_id])),
+            ['dog']
+        )
+        self.assertEqual(contents[100], [])
+
+    def test_data_version(self):
+        cursor = create_memory_cursor()
+
+        version = db_util.get_data_version(cursor)
+
+        snapshot = copy.copy(TEST_SNAPSHOT)
+        db_util.insert_snapshot(snapshot, {}, cursor)
+        self.assertEqual(db_util.get_data_version(cursor), version + 1)
+
+        db_util.update_snapshot(snapshot, cursor)
+        self.assertEqual(db_util.get_data_version(cursor), version + 2)
+
+        db_util.insert_snapshots([(copy.copy(TEST_SNAPSHOT), {})], cursor)
+        self.assertEqual(db_util.get_data_version(cursor), version + 3)
+
+        db_util.delete_snapshot(snapshot.database_id, cursor)
+        self.assertEqual(db_util.get_data_version(cursor), version + 4)
+
+    def test_snapshot_changes(self):
+        cursor = create_memory_cursor()
+
+        snapshot = copy.copy(TEST_SNAPSHOT)
+        db_util.insert_snapshot(snapshot, {}, cursor)
+        db_util.insert_snapshots([(copy.copy(TEST_SNAPSHOT), {})], cursor)
+        db_util.update_snapshot(snapshot, cursor)
+        db_util.update_participant_metadata(
+            TEST_DB_ID,
+            TEST_SNAPSHOT.gender,
+            TEST_SNAPSHOT.birthday,
+            TEST_SNAPSHOT.hard_of_hearing,
+            ['english'],
+            cursor=cursor
+        )
+        db_util.delete_snapshot(snapshot.database_id, cursor)
+
+        changes = db_util.load_snapshot_changes(0, 10, cursor)
+        self.assertEqual(
+            [(x.snapshot_id, x.operation) for x in changes],
+            [
+                (1, db_util.CHANGE_INSERT),
+                (2, db_util.CHANGE_INSERT),
+                (1, db_util.CHANGE_UPDATE),
+                (1, db_util.CHANGE_UPDATE),
+                (2, db_util.CHANGE_UPDATE),
+                (1, db_util.CHANGE_HARD_DELETE)
+            ]
+        )
+
+        later_changes = db_util.load_snapshot_changes(
+            changes[3].sequence,
+            1,
+            cursor
+        )
+        self.assertEqual(later_changes, [changes[4]])
+
+        self.assertEqual(
+            db_util.load_changed_studies(
+                0,
+                db_util.get_latest_change_sequence(cursor),
+                cursor
+            ),
+            [TEST_SNAPSHOT.study]
+        )
+        self.assertEqual(
+            db_util.load_changed_studies(changes[-1].sequence, 100, cursor),
+            []
+        )
+
+    def test_snapshot_changes_moved_study(self):
+        cursor = create_memory_cursor()
+
+        snapshot = copy.copy(TEST_SNAPSHOT)
+        db_util.insert_snapshot(snapshot, {}, cursor)
+        start = db_util.get_latest_change_sequence(cursor)
+
+        db_util.update_snapshot(snapshot, cursor)
+        self.assertEqual(
+            db_util.load_changed_studies(
+                start,
+                db_util.get_latest_change_sequence(cursor),
+                cursor
+            ),
+            [TEST_SNAPSHOT.study]
+        )
+        start = db_util.get_latest_change_sequence(cursor)
+
+        snapshot.study = 'other study'
+        db_util.update_snapshot(snapshot, cursor)
+        self.assertEqual(
+            db_util.load_changed_studies(
+                start,
+                db_util.get_latest_change_sequence(cursor),
+                cursor
+            ),
+            sorted(['other study', TEST_SNAPSHOT.study])
+        )
+
+    def test_count_participant_sessions(self):
+        fake_cursor = FakeCursor([(3,)])
+
+        count = db_util.count_participant_sessions(
+            TEST_STUDY,
+            TEST_STUDY_ID,
+            fake_cursor
+        )
+
+        self.assertEqual(count, 3)
+        self.assertEqual(len(fake_cursor.commands), 1)
+        self.assertTrue('COUNT(*)' in fake_cursor.commands[0][0])
+        self.assertEqual(fake_cursor.commands[0][1], (TEST_STUDY, TEST_STUDY_ID))
+
+    def test_insert_snapshot_assign_session_num(self):
+        cursor = create_memory_cursor()
+
+        first = copy.copy(TEST_SNAPSHOT)
+        db_util.insert_snapshot(first, {'ball': 1}, cursor)
+
+        deleted = copy.copy(TEST_SNAPSHOT)
+        deleted.deleted = True
+        db_util.insert_snapshot(deleted, {'ball': 1}, cursor)
+
+        second = copy.copy(TEST_SNAPSHOT)
+        second.session_num = None
+        second.total_num_sessions = None
+        db_util.insert_snapshot(
+            second,
+            {'ball': 1},
+            cursor,
+            assign_session_num=True
+        )
+
+        self.assertEqual(second.session_num, 2)
+        self.assertEqual(second.total_num_sessions, 2)
+        self.assertEqual(
+            db_util.count_participant_sessions(
+                TEST_STUDY,
+                TEST_STUDY_ID,
+                cursor
+            ),
+            2
+        )
+
+        other_study = copy.copy(TEST_SNAPSHOT)
+        other_study.study = 'other study'
+        db_util.insert_snapshot(
+            other_study,
+            {'ball': 1},
+            cursor,
+            assign_session_num=True
+        )
+
+        self.assertEqual(other_study.session_num, 1)
+        self.assertEqual(other_study.total_num_sessions, 25)
+
+    def test_reserve_child_ids(self):
+        cursor = create_memory_cursor()
+
+        self.assertEqual(
+            db_util.reserve_child_ids(3, cursor),
+            ['auto_1', 'auto_2', 'auto_3']
+        )
+        self.assertEqual(db_util.reserve_child_id(cursor), 'auto_4')
+
+    def test_insert_snapshot_new_id(self):
+        cursor = create_memory_cursor()
+
+        snapshot = copy.copy(TEST_SNAPSHOT)
+        snapshot.child_id = None
+        db_util.insert_snapshot(snapshot, {'ball': 1}, cursor)
+
+        cursor.execute('SELECT child_id FROM snapshots')
+        self.assertEqual(cursor.fetchone()[0], 'auto_1')
+        self.assertEqual(db_util.reserve_child_id(cursor), 'auto_2')
+
+    def test_id_block_allocator(self):
+        allocator = db_util.IdBlockAllocator('test')
+
+        with unittest.mock.patch('prog_code.util.db_util.advance_sequence') as mock:
+            mock.return_value = range(5, 15)
+
+            self.assertEqual(allocator.allocate(2, 10), [5, 6])
+            self.assertEqual(allocator.allocate(3, 10), [7, 8, 9])
+            mock.assert_called_once_with('test', 10)
+
+            mock.return_value = range(15, 25)
+            self.assertEqual(allocator.allocate(6, 10), [10, 11, 12, 13, 14, 15])
+            self.assertEqual(mock.call_count, 2)
+
+    def test_id_block_allocator_in_transaction(self):
+        allocator = db_util.IdBlockAllocator('test')
+        fake_cursor = FakeCursor()
+
+        with unittest.mock.patch('prog_code.util.db_util.advance_sequence') as mock:
+            mock.return_value = range(5, 7)
+
+            self.assertEqual(allocator.allocate(2, 10, fake_cursor), [5, 6])
+            mock.assert_called_once_with('test', 2, fake_cursor)
+
+    def test_insert_snapshots(self):
+        cursor = create_memory_cursor()
+
+        first = copy.copy(TEST_SNAPSHOT)
+        second = copy.copy(TEST_SNAPSHOT)
+        second.child_id = None
+        third = copy.copy(TEST_SNAPSHOT)
+        third.child_id = None
+        third.birthday = '2011/9/2'
+
+        summary = db_util.insert_snapshots(
+            [
+                (first, {'ball': 1, 'Dog': 0}),
+                (second, [models.SnapshotContent(None, 'cat', 1, 2)]),
+                (third, {})
+            ],
+            cursor,
+            chunk_size=2
+        )
+
+        self.assertEqual(summary.database_ids, [1, 2, 3])
+        self.assertEqual(summary.num_snapshots, 3)
+        self.assertEqual(summary.num_words, 3)
+        self.assertEqual(third.database_id, 3)
+
+        cursor.execute('SELECT id, child_id, birthday FROM snapshots')
+        self.assertEqual(cursor.fetchall(), [
+            (1, TEST_DB_ID, TEST_BIRTHDAY),
+            (2, 'auto_1', TEST_BIRTHDAY),
+            (3, 'auto_2', '2011/09/02')
+        ])
+
+        cursor.execute('SELECT * FROM snapshot_content ORDER BY word')
+        self.assertEqual(cursor.fetchall(), [
+            (1, 'ball', 1, 0),
+            (2, 'cat', 1, 2),
+            (1, 'dog', 0, 0)
+        ])
+
+        summary = db_util.insert_snapshots(
+            [(copy.copy(TEST_SNAPSHOT), {})],
+            cursor
+        )
+        self.assertEqual(summary.database_ids, [4])
+
+    def test_insert_snapshots_single_transaction(self):
+        cursor = create_memory_cursor()
+
+        bad = copy.copy(TEST_SNAPSHOT)
+        bad.languages = 'english'
+
+        with self.assertRaises(RuntimeError):
+            db_util.insert_snapshots(
+                [(copy.copy(TEST_SNAPSHOT), {'ball': 1}), (bad, {})],
+                cursor,
+                chunk_size=1
+            )
+
+        self.assertTrue(cursor.connection.in_transaction)
+        cursor.connection.rollback()
+
+        cursor.execute('SELECT COUNT(*) FROM snapshots')
+        self.assertEqual(cursor.fetchone()[0], 0)
+        cursor.execute('SELECT COUNT(*) FROM snapshot_content')
+        self.assertEqual(cursor.fetchone()[0], 0)
+
+    def test_insert_snapshots_open_transaction(self):
+        schema_path = os.path.join(
+            os.path.dirname(__file__),
+            '..',
+            '..',
+            'db',
+            'create_local_db.sql'
+        )
+        with open(schema_path) as f:
+            schema = f.read()
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'test.db')
+            connection = sqlite3.connect(path)
+            connection.executescript(schema)
+            other_connection = sqlite3.connect(path, timeout=0)
+
+            try:
+                cursor = connection.cursor()
+                cursor.execute('BEGIN')
+                cursor.execute('SELECT COUNT(*) FROM snapshots')
+
+                summary = db_util.insert_snapshots(
+                    [(copy.copy(TEST_SNAPSHOT), {'ball': 1})],
+                    cursor
+                )
+                self.assertEqual(summary.database_ids, [1])
+
+                with self.assertRaises(sqlite3.OperationalError):
+                    other_connection.execute('BEGIN IMMEDIATE')
+
+                connection.commit()
+                other_connection.execute('BEGIN IMMEDIATE')
+                other_connection.rollback()
+            finally:
+                other_connection.close()
+                connection.close()
+
+    def test_compute_snapshot_fingerprint(self):
+        fingerprint = db_util.compute_snapshot_fingerprint(
+            TEST_STUDY,
+            TEST_STUDY_ID,
+            '2013/10/12',
+            'standard',
+            [(1, 'ball', 1, 0), (1, 'dog', 0, 0)]
+        )
+
+        reordered = db_util.compute_snapshot_fingerprint(
+            TEST_STUDY,
+            TEST_STUDY_ID,
+            '2013/10/12',
+            'standard',
+            [(2, 'dog', 0, 3), (2, 'ball', 1, 0)]
+        )
+        self.assertEqual(fingerprint, reordered)
+
+        changed = db_util.compute_snapshot_fingerprint(
+            TEST_STUDY,
+            TEST_STUDY_ID,
+            '2013/10/12',
+            'standard',
+            [(1, 'ball', 1, 0), (1, 'dog', 1, 0)]
+        )
+        self.assertNotEqual(fingerprint, changed)
+
+    def test_insert_snapshot_duplicate_policy(self):
+        cursor = create_memory_cursor()
+
+        first = copy.copy(TEST_SNAPSHOT)
+        self.assertEqual(
+            db_util.insert_snapshot(first, {'ball': 1}, cursor),
+            None
+        )
+
+        self.assertEqual(
+            db_util.insert_snapshot(
+                copy.copy(TEST_SNAPSHOT),
+                {'ball': 1},
+                cursor,
+                duplicate_policy=db_util.DUPLICATE_WARN
+            ),
+            first.database_id
+        )
+
+        self.assertEqual(
+            db_util.insert_snapshot(
+                copy.copy(TEST_SNAPSHOT),
+                {'ball': 1},
+                cursor,
+                duplicate_policy=db_util.DUPLICATE_ALLOW
+            ),
+            None
+        )
+
+        with self.assertRaises(db_util.DuplicateSnapshotError) as context:
+            db_util.insert_snapshot(
+                copy.copy(TEST_SNAPSHOT),
+                {'ball': 1},
+                cursor,
+                duplicate_policy=db_util.DUPLICATE_REJECT
+            )
+        self.assertEqual(context.exception.existing_id, first.database_id)
+
+        self.assertEqual(
+            db_util.insert_snapshot(
+                copy.copy(TEST_SNAPSHOT),
+                {'ball': 0},
+                cursor,
+                duplicate_policy=db_util.DUPLICATE_REJECT
+            ),
+            None
+        )
+
+        cursor.execute('SELECT COUNT(*) FROM snapshots')
+        self.assertEqual(cursor.fetchone()[0], 4)
+
+    def test_insert_snapshots_duplicate_policy(self):
+        cursor = create_memory_cursor()
+
+        db_util.insert_snapshot(copy.copy(TEST_SNAPSHOT), {'ball': 1}, cursor)
+
+        summary = db_util.insert_snapshots(
+            [
+                (copy.copy(TEST_SNAPSHOT), {'ball': 1}),
+                (copy.copy(TEST_SNAPSHOT), {'ball': 0}),
+                (copy.copy(TEST_SNAPSHOT), {'ball': 0})
+            ],
+            cursor,
+            chunk_size=1,
+            duplicate_policy=db_util.DUPLICATE_WARN
+        )
+        self.assertEqual(summary.database_ids, [2, 3, 4])
+        self.assertEqual(summary.duplicate_ids, [2, 4])
+
+        with self.assertRaises(db_util.DuplicateSnapshotError) as context:
+            db_util.insert_snapshots(
+                [(copy.copy(TEST_SNAPSHOT), {'ball': 0})],
+                cursor,
+                duplicate_policy=db_util.DUPLICATE_REJECT
+            )
+        self.assertEqual(context.exception.existing_id, 3)
+
+    def test_find_duplicate_snapshots(self):
+        cursor = create_memory_cursor()
+
+        db_util.insert_snapshot(copy.copy(TEST_SNAPSHOT), {'ball': 1}, cursor)
+        db_util.insert_snapshot(copy.copy(TEST_SNAPSHOT), {'ball': 1}, cursor)
+        db_util.insert_snapshot(copy.copy(TEST_SNAPSHOT), {'ball': 0}, cursor)
+        db_util.insert_snapshot(copy.copy(TEST_SNAPSHOT), {'ball': 1}, cursor)
+        cursor.execute('UPDATE snapshots SET deleted=1 WHERE id=4')
+
+        cursor.execute('UPDATE snapshots SET fingerprint=NULL')
+        self.assertEqual(db_util.find_duplicate_snapshots(cursor), [])
+
+        self.assertEqual(db_util.backfill_snapshot_fingerprints(cursor), 4)
+
+        groups = db_util.find_duplicate_snapshots(cursor)
+        self.assertEqual(len(groups), 1)
+        self.assertEqual(groups[0].database_ids, [1, 2])
+
+    def test_update_snapshot_refreshes_fingerprint(self):
+        cursor = create_memory_cursor()
+
+        edited = copy.copy(TEST_SNAPSHOT)
+        db_util.insert_snapshot(edited, {'ball': 1}, cursor)
+        db_util.insert_snapshot(
+            copy.copy(TEST_SNAPSHOT),
+            {'ball': 1},
+            cursor,
+            duplicate_policy=db_util.DUPLICATE_ALLOW
+        )
+
+        edited.study = 'other_study'
+        db_util.update_snapshot(edited, cursor)
+        self.assertEqual(db_util.find_duplicate_snapshots(cursor), [])
+
+        moved = copy.copy(TEST_SNAPSHOT)
+        moved.study = 'other_study'
+        with self.assertRaises(db_util.DuplicateSnapshotError) as context:
+            db_util.insert_snapshot(
+                moved,
+                {'ball': 1},
+                cursor,
+                duplicate_policy=db_util.DUPLICATE_REJECT
+            )
+        self.assertEqual(context.exception.existing_id, edited.database_id)
+
+        cursor.execute('SELECT fingerprint FROM snapshots ORDER BY id')
+        fingerprints = [x[0] for x in cursor.fetchall()]
+        cursor.execute('UPDATE snapshots SET fingerprint=NULL')
+        db_util.backfill_snapshot_fingerprints(cursor)
+        cursor.execute('SELECT fingerprint FROM snapshots ORDER BY id')
+        self.assertEqual([x[0] for x in cursor.fetchall()], fingerprints)
+
+    def test_realized_cursor_rollback(self):
+        fake_connection = unittest.mock.MagicMock()
+
+        with unittest.mock.patch('prog_code.util.db_util.get_db_connection') as mock:
+            mock.return_value = fake_connection
+
+            with self.assertRaises(RuntimeError):
+                with db_util.get_cursor():
+                    raise RuntimeError('test')
+
+        fake_connection.rollback.assert_called_once_with()
+        fake_connection.commit.assert_not_called()
+        fake_connection.close.assert_called_once_with()
 
     def test_get_consent_settings_no_prior(self):
         fake_cursor = FakeCursor()
@@ -0,0 +1,70 @@
+"""One-off report of snapshots which duplicate other snapshots.
+
+Copyright (C) 2014 A. Samuel Pottinger ("Sam Pottinger", gleap.org)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Run from the repository root with:
+
+    $ python -m prog_code.util.duplicate_scan [--backfill]
+
+Use --backfill to first compute fingerprints for snapshots saved before
+fingerprints were recorded.
+
+@author Sam Pottinger
+@license GNU GPL v3
+"""
+import sys
+import typing
+
+import prog_code.util.db_util as db_util
+
+BACKFILL_FLAG = '--backfill'
+
+
+def report_duplicates(groups: typing.List[db_util.DuplicateSnapshotGroup],
+        target: typing.TextIO) -> None:
+    """Write a description of each group of duplicate snapshots.
+
+    @param groups: The duplicates found by db_util.find_duplicate_snapshots.
+    @param target: Stream to write the report to.
+    """
+    for group in groups:
+        target.write('%s: %s\n' % (
+            group.fingerprint,
+            ', '.join(map(str, group.database_ids))
+        ))
+
+    target.write('%d sets of duplicate snapshots found.\n' % len(groups))
+
+
+def run_scan(backfill: bool, target: typing.TextIO) -> None:
+    """Optionally backfill fingerprints and then report duplicates.
+
+    @param backfill: True if fingerprints should be computed for snapshots
+        which do not have them.
+    @param target: Stream to write the report to.
+    """
+    with db_util.get_cursor() as cursor:
+        if backfill:
+            num_updated = db_util.backfill_snapshot_fingerprints(cursor)
+            target.write('Fingerprinted %d snapshots.\n' % num_updated)
+
+        groups = db_util.find_duplicate_snapshots(cursor)
+
+    report_duplicates(groups, target)
+
+
+if __name__ == '__main__':
+    run_scan(BACKFILL_FLAG in sys.argv[1:], sys.stdout)
@@ -18,7 +18,9 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 @author: Sam Pottinger
 @license: GNU GPL v3
 """
+import itertools
 import numbers
+import sqlite3
 import typing
 
 from ..struct import models
@@ -26,6 +28,7 @@ from ..struct import models
 import prog_code.util.constants as constants
 import prog_code.util.db_util as db_util
 import prog_code.util.oper_interp as oper_interp
+import prog_code.util.type_util as type_util
 
 
 FIELD_MAP: typing.Mapping[str, oper_interp.FieldInfo] = {
@@ -33,8 +36,8 @@ FIELD_MAP: typing.Mapping[str, oper_interp.FieldInfo] = {
     'study_id': oper_interp.RawInterpretField('study_id'),
     'study': oper_interp.RawInterpretField('study'),
     'gender': oper_interp.GenderField('gender'),
-    'birthday': oper_interp.DateInterpretField('birthday'),
-    'session_date': oper_interp.DateInterpretField('session_date'),
+    'birthday': oper_interp.DateInterpretField('birthday_day'),
+    'session_date': oper_interp.DateInterpretField('session_date_day'),
     'session_num': oper_interp.NumericalField('session_num'),
     'words_spoken': oper_interp.NumericalField('words_spoken'),
     'items_excluded': oper_interp.NumericalField('items_excluded'),
@@ -43,12 +46,61 @@ FIELD_MAP: typing.Mapping[str, oper_interp.FieldInfo] = {
     'percentile': oper_interp.NumericalField('percentile'),
     'extra_categories': oper_interp.NumericalField('extra_categories'),
     'CDI_type': oper_interp.RawInterpretField('cdi_type'),
-    'specific_language': oper_interp.RawInterpretField('languages'),
+    'specific_language': oper_interp.LanguageField('languages'),
     'num_languages': oper_interp.NumericalField('num_languages'),
     'hard_of_hearing': oper_interp.BooleanField('hard_of_hearing'),
-    'deleted': oper_interp.BooleanField('deleted')
+    'deleted': oper_interp.BooleanField('deleted'),
+    'database_id': oper_interp.NumericalField('id')
 }
 
+# Equality filters with more than this many values are matched against a
+# temporary table of values instead of binding each value as a parameter. This
+# keeps large cohorts under SQLite's limit on the number of bound parameters.
+TEMP_TABLE_OPERAND_THRESHOLD = 500
+
+TEMP_TABLE_NAME_TEMPLATE = 'temp.filter_values_%d'
+
+# Source of the numbers giving each query's temporary tables unique names.
+# Queries may be iterated at the same time on the shared connection and SQLite
+# will not drop a table which another open query is still reading.
+TEMP_TABLE_IDS = itertools.count()
+
+# Temporary tables which could not be dropped because another query was still
+# reading from the connection. They are emptied and dropped by a later clean up.
+UNDROPPED_TEMP_TABLES: typing.Set[str] = set()
+
+CREATE_TEMP_TABLE_CMD = 'CREATE TEMP TABLE %s (value)'
+
+INSERT_TEMP_VALUE_CMD = 'INSERT INTO %s VALUES (?)'
+
+DROP_TEMP_TABLE_CMD = 'DROP TABLE IF EXISTS %s'
+
+CLEAR_TEMP_TABLE_CMD = 'DELETE FROM %s'
+
+PARTICIPANT_TEMP_TABLE_TEMPLATE = 'temp.participant_values_%d'
+
+CREATE_PARTICIPANT_TEMP_TABLE_CMD = 'CREATE TEMP TABLE %s (study, study_id)'
+
+INSERT_PARTICIPANT_TEMP_VALUE_CMD = 'INSERT INTO %s VALUES (?, ?)'
+
+PARTICIPANT_QUERY = (
+    'SELECT snapshots.* FROM %s AS participants INNER JOIN snapshots ON '
+    'snapshots.study = participants.study AND '
+    'snapshots.study_id = participants.study_id'
+)
+
+# Matching snapshots joined with their word values, ordered so that each
+# snapshot's words are adjacent. The snapshot columns come first.
+SEARCH_CONTENTS_TEMPLATE = (
+    'SELECT matched.*, snapshot_content.word, snapshot_content.value '
+    'FROM (SELECT * FROM %s WHERE %s) AS matched '
+    'INNER JOIN snapshot_content ON snapshot_content.snapshot_id = matched.id '
+    'ORDER BY matched.id'
+)
+
+# Number of rows fetched from the database at a time by iter_search_query.
+SEARCH_BATCH_SIZE = 500
+
 OPERATOR_MAP = {
     'eq': '==',
     'lt': '<',
@@ -63,7 +115,8 @@ class QueryInfo:
     """Information necessary to execute a user generated SQL select."""
 
     def __init__(self, filter_fields: typing.List[oper_interp.FieldInfo],
-            query_str:str):
+            query_str:str,
+            temp_tables: typing.Optional[typing.List[typing.Optional[str]]] = None):
         """Create a structure containing info needed to run SQL select.
 
         @param filter_fields: The filters that are included in this select
@@ -72,31 +125,61 @@ class QueryInfo:
         @param query_str: SQL select statement with placeholders for operand
             values.
         @type query_str: str
+        @param temp_tables: For each filter, the name of the temporary table
+            the query reads that filter's values from or None if its values are
+            bound as parameters. Defaults to binding all values.
         """
         self.filter_fields = filter_fields
         self.query_str = query_str
 
+        if temp_tables == None:
+            temp_tables = [None] * len(filter_fields)
+        self.temp_tables = temp_tables
+
+
+def count_operands(operand: typing.Any) -> int:
+    """Determine how many values a possibly comma separated operand holds.
+
+    @param operand: The raw operand from a models.Filter.
+    @returns: Number of values to be compared against.
+    """
+    if isinstance(operand, str):
+        return operand.count(',') + 1
+    else:
+        return 1
+
 
 def build_query_component(field: oper_interp.FieldInfo, operator: str,
-        operand: str) -> str:
+        operand: str, temp_table: typing.Optional[str] = None) -> str:
     """Generate part of a query for SQL.
 
     Generate part of a query for SQL without checking for security issues,
-    issues which can be found through build_query.
+    issues which can be found through build_query. Equality against multiple
+    values is compiled to IN so that it can use an index.
 
     @param field: The field to query.
     @param operator: The operator to use in comparison.
     @param operand: The value to compare against.
+    @param temp_table: The name of the temporary table holding the values to
+        compare against or None if they are bound as parameters.
     @returns: Query component.
     """
+    if temp_table != None:
+        values_sql = '(SELECT value FROM %s)' % temp_table
+        return '(' + field.build_in_comparison(values_sql) + ')'
+
     if isinstance(operand, str):
         operands = operand.split(',')
     else:
         operands = [operand]
+
+    if operator == '==' and len(operands) > 1:
+        values_sql = '(' + ', '.join('?' * len(operands)) + ')'
+        return '(' + field.build_in_comparison(values_sql) + ')'
+
     query_subcomponents = []
     for operand in operands:
-        template_vals = (field.get_field_name(), operator)
-        query_subcomponents.append('%s %s ?' % template_vals)
+        query_subcomponents.append(field.build_comparison(operator))
 
     if len(operands) > 0:
         return '(' + ' OR '.join(query_subcomponents) + ')'
@@ -141,32 +224,120 @@ def build_query(filters: typing.Iterable[models.Filter], table: str,
         fields_and_extraneous
     )
 
+    fields_and_extraneous_named_realized = list(fields_and_extraneous_named)
+
+    temp_tables: typing.List[typing.Optional[str]] = []
+    for info in fields_and_extraneous_named_realized:
+        use_temp_table = info['operator'] == '=='
+        use_temp_table = use_temp_table and count_operands(info['operands']) > \
+            TEMP_TABLE_OPERAND_THRESHOLD
+
+        if use_temp_table:
+            temp_tables.append(TEMP_TABLE_NAME_TEMPLATE % next(TEMP_TABLE_IDS))
+        else:
+            temp_tables.append(None)
+
     filter_fields_str = map(
         lambda x: build_query_component(
-            x['field'], # type: ignore
-            x['operator'], # type: ignore
-            x['operands'] # type: ignore
+            x[0]['field'], # type: ignore
+            x[0]['operator'], # type: ignore
+            x[0]['operands'], # type: ignore
+            x[1]
         ),
-        fields_and_extraneous_named
+        zip(fields_and_extraneous_named_realized, temp_tables)
     )
     clause = ' AND '.join(filter_fields_str)
 
     stmt = statement_template % (table, clause)
 
-    return QueryInfo(filter_fields_realized, stmt)
+    return QueryInfo(filter_fields_realized, stmt, temp_tables)
+
+
+def prepare_operands(query_info: QueryInfo,
+        filters: typing.Iterable[models.Filter],
+        db_cursor: sqlite3.Cursor) -> typing.List[typing.Any]:
+    """Interpret filter operands and load any temporary tables a query uses.
+
+    @param query_info: The query to be run.
+    @param filters: The filters from which the query was built.
+    @param db_cursor: The cursor with which the query will be run.
+    @returns: Values to bind to the query's placeholders.
+    """
+    raw_operands = map(lambda x: x.operand, filters)
+
+    operands_flat: typing.List[typing.Any] = []
+    for (field, temp_table, raw_operand) in zip(query_info.filter_fields,
+            query_info.temp_tables, raw_operands):
+        operand = field.interpret_value(raw_operand)
+
+        if temp_table == None:
+            operands_flat.extend(operand)
+        else:
+            db_cursor.execute(DROP_TEMP_TABLE_CMD % temp_table, [])
+            db_cursor.execute(CREATE_TEMP_TABLE_CMD % temp_table, [])
+            db_cursor.executemany(
+                INSERT_TEMP_VALUE_CMD % temp_table,
+                map(lambda x: (x,), operand)
+            )
+
+    return operands_flat
+
+
+def drop_temp_table(temp_table: str, db_cursor: sqlite3.Cursor) -> None:
+    """Remove a temporary table once the query reading it has finished.
+
+    SQLite will not drop a table while any other query on the connection is
+    still open, as happens when several results are iterated at once. In that
+    case the table is emptied and dropped by a later call instead. The caller
+    must hold the database connection.
+
+    @param temp_table: The name of the temporary table to remove.
+    @param db_cursor: The cursor with which to remove it.
+    """
+    try:
+        db_cursor.execute(DROP_TEMP_TABLE_CMD % temp_table, [])
+    except sqlite3.OperationalError:
+        db_cursor.execute(CLEAR_TEMP_TABLE_CMD % temp_table, [])
+        UNDROPPED_TEMP_TABLES.add(temp_table)
+        return
+
+    for undropped_table in list(UNDROPPED_TEMP_TABLES):
+        try:
+            db_cursor.execute(DROP_TEMP_TABLE_CMD % undropped_table, [])
+        except sqlite3.OperationalError:
+            return
+        UNDROPPED_TEMP_TABLES.discard(undropped_table)
+
+
+def drop_temp_tables(query_info: QueryInfo, db_cursor: sqlite3.Cursor) -> None:
+    """Remove the temporary tables loaded by prepare_operands.
+
+    @param query_info: The query which was run.
+    @param db_cursor: The cursor with which the query was run.
+    """
+    for temp_table in query_info.temp_tables:
+        if temp_table != None:
+            drop_temp_table(temp_table, db_cursor) # type: ignore
 
 
 def build_search_query(filters: typing.Iterable[models.Filter],
-        table: str) -> QueryInfo:
+        table: str, limit: typing.Optional[int] = None) -> QueryInfo:
     """Build a string SQL query from the given filters.
 
     @param filters: The filters to build the query out of.
     @type filters: Iterable over models.Filter
     @param table: The name of the table to query.
     @type table: str
+    @param limit: The maximum number of rows to return or None for no limit.
+        If given, rows are ordered by database ID so that a later query can
+        continue after the last ID returned.
     @return: SQL select query for the given table with the given filters.
     """
-    return build_query(filters, table, 'SELECT * FROM %s WHERE %s')
+    statement_template = 'SELECT * FROM %s WHERE %s'
+    if limit != None:
+        statement_template += ' ORDER BY id LIMIT %d' % limit
+
+    return build_query(filters, table, statement_template)
 
 
 def build_delete_query(filters: typing.Iterable[models.Filter], table: str,
@@ -208,69 +379,239 @@ def assert_str(target: typing.Any) -> str:
     return str(target) # type: ignore
 
 
-def run_search_query(filters_iter: typing.Iterable[models.Filter], table: str,
-        exclude_deleted: bool = True) -> typing.List[models.SnapshotMetadata]:
-    """Builds and runs a SQL select query on the given table with given filters.
-
-    @param filters_iter: The filters to build the query out of.
-    @type filters_iter: Iterable over models.Filter
-    @param table: The name of the table to query.
-    @type table: str
-    @return: Results of SQL select query for the given table with the given
-        filters.
-    @rtype: Iterable over models.SnapshotMetadata
+def assert_languages(target: typing.Any) -> typing.List[str]:
+    """Ensure that target has a string type and split it into languages."""
+    return assert_str(target).split(',')
+
+
+# Conversion applied to each column of a snapshots row in table order.
+SNAPSHOT_COLUMN_CONVERTERS = [
+    assert_int,
+    assert_str,
+    assert_str,
+    assert_str,
+    assert_int,
+    assert_float,
+    assert_str,
+    assert_str,
+    assert_int,
+    assert_int,
+    assert_int,
+    assert_int,
+    assert_float,
+    assert_int,
+    assert_int,
+    assert_languages,
+    assert_int,
+    assert_str,
+    assert_int,
+    assert_int
+]
+
+
+def convert_snapshot_rows(rows: typing.List[typing.Tuple]
+        ) -> typing.List[models.SnapshotMetadata]:
+    """Convert a batch of snapshots table rows to snapshot records.
+
+    Values are converted a column at a time so that each column's conversion is
+    looked up once per batch rather than once per value.
+
+    @param rows: Rows from a SELECT * on the snapshots table.
+    @returns: Snapshot metadata records in the same order as rows.
+    """
+    columns = zip(*rows)
+    converted_columns = [
+        map(convert, column)
+        for (convert, column) in zip(SNAPSHOT_COLUMN_CONVERTERS, columns)
+    ]
+    return [models.SnapshotMetadata(*x) for x in zip(*converted_columns)]
+
+
+def iter_snapshot_query(query_str: str,
+        prepare: typing.Callable[[sqlite3.Cursor], typing.List[typing.Any]],
+        clean_up: typing.Optional[typing.Callable[[sqlite3.Cursor], None]],
+        batch_size: int = SEARCH_BATCH_SIZE,
+        convert_rows: typing.Callable[[typing.List[typing.Tuple]], typing.List] = convert_snapshot_rows
+        ) -> typing.Iterator:
+    """Lazily run a SQL select query returning full rows from snapshots.
+
+    Rows are fetched batch_size at a time and the database connection is
+    released between batches so that consumers may use the database while
+    iterating.
+
+    @param query_str: The SQL select statement to run.
+    @param prepare: Function which, given the cursor the query will be run with,
+        loads any temporary tables the query needs and returns the values to
+        bind to its placeholders.
+    @param clean_up: Function which, given the same cursor, removes anything
+        prepare created or None if there is nothing to remove.
+    @param batch_size: The number of rows to fetch at a time.
+    @param convert_rows: Function converting each batch of rows to the values
+        yielded. Defaults to building snapshot records.
+    @returns: Iterator over matching snapshots or converted rows.
     """
     db_connection = db_util.get_db_connection()
     db_cursor = db_connection.cursor()
+    holding_connection = True
+
+    try:
+        operands_flat = prepare(db_cursor)
+        db_cursor.execute(query_str, operands_flat)
+
+        while True:
+            rows = db_cursor.fetchmany(batch_size)
+            db_connection.close()
+            holding_connection = False
 
+            if not rows:
+                break
+
+            yield from convert_rows(rows)
+
+            db_connection.acquire()
+            holding_connection = True
+    finally:
+        try:
+            if clean_up != None:
+                if not holding_connection:
+                    db_connection.acquire()
+                    holding_connection = True
+
+                clean_up(db_cursor) # type: ignore
+                db_connection.commit()
+        finally:
+            if holding_connection:
+                db_connection.close()
+
+
+def iter_search_query(filters_iter: typing.Iterable[models.Filter], table: str,
+        exclude_deleted: bool = True, batch_size: int = SEARCH_BATCH_SIZE,
+        limit: typing.Optional[int] = None
+        ) -> typing.Iterator[models.SnapshotMetadata]:
+    """Lazily run a SQL select query on the given table with given filters.
+
+    @param filters_iter: The filters to build the query out of.
+    @param table: The name of the table to query.
+    @param exclude_deleted: Flag indicating if deleted snapshots should be left
+        out of the results.
+    @param batch_size: The number of rows to fetch at a time.
+    @param limit: The maximum number of snapshots to return in order of
+        database ID or None to return all matches in no particular order.
+    @returns: Iterator over matching snapshots.
+    """
     filters = list(filters_iter)
 
     if exclude_deleted:
         filters.append(models.Filter('deleted', 'eq', 0))
 
-    query_info = build_search_query(filters, table)
-    raw_operands = map(lambda x: x.operand, filters)
+    query_info = build_search_query(filters, table, limit)
 
-    filter_fields_and_operands = zip(query_info.filter_fields, raw_operands)
+    if any(map(lambda x: x != None, query_info.temp_tables)):
+        clean_up = lambda cursor: drop_temp_tables(query_info, cursor)
+    else:
+        clean_up = None
 
-    operands = map(
-        lambda x: x[0].interpret_value(x[1]),
-        filter_fields_and_operands
+    return iter_snapshot_query(
+        query_info.query_str,
+        lambda cursor: prepare_operands(query_info, filters, cursor),
+        clean_up,
+        batch_size
     )
 
-    operands_flat = []
-    for operand in operands:
-        operands_flat.extend(operand)
-
-    db_cursor.execute(query_info.query_str, operands_flat)
-
-    ret_val = list(map(
-        lambda x: models.SnapshotMetadata(
-            assert_int(x[0]),
-            assert_str(x[1]),
-            assert_str(x[2]),
-            assert_str(x[3]),
-            assert_int(x[4]),
-            assert_float(x[5]),
-            assert_str(x[6]),
-            assert_str(x[7]),
-            assert_int(x[8]),
-            assert_int(x[9]),
-            assert_int(x[10]),
-            assert_int(x[11]),
-            assert_float(x[12]),
-            assert_int(x[13]),
-            assert_int(x[14]),
-            assert_str(x[15]).split(','),
-            assert_int(x[16]),
-            assert_str(x[17]),
-            assert_int(x[18]),
-            assert_int(x[19])
-        ),
-        db_cursor.fetchall()
-    ))
-    db_connection.close()
-    return ret_val
+
+def iter_search_contents_query(filters_iter: typing.Iterable[models.Filter],
+        table: str, exclude_deleted: bool = True,
+        batch_size: int = SEARCH_BATCH_SIZE) -> typing.Iterator[
+            typing.Tuple[models.SnapshotMetadata, typing.List[typing.Tuple[str, int]]]]:
+    """Lazily find snapshots along with their word values in a single query.
+
+    Only one snapshot's word values are held at a time so that exports of
+    every word can be streamed without loading all of the results.
+
+    @param filters_iter: The filters to build the query out of.
+    @param table: The name of the table to query.
+    @param exclude_deleted: Flag indicating if deleted snapshots should be left
+        out of the results.
+    @param batch_size: The number of rows, one per snapshot word, to fetch at
+        a time.
+    @returns: Iterator over (snapshot, [(word, value), ...]) pairs in order of
+        database ID. Snapshots without word values are left out.
+    """
+    filters = list(filters_iter)
+
+    if exclude_deleted:
+        filters.append(models.Filter('deleted', 'eq', 0))
+
+    query_info = build_query(filters, table, SEARCH_CONTENTS_TEMPLATE)
+
+    if any(map(lambda x: x != None, query_info.temp_tables)):
+        clean_up = lambda cursor: drop_temp_tables(query_info, cursor)
+    else:
+        clean_up = None
+
+    rows = iter_snapshot_query(
+        query_info.query_str,
+        lambda cursor: prepare_operands(query_info, filters, cursor),
+        clean_up,
+        batch_size,
+        lambda x: x
+    )
+
+    for (_, snapshot_rows_iter) in itertools.groupby(rows, lambda x: x[0]):
+        snapshot_rows = list(snapshot_rows_iter)
+        snapshot = convert_snapshot_rows([snapshot_rows[0][:-2]])[0]
+        yield (snapshot, list(map(lambda x: (x[-2], x[-1]), snapshot_rows)))
+
+
+def iter_participant_query(participants: typing.Iterable[typing.Tuple[str, str]],
+        exclude_deleted: bool = True, batch_size: int = SEARCH_BATCH_SIZE
+        ) -> typing.Iterator[models.SnapshotMetadata]:
+    """Lazily find the snapshots for many participants with a single query.
+
+    The study / study ID pairs are loaded into a temporary table and joined
+    against snapshots so that the lookup uses the participant index.
+
+    @param participants: The (study, study ID) pairs to look up.
+    @param exclude_deleted: Flag indicating if deleted snapshots should be left
+        out of the results.
+    @param batch_size: The number of rows to fetch at a time.
+    @returns: Iterator over snapshots of the given participants.
+    """
+    participants_realized = list(set(participants))
+    temp_table = PARTICIPANT_TEMP_TABLE_TEMPLATE % next(TEMP_TABLE_IDS)
+
+    def prepare(cursor):
+        cursor.execute(DROP_TEMP_TABLE_CMD % temp_table, [])
+        cursor.execute(CREATE_PARTICIPANT_TEMP_TABLE_CMD % temp_table, [])
+        cursor.executemany(
+            INSERT_PARTICIPANT_TEMP_VALUE_CMD % temp_table,
+            participants_realized
+        )
+        return []
+
+    def clean_up(cursor):
+        drop_temp_table(temp_table, cursor)
+
+    query_str = PARTICIPANT_QUERY % temp_table
+    if exclude_deleted:
+        query_str += ' WHERE snapshots.deleted = 0'
+
+    return iter_snapshot_query(query_str, prepare, clean_up, batch_size)
+
+
+def run_search_query(filters_iter: typing.Iterable[models.Filter], table: str,
+        exclude_deleted: bool = True) -> typing.List[models.SnapshotMetadata]:
+    """Builds and runs a SQL select query on the given table with given filters.
+
+    @param filters_iter: The filters to build the query out of.
+    @type filters_iter: Iterable over models.Filter
+    @param table: The name of the table to query.
+    @type table: str
+    @return: Results of SQL select query for the given table with the given
+        filters.
+    @rtype: Iterable over models.SnapshotMetadata
+    """
+    return list(iter_search_query(filters_iter, table, exclude_deleted))
 
 
 def run_delete_query(filters: typing.Iterable[models.Filter],
@@ -300,20 +641,38 @@ def run_delete_query(filters: typing.Iterable[models.Filter],
         restore,
         hard_delete=hard_delete
     )
-    raw_operands = map(lambda x: x.operand, filters_realized)
-
-    filter_fields_and_operands = zip(query_info.filter_fields, raw_operands)
-
-    operands = map(
-        lambda x: x[0].interpret_value(x[1]),
-        filter_fields_and_operands
-    )
-
-    operands_flat = []
-    for operand in operands:
-        operands_flat.extend(operand)
 
     with db_util.get_cursor() as db_cursor:
+        # Changes are logged before the delete so hard deleted rows still exist
+        if table == constants.SNAPSHOTS_DB_TABLE:
+            if restore:
+                operation = db_util.CHANGE_RESTORE
+            elif hard_delete:
+                operation = db_util.CHANGE_HARD_DELETE
+            else:
+                operation = db_util.CHANGE_DELETE
+
+            db_util.record_snapshot_changes(
+                map(lambda x: type_util.assert_not_none(x.database_id), records),
+                operation,
+                db_cursor
+            )
+
+        operands_flat = prepare_operands(
+            query_info,
+            filters_realized,
+            db_cursor
+        )
         db_cursor.execute(query_info.query_str, operands_flat)
+        drop_temp_tables(query_info, db_cursor)
+
+        if hard_delete and not restore and table == constants.SNAPSHOTS_DB_TABLE:
+            db_util.delete_snapshot_languages(
+                map(lambda x: type_util.assert_not_none(x.database_id), records),
+                db_cursor
+            )
+
+        if table == constants.SNAPSHOTS_DB_TABLE:
+            db_util.bump_data_version(db_cursor)
 
     return records
@@ -15,13 +15,18 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
+import copy
 import re
+import sqlite3
+import threading
 import unittest
 import unittest.mock
 
 from ..struct import models
 
+import prog_code.util.constants as constants
 import prog_code.util.db_util as db_util
+import prog_code.util.db_util_test as db_util_test
 import prog_code.util.filter_util as filter_util
 
 
@@ -39,6 +44,11 @@ class TestDBCursor:
     def fetchall(self):
         return self.result
 
+    def fetchmany(self, size):
+        ret_val = self.result[:size]
+        self.result = self.result[size:]
+        return ret_val
+
 
 class TestDBConnection:
 
@@ -49,6 +59,9 @@ class TestDBConnection:
     def cursor(self):
         return self.next_cursor
 
+    def acquire(self):
+        self.closed = False
+
     def close(self):
         self.closed = True
 
@@ -56,6 +69,27 @@ class TestDBConnection:
         pass
 
 
+class TestLockingDBConnection:
+    """Connection handing out separate cursors guarded by a single lock."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.lock = threading.Lock()
+
+    def cursor(self):
+        self.lock.acquire()
+        return self.connection.cursor()
+
+    def acquire(self):
+        self.lock.acquire()
+
+    def close(self):
+        self.lock.release()
+
+    def commit(self):
+        self.connection.commit()
+
+
 class FilterUtilTests(unittest.TestCase):
 
     def test_run_search_query(self):
@@ -70,7 +104,7 @@ class FilterUtilTests(unittest.TestCase):
             filter_util.run_search_query(filters, 'test')
 
             query = fake_cursor.queries[0]
-            query_str ='SELECT * FROM test WHERE (study == ? OR study == ?) AND '\
+            query_str ='SELECT * FROM test WHERE (study IN (?, ?)) AND '\
                 '(deleted == ?)'
             self.assertEqual(query, query_str)
 
@@ -82,6 +116,296 @@ class FilterUtilTests(unittest.TestCase):
 
             mock.assert_called()
 
+    def test_run_search_query_language(self):
+        cursor = db_util_test.create_memory_cursor()
+
+        for (study_id, languages) in [('p1', ['english']),
+                ('p2', ['english', 'spanish']), ('p3', ['french'])]:
+            snapshot = copy.copy(db_util_test.TEST_SNAPSHOT)
+            snapshot.study_id = study_id
+            snapshot.languages = languages
+            db_util.insert_snapshot(snapshot, {}, cursor)
+
+        def run_query(operator, operand):
+            filters = [models.Filter('specific_language', operator, operand)]
+            query_info = filter_util.build_search_query(
+                filters,
+                constants.SNAPSHOTS_DB_TABLE
+            )
+            operands = query_info.filter_fields[0].interpret_value(operand)
+            cursor.execute(query_info.query_str, operands)
+            return sorted(map(lambda x: x[2], cursor.fetchall()))
+
+        self.assertEqual(run_query('eq', 'Spanish'), ['p2'])
+        self.assertEqual(run_query('eq', 'english'), ['p1', 'p2'])
+        self.assertEqual(run_query('eq', 'spanish,french'), ['p2', 'p3'])
+        self.assertEqual(run_query('neq', 'english'), ['p3'])
+
+    def test_run_search_query_date_range(self):
+        cursor = db_util_test.create_memory_cursor()
+
+        for (study_id, session_date) in [('p1', '2013/01/31'),
+                ('p2', '2013/02/01'), ('p3', '2013/03/01')]:
+            snapshot = copy.copy(db_util_test.TEST_SNAPSHOT)
+            snapshot.study_id = study_id
+            snapshot.session_date = session_date
+            db_util.insert_snapshot(snapshot, {}, cursor)
+
+        filters = [
+            models.Filter('session_date', 'gteq', '02/01/2013'),
+            models.Filter('session_date', 'lt', '03/01/2013')
+        ]
+        query_info = filter_util.build_search_query(
+            filters,
+            constants.SNAPSHOTS_DB_TABLE
+        )
+        self.assertTrue('session_date_day >= ?' in query_info.query_str)
+
+        operands = []
+        for (field, db_filter) in zip(query_info.filter_fields, filters):
+            operands.extend(field.interpret_value(db_filter.operand))
+        cursor.execute(query_info.query_str, operands)
+
+        self.assertEqual([x[2] for x in cursor.fetchall()], ['p2'])
+
+    def test_build_query_component(self):
+        field = filter_util.FIELD_MAP['study']
+        self.assertEqual(
+            filter_util.build_query_component(field, '==', 'study1'),
+            '(study == ?)'
+        )
+        self.assertEqual(
+            filter_util.build_query_component(field, '!=', 'study1,study2'),
+            '(study != ? OR study != ?)'
+        )
+        self.assertEqual(
+            filter_util.build_query_component(
+                field,
+                '==',
+                'study1,study2',
+                'temp.filter_values_0'
+            ),
+            '(study IN (SELECT value FROM temp.filter_values_0))'
+        )
+
+    def test_run_search_query_large_cohort(self):
+        cursor = db_util_test.create_memory_cursor()
+        connection = cursor.connection
+
+        for child_id in range(1, 21):
+            snapshot = copy.copy(db_util_test.TEST_SNAPSHOT)
+            snapshot.child_id = child_id
+            snapshot.study_id = str(child_id)
+            db_util.insert_snapshot(snapshot, {}, cursor)
+
+        cohort = list(range(2, 20000, 2))
+        self.assertTrue(len(cohort) > filter_util.TEMP_TABLE_OPERAND_THRESHOLD)
+        filters = [
+            models.Filter('child_id', 'eq', ','.join(map(str, cohort))),
+            models.Filter('specific_language', 'eq', 'english')
+        ]
+
+        with unittest.mock.patch('prog_code.util.db_util.get_db_connection') as mock:
+            mock.return_value = TestDBConnection(cursor)
+            results = filter_util.run_search_query(filters, 'snapshots')
+
+        self.assertEqual(
+            sorted(map(lambda x: int(x.child_id), results)),
+            list(range(2, 21, 2))
+        )
+
+        cursor.execute('SELECT name FROM sqlite_temp_master')
+        self.assertEqual(cursor.fetchall(), [])
+
+    def test_iter_search_query(self):
+        cursor = db_util_test.create_memory_cursor()
+        connection = TestDBConnection(cursor)
+
+        for study_id in ['p1', 'p2', 'p3']:
+            snapshot = copy.copy(db_util_test.TEST_SNAPSHOT)
+            snapshot.study_id = study_id
+            db_util.insert_snapshot(snapshot, {}, cursor)
+
+        with unittest.mock.patch('prog_code.util.db_util.get_db_connection') as mock:
+            mock.return_value = connection
+
+            results = filter_util.iter_search_query(
+                [models.Filter('study', 'eq', db_util_test.TEST_STUDY)],
+                'snapshots',
+                batch_size=2
+            )
+
+            first = next(results)
+            self.assertTrue(connection.closed)
+            self.assertEqual(first.study_id, 'p1')
+            self.assertEqual(first.child_id, str(db_util_test.TEST_DB_ID))
+            self.assertEqual(first.languages, ['english', 'spanish'])
+            self.assertEqual(first.percentile, 50.0)
+
+            self.assertEqual(
+                list(map(lambda x: x.study_id, results)),
+                ['p2', 'p3']
+            )
+            self.assertTrue(connection.closed)
+
+    def test_iter_search_query_limit(self):
+        cursor = db_util_test.create_memory_cursor()
+
+        for study_id in ['p1', 'p2', 'p3']:
+            snapshot = copy.copy(db_util_test.TEST_SNAPSHOT)
+            snapshot.study_id = study_id
+            db_util.insert_snapshot(snapshot, {}, cursor)
+
+        with unittest.mock.patch('prog_code.util.db_util.get_db_connection') as mock:
+            mock.return_value = TestDBConnection(cursor)
+
+            results = filter_util.iter_search_query(
+                [models.Filter('database_id', 'gt', 1)],
+                'snapshots',
+                limit=1
+            )
+            self.assertEqual(list(map(lambda x: x.database_id, results)), [2])
+
+    def test_iter_participant_query(self):
+        cursor = db_util_test.create_memory_cursor()
+
+        for (study, study_id) in [('s1', 'p1'), ('s1', 'p2'), ('s2', 'p1')]:
+            snapshot = copy.copy(db_util_test.TEST_SNAPSHOT)
+            snapshot.study = study
+            snapshot.study_id = study_id
+            db_util.insert_snapshot(snapshot, {}, cursor)
+
+        with unittest.mock.patch('prog_code.util.db_util.get_db_connection') as mock:
+            mock.return_value = TestDBConnection(cursor)
+
+            results = filter_util.iter_participant_query(
+                [('s1', 'p2'), ('s2', 'p1'), ('s2', 'p1'), ('s3', 'p1')]
+            )
+            self.assertEqual(
+                sorted(map(lambda x: (x.study, x.study_id), results)),
+                [('s1', 'p2'), ('s2', 'p1')]
+            )
+
+        cursor.execute('SELECT name FROM sqlite_temp_master')
+        self.assertEqual(cursor.fetchall(), [])
+
+    def test_iter_queries_interleaved(self):
+        cursor = db_util_test.create_memory_cursor()
+
+        for child_id in range(1, 7):
+            snapshot = copy.copy(db_util_test.TEST_SNAPSHOT)
+            snapshot.child_id = child_id
+            snapshot.study_id = 'p%d' % child_id
+            db_util.insert_snapshot(snapshot, {}, cursor)
+
+        cohort = ','.join(map(str, range(1, 1501)))
+        filters = [models.Filter('child_id', 'eq', cohort)]
+        participants = [(db_util_test.TEST_STUDY, 'p1'), (db_util_test.TEST_STUDY, 'p2')]
+        connection = TestLockingDBConnection(cursor.connection)
+
+        with unittest.mock.patch('prog_code.util.db_util.get_db_connection') as mock:
+            mock.return_value = connection
+
+            first = filter_util.iter_search_query(filters, 'snapshots', batch_size=2)
+            second = filter_util.iter_search_query(filters, 'snapshots', batch_size=2)
+            third = filter_util.iter_participant_query(participants, batch_size=1)
+            fourth = filter_util.iter_participant_query(participants, batch_size=1)
+
+            first_ids = [next(first).child_id]
+            second_ids = [next(second).child_id]
+            third_ids = [next(third).study_id]
+            fourth_ids = [next(fourth).study_id]
+            second_ids.extend(map(lambda x: x.child_id, second))
+            fourth_ids.extend(map(lambda x: x.study_id, fourth))
+            first_ids.extend(map(lambda x: x.child_id, first))
+            third_ids.extend(map(lambda x: x.study_id, third))
+
+        expected_ids = list(map(str, range(1, 7)))
+        self.assertEqual(sorted(first_ids, key=int), expected_ids)
+        self.assertEqual(sorted(second_ids, key=int), expected_ids)
+        self.assertEqual(sorted(third_ids), ['p1', 'p2'])
+        self.assertEqual(sorted(fourth_ids), ['p1', 'p2'])
+        self.assertFalse(connection.lock.locked())
+
+        cursor.execute('SELECT name FROM sqlite_temp_master')
+        self.assertEqual(cursor.fetchall(), [])
+
+    def test_iter_query_clean_up_failure_releases_lock(self):
+        cursor = db_util_test.create_memory_cursor()
+        connection = TestLockingDBConnection(cursor.connection)
+
+        def clean_up(cursor):
+            raise sqlite3.OperationalError('database table is locked')
+
+        with unittest.mock.patch('prog_code.util.db_util.get_db_connection') as mock:
+            mock.return_value = connection
+
+            results = filter_util.iter_snapshot_query(
+                'SELECT * FROM snapshots',
+                lambda cursor: [],
+                clean_up
+            )
+            with self.assertRaises(sqlite3.OperationalError):
+                list(results)
+
+        self.assertFalse(connection.lock.locked())
+
+    def test_iter_search_contents_query(self):
+        cursor = db_util_test.create_memory_cursor()
+
+        snapshots = []
+        for (study, words) in [('s1', {'a': 1, 'b': 0}), ('s2', {'c': 1}), ('s1', {})]:
+            snapshot = copy.copy(db_util_test.TEST_SNAPSHOT)
+            snapshot.study = study
+            db_util.insert_snapshot(snapshot, words, cursor)
+            snapshots.append(snapshot)
+
+        deleted_snapshot = copy.copy(db_util_test.TEST_SNAPSHOT)
+        deleted_snapshot.study = 's1'
+        deleted_snapshot.deleted = 1
+        db_util.insert_snapshot(deleted_snapshot, {'d': 1}, cursor)
+
+        with unittest.mock.patch('prog_code.util.db_util.get_db_connection') as mock:
+            mock.return_value = TestDBConnection(cursor)
+
+            results = list(filter_util.iter_search_contents_query(
+                [models.Filter('study', 'eq', 's1,s2')],
+                'snapshots',
+                batch_size=1
+            ))
+
+        self.assertEqual(
+            [(x[0].database_id, x[0].study) for x in results],
+            [(snapshots[0].database_id, 's1'), (snapshots[1].database_id, 's2')]
+        )
+        self.assertEqual(sorted(results[0][1]), [('a', 1), ('b', 0)])
+        self.assertEqual(results[1][1], [('c', 1)])
+        self.assertEqual(
+            results[0][0].languages,
+            db_util_test.TEST_SNAPSHOT.languages
+        )
+
+    def test_run_delete_query_data_version(self):
+        cursor = db_util_test.create_memory_cursor()
+        db_util.insert_snapshot(copy.copy(db_util_test.TEST_SNAPSHOT), {}, cursor)
+        version = db_util.get_data_version(cursor)
+
+        with unittest.mock.patch('prog_code.util.db_util.get_db_connection') as mock:
+            mock.return_value = TestDBConnection(cursor)
+            filter_util.run_delete_query(
+                [models.Filter('study', 'eq', db_util_test.TEST_STUDY)],
+                'snapshots',
+                False
+            )
+
+        self.assertEqual(db_util.get_data_version(cursor), version + 1)
+
+        changes = db_util.load_snapshot_changes(0, 10, cursor)
+        self.assertEqual(
+            [(x.snapshot_id, x.operation) for x in changes],
+            [(1, db_util.CHANGE_INSERT), (1, db_util.CHANGE_DELETE)]
+        )
+
     def test_delete_search_query_restore(self):
         with unittest.mock.patch('prog_code.util.db_util.get_db_connection') as mock:
             fake_cursor = TestDBCursor()
@@ -94,7 +418,7 @@ class FilterUtilTests(unittest.TestCase):
             filter_util.run_delete_query(filters, 'test', True)
 
             query = fake_cursor.queries[1]
-            query_str ='UPDATE test SET deleted=0 WHERE (study == ? OR study == ?)'
+            query_str ='UPDATE test SET deleted=0 WHERE (study IN (?, ?))'
             self.assertEqual(query, query_str)
 
             operands = fake_cursor.operands[0]
@@ -116,7 +440,7 @@ class FilterUtilTests(unittest.TestCase):
             filter_util.run_delete_query(filters, 'test', False)
 
             query = fake_cursor.queries[1]
-            query_str ='UPDATE test SET deleted=1 WHERE (study == ? OR study == ?)'
+            query_str ='UPDATE test SET deleted=1 WHERE (study IN (?, ?))'
             self.assertEqual(query, query_str)
 
             operands = fake_cursor.operands[0]
@@ -138,7 +462,7 @@ class FilterUtilTests(unittest.TestCase):
             filter_util.run_delete_query(filters, 'test', False, hard_delete=True)
 
             query = fake_cursor.queries[1]
-            query_str ='DELETE FROM test WHERE (study == ? OR study == ?)'
+            query_str ='DELETE FROM test WHERE (study IN (?, ?))'
             self.assertEqual(query, query_str)
 
             operands = fake_cursor.operands[0]
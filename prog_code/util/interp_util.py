@@ -19,12 +19,21 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 @license: GNU GPL v3
 """
 import datetime
+import functools
 import typing
 
 from ..struct import models
 
 DAYS_PER_MONTH = 30.42
 
+# Dates are also stored as the number of days since this date so that they can
+# be compared and subtracted as integers.
+DAY_NUM_EPOCH = datetime.date(1970, 1, 1)
+
+DAY_NUM_EPOCH_ORDINAL = DAY_NUM_EPOCH.toordinal()
+
+DAY_NUM_CACHE_SIZE = 4096
+
 
 def interpret_date(target_val: str) -> datetime.date:
     """Interpret a date of form YYYY/MM/DD as a datetime.date.
@@ -36,6 +45,61 @@ def interpret_date(target_val: str) -> datetime.date:
     return datetime.date(parts[0], parts[1], parts[2])
 
 
+def date_to_day_num(target: datetime.date) -> int:
+    """Get the number of days between DAY_NUM_EPOCH and a date.
+
+    @param target: The date to convert.
+    @returns: Days since DAY_NUM_EPOCH (negative if before).
+    """
+    return target.toordinal() - DAY_NUM_EPOCH_ORDINAL
+
+
+@functools.lru_cache(maxsize=DAY_NUM_CACHE_SIZE)
+def interpret_day_num(target_val: str) -> int:
+    """Interpret a date of form YYYY/MM/DD as a day number.
+
+    Results are cached as participants share the same few birthdays and session
+    dates across many snapshots.
+
+    @param target_val: The string to interpret.
+    @returns: Days since DAY_NUM_EPOCH.
+    @raises ValueError: Raised if target_val is not a valid date.
+    """
+    return date_to_day_num(interpret_date(target_val))
+
+
+def safe_interpret_day_num(target: typing.Optional[str]) -> typing.Optional[int]:
+    """Interpret a date of form YYYY/MM/DD as a day number.
+
+    @param target: The value to interpret.
+    @return: Days since DAY_NUM_EPOCH or None if could not be parsed.
+    @rtype: int or None
+    """
+    if target == None:
+        return None
+
+    target_realized: str = target # type: ignore
+
+    try:
+        return interpret_day_num(target_realized)
+    except (ValueError, IndexError):
+        return None
+
+
+def monthdelta_days(start_day: int, end_day: int) -> float:
+    """Determine the number of normalized months between two day numbers.
+
+    @param start_day: The earlier date as days since DAY_NUM_EPOCH.
+    @param end_day: The later date as days since DAY_NUM_EPOCH.
+    @returns: The number of normalized months between the two given days or 0
+        if end_day is not after start_day.
+    """
+    if start_day >= end_day:
+        return 0
+
+    return float(end_day - start_day) / DAYS_PER_MONTH
+
+
 def monthdelta(d1: datetime.date, d2: datetime.date) -> float:
     """Determine the number of normalized months between two dates.
 
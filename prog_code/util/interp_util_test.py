@@ -30,6 +30,20 @@ class InterpUtilTests(unittest.TestCase):
         generated_date = interp_util.interpret_date('2010/03/20')
         self.assertEqual(expected_date, generated_date)
 
+    def test_interpret_day_num(self):
+        self.assertEqual(interp_util.interpret_day_num('1970/01/01'), 0)
+        self.assertEqual(interp_util.interpret_day_num('1969/12/31'), -1)
+        self.assertEqual(interp_util.interpret_day_num('2010/03/20'), 14688)
+
+        self.assertEqual(interp_util.safe_interpret_day_num('2010/3/20'), 14688)
+        self.assertEqual(interp_util.safe_interpret_day_num('2010/00/00'), None)
+        self.assertEqual(interp_util.safe_interpret_day_num('invalid'), None)
+        self.assertEqual(interp_util.safe_interpret_day_num(None), None)
+
+    def test_monthdelta_days(self):
+        self.assertAlmostEqual(interp_util.monthdelta_days(10, 71), 2.0053, 4)
+        self.assertEqual(interp_util.monthdelta_days(71, 10), 0)
+
     def test_monthdelta(self):
         d1 = datetime.date(2010, 3, 20)
         d2 = datetime.date(2012, 3, 10)
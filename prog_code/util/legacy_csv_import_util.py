@@ -19,7 +19,6 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 @license: GNU GPL v3
 """
 import typing
-import sqlite3
 
 STATE_PARSE_CHILD_DB_ID = 0
 STATE_PARSE_CHILD_STUDY_ID = 1
@@ -49,10 +48,23 @@ DATE_MALFORMED_ERR = 'Found a date (%s) but was expecting form MM/DD/YYYY on '\
     'row %d.'
 INVALID_PERCENT_ERR = 'Invalid percent (%s) found on row %d.'
 INVALID_WORD_VAL_ERROR = 'Invalid word value (%s) found on row %d.'
+UNKNOWN_CDI_TYPE_ERR = 'Unknown CDI type.'
+MISSING_PERCENTILES_ERR = 'Missing percentile tables.'
+
+DEFAULT_MAX_VALIDATION_ERRORS = 100
+
+# Number of participants parsed and saved per transaction when importing.
+IMPORT_CHUNK_SIZE = 250
+
+PARTIAL_IMPORT_ERR = '%s Stopped after importing %d snapshots.'
 
 import csv
 import datetime
 import io
+import os
+import shutil
+import tempfile
+import time
 
 from ..struct import models
 
@@ -62,6 +74,12 @@ import prog_code.util.math_util as math_util
 
 PercentileTableMapping = typing.Dict[int, models.PercentileTable]
 AutomatonStepHandler = typing.Callable[[typing.List[str], int], None]
+SnapshotRecord = typing.Tuple[models.SnapshotMetadata, typing.Dict[str, int]]
+
+
+class CSVParseError(Exception):
+    """Error raised when a streamed CSV import finds an invalid value."""
+    pass
 
 
 class UploadParserAutomaton:
@@ -69,12 +87,17 @@ class UploadParserAutomaton:
 
     def __init__(self,
             percentile_table: PercentileTableMapping,
-            state: int = STATE_PARSE_CHILD_DB_ID):
+            state: int = STATE_PARSE_CHILD_DB_ID,
+            max_errors: int = 1):
         """Create a new upload parser automaton.
 
         @keyword percentile_table: The raw percentile tables to use
             while calculating children percentiles.
         @type percentile_table: 2D float array
+        @keyword max_errors: The number of errors after which the automaton
+            stops parsing. Before reaching this limit, the automaton records
+            each error and continues with the next value. Defaults to stopping
+            at the first error.
         """
         self.__percentile_table: PercentileTableMapping
         self.__needing_percentiles: typing.List[int]
@@ -85,6 +108,10 @@ class UploadParserAutomaton:
         self.__state: int
         self.__error: typing.Optional[str]
         self.__prototypes: typing.List[dict]
+        self.__max_errors: int
+        self.__errors: typing.List[models.ImportValidationError]
+        self.__row_num: typing.Optional[int]
+        self.__col_num: typing.Optional[int]
 
         self.__percentile_table = percentile_table
         self.__needing_percentiles = []
@@ -109,14 +136,59 @@ class UploadParserAutomaton:
         self.__state = state
         self.__error = None
         self.__prototypes = []
+        self.__max_errors = max_errors
+        self.__errors = []
+        self.__row_num = None
+        self.__col_num = None
 
     def enter_error_state(self, message: str) -> None:
         """Indicate that we've encountered an error.
 
+        Records the error along with the row and column being processed. Stops
+        parsing once max_errors errors have been found.
+
         @param message: Message describing the error.
         """
-        self.__state = STATE_FOUND_ERROR
-        self.__error = message
+        self.__errors.append(models.ImportValidationError(
+            self.__row_num,
+            self.__col_num,
+            message
+        ))
+
+        if self.__error == None:
+            self.__error = message
+
+        if len(self.__errors) >= self.__max_errors:
+            self.__state = STATE_FOUND_ERROR
+
+    def is_halted(self) -> bool:
+        """Determine if the automaton has stopped parsing due to errors.
+
+        @returns: True if in the error state and false otherwise.
+        """
+        return self.__state == STATE_FOUND_ERROR
+
+    def iter_values(self, step_val: typing.List[str]) -> typing.Iterator[str]:
+        """Iterate over the participant values in a row.
+
+        @param step_val: The current row.
+        @returns: Iterator over the cells after the row label, recording the
+            column of each cell for error reporting.
+        """
+        # Participant values start in the third column.
+        for (index, val) in enumerate(step_val[2:]):
+            self.__col_num = index + 3
+            yield val
+
+    def iter_prototype_values(self,
+            step_val: typing.List[str]) -> typing.Iterator[typing.Tuple[str, dict]]:
+        """Iterate over the participant values in a row with their prototypes.
+
+        @param step_val: The current row.
+        @returns: Iterator over pairs of cell value and the prototype for the
+            participant described by the cell's column.
+        """
+        return zip(self.iter_values(step_val), self.__prototypes)
 
     def sanity_check(self, step_val: typing.List[str], expected: str,
             row_num: int) -> bool:
@@ -131,6 +203,7 @@ class UploadParserAutomaton:
         if step_val[1] == expected:
             return True
         else:
+            self.__col_num = 2
             msg = FAILED_SANITY_CHECK_ERR % (expected, row_num, step_val[1])
             self.enter_error_state(msg)
             return False
@@ -201,7 +274,20 @@ class UploadParserAutomaton:
         """
         for i in range(0, len(step_val)):
             step_val[i] = step_val[i].strip()
-        self.__state_matrix[self.__state](step_val, row_num)
+
+        self.__row_num = row_num
+        self.__col_num = None
+
+        state = self.__state
+        num_errors = len(self.__errors)
+        self.__state_matrix[state](step_val, row_num)
+
+        # When collecting errors, a row rejected outright (like one with the
+        # wrong label) is skipped so that later rows are still checked.
+        row_rejected = len(self.__errors) > num_errors
+        row_rejected = row_rejected and self.__state == state
+        if row_rejected and state not in [STATE_PARSE_WORDS, STATE_FOUND_ERROR]:
+            self.__state += 1
 
     def parse_child_db_id(self, step_val: typing.List[str],
             row_num: int) -> None:
@@ -219,9 +305,9 @@ class UploadParserAutomaton:
         if not passed_sanity_check:
             return
 
-        for val in step_val[2:]:
+        for val in self.iter_values(step_val):
             converted_val = self.safe_parse_int(val, row_num)
-            if converted_val == None: return
+            if converted_val == None and self.is_halted(): return
             else: self.__prototypes.append({ 'child_id': converted_val })
 
         self.__state += 1
@@ -236,7 +322,7 @@ class UploadParserAutomaton:
         if not self.sanity_check(step_val, 'Name / Number', row_num):
             return
 
-        for (val, prototype) in zip(step_val[2:], self.__prototypes):
+        for (val, prototype) in self.iter_prototype_values(step_val):
             prototype['study_id'] = val
 
         self.__state += 1
@@ -251,7 +337,7 @@ class UploadParserAutomaton:
         if not self.sanity_check(step_val, 'Study / Source', row_num):
             return
 
-        for (val, prototype) in zip(step_val[2:], self.__prototypes):
+        for (val, prototype) in self.iter_prototype_values(step_val):
             prototype['study'] = val
 
         self.__state += 1
@@ -265,7 +351,7 @@ class UploadParserAutomaton:
         if not self.sanity_check(step_val, 'Gender', row_num):
             return
 
-        for (val, prototype) in zip(step_val[2:], self.__prototypes):
+        for (val, prototype) in self.iter_prototype_values(step_val):
             converted_val = None
 
             if val == 'M': converted_val = constants.MALE
@@ -273,7 +359,7 @@ class UploadParserAutomaton:
             elif val == 'O': converted_val = constants.OTHER_GENDER
             else:
                 self.enter_error_state(GENDER_INVALID_ERR % (val, row_num))
-                return
+                if self.is_halted(): return
 
             prototype['gender'] = converted_val
 
@@ -288,9 +374,9 @@ class UploadParserAutomaton:
         if not self.sanity_check(step_val, 'Age (months)', row_num):
             return
 
-        for (val, prototype) in zip(step_val[2:], self.__prototypes):
+        for (val, prototype) in self.iter_prototype_values(step_val):
             converted_val = self.safe_parse_float(val, row_num)
-            if converted_val == None: return
+            if converted_val == None and self.is_halted(): return
             else: prototype['age'] = converted_val
 
         self.__state += 1
@@ -305,9 +391,9 @@ class UploadParserAutomaton:
         if not self.sanity_check(step_val, 'Date of Birth', row_num):
             return
 
-        for (val, prototype) in zip(step_val[2:], self.__prototypes):
+        for (val, prototype) in self.iter_prototype_values(step_val):
             converted_val = self.safe_parse_date(val, row_num)
-            if converted_val == None: return
+            if converted_val == None and self.is_halted(): return
             else: prototype['birthday'] = converted_val
 
         self.__state += 1
@@ -322,9 +408,9 @@ class UploadParserAutomaton:
         if not self.sanity_check(step_val, 'Date of Session', row_num):
             return
 
-        for (val, prototype) in zip(step_val[2:], self.__prototypes):
+        for (val, prototype) in self.iter_prototype_values(step_val):
             converted_val = self.safe_parse_date(val, row_num)
-            if converted_val == None: return
+            if converted_val == None and self.is_halted(): return
             else: prototype['session_date'] = converted_val
 
         self.__state += 1
@@ -342,9 +428,9 @@ class UploadParserAutomaton:
         if not self.sanity_check(step_val, 'Session #', row_num):
             return
 
-        for (val, prototype) in zip(step_val[2:], self.__prototypes):
+        for (val, prototype) in self.iter_prototype_values(step_val):
             converted_val = self.safe_parse_int(val, row_num)
-            if converted_val == None: return
+            if converted_val == None and self.is_halted(): return
             else: prototype['session_num'] = converted_val
 
         self.__state += 1
@@ -359,9 +445,9 @@ class UploadParserAutomaton:
         if not self.sanity_check(step_val, 'Total # of Sessions', row_num):
             return
 
-        for (val, prototype) in zip(step_val[2:], self.__prototypes):
+        for (val, prototype) in self.iter_prototype_values(step_val):
             converted_val = self.safe_parse_int(val, row_num)
-            if converted_val == None: return
+            if converted_val == None and self.is_halted(): return
             else: prototype['total_num_sessions'] = converted_val
 
         self.__state += 1
@@ -376,9 +462,9 @@ class UploadParserAutomaton:
         if not self.sanity_check(step_val, 'Words Spoken', row_num):
             return
 
-        for (val, prototype) in zip(step_val[2:], self.__prototypes):
+        for (val, prototype) in self.iter_prototype_values(step_val):
             converted_val = self.safe_parse_int(val, row_num)
-            if converted_val == None: return
+            if converted_val == None and self.is_halted(): return
             else: prototype['words_spoken'] = converted_val
 
         self.__state += 1
@@ -393,9 +479,9 @@ class UploadParserAutomaton:
         if not self.sanity_check(step_val, 'Items Excluded', row_num):
             return
 
-        for (val, prototype) in zip(step_val[2:], self.__prototypes):
+        for (val, prototype) in self.iter_prototype_values(step_val):
             converted_val = self.safe_parse_int(val, row_num)
-            if converted_val == None: return
+            if converted_val == None and self.is_halted(): return
             else: prototype['items_excluded'] = converted_val
 
         self.__state += 1
@@ -411,22 +497,19 @@ class UploadParserAutomaton:
             return
 
         index = 0
-        for (val, prototype) in zip(step_val[2:], self.__prototypes):
+        for (val, prototype) in self.iter_prototype_values(step_val):
             if val == 'calculate':
                 self.__needing_percentiles.append(index)
                 prototype['percentile'] = -1
             else:
                 converted_val = self.safe_parse_float(val, row_num)
                 if converted_val == None:
-                    self.enter_error_state(
-                        INVALID_PERCENT_ERR % (converted_val, row_num),
-                    )
-                    return
+                    if self.is_halted(): return
                 elif converted_val < 0 or converted_val > 100: # type: ignore
                     self.enter_error_state(
                         INVALID_PERCENT_ERR % (converted_val, row_num),
                     )
-                    return
+                    if self.is_halted(): return
                 else:
                     prototype['percentile'] = converted_val
             index += 1
@@ -443,14 +526,14 @@ class UploadParserAutomaton:
         if not self.sanity_check(step_val, 'Extra Categories?', row_num):
             return
 
-        for (val, prototype) in zip(step_val[2:], self.__prototypes):
+        for (val, prototype) in self.iter_prototype_values(step_val):
             converted_val = None
 
             if val == 'N': converted_val = constants.EXPLICIT_FALSE
             elif val == 'Y': converted_val = constants.EXPLICIT_TRUE
             else:
                 self.enter_error_state(EXTRA_CAT_INVALID_ERR % (val, row_num))
-                return
+                if self.is_halted(): return
 
             prototype['extra_categories'] = converted_val
 
@@ -463,12 +546,12 @@ class UploadParserAutomaton:
         @param step_val: The current row.
         @param row_num: The row index being processed.
         """
-        if not self.sanity_check(step_val, 'Word', row_num): return
-        else: self.__state += 1
-
         for prototype in self.__prototypes:
             prototype['words'] = []
 
+        if not self.sanity_check(step_val, 'Word', row_num): return
+        else: self.__state += 1
+
     def parse_words(self, step_val: typing.List[str], row_num: int) -> None:
         """Parse individual word reports.
 
@@ -477,8 +560,7 @@ class UploadParserAutomaton:
         """
         word = step_val[1]
 
-        for (val, prototype) in zip(step_val[2:], self.__prototypes):
-
+        for (val, prototype) in self.iter_prototype_values(step_val):
             converted_val = None
             if val == 'na':
                 converted_val = constants.NO_DATA
@@ -496,7 +578,7 @@ class UploadParserAutomaton:
                 self.enter_error_state(
                     INVALID_WORD_VAL_ERROR % (step_val, row_num)
                 )
-                return
+                if self.is_halted(): return
             else:
                 prototype['words'].append({
                     'word': word,
@@ -572,6 +654,13 @@ class UploadParserAutomaton:
         """
         return self.__error
 
+    def get_errors(self) -> typing.List[models.ImportValidationError]:
+        """Get all of the errors encountered by this automaton.
+
+        @returns: Errors in the order found.
+        """
+        return self.__errors
+
     def get_prototypes(self) -> typing.List[dict]:
         """Get the rows as dictionaries with keys describing each value.
 
@@ -597,7 +686,8 @@ class UploadParserAutomaton:
 
 def parse_csv_prototypes(contents: typing.Union[str, typing.IO[str]],
         percentile_table: PercentileTableMapping,
-        act_as_file: bool = False) -> typing.Dict:
+        act_as_file: bool = False,
+        max_errors: int = 1) -> typing.Dict:
     """Parse a CSV into a dictionary of primitives.
 
     @param contents: The content of the CSV to be parsed.
@@ -605,8 +695,9 @@ def parse_csv_prototypes(contents: typing.Union[str, typing.IO[str]],
     @param act_as_file: Flag indicating if contents should be treated as a
         string or file-like. If true, treats it as a file-like. If false,
         treats it as a string.
-    @returns: Dictionary describing the error found and the primitive prototypes
-        parsed.
+    @param max_errors: The number of errors after which to stop parsing.
+    @returns: Dictionary describing the first error found, all errors found, the
+        number of cells read, and the primitive prototypes parsed.
     """
 
     target_buffer: typing.IO[str]
@@ -616,36 +707,171 @@ def parse_csv_prototypes(contents: typing.Union[str, typing.IO[str]],
     else:
         target_buffer = io.StringIO(contents) # type: ignore
 
-    reader = csv.reader(target_buffer)
+    return parse_rows_prototypes(
+        csv.reader(target_buffer),
+        percentile_table,
+        max_errors
+    )
+
+
+def parse_rows_prototypes(rows: typing.Iterable[typing.List[str]],
+        percentile_table: PercentileTableMapping,
+        max_errors: int = 1) -> typing.Dict:
+    """Parse CSV rows into a dictionary of primitives.
 
-    automaton = UploadParserAutomaton(percentile_table)
+    @param rows: The rows of the CSV to be parsed.
+    @param percentile_table: Table to use to calculate missing percentiles.
+    @param max_errors: The number of errors after which to stop parsing.
+    @returns: Dictionary like that returned by parse_csv_prototypes.
+    """
+    automaton = UploadParserAutomaton(
+        percentile_table,
+        max_errors=max_errors
+    )
     row_num = 1
-    for row in reader:
+    num_cells = 0
+    for row in rows:
+        num_cells += len(row)
         automaton.step(row, row_num)
         row_num += 1
 
-    if automaton.get_state() != STATE_FOUND_ERROR:
+    if len(automaton.get_errors()) == 0:
         automaton.finish()
 
     return {
         'error': automaton.get_error(),
+        'errors': automaton.get_errors(),
+        'num_cells': num_cells,
         'prototypes': automaton.get_prototypes()
     }
 
 
-def build_snapshot(prototype: typing.Dict,
+def load_percentile_tables(cdi_type: str) -> typing.Dict:
+    """Load the percentile tables needed to parse a CSV for a type of CDI.
+
+    @param cdi_type: The type of CDI being imported.
+    @returns: Dictionary describing any error encountered and the percentile
+        tables by gender constant.
+    """
+    cdi_model: models.CDIFormat
+    cdi_model_maybe = db_util.load_cdi_model(cdi_type)
+
+    if cdi_model_maybe == None:
+        return {'error': UNKNOWN_CDI_TYPE_ERR, 'tables': None}
+
+    cdi_model = cdi_model_maybe #type: ignore
+
+    percentile_names = cdi_model.details['percentiles']
+
+    male_percentiles_name = percentile_names['male']
+    female_percentiles_name = percentile_names['female']
+    other_percentiles_name = percentile_names['other']
+
+    male_percentiles_maybe = db_util.load_percentile_model(
+        male_percentiles_name
+    )
+    female_percentiles_maybe = db_util.load_percentile_model(
+        female_percentiles_name
+    )
+    other_percentiles_maybe = db_util.load_percentile_model(
+        other_percentiles_name
+    )
+
+    all_percentiles = [
+        male_percentiles_maybe,
+        female_percentiles_maybe,
+        other_percentiles_maybe
+    ]
+
+    if None in all_percentiles:
+        return {'error': MISSING_PERCENTILES_ERR, 'tables': None}
+
+    male_percentiles: models.PercentileTable
+    female_percentiles: models.PercentileTable
+    other_percentiles: models.PercentileTable
+
+    male_percentiles = male_percentiles_maybe # type: ignore
+    female_percentiles = female_percentiles_maybe # type: ignore
+    other_percentiles = other_percentiles_maybe # type: ignore
+
+    return {
+        'error': None,
+        'tables': {
+            constants.MALE: male_percentiles,
+            constants.FEMALE: female_percentiles,
+            constants.OTHER_GENDER: other_percentiles
+        }
+    }
+
+
+def validate_csv(contents: typing.Union[str, typing.IO[str]],
+        cdi_type: str,
+        act_as_file: bool = False,
+        max_errors: int = DEFAULT_MAX_VALIDATION_ERRORS) -> models.ImportValidationReport:
+    """Parse a CSV without saving it, collecting every error found.
+
+    @param contents: The content of the CSV to be checked.
+    @param cdi_type: The type of CDI being imported.
+    @param act_as_file: Flag indicating if contents should be treated as a
+        string or file-like. If true, treats it as a file-like. If false,
+        treats it as a string.
+    @param max_errors: The number of errors after which to stop checking.
+    @returns: Report of the errors found and the parsing throughput.
+    """
+    start = time.time()
+
+    percentile_info = load_percentile_tables(cdi_type)
+    if percentile_info['error']:
+        error = models.ImportValidationError(None, None, percentile_info['error'])
+        return models.ImportValidationReport(
+            0,
+            0,
+            time.time() - start,
+            [error],
+            False
+        )
+
+    parse_info = parse_csv_prototypes(
+        contents,
+        percentile_info['tables'],
+        act_as_file,
+        max_errors
+    )
+
+    # Each participant is a column so a record is valid if no error was found
+    # in its column. Errors on a row label invalidate every record.
+    errors = parse_info['errors']
+    bad_columns = set(map(lambda x: x.column, errors))
+    if None in bad_columns or 2 in bad_columns:
+        num_records = 0
+    else:
+        num_records = len(list(filter(
+            lambda x: x + 3 not in bad_columns,
+            range(0, len(parse_info['prototypes']))
+        )))
+
+    return models.ImportValidationReport(
+        num_records,
+        parse_info['num_cells'],
+        time.time() - start,
+        errors,
+        len(errors) >= max_errors
+    )
+
+
+def create_snapshot_record(prototype: typing.Dict,
         cdi_type: str,
         languages: typing.List[str],
-        hard_of_hearing: int,
-        cursor: sqlite3.Cursor):
-    """Save a snapshot and return its metadata.
+        hard_of_hearing: int) -> SnapshotRecord:
+    """Convert a parsed prototype into a snapshot that may be saved.
 
     @param prototype: The primtive prototype parsed.
     @param cdi_type: The type of CDI being saved.
+    @param languages: The languages spoken by the participant.
     @param hard_of_hearing: Constant indicating if the participant is hard of
         hearing.
-    @param cursor: Cursor to use to save the record.
-    @returns: Metadata of newly saved snapshot.
+    @returns: Unsaved snapshot metadata and mapping from word to value like
+        those expected by db_util.insert_snapshot.
     """
     metadata = models.SnapshotMetadata(
         -1,
@@ -674,94 +900,193 @@ def build_snapshot(prototype: typing.Dict,
     for word_prototype in prototype['words']:
         words[word_prototype['word']] = word_prototype['val']
 
-    db_util.insert_snapshot(metadata, words, cursor)
-    return metadata
+    return (metadata, words)
 
 
-def parse_csv(contents: typing.Union[str, typing.IO[str]],
+def parse_csv_records(contents: typing.Union[str, typing.IO[str]],
         cdi_type: str,
         languages: typing.List[str],
         hard_of_hearing: int,
         act_as_file: bool = False) -> typing.Dict:
-    """Create and save snapshots from a CSV.
+    """Parse a CSV into snapshots without saving them.
 
     @param contents: The content of the CSV to be parsed.
-    @param cdi_type: The type of CDI being saved.
-    @param hard_of_hearing: Constant indicating if the participant is hard of
+    @param cdi_type: The type of CDI being parsed.
+    @param languages: The languages spoken by the participants.
+    @param hard_of_hearing: Constant indicating if the participants are hard of
         hearing.
     @param act_as_file: Flag indicating if contents should be treated as a
         string or file-like. If true, treats it as a file-like. If false,
         treats it as a string.
-    @returns: Dictionary describing any error encountered and the ids of the
-        children for which records were created.
+    @returns: Dictionary describing any error encountered and the (metadata,
+        words) pairs parsed which may be given to db_util.insert_snapshots.
     """
-    cdi_model: models.CDIFormat
-    cdi_model_maybe = db_util.load_cdi_model(cdi_type)
+    percentile_info = load_percentile_tables(cdi_type)
+    if percentile_info['error']:
+        return {'error': percentile_info['error'], 'records': []}
+
+    parse_info = parse_csv_prototypes(
+        contents,
+        percentile_info['tables'],
+        act_as_file
+    )
 
-    if cdi_model_maybe == None:
-        return {'error': 'Unknown CDI type.', 'ids': []}
+    if parse_info['error']:
+        return {'error': parse_info['error'], 'records': []}
 
-    cdi_model = cdi_model_maybe #type: ignore
+    records = [
+        create_snapshot_record(x, cdi_type, languages, hard_of_hearing)
+        for x in parse_info['prototypes']
+    ]
+    return {'error': None, 'records': records}
 
-    percentile_names = cdi_model.details['percentiles']
 
-    male_percentiles_name = percentile_names['male']
-    female_percentiles_name = percentile_names['female']
-    other_percentiles_name = percentile_names['other']
+def iter_row_blocks(path: str,
+        block_size: int) -> typing.Iterator[typing.Iterator[typing.List[str]]]:
+    """Iterate over a CSV file in blocks of participants.
 
-    male_percentiles_maybe = db_util.load_percentile_model(
-        male_percentiles_name
-    )
-    female_percentiles_maybe = db_util.load_percentile_model(
-        female_percentiles_name
-    )
-    other_percentiles_maybe = db_util.load_percentile_model(
-        other_percentiles_name
-    )
+    Participants are columns in the legacy format so a participant is only
+    complete after the last row has been read. To avoid holding every
+    participant in memory, the file is read once per block of block_size
+    participant columns, keeping only the row labels and that block's cells.
 
-    all_percentiles = [
-        male_percentiles_maybe,
-        female_percentiles_maybe,
-        other_percentiles_maybe
-    ]
+    @param path: Path to the CSV file.
+    @param block_size: The number of participant columns per block.
+    @returns: Iterator over blocks where each block is an iterator over rows
+        containing the two label columns followed by the block's cells.
+    """
+    def read_rows():
+        with open(path, newline='', encoding='utf-8') as f:
+            yield from csv.reader(f)
 
-    if None in all_percentiles:
-        return {'error': 'Missing percentile tables.', 'ids': []}
+    num_columns = max(map(len, read_rows()), default=0)
 
-    male_percentiles: models.PercentileTable
-    female_percentiles: models.PercentileTable
-    other_percentiles: models.PercentileTable
+    # Check the row labels even if there are no participants.
+    for block_start in range(2, max(num_columns, 3), block_size):
+        block_end = block_start + block_size
+        yield (row[:2] + row[block_start:block_end] for row in read_rows())
 
-    male_percentiles = male_percentiles_maybe # type: ignore
-    female_percentiles = female_percentiles_maybe # type: ignore
-    other_percentiles = other_percentiles_maybe # type: ignore
 
-    percentile_tables = {
-        constants.MALE: male_percentiles,
-        constants.FEMALE: female_percentiles,
-        constants.OTHER_GENDER: other_percentiles
-    }
+def iter_csv_records(path: str,
+        cdi_type: str,
+        languages: typing.List[str],
+        hard_of_hearing: int,
+        percentile_tables: PercentileTableMapping,
+        block_size: typing.Optional[int] = None) -> typing.Iterator[typing.List[SnapshotRecord]]:
+    """Lazily parse a legacy CSV file from disk in blocks of participants.
+
+    @param path: Path to the CSV file.
+    @param cdi_type: The type of CDI being parsed.
+    @param languages: The languages spoken by the participants.
+    @param hard_of_hearing: Constant indicating if the participants are hard of
+        hearing.
+    @param percentile_tables: Tables to use to calculate missing percentiles.
+    @param block_size: The number of participants to parse at a time or None to
+        use IMPORT_CHUNK_SIZE.
+    @returns: Iterator over lists of unsaved (metadata, words) records, one
+        list per block of participants.
+    @raises CSVParseError: Raised on the first invalid value found.
+    """
+    if block_size == None:
+        block_size = IMPORT_CHUNK_SIZE
 
-    with db_util.get_cursor() as cursor:
-        parse_info = parse_csv_prototypes(
-            contents,
-            percentile_tables,
-            act_as_file
-        )
+    for rows in iter_row_blocks(path, block_size): # type: ignore
+        parse_info = parse_rows_prototypes(rows, percentile_tables)
 
         if parse_info['error']:
-            return {'error': parse_info['error']}
-
-        prototypes = parse_info['prototypes']
-        ids = map(lambda x: x['child_id'], prototypes)
-
-        for prototype in prototypes:
-            build_snapshot(
-                prototype,
-                cdi_type,
-                languages,
-                hard_of_hearing,
-                cursor
+            raise CSVParseError(parse_info['error'])
+
+        yield [
+            create_snapshot_record(x, cdi_type, languages, hard_of_hearing)
+            for x in parse_info['prototypes']
+        ]
+
+
+def parse_csv_file(path: str,
+        cdi_type: str,
+        languages: typing.List[str],
+        hard_of_hearing: int,
+        chunk_size: typing.Optional[int] = None) -> typing.Dict:
+    """Create and save snapshots from a CSV file on disk.
+
+    Participants are parsed in chunks of chunk_size without holding a database
+    cursor and each chunk is then saved in its own transaction. If an error is
+    found, chunks saved before the error are kept.
+
+    @param path: Path to the CSV file.
+    @param cdi_type: The type of CDI being saved.
+    @param languages: The languages spoken by the participants.
+    @param hard_of_hearing: Constant indicating if the participants are hard of
+        hearing.
+    @param chunk_size: The number of participants to parse and save at a time
+        or None to use IMPORT_CHUNK_SIZE.
+    @returns: Dictionary describing any error encountered, the database ids
+        of the snapshots created, and the database ids of new snapshots which
+        duplicate existing snapshots.
+    """
+    percentile_info = load_percentile_tables(cdi_type)
+    if percentile_info['error']:
+        return {'error': percentile_info['error'], 'ids': [], 'duplicates': []}
+
+    if chunk_size == None:
+        chunk_size = IMPORT_CHUNK_SIZE
+
+    chunks = iter_csv_records(
+        path,
+        cdi_type,
+        languages,
+        hard_of_hearing,
+        percentile_info['tables'],
+        chunk_size
+    )
+
+    ids: typing.List[int] = []
+    duplicates: typing.List[int] = []
+
+    try:
+        for records in chunks:
+            summary = db_util.insert_snapshots(
+                records,
+                chunk_size=chunk_size # type: ignore
             )
+            ids.extend(summary.database_ids)
+            duplicates.extend(summary.duplicate_ids)
+    except (CSVParseError, db_util.DuplicateSnapshotError) as e:
+        if len(ids) == 0:
+            message = str(e)
+        else:
+            message = PARTIAL_IMPORT_ERR % (str(e), len(ids))
+        return {'error': message, 'ids': ids, 'duplicates': duplicates}
 
-    return {'error': None, 'ids': ids}
+    return {'error': None, 'ids': ids, 'duplicates': duplicates}
+
+
+def parse_csv(contents: typing.Union[str, typing.IO[str]],
+        cdi_type: str,
+        languages: typing.List[str],
+        hard_of_hearing: int,
+        act_as_file: bool = False) -> typing.Dict:
+    """Create and save snapshots from a CSV.
+
+    @param contents: The content of the CSV to be parsed.
+    @param cdi_type: The type of CDI being saved.
+    @param hard_of_hearing: Constant indicating if the participant is hard of
+        hearing.
+    @param act_as_file: Flag indicating if contents should be treated as a
+        string or file-like. If true, treats it as a file-like. If false,
+        treats it as a string.
+    @returns: Dictionary describing any error encountered and the database
+        ids of the snapshots created.
+    """
+    if not act_as_file:
+        contents = io.StringIO(contents) # type: ignore
+
+    with tempfile.NamedTemporaryFile('w', suffix='.csv', newline='',
+            encoding='utf-8', delete=False) as f:
+        shutil.copyfileobj(contents, f) # type: ignore
+        path = f.name
+
+    try:
+        return parse_csv_file(path, cdi_type, languages, hard_of_hearing)
+    finally:
+        os.remove(path)
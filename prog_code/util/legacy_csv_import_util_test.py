@@ -15,13 +15,43 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
+import os
+import tempfile
 import unittest
+import unittest.mock
 
 import prog_code.util.constants as constants
+import prog_code.util.db_util as db_util
 import prog_code.util.legacy_csv_import_util as legacy_csv_import_util
 import prog_code.util.math_util as math_util
 
 
+TEST_LEGACY_CSV = ''',Child's ID (from database),1,2
+,Name / Number,a,b
+,Study / Source,study,study
+,Gender,M,F
+,Age (months),20,21
+,Date of Birth,1/2/2013,%s
+,Date of Session,9/2/2014,9/3/2014
+,Session #,1,1
+,Total # of Sessions,1,1
+,Words Spoken,1,0
+,Items Excluded,0,0
+,Percentile,50,10
+,Extra Categories?,N,N
+,Word,,
+1,ball,y,n
+'''
+
+
+def write_csv(contents):
+    """Write contents to a temporary CSV file, returning its path."""
+    with tempfile.NamedTemporaryFile('w', suffix='.csv', newline='',
+            delete=False) as f:
+        f.write(contents)
+        return f.name
+
+
 class FakePercentileTable:
 
     def __init__(self, details):
@@ -731,6 +761,210 @@ class LegacyUploadParserAutomatonTests(unittest.TestCase):
         self.__test_automaton.set_state(legacy_csv_import_util.STATE_FOUND_ERROR)
         self.__test_automaton.finish()
 
+    def test_step_collect_errors(self):
+        automaton = legacy_csv_import_util.UploadParserAutomaton(
+            {},
+            max_errors=10
+        )
+
+        automaton.step(['', 'Child\'s ID (from database)', '1', 'a', '3'], 1)
+        automaton.step(['', 'Name / Numbr', 'a', 'b', 'c'], 2)
+        automaton.step(['', 'Study / Source', 's', 's', 's'], 3)
+        automaton.step(['', 'Gender', 'X', 'F', 'Y'], 4)
+
+        self.assertEqual(
+            automaton.get_state(),
+            legacy_csv_import_util.STATE_PARSE_AGE
+        )
+        self.assertEqual(len(automaton.get_prototypes()), 3)
+        self.assertEqual(
+            [(x.row, x.column) for x in automaton.get_errors()],
+            [(1, 4), (2, 2), (4, 3), (4, 5)]
+        )
+        self.assertEqual(
+            automaton.get_error(),
+            'Was expecting an integer but found "a" on row 1.'
+        )
+
+    def test_step_collect_errors_limit(self):
+        automaton = legacy_csv_import_util.UploadParserAutomaton(
+            {},
+            max_errors=2
+        )
+
+        automaton.step(['', 'Child\'s ID (from database)', 'a', 'b', 'c'], 1)
+
+        self.assertEqual(
+            automaton.get_state(),
+            legacy_csv_import_util.STATE_FOUND_ERROR
+        )
+        self.assertEqual(len(automaton.get_errors()), 2)
+
+
+class LegacyParseCSVTests(unittest.TestCase):
+
+    def __run_with_model_mocks(self, callback):
+        with unittest.mock.patch('prog_code.util.db_util.load_cdi_model') as mock_cdi:
+            with unittest.mock.patch('prog_code.util.db_util.load_percentile_model') as mock_percentile:
+                mock_cdi.return_value = unittest.mock.Mock(details={
+                    'percentiles': {
+                        'male': 'test_percentiles',
+                        'female': 'test_percentiles',
+                        'other': 'test_percentiles'
+                    }
+                })
+                mock_percentile.return_value = FakePercentileTable([])
+                callback()
+
+    def test_validate_csv(self):
+        def callback():
+            report = legacy_csv_import_util.validate_csv(
+                TEST_LEGACY_CSV % '1/3/2013',
+                'test_cdi_type'
+            )
+            self.assertEqual(report.num_records, 2)
+            self.assertEqual(report.num_cells, 15 * 4)
+            self.assertEqual(len(report.errors), 0)
+            self.assertFalse(report.truncated)
+
+        self.__run_with_model_mocks(callback)
+
+    def test_validate_csv_invalid(self):
+        def callback():
+            report = legacy_csv_import_util.validate_csv(
+                TEST_LEGACY_CSV % 'yesterday',
+                'test_cdi_type'
+            )
+            self.assertEqual(report.num_records, 1)
+            self.assertEqual(len(report.errors), 1)
+            self.assertEqual(report.errors[0].row, 6)
+            self.assertEqual(report.errors[0].column, 4)
+
+        self.__run_with_model_mocks(callback)
+
+    def test_parse_csv_records(self):
+        def callback():
+            results = legacy_csv_import_util.parse_csv_records(
+                TEST_LEGACY_CSV % '1/3/2013',
+                'test_cdi_type',
+                ['english'],
+                constants.EXPLICIT_FALSE
+            )
+            self.assertEqual(results['error'], None)
+            self.assertEqual(len(results['records']), 2)
+
+            (metadata, words) = results['records'][1]
+            self.assertEqual(metadata.child_id, 2)
+            self.assertEqual(metadata.birthday, '2013/1/3')
+            self.assertEqual(metadata.cdi_type, 'test_cdi_type')
+            self.assertEqual(words, {'ball': constants.EXPLICIT_FALSE})
+
+        self.__run_with_model_mocks(callback)
+
+    def test_iter_row_blocks(self):
+        path = write_csv('a,b,1,2,3\nc,d,4,5\n')
+
+        try:
+            blocks = [
+                list(x) for x in legacy_csv_import_util.iter_row_blocks(path, 2)
+            ]
+        finally:
+            os.remove(path)
+
+        self.assertEqual(blocks, [
+            [['a', 'b', '1', '2'], ['c', 'd', '4', '5']],
+            [['a', 'b', '3'], ['c', 'd']]
+        ])
+
+    def test_parse_csv_file(self):
+        path = write_csv(TEST_LEGACY_CSV % '1/3/2013')
+        inserted = []
+
+        def callback():
+            with unittest.mock.patch('prog_code.util.db_util.insert_snapshots') as mock_insert:
+                def insert_snapshots(records, chunk_size):
+                    inserted.append([x[0].child_id for x in records])
+                    return db_util.BulkInsertSummary(
+                        [len(inserted) + 10],
+                        1,
+                        0,
+                        0,
+                        []
+                    )
+
+                mock_insert.side_effect = insert_snapshots
+
+                results = legacy_csv_import_util.parse_csv_file(
+                    path,
+                    'test_cdi_type',
+                    ['english'],
+                    constants.EXPLICIT_FALSE,
+                    1
+                )
+
+            self.assertEqual(
+                results,
+                {'error': None, 'ids': [11, 12], 'duplicates': []}
+            )
+
+        try:
+            self.__run_with_model_mocks(callback)
+        finally:
+            os.remove(path)
+
+        self.assertEqual(inserted, [[1], [2]])
+
+    def test_parse_csv_file_partial(self):
+        path = write_csv(TEST_LEGACY_CSV % 'yesterday')
+
+        def callback():
+            with unittest.mock.patch('prog_code.util.db_util.insert_snapshots') as mock_insert:
+                mock_insert.return_value = db_util.BulkInsertSummary(
+                    [11],
+                    1,
+                    0,
+                    0,
+                    []
+                )
+
+                results = legacy_csv_import_util.parse_csv_file(
+                    path,
+                    'test_cdi_type',
+                    ['english'],
+                    constants.EXPLICIT_FALSE,
+                    1
+                )
+
+                self.assertEqual(mock_insert.call_count, 1)
+
+            self.assertEqual(results['ids'], [11])
+            self.assertEqual(
+                results['error'],
+                legacy_csv_import_util.PARTIAL_IMPORT_ERR % (
+                    'Was expecting a date but found "yesterday" on row 6.',
+                    1
+                )
+            )
+
+        try:
+            self.__run_with_model_mocks(callback)
+        finally:
+            os.remove(path)
+
+    def test_validate_csv_unknown_cdi(self):
+        with unittest.mock.patch('prog_code.util.db_util.load_cdi_model') as mock_cdi:
+            mock_cdi.return_value = None
+            report = legacy_csv_import_util.validate_csv(
+                TEST_LEGACY_CSV % '1/3/2013',
+                'test_cdi_type'
+            )
+
+        self.assertEqual(report.num_records, 0)
+        self.assertEqual(
+            report.errors[0].message,
+            legacy_csv_import_util.UNKNOWN_CDI_TYPE_ERR
+        )
+
 
 if __name__ == '__main__':
     unittest.main()
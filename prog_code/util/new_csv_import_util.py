@@ -22,15 +22,31 @@ import csv
 import collections
 import datetime
 import functools
+import io
+import os
+import pickle
+import shutil
+import tempfile
+import time
 import typing
 
 import prog_code.util.constants as constants
+import prog_code.util.db_util as db_util
 import prog_code.util.recalc_util as recalc_util
 
 from ..struct import models
 
 T = typing.TypeVar('T')
 
+# Number of participant columns held in memory at a time when streaming a file.
+DEFAULT_COLUMN_BLOCK_SIZE = 250
+
+# Number of distinct cell values remembered by each of the memoized parsers.
+PARSE_CACHE_SIZE = 4096
+
+# Number of errors after which checking an upload stops.
+DEFAULT_MAX_VALIDATION_ERRORS = 100
+
 STATE_PARSE_HEADER = 0
 STATE_PARSE_DATABASE_ID = 1
 STATE_PARSE_CHILD_ID = 2
@@ -132,6 +148,7 @@ ERROR_INVALID_NUM_LANGUAGES = "Incorrect number of languages provided on column
 ERROR_INVALID_PERCENTILE = "Incorrect percentile provided on column %d (given %.1f but found %.1f)."
 ERROR_INVALID_AGE = "Incorrect age on column %d (given %.1f but found %.1f)."
 ERROR_INVALID_NUM_WORDS = "Incorrect num words on column %d (given %d but found %d)."
+ERROR_UNSPECIFIED = "Unable to parse column %d."
 
 
 AutomatonResults = collections.namedtuple(
@@ -146,20 +163,99 @@ CSVResults = collections.namedtuple(
 )
 
 
+CDIPlan = collections.namedtuple(
+    "CDIPlan",
+    ["allowed_values", "count_as_spoken_values", "unexpected_words"]
+)
+
+
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_float_str(str_val: str) -> typing.Optional[float]:
+    """Parse a string as a float, remembering recent results.
+
+    @param str_val: The value to parse.
+    @returns: Parsed value or None if parsing failure.
+    """
+    str_val = str_val.strip()
+
+    if str_val == "0":
+        return 0
+
+    invalid_zero = str_val.startswith("0") and not str_val.startswith("0.")
+    if invalid_zero or str_val == "":
+        return None
+
+    try:
+        return float(str_val)
+    except ValueError:
+        return None
+
+
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_int_str(str_val: str) -> typing.Optional[int]:
+    """Parse a string as an int, remembering recent results.
+
+    @param str_val: The value to parse.
+    @returns: Parsed value or None if parsing failure.
+    """
+    str_val = str_val.strip()
+
+    if str_val == "0":
+        return 0
+
+    if str_val.startswith("0") or str_val == "":
+        return None
+
+    try:
+        return int(str_val)
+    except ValueError:
+        return None
+
+
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_date_str(str_val: str) -> typing.Optional[str]:
+    """Parse an ISO or US date into a standardized string, remembering results.
+
+    @param str_val: The value to parse.
+    @returns: Date as YYYY/MM/DD or None if parsing failure.
+    """
+    str_val = str_val.strip().replace("-", "/")
+
+    for date_format in ["%Y/%m/%d", "%m/%d/%Y"]:
+        try:
+            converted_date = datetime.datetime.strptime(str_val, date_format)
+        except ValueError:
+            continue
+
+        return converted_date.date().isoformat().replace("-", "/")
+
+    return None
+
+
+class CSVParseError(Exception):
+    """Error raised when a streamed CSV import finds an invalid value."""
+    pass
+
+
 class UploadParserAutomaton:
     """Automaton to parse the "new" CSV format."""
 
-    def __init__(self, cached_adapter: recalc_util.CachedCDIAdapter):
+    def __init__(self, cached_adapter: recalc_util.CachedCDIAdapter,
+            cursor_maybe: db_util.OptionalCursor = None):
         """Create a new automaton in the STATE_PARSE_HEADER state.
 
         @params cached_adapter: Caching entry point into information about
             percentiles and CDI models.
+        @param cursor_maybe: The cursor to use when looking up prior sessions or
+            None if a new cursor should be created for each lookup.
         """
         self.__cached_adapter = cached_adapter
+        self.__cursor_maybe = cursor_maybe
 
         self.__state = STATE_PARSE_HEADER
 
         self.__error: typing.Optional[str] = None
+        self.__error_row: typing.Optional[int] = None
 
         self.__columns_processed = 0
         self.__has_database_id = False
@@ -196,34 +292,40 @@ class UploadParserAutomaton:
         self.__allowed_word_values: typing.Set[str] = set()
         self.__count_as_spoken_values: typing.Set[str] = set()
         self.__word_values: typing.Dict[str, typing.Optional[int]] = {}
+        self.__num_spoken_found = 0
         self.__processed_records: typing.List['AutomatonResults'] = []
 
-        self.__step_handlers = {
-            STATE_PARSE_HEADER: lambda x: self.parse_header(x),
-            STATE_PARSE_DATABASE_ID: lambda x: self.parse_database_id(x),
-            STATE_PARSE_CHILD_ID: lambda x: self.parse_child_id(x),
-            STATE_PARSE_STUDY_ID: lambda x: self.parse_study_id(x),
-            STATE_PARSE_STUDY: lambda x: self.parse_study(x),
-            STATE_PARSE_GENDER: lambda x: self.parse_gender(x),
-            STATE_PARSE_AGE: lambda x: self.parse_age(x),
-            STATE_PARSE_BIRTHDAY: lambda x: self.parse_birthday(x),
-            STATE_PARSE_SESSION_DATE: lambda x: self.parse_session_date(x),
-            STATE_PARSE_SESSION_NUM: lambda x: self.parse_session_num(x),
-            STATE_PARSE_TOTAL_NUM_SESSIONS: lambda x: self.parse_total_num_sessions(x),
-            STATE_PARSE_WORDS_SPOKEN: lambda x: self.parse_spoken_words(x),
-            STATE_PARSE_ITEMS_EXCLUDED: lambda x: self.parse_excluded_items(x),
-            STATE_PARSE_PERCENTILE: lambda x: self.parse_percentile(x),
-            STATE_PARSE_EXTRA_CATEGORIES: lambda x: self.parse_extra_categories(x),
-            STATE_PARSE_REVISION: lambda x: self.parse_revision(x),
-            STATE_PARSE_LANGUAGES: lambda x: self.parse_languages(x),
-            STATE_PARSE_NUM_LANGUAGES: lambda x: self.parse_num_languages(x),
-            STATE_PARSE_CDI_TYPE: lambda x: self.parse_cdi_type(x),
-            STATE_PARSE_HARD_OF_HEARING: lambda x: self.parse_hard_of_hearing(x),
-            STATE_PARSE_DELETED: lambda x: self.parse_deleted(x),
-            STATE_PARSE_START_WORDS: lambda x: self.parse_word_start(x),
-            STATE_PARSE_WORDS: lambda x: self.parse_word(x),
-            STATE_FOUND_ERROR: lambda x: self.maintain_error_state(x)
-        }
+        # Plans for each CDI type seen, resolved the first time that type is
+        # encountered as they depend only on the header and CDI format.
+        self.__cdi_plans: typing.Dict[str, typing.Optional[CDIPlan]] = {}
+
+        # Handlers indexed by state.
+        self.__step_handlers: typing.List[typing.Callable[[str], None]] = [
+            self.parse_header, # type: ignore
+            self.parse_database_id,
+            self.parse_child_id,
+            self.parse_study_id,
+            self.parse_study,
+            self.parse_gender,
+            self.parse_age,
+            self.parse_birthday,
+            self.parse_session_date,
+            self.parse_session_num,
+            self.parse_total_num_sessions,
+            self.parse_spoken_words,
+            self.parse_excluded_items,
+            self.parse_percentile,
+            self.parse_extra_categories,
+            self.parse_revision,
+            self.parse_languages,
+            self.parse_num_languages,
+            self.parse_cdi_type,
+            self.parse_hard_of_hearing,
+            self.parse_deleted,
+            self.parse_word_start,
+            self.parse_word,
+            self.maintain_error_state
+        ]
 
     def get_processed_records(self) -> typing.List['AutomatonResults']:
         """Get all of the records found.
@@ -232,6 +334,15 @@ class UploadParserAutomaton:
         """
         return self.__processed_records
 
+    def pop_processed_records(self) -> typing.List['AutomatonResults']:
+        """Get the records found since the last pop and stop retaining them.
+
+        @returns: List of processed records not previously popped.
+        """
+        ret_val = self.__processed_records
+        self.__processed_records = []
+        return ret_val
+
     def process_column(self, input_vals: typing.List[str]) -> None:
         """Process a column representing a single child snapshot.
 
@@ -252,15 +363,25 @@ class UploadParserAutomaton:
         @param input_vals: List where each element is a cell going in increasing
             column number.
         """
-        for input_val in input_vals:
+        step_handlers = self.__step_handlers
+        num_handlers = len(step_handlers)
+
+        for (i, input_val) in enumerate(input_vals):
+            state = self.__state
+
+            if state == STATE_PARSE_START_WORDS:
+                self.parse_words(input_vals[i:])
+                break
 
-            if not self.__state in self.__step_handlers:
+            if state == STATE_FOUND_ERROR:
+                break
+
+            if state < 0 or state >= num_handlers:
                 self.enter_error_state("Automaton reached unexpected state.")
                 self.__columns_processed += 1
                 return
 
-            step_handler = self.__step_handlers[self.__state]
-            step_handler(input_val)
+            step_handlers[state](input_val)
 
         self.__columns_processed += 1
 
@@ -277,7 +398,8 @@ class UploadParserAutomaton:
 
             if user_provided_num_languages != expected_num_languages:
                 self.enter_error_state(
-                    ERROR_INVALID_NUM_LANGUAGES % (self.__columns_processed + 1)
+                    ERROR_INVALID_NUM_LANGUAGES % (self.__columns_processed + 1),
+                    self.__get_row_for_state(STATE_PARSE_NUM_LANGUAGES)
                 )
                 return
 
@@ -291,7 +413,8 @@ class UploadParserAutomaton:
                         self.__columns_processed + 1,
                         user_provided_age,
                         expected_age
-                    )
+                    ),
+                    self.__get_row_for_state(STATE_PARSE_AGE)
                 )
                 return
 
@@ -305,7 +428,8 @@ class UploadParserAutomaton:
                         self.__columns_processed + 1,
                         user_provided_num_words,
                         expected_num_words
-                    )
+                    ),
+                    self.__get_row_for_state(STATE_PARSE_WORDS_SPOKEN)
                 )
                 return
 
@@ -319,7 +443,8 @@ class UploadParserAutomaton:
                         self.__columns_processed + 1,
                         user_provided_percentile,
                         expected_percentile
-                    )
+                    ),
+                    self.__get_row_for_state(STATE_PARSE_PERCENTILE)
                 )
                 return
 
@@ -364,15 +489,10 @@ class UploadParserAutomaton:
 
         @returns: Records describing if words were found or not.
         """
-        return list(map(
-            lambda x: models.SnapshotContent(
-                None,
-                x[0],
-                x[1], # type: ignore
-                0
-            ),
-            self.__word_values.items()
-        ))
+        return [
+            models.SnapshotContent(None, word, value, 0) # type: ignore
+            for (word, value) in self.__word_values.items()
+        ]
 
     def __get_percentile(self) -> float:
         """Use the found percentile or calculate it if not given in import CSV.
@@ -417,10 +537,7 @@ class UploadParserAutomaton:
         @returns: Newly calculated number of words, ignoring a if given in an
             import CSV.
         """
-        return len(list(filter(
-            lambda x: x in self.__count_as_spoken_values,
-            self.__word_values.values()
-        )))
+        return self.__num_spoken_found
 
     def __get_age(self) -> float:
         """Get the age of the child whose snapshot is currently being processed.
@@ -483,7 +600,8 @@ class UploadParserAutomaton:
         if self.__session_num_deferred:
             return recalc_util.get_session_number(
                 study_realized,
-                study_id_realized
+                study_id_realized,
+                self.__cursor_maybe
             )
         else:
             return self.__assert_not_none(self.__session_num)
@@ -565,18 +683,67 @@ class UploadParserAutomaton:
 
         return self.__has_database_id
 
-    def enter_error_state(self, error_message: str):
+    def get_error_row(self) -> typing.Optional[int]:
+        """Get the row of the cell which caused the error.
+
+        @returns: The 1-indexed row within the CSV file or None if no error was
+            encountered or the error does not pertain to a single row.
+        """
+        return self.__error_row
+
+    def enter_error_state(self, error_message: str,
+            row: typing.Optional[int] = None):
         """Indicate that the automaton encountered an error and stop processing.
 
         @param error_message: Message describing the error encountered.
+        @param row: The 1-indexed row of the invalid cell or None if the cell
+            being parsed in the current state was invalid.
         """
         if error_message is None:
             raise RuntimeError(
                 "Unexpected automaton error message: " + error_message
             )
 
+        if row == None and not self.waiting_for_header():
+            row = self.__get_row_for_state(self.__state)
+
         self.__state = STATE_FOUND_ERROR
         self.__error = error_message
+        self.__error_row = row
+
+    def recover(self) -> bool:
+        """Leave the error state, resuming parsing at the next record.
+
+        Allows an upload to be checked for all of its invalid records instead of
+        stopping at the first one. The record in which the error was found is
+        discarded.
+
+        @returns: True if parsing can resume and false if the header itself
+            was invalid such that no further columns can be parsed.
+        """
+        if self.__columns_processed == 0:
+            return False
+
+        self.__error = None
+        self.__error_row = None
+
+        if self.__has_database_id:
+            self.__state = STATE_PARSE_DATABASE_ID
+        else:
+            self.__state = STATE_PARSE_CHILD_ID
+
+        return True
+
+    def __get_row_for_state(self, state: int) -> int:
+        """Get the row of the cell parsed in a state.
+
+        @param state: The state like STATE_PARSE_AGE.
+        @returns: The 1-indexed row within the CSV file.
+        """
+        if self.__has_database_id:
+            return state
+        else:
+            return state - 1
 
     def parse_header(self, header_column_cased: typing.List[str]) -> None:
         """Parse a header column.
@@ -952,10 +1119,13 @@ class UploadParserAutomaton:
 
         @param input_val: Cell to parse.
         """
-        cdi_model_maybe = self.__cached_adapter.load_cdi_model(cdi_name)
+        if cdi_name not in self.__cdi_plans:
+            self.__cdi_plans[cdi_name] = self.__compile_cdi_plan(cdi_name)
+
+        plan = self.__cdi_plans[cdi_name]
 
         # Check CDI was known
-        if cdi_model_maybe == None:
+        if plan == None:
             msg = ERROR_UNKNOWN_CDI_TYPE % (
                 cdi_name,
                 self.__columns_processed + 1
@@ -963,39 +1133,14 @@ class UploadParserAutomaton:
             self.enter_error_state(msg)
             return
 
-        cdi_model: models.CDIFormat = cdi_model_maybe # type: ignore
+        plan_realized: CDIPlan = plan # type: ignore
 
-        # Check words were present
-        required_words: typing.Set[str] = set(functools.reduce(
-            lambda last, cur: last + cur["words"],
-            cdi_model.details["categories"],
-            []
-        ))
+        self.__allowed_word_values = plan_realized.allowed_values
+        self.__count_as_spoken_values = plan_realized.count_as_spoken_values
 
-        required_words = set(map(
-            lambda x: x.replace("*", "").lower(),
-            required_words
-        ))
-
-        # Check allowed values
-        explicit_options = set(map(
-            lambda x: x["value"],
-            cdi_model.details["options"]
-        ))
-
-        prefill_values: typing.Set[str] = set(functools.reduce(
-            lambda prev, cur: extend_list(prev, cur.get("prefill_value", [])),
-            cdi_model.details["options"],
-            []
-        ))
-
-        self.__allowed_word_values = explicit_options.union(prefill_values)
-
-        self.__count_as_spoken_values = set(cdi_model.details["count_as_spoken"])
-
-        difference = required_words.symmetric_difference(self.__expected_words)
-        if len(difference) > 0:
-            diff_str = ",".join(difference)
+        # Check words were present
+        if len(plan_realized.unexpected_words) > 0:
+            diff_str = ",".join(plan_realized.unexpected_words)
             self.enter_error_state(
                 ERROR_WORDS_NOT_EXPECTED % (cdi_name, diff_str)
             )
@@ -1005,6 +1150,28 @@ class UploadParserAutomaton:
         self.__cdi_name = cdi_name
         self.__state = STATE_PARSE_HARD_OF_HEARING
 
+    def __compile_cdi_plan(self, cdi_name: str) -> typing.Optional[CDIPlan]:
+        """Resolve what is needed to check the words for a type of CDI.
+
+        @param cdi_name: The name of the CDI format.
+        @returns: Plan for checking word values or None if the CDI format is
+            not known.
+        """
+        compiled_maybe = self.__cached_adapter.load_compiled_cdi_model(
+            cdi_name
+        )
+
+        if compiled_maybe == None:
+            return None
+
+        compiled: recalc_util.CompiledCDIFormat = compiled_maybe # type: ignore
+
+        return CDIPlan(
+            compiled.allowed_values,
+            compiled.count_as_spoken_values,
+            list(compiled.words.symmetric_difference(self.__expected_words))
+        )
+
     def parse_hard_of_hearing(self, input_val: str) -> None:
         """Parse flag indicating if the paricipant is hard of hearing.
 
@@ -1043,6 +1210,7 @@ class UploadParserAutomaton:
         @param input_val: Cell to parse.
         """
         self.__word_values = {}
+        self.__num_spoken_found = 0
         self.__expected_word_queue = collections.deque(self.__expected_words)
 
         self.__state = STATE_PARSE_WORDS
@@ -1053,9 +1221,16 @@ class UploadParserAutomaton:
 
         @param input_val: Cell to parse.
         """
+        num_words_parsed = (
+            len(self.__expected_words) - len(self.__expected_word_queue)
+        )
+        row = self.__get_row_for_state(STATE_PARSE_START_WORDS)
+        row += num_words_parsed
+
         if len(self.__expected_word_queue) == 0:
             self.enter_error_state(
-                ERROR_UNEXPECTED_WORD % (self.__columns_processed + 1)
+                ERROR_UNEXPECTED_WORD % (self.__columns_processed + 1),
+                row
             )
             return
 
@@ -1069,11 +1244,62 @@ class UploadParserAutomaton:
                 word,
                 self.__columns_processed + 1
             )
-            self.enter_error_state(msg)
+            self.enter_error_state(msg, row)
             return
 
         self.__word_values[word] = input_val_int
 
+        if input_val_int in self.__count_as_spoken_values:
+            self.__num_spoken_found += 1
+
+    def parse_words(self, input_vals: typing.List[str]) -> None:
+        """Parse the status of all words for a participant at once.
+
+        Equivalent to parse_word_start followed by parse_word for each
+        remaining cell but checks cells against the word positions and allowed
+        values resolved from the header and CDI type in a single pass.
+
+        @param input_vals: The cells for the words in header order.
+        """
+        expected_words = self.__expected_words
+        allowed_values = self.__allowed_word_values
+        count_as_spoken_values = self.__count_as_spoken_values
+
+        word_values: typing.Dict[str, typing.Optional[int]] = {}
+        num_spoken_found = 0
+        start_row = self.__get_row_for_state(STATE_PARSE_START_WORDS)
+
+        word_input_vals = zip(expected_words, input_vals)
+        for (i, (word, input_val)) in enumerate(word_input_vals):
+            input_val_int = parse_int_str(input_val)
+
+            if input_val_int == None or not input_val_int in allowed_values:
+                msg = ERROR_UNKNOWN_WORD_VAL % (
+                    input_val,
+                    word,
+                    self.__columns_processed + 1
+                )
+                self.enter_error_state(msg, start_row + i)
+                return
+
+            word_values[word] = input_val_int
+
+            if input_val_int in count_as_spoken_values:
+                num_spoken_found += 1
+
+        self.__word_values = word_values
+        self.__num_spoken_found = num_spoken_found
+        self.__expected_word_queue = collections.deque(
+            expected_words[len(input_vals):]
+        )
+        self.__state = STATE_PARSE_WORDS
+
+        if len(input_vals) > len(expected_words):
+            self.enter_error_state(
+                ERROR_UNEXPECTED_WORD % (self.__columns_processed + 1),
+                start_row + len(expected_words)
+            )
+
     def maintain_error_state(self, input_val: str) -> None:
         """Continue operating the automaton in the error state.
 
@@ -1100,7 +1326,7 @@ class UploadParserAutomaton:
                     header_col[i],
                     i + 1
                 )
-                self.enter_error_state(msg)
+                self.enter_error_state(msg, i + 1)
                 return False
 
         return check
@@ -1141,19 +1367,7 @@ class UploadParserAutomaton:
         @param str_val: The value to parse.
         @returns: Parsed value or None if parsing failure.
         """
-        str_val = str_val.strip()
-
-        if str_val == "0":
-            return 0
-
-        invalid_zero = str_val.startswith("0") and not str_val.startswith("0.")
-        if invalid_zero or self.__is_empty(str_val):
-            return None
-
-        try:
-            return float(str_val)
-        except ValueError:
-            return None
+        return parse_float_str(str_val)
 
     def __parse_int(self, str_val: str) -> typing.Optional[int]:
         """Parse a string as an int.
@@ -1161,18 +1375,7 @@ class UploadParserAutomaton:
         @param str_val: The value to parse.
         @returns: Parsed value or None if parsing failure.
         """
-        str_val = str_val.strip()
-
-        if str_val == "0":
-            return 0
-
-        if str_val.startswith("0") or self.__is_empty(str_val):
-            return None
-
-        try:
-            return int(str_val)
-        except ValueError:
-            return None
+        return parse_int_str(str_val)
 
     def __parse_date(self, str_val: str) -> typing.Optional[str]:
         """Parse a string as a date into a standardized string format.
@@ -1180,38 +1383,7 @@ class UploadParserAutomaton:
         @param str_val: The value to parse.
         @returns: Parsed value or None if parsing failure.
         """
-        str_val = str_val.strip().replace("-", "/")
-
-        converted_date = self.__parse_date_iso(str_val)
-        if not converted_date:
-            converted_date = self.__parse_date_usa(str_val)
-
-        if not converted_date:
-            return None
-
-        return converted_date.date().isoformat().replace("-", "/")
-
-    def __parse_date_iso(self, str_val: str) -> typing.Optional[datetime.datetime]:
-        """Parse an ISO formatted string as a date into a datetime.
-
-        @param str_val: The value to parse.
-        @returns: Parsed value or None if parsing failure.
-        """
-        try:
-            return datetime.datetime.strptime(str_val, "%Y/%m/%d")
-        except ValueError:
-            return None
-
-    def __parse_date_usa(self, str_val: str) -> typing.Optional[datetime.datetime]:
-        """Parse an US formatted string as a date into a datetime.
-
-        @param str_val: The value to parse.
-        @returns: Parsed value or None if parsing failure.
-        """
-        try:
-            return datetime.datetime.strptime(str_val, "%m/%d/%Y")
-        except ValueError:
-            return None
+        return parse_date_str(str_val)
 
 
 class Counter:
@@ -1225,19 +1397,30 @@ class Counter:
         return old_val
 
 
+def transpose_rows(rows: typing.List[typing.List[str]]) -> typing.List[typing.List[str]]:
+    """Convert CSV rows into columns, treating missing cells as empty.
+
+    @param rows: The rows to transpose.
+    @returns: List of columns.
+    """
+    num_columns = max(map(len, rows), default=0)
+    return [
+        [row[col_num] if col_num < len(row) else '' for row in rows]
+        for col_num in range(0, num_columns)
+    ]
+
+
 def process_csv(input_str: typing.Union[str, bytes]) -> CSVResults:
-    columns = []
+    """Parse a CSV file in the "new" format that is already in memory.
 
+    @param input_str: The contents of the file.
+    @returns: The parsed records or a description of the first error found.
+    """
     if isinstance(input_str, bytes):
-        input_rows_iterator = input_str.decode('utf-8').split('\n')
-    else:
-        input_rows_iterator = input_str.split('\n')
-
-    input_rows = list(csv.reader(input_rows_iterator))
+        input_str = input_str.decode('utf-8')
 
-    for col_num in range(0, len(input_rows[0])):
-        column = list(map(lambda row: row[col_num], input_rows))
-        columns.append(column)
+    input_rows = [row for row in csv.reader(io.StringIO(input_str)) if row]
+    columns = transpose_rows(input_rows)
 
     automaton = UploadParserAutomaton(recalc_util.CachedCDIAdapter())
 
@@ -1251,14 +1434,178 @@ def process_csv(input_str: typing.Union[str, bytes]) -> CSVResults:
     )
 
 
-def extend_list(prev, cur) -> typing.List[T]:
-    cur = cur if is_iterable(cur) else [cur]
-    return prev + cur
+def spool_upload(source: typing.IO[bytes],
+        directory: typing.Optional[str] = None) -> str:
+    """Copy an uploaded file to a temporary file on disk.
+
+    @param source: Stream with the contents of the upload.
+    @param directory: The directory in which to create the file or None to use
+        the system default temporary directory.
+    @returns: Path to the new file. The caller is responsible for removing it.
+    """
+    with tempfile.NamedTemporaryFile(suffix='.csv', dir=directory,
+            delete=False) as f:
+        shutil.copyfileobj(source, f)
+        return f.name
+
+
+def iter_csv_columns(path: str,
+        block_size: int = DEFAULT_COLUMN_BLOCK_SIZE) -> typing.Iterator[typing.List[str]]:
+    """Iterate over the columns of a CSV file with bounded memory.
+
+    A first pass over the file finds the number of columns. The file is then
+    read once per block of block_size columns, keeping only the cells for that
+    block, so at most block_size columns are held in memory at a time.
+
+    @param path: Path to the CSV file.
+    @param block_size: The number of columns to collect per pass.
+    @returns: Iterator over columns where each column is a list of cells going
+        in increasing row number.
+    """
+    def read_rows():
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.reader(f):
+                if row:
+                    yield row
+
+    num_columns = max(map(len, read_rows()), default=0)
+
+    for block_start in range(0, num_columns, block_size):
+        block_end = min(block_start + block_size, num_columns)
+        block = [[] for i in range(block_start, block_end)] # type: ignore
+
+        for row in read_rows():
+            cells = row[block_start:block_end]
+            for (column, cell) in zip(block, cells):
+                column.append(cell)
+            for column in block[len(cells):]:
+                column.append('')
+
+        yield from block
+
+
+def process_csv_file(path: str, cursor_maybe: db_util.OptionalCursor = None,
+        block_size: int = DEFAULT_COLUMN_BLOCK_SIZE) -> typing.Iterator[AutomatonResults]:
+    """Lazily parse a CSV file in the "new" format from disk.
+
+    Records are yielded as each participant column is parsed and are not
+    retained, so this may be given directly to db_util.insert_snapshots.
+
+    @param path: Path to the CSV file.
+    @param cursor_maybe: The cursor to use for any database lookups or None if
+        new cursors should be created. Provide the cursor of the transaction
+        into which records are being inserted, if any.
+    @param block_size: The number of columns to read per pass over the file.
+    @returns: Iterator over parsed records.
+    @raises CSVParseError: Raised on the first invalid value found.
+    """
+    automaton = UploadParserAutomaton(
+        recalc_util.CachedCDIAdapter(cursor_maybe),
+        cursor_maybe
+    )
 
+    for column in iter_csv_columns(path, block_size):
+        automaton.process_column(column)
+
+        if automaton.is_in_error():
+            raise CSVParseError(automaton.get_error())
+
+        yield from automaton.pop_processed_records()
+
+
+def spool_records(records: typing.Iterable[AutomatonResults],
+        directory: typing.Optional[str] = None) -> str:
+    """Write parsed records to a temporary file on disk one at a time.
+
+    Lets an upload be parsed in full before saving starts without holding all
+    of its records in memory. Read back with iter_spooled_records.
+
+    @param records: The records to write.
+    @param directory: The directory in which to create the file or None to use
+        the system default temporary directory.
+    @returns: Path to the new file. The caller is responsible for removing it.
+        The file is removed before returning if records raises an exception.
+    """
+    with tempfile.NamedTemporaryFile(suffix='.pickle', dir=directory,
+            delete=False) as f:
+        try:
+            for record in records:
+                pickle.dump(record, f, pickle.HIGHEST_PROTOCOL)
+        except:
+            f.close()
+            os.remove(f.name)
+            raise
+
+        return f.name
+
+
+def iter_spooled_records(path: str) -> typing.Iterator[AutomatonResults]:
+    """Lazily read records written by spool_records.
+
+    @param path: Path to the file from spool_records.
+    @returns: Iterator over the records in the order they were written.
+    """
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+def validate_csv_file(path: str,
+        max_errors: int = DEFAULT_MAX_VALIDATION_ERRORS,
+        block_size: int = DEFAULT_COLUMN_BLOCK_SIZE) -> models.ImportValidationReport:
+    """Parse a CSV file in the "new" format without saving it.
+
+    Unlike process_csv_file, parsing continues with the next participant column
+    after an invalid one so that all of the problems in an upload can be
+    reported at once.
+
+    @param path: Path to the CSV file.
+    @param max_errors: The number of errors after which to stop checking.
+    @param block_size: The number of columns to read per pass over the file.
+    @returns: Report of the errors found and the parsing throughput.
+    """
+    start = time.time()
+
+    automaton = UploadParserAutomaton(recalc_util.CachedCDIAdapter())
+
+    errors: typing.List[models.ImportValidationError] = []
+    num_records = 0
+    num_cells = 0
+    truncated = False
+
+    for (i, column) in enumerate(iter_csv_columns(path, block_size)):
+        num_cells += len(column)
+        automaton.process_column(column)
+        num_records += len(automaton.pop_processed_records())
+
+        if not automaton.is_in_error():
+            continue
+
+        error = automaton.get_error()
+        if error == None:
+            error = ERROR_UNSPECIFIED % (i + 1)
+
+        errors.append(models.ImportValidationError(
+            automaton.get_error_row(),
+            i + 1,
+            error # type: ignore
+        ))
+
+        if len(errors) >= max_errors:
+            truncated = True
+            break
+
+        if not automaton.recover():
+            break
+
+    return models.ImportValidationReport(
+        num_records,
+        num_cells,
+        time.time() - start,
+        errors,
+        truncated
+    )
 
-def is_iterable(target) -> bool:
-    try:
-        iter(target)
-        return True
-    except TypeError:
-        return False
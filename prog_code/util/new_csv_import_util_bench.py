@@ -0,0 +1,166 @@
+"""Benchmark for parsing the "new" CSV import format.
+
+Copyright (C) 2014 A. Samuel Pottinger ("Sam Pottinger", gleap.org)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Run from the repository root with:
+
+    $ python -m prog_code.util.new_csv_import_util_bench
+
+@author Sam Pottinger
+@license GNU GPL v3
+"""
+import sys
+import time
+import typing
+
+import prog_code.util.new_csv_import_util as new_csv_import_util
+import prog_code.util.recalc_util as recalc_util
+
+from ..struct import models
+
+BENCH_CDI_NAME = 'bench_cdi'
+BENCH_PERCENTILES_NAME = 'bench_percentiles'
+NUM_PARTICIPANTS = 1000
+NUM_CATEGORIES = 20
+WORDS_PER_CATEGORY = 34
+NUM_REPETITIONS = 3
+
+HEADER_FIELDS = ['database id'] + new_csv_import_util.EXPECTED_HEADER_FIELDS
+
+
+def create_adapter(words: typing.List[str]) -> recalc_util.CachedCDIAdapter:
+    """Create an adapter with the benchmark CDI and percentiles pre-cached.
+
+    @param words: The words on the benchmark CDI.
+    @returns: Adapter which will not need to go to the database.
+    """
+    adapter = recalc_util.CachedCDIAdapter()
+
+    categories = [
+        {'words': words[i:i + WORDS_PER_CATEGORY]}
+        for i in range(0, len(words), WORDS_PER_CATEGORY)
+    ]
+
+    adapter.cdi_models[BENCH_CDI_NAME] = models.CDIFormat(
+        'Benchmark CDI',
+        BENCH_CDI_NAME,
+        'bench_cdi.yaml',
+        {
+            'options': [{'value': 0}, {'value': 1}, {'value': 2}],
+            'categories': categories,
+            'count_as_spoken': [1],
+            'percentiles': {
+                'male': BENCH_PERCENTILES_NAME,
+                'female': BENCH_PERCENTILES_NAME
+            }
+        }
+    )
+
+    months = list(range(16, 31))
+    table = [['percentile'] + months] + [
+        [percentile] + [percentile * 6] * len(months)
+        for percentile in [99, 90, 75, 50, 25, 10, 5]
+    ]
+    adapter.percentiles[BENCH_PERCENTILES_NAME] = models.PercentileTable(
+        'Benchmark percentiles',
+        BENCH_PERCENTILES_NAME,
+        'bench_percentiles.csv',
+        table
+    )
+
+    return adapter
+
+
+def create_columns(words: typing.List[str]) -> typing.List[typing.List[str]]:
+    """Create the columns of a synthetic import file.
+
+    @param words: The words on the benchmark CDI.
+    @returns: Header column followed by one column per participant.
+    """
+    columns = [HEADER_FIELDS + words]
+
+    for i in range(0, NUM_PARTICIPANTS):
+        columns.append([
+            '',
+            str(i + 1),
+            'participant_%d' % i,
+            'bench study',
+            'f' if i % 2 else 'm',
+            '',
+            '2014/%02d/%02d' % (i % 12 + 1, i % 28 + 1),
+            '%02d/15/2016' % (i % 6 + 1),
+            '1',
+            '1',
+            '',
+            '0',
+            '',
+            '0',
+            '0',
+            'english',
+            '1',
+            BENCH_CDI_NAME,
+            '0',
+            '0'
+        ] + [str((i + j) % 3) for j in range(0, len(words))])
+
+    return columns
+
+
+def run_benchmark() -> float:
+    """Parse the synthetic file, returning the best rate in cells per second.
+
+    @returns: Cells parsed per second in the fastest repetition.
+    """
+    words = [
+        'word_%d' % i
+        for i in range(0, NUM_CATEGORIES * WORDS_PER_CATEGORY)
+    ]
+    columns = create_columns(words)
+    num_cells = sum(map(len, columns))
+
+    best_seconds = None
+    for i in range(0, NUM_REPETITIONS):
+        automaton = new_csv_import_util.UploadParserAutomaton(
+            create_adapter(words)
+        )
+
+        start = time.time()
+        for column in columns:
+            automaton.process_column(column)
+        elapsed = time.time() - start
+
+        if automaton.is_in_error():
+            raise RuntimeError(automaton.get_error())
+
+        assert len(automaton.get_processed_records()) == NUM_PARTICIPANTS
+
+        if best_seconds == None or elapsed < best_seconds:
+            best_seconds = elapsed
+
+    rate = num_cells / best_seconds # type: ignore
+    sys.stdout.write(
+        '%d participants, %d cells: %.2f s, %.0f cells / s\n' % (
+            NUM_PARTICIPANTS,
+            num_cells,
+            best_seconds,
+            rate
+        )
+    )
+    return rate
+
+
+if __name__ == '__main__':
+    run_benchmark()
@@ -15,6 +15,10 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
+import csv
+import io
+import os
+import tempfile
 import unittest
 
 from ..struct import models
@@ -54,6 +58,60 @@ CORRECT_TEST_HEADER_VALUES = [
 ]
 
 
+VALID_TEST_RECORD_VALUES = [
+    '1',
+    'test_child_id',
+    'test_study_id',
+    'test_study',
+    'm',
+    '24',
+    '2014/12/24',
+    '2016/12/24',
+    '1',
+    '1',
+    '3',
+    '0',
+    '',
+    '0',
+    '0',
+    'english,spanish',
+    '2',
+    'test_cdi_type',
+    '0',
+    '0',
+    '1',
+    '1',
+    '1',
+    '0'
+]
+
+TEST_CDI_FORMAT = models.CDIFormat(
+    'test CDI type',
+    'test_cdi_type',
+    'test_cdi_type.yaml',
+    {
+        'options': [
+            {'value': 0},
+            {'value': 1}
+        ],
+        'categories': [
+            {'words': ['word1', 'word2']},
+            {'words': ['word3', 'word4']}
+        ],
+        'count_as_spoken': [1]
+    }
+)
+
+
+def write_columns_to_csv(columns):
+    """Write columns to a temporary CSV file, returning its path."""
+    rows = zip(*columns)
+    with tempfile.NamedTemporaryFile('w', suffix='.csv', newline='',
+            delete=False) as f:
+        csv.writer(f).writerows(rows)
+        return f.name
+
+
 class FakePercentileTable:
 
     def __init__(self, details):
@@ -1662,7 +1720,7 @@ class NewUploadParserAutomatonTests(unittest.TestCase):
 
             self.__setup_for_parse_with_percentile(callback)
 
-            mock.assert_called_with('test_study', 'test_study_id')
+            mock.assert_called_with('test_study', 'test_study_id', None)
 
         self.assertTrue(self.__callback_called)
 
@@ -1750,3 +1808,269 @@ class NewUploadParserAutomatonTests(unittest.TestCase):
 
         self.__setup_for_parse_with_percentile(callback, False)
         self.assertTrue(self.__callback_called)
+
+    def test_parse_date_str(self):
+        self.assertEqual(
+            new_csv_import_util.parse_date_str('2014-12-24'),
+            '2014/12/24'
+        )
+        self.assertEqual(
+            new_csv_import_util.parse_date_str(' 12/24/2014'),
+            '2014/12/24'
+        )
+        self.assertEqual(new_csv_import_util.parse_date_str('24/12/2014'), None)
+        self.assertEqual(new_csv_import_util.parse_date_str(''), None)
+
+    def test_parse_int_str(self):
+        self.assertEqual(new_csv_import_util.parse_int_str('0'), 0)
+        self.assertEqual(new_csv_import_util.parse_int_str(' 12 '), 12)
+        self.assertEqual(new_csv_import_util.parse_int_str('012'), None)
+        self.assertEqual(new_csv_import_util.parse_int_str('1.5'), None)
+        self.assertEqual(new_csv_import_util.parse_int_str(''), None)
+
+    def test_parse_float_str(self):
+        self.assertEqual(new_csv_import_util.parse_float_str('0'), 0)
+        self.assertEqual(new_csv_import_util.parse_float_str('0.5'), 0.5)
+        self.assertEqual(new_csv_import_util.parse_float_str('01.5'), None)
+        self.assertEqual(new_csv_import_util.parse_float_str('a'), None)
+
+    def test_parse_words_too_many(self):
+        def callback():
+            self.__test_automaton.parse_words(['1', '1', '1', '0', '1'])
+            self.assertEqual(
+                self.__test_automaton.get_state(),
+                new_csv_import_util.STATE_FOUND_ERROR
+            )
+            self.__callback_called = True
+
+        self.__setup_test_cdi(callback)
+        self.assertTrue(self.__callback_called)
+
+    def __run_with_cdi_mocks(self, callback):
+        with unittest.mock.patch('prog_code.util.db_util.load_cdi_model') as mock_cdi:
+            with unittest.mock.patch('prog_code.util.recalc_util.recalculate_percentile_raw') as mock_percentile:
+                mock_cdi.return_value = TEST_CDI_FORMAT
+                mock_percentile.return_value = 99
+                callback()
+
+    def test_iter_csv_columns(self):
+        path = write_columns_to_csv([
+            ['a', 'b', 'c'],
+            ['1', 'multi\nline', '3'],
+            ['4', '5', '6']
+        ])
+
+        try:
+            columns = list(new_csv_import_util.iter_csv_columns(path, 2))
+        finally:
+            os.remove(path)
+
+        self.assertEqual(columns, [
+            ['a', 'b', 'c'],
+            ['1', 'multi\nline', '3'],
+            ['4', '5', '6']
+        ])
+
+    def test_process_csv_quoted_newline_and_trailing_newline(self):
+        def callback():
+            record = list(VALID_TEST_RECORD_VALUES)
+            record[2] = 'test\nstudy_id'
+
+            target = io.StringIO()
+            csv.writer(target).writerows(zip(CORRECT_TEST_HEADER_VALUES, record))
+            contents = target.getvalue() + '\n'
+
+            results = new_csv_import_util.process_csv(contents)
+
+            self.assertFalse(results.had_error)
+            self.assertEqual(len(results.records), 1)
+            self.assertEqual(
+                results.records[0].meta.study_id,
+                'test\nstudy_id'
+            )
+            self.__callback_called = True
+
+        self.__run_with_cdi_mocks(callback)
+        self.assertTrue(self.__callback_called)
+
+    def test_process_csv_file(self):
+        second_record = list(VALID_TEST_RECORD_VALUES)
+        second_record[1] = 'test_child_id_2'
+
+        path = write_columns_to_csv([
+            CORRECT_TEST_HEADER_VALUES,
+            VALID_TEST_RECORD_VALUES,
+            second_record
+        ])
+
+        def callback():
+            records = new_csv_import_util.process_csv_file(path, block_size=1)
+            child_ids = [x.meta.child_id for x in records]
+            self.assertEqual(child_ids, ['test_child_id', 'test_child_id_2'])
+            self.__callback_called = True
+
+        try:
+            self.__run_with_cdi_mocks(callback)
+        finally:
+            os.remove(path)
+
+        self.assertTrue(self.__callback_called)
+
+    def test_process_csv_file_error(self):
+        bad_record = list(VALID_TEST_RECORD_VALUES)
+        bad_record[4] = 'unknown'
+
+        path = write_columns_to_csv([
+            CORRECT_TEST_HEADER_VALUES,
+            VALID_TEST_RECORD_VALUES,
+            bad_record
+        ])
+
+        def callback():
+            records = new_csv_import_util.process_csv_file(path)
+            self.assertEqual(next(records).meta.child_id, 'test_child_id')
+            with self.assertRaises(new_csv_import_util.CSVParseError):
+                next(records)
+            self.__callback_called = True
+
+        try:
+            self.__run_with_cdi_mocks(callback)
+        finally:
+            os.remove(path)
+
+        self.assertTrue(self.__callback_called)
+
+    def test_spool_records(self):
+        second_record = list(VALID_TEST_RECORD_VALUES)
+        second_record[1] = 'test_child_id_2'
+
+        path = write_columns_to_csv([
+            CORRECT_TEST_HEADER_VALUES,
+            VALID_TEST_RECORD_VALUES,
+            second_record
+        ])
+
+        def callback():
+            records_path = new_csv_import_util.spool_records(
+                new_csv_import_util.process_csv_file(path)
+            )
+            try:
+                records = new_csv_import_util.iter_spooled_records(
+                    records_path
+                )
+                child_ids = [x.meta.child_id for x in records]
+            finally:
+                os.remove(records_path)
+
+            self.assertEqual(child_ids, ['test_child_id', 'test_child_id_2'])
+            self.__callback_called = True
+
+        try:
+            self.__run_with_cdi_mocks(callback)
+        finally:
+            os.remove(path)
+
+        self.assertTrue(self.__callback_called)
+
+    def test_spool_records_error(self):
+        bad_record = list(VALID_TEST_RECORD_VALUES)
+        bad_record[4] = 'unknown'
+
+        path = write_columns_to_csv([
+            CORRECT_TEST_HEADER_VALUES,
+            VALID_TEST_RECORD_VALUES,
+            bad_record
+        ])
+
+        def callback():
+            with tempfile.TemporaryDirectory() as directory:
+                with self.assertRaises(new_csv_import_util.CSVParseError):
+                    new_csv_import_util.spool_records(
+                        new_csv_import_util.process_csv_file(path),
+                        directory
+                    )
+                self.assertEqual(os.listdir(directory), [])
+            self.__callback_called = True
+
+        try:
+            self.__run_with_cdi_mocks(callback)
+        finally:
+            os.remove(path)
+
+        self.assertTrue(self.__callback_called)
+
+    def test_validate_csv_file(self):
+        bad_gender_record = list(VALID_TEST_RECORD_VALUES)
+        bad_gender_record[4] = 'unknown'
+
+        bad_word_record = list(VALID_TEST_RECORD_VALUES)
+        bad_word_record[20] = '5'
+
+        path = write_columns_to_csv([
+            CORRECT_TEST_HEADER_VALUES,
+            VALID_TEST_RECORD_VALUES,
+            bad_gender_record,
+            bad_word_record,
+            VALID_TEST_RECORD_VALUES
+        ])
+
+        def callback():
+            report = new_csv_import_util.validate_csv_file(path, block_size=2)
+            self.assertEqual(report.num_records, 2)
+            self.assertEqual(report.num_cells, 5 * 24)
+            self.assertFalse(report.truncated)
+            self.assertEqual(
+                [(x.row, x.column) for x in report.errors],
+                [(5, 3), (21, 4)]
+            )
+            self.__callback_called = True
+
+        try:
+            self.__run_with_cdi_mocks(callback)
+        finally:
+            os.remove(path)
+
+        self.assertTrue(self.__callback_called)
+
+    def test_validate_csv_file_max_errors(self):
+        bad_record = list(VALID_TEST_RECORD_VALUES)
+        bad_record[2] = ''
+
+        path = write_columns_to_csv([
+            CORRECT_TEST_HEADER_VALUES,
+            bad_record,
+            bad_record,
+            VALID_TEST_RECORD_VALUES
+        ])
+
+        def callback():
+            report = new_csv_import_util.validate_csv_file(path, max_errors=1)
+            self.assertTrue(report.truncated)
+            self.assertEqual(len(report.errors), 1)
+            self.assertEqual(report.errors[0].row, 3)
+            self.assertEqual(report.errors[0].column, 2)
+            self.__callback_called = True
+
+        try:
+            self.__run_with_cdi_mocks(callback)
+        finally:
+            os.remove(path)
+
+        self.assertTrue(self.__callback_called)
+
+    def test_validate_csv_file_bad_header(self):
+        header = list(CORRECT_TEST_HEADER_VALUES)
+        header[4] = 'sex'
+
+        path = write_columns_to_csv([header, VALID_TEST_RECORD_VALUES])
+
+        try:
+            report = new_csv_import_util.validate_csv_file(path)
+        finally:
+            os.remove(path)
+
+        self.assertEqual(report.num_records, 0)
+        self.assertFalse(report.truncated)
+        self.assertEqual(len(report.errors), 1)
+        self.assertEqual(report.errors[0].row, 5)
+        self.assertEqual(report.errors[0].column, 1)
@@ -21,6 +21,7 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import typing
 
 import prog_code.util.constants as constants
+import prog_code.util.interp_util as interp_util
 
 
 T = typing.TypeVar('T')
@@ -51,6 +52,23 @@ class FieldInfo(typing.Generic[T]):
         """
         return self.__field_name
 
+    def build_comparison(self, operator: str) -> str:
+        """Get the SQL condition comparing this field to a single operand.
+
+        @param operator: The SQL operator to compare with like == or <.
+        @returns: SQL condition with one placeholder for the operand.
+        """
+        return '%s %s ?' % (self.get_field_name(), operator)
+
+    def build_in_comparison(self, values_sql: str) -> str:
+        """Get the SQL condition checking this field against a set of values.
+
+        @param values_sql: Parenthesized placeholders or subquery providing the
+            values to match.
+        @returns: SQL condition true if the field equals any of the values.
+        """
+        return '%s IN %s' % (self.get_field_name(), values_sql)
+
     def interpret_value(self, val: typing.Union[str, int, float]) -> typing.List[T]:
         """Interpret a value which may be a comma separated string.
 
@@ -62,41 +80,48 @@ class FieldInfo(typing.Generic[T]):
             return [val] # type: ignore
 
 
-class DateInterpretField(FieldInfo[str]):
-    """A value interpreter for filter operands that returns original input.
+class DateInterpretField(FieldInfo[int]):
+    """A value interpreter for filter operands with date info.
 
-    User input interpreter for filter operand values that returns original user
-    input without interpretation.
+    User input interpreter for filter operand values that converts dates to the
+    number of days since interp_util.DAY_NUM_EPOCH so that they can be compared
+    against the indexed day number columns.
     """
 
     def __init__(self, field_name: str):
         """Create a new value interpreter for dates.
 
-        @param field_name: The name of the field of which this interpreter will
-            be used.
+        @param field_name: The name of the day number field of which this
+            interpreter will be used.
         """
         super(DateInterpretField, self).__init__(field_name)
 
-    def interpret_single(self, val: str) -> str:
+    def interpret_single(self, val: str) -> int:
         """Interpret a value.
 
-        @param val: The value to interpret.
-        @returns: Interpreted value.
+        @param val: The value to interpret as MM/DD/YYYY or YYYY/MM/DD.
+        @returns: Interpreted value as days since interp_util.DAY_NUM_EPOCH.
         """
-        parts = val.split('/')
-        return parts[2] + '/' + parts[0] + '/' + parts[1]
+        parts = val.strip().split('/')
+        if len(parts) == 3 and len(parts[0]) != 4:
+            parts = [parts[2], parts[0], parts[1]]
 
-    def interpret_value(self, val: typing.Union[str, int, float]) -> typing.List[str]:
-        """Return user provided operand value without interpretation.
+        day_num = interp_util.safe_interpret_day_num('/'.join(parts))
+        if day_num == None:
+            raise RuntimeError('Unexpected value: ' + val)
+
+        return day_num # type: ignore
+
+    def interpret_value(self, val: typing.Union[str, int, float]) -> typing.List[int]:
+        """Return user provided operand interpreted as a day number.
 
         @param val: The original user provided operand value.
         @type val: str
-        @return: Originally provided value.
-        @rtype: str
+        @return: Days since interp_util.DAY_NUM_EPOCH.
+        @rtype: int
         """
-        vals = FieldInfo.interpret_value(self, val)
-        vals = list(map(lambda x: self.interpret_single(x), vals))
-        return vals
+        raw_vals = str(val).split(',')
+        return list(map(lambda x: self.interpret_single(x), raw_vals))
 
 
 class RawInterpretField(FieldInfo[str]):
@@ -244,3 +269,73 @@ class NumericalField(FieldInfo[float]):
             except ValueError:
                 ret_vals.append(candidate_val)
         return ret_vals
+
+
+class LanguageField(FieldInfo[str]):
+    """A value interpreter for filters on the languages a participant speaks.
+
+    Languages are kept one per row in the snapshot_languages table so this
+    compares against that table through an indexed subquery instead of the
+    comma separated languages column on snapshots.
+    """
+
+    SUBQUERY_TEMPLATE = (
+        '%sEXISTS (SELECT 1 FROM snapshot_languages WHERE '
+        'snapshot_languages.snapshot_id = %s.id AND '
+        'snapshot_languages.language %s %s)'
+    )
+
+    def __init__(self, field_name: str):
+        """Create a new value interpreter for languages.
+
+        @param field_name: The name of the field of which this interpreter will
+            be used.
+        """
+        super(LanguageField, self).__init__(field_name)
+
+    def build_comparison(self, operator: str) -> str:
+        """Get the SQL condition checking the languages of a snapshot.
+
+        The != operator matches snapshots which do not list the language at
+        all rather than snapshots which list any other language.
+
+        @param operator: The SQL operator to compare with like == or !=.
+        @returns: SQL condition with one placeholder for the operand.
+        """
+        if operator == '!=':
+            return self.SUBQUERY_TEMPLATE % (
+                'NOT ',
+                constants.SNAPSHOTS_DB_TABLE,
+                '==',
+                '?'
+            )
+        else:
+            return self.SUBQUERY_TEMPLATE % (
+                '',
+                constants.SNAPSHOTS_DB_TABLE,
+                operator,
+                '?'
+            )
+
+    def build_in_comparison(self, values_sql: str) -> str:
+        """Get the SQL condition checking for any of a set of languages.
+
+        @param values_sql: Parenthesized placeholders or subquery providing the
+            languages to match.
+        @returns: SQL condition true if the snapshot lists any of the languages.
+        """
+        return self.SUBQUERY_TEMPLATE % (
+            '',
+            constants.SNAPSHOTS_DB_TABLE,
+            'IN',
+            values_sql
+        )
+
+    def interpret_value(self, val: typing.Union[str, int, float]) -> typing.List[str]:
+        """Return user provided languages normalized as they are stored.
+
+        @param val: The original user provided operand value.
+        @return: Lower cased languages without surrounding whitespace.
+        """
+        vals = FieldInfo.interpret_value(self, val)
+        return list(map(lambda x: str(x).strip().lower(), vals))
@@ -28,6 +28,17 @@ class OperUtilTests(unittest.TestCase):
         self.assertEqual(target_field.interpret_value('Test')[0], 'Test')
         self.assertEqual(target_field.get_field_name(), 'Test1')
 
+    def test_date_interpret_field(self):
+        target_field = oper_interp.DateInterpretField('Test6')
+
+        target_vals = target_field.interpret_value('03/20/2010,2010/03/21')
+        self.assertEqual(target_vals, [14688, 14689])
+
+        with self.assertRaises(RuntimeError):
+            target_field.interpret_value('20/03/2010')
+
+        self.assertEqual(target_field.get_field_name(), 'Test6')
+
     def test_gender_field(self):
         target_field = oper_interp.GenderField('Test2')
 
@@ -66,3 +77,17 @@ class OperUtilTests(unittest.TestCase):
         self.assertEqual(target_val, 1.23)
 
         self.assertEqual(target_field.get_field_name(), 'Test4')
+
+    def test_language_field(self):
+        target_field = oper_interp.LanguageField('Test5')
+
+        target_vals = target_field.interpret_value('English, spanish')
+        self.assertEqual(target_vals, ['english', 'spanish'])
+
+        comparison = target_field.build_comparison('==')
+        self.assertTrue(comparison.startswith('EXISTS'))
+        self.assertTrue('snapshot_languages.language == ?' in comparison)
+
+        comparison = target_field.build_comparison('!=')
+        self.assertTrue(comparison.startswith('NOT EXISTS'))
+        self.assertTrue('snapshot_languages.language == ?' in comparison)
@@ -0,0 +1,363 @@
+"""Logic for keeping per-study exports rendered ahead of download.
+
+Watches the snapshot change log and, once a study has stopped changing for a
+while, rebuilds that study's ZIP and CSV exports in the background so that
+they can be served as static files.
+
+Copyright (C) 2014 A. Samuel Pottinger ("Sam Pottinger", gleap.org)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Outside of the web application, run the scheduler from the repository root
+with:
+
+    $ python -m prog_code.util.prebuilt_export_util format_name [--once]
+
+Use --once to rebuild the exports of studies changed since the last run and
+then exit instead of watching for further changes.
+
+@author: Sam Pottinger
+@license: GNU GPL v3
+"""
+import collections
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import typing
+import urllib.parse
+
+from ..struct import models
+
+import prog_code.util.constants as constants
+import prog_code.util.db_util as db_util
+import prog_code.util.file_util as file_util
+import prog_code.util.filter_util as filter_util
+import prog_code.util.report_util as report_util
+
+PREBUILT_EXPORT_DIR = os.path.join(file_util.ROOT_DIR, 'prebuilt_exports')
+
+# Name of the presentation format used to render prebuilt exports. Exports are
+# not built if None.
+PREBUILT_EXPORT_FORMAT: typing.Optional[str] = None
+
+# A study is rebuilt once it has gone this many seconds without changes or
+# once it has been waiting PREBUILT_EXPORT_MAX_DELAY seconds, whichever is
+# first.
+PREBUILT_EXPORT_DEBOUNCE = 300
+PREBUILT_EXPORT_MAX_DELAY = 3600
+PREBUILT_EXPORT_POLL_INTERVAL = 30
+
+EXPORT_KIND_ZIP = 'zip'
+EXPORT_KIND_CSV = 'csv'
+EXPORT_KINDS = [EXPORT_KIND_ZIP, EXPORT_KIND_CSV]
+
+STATE_FILENAME = 'state.json'
+ONCE_FLAG = '--once'
+
+PrebuiltExport = collections.namedtuple(
+    'PrebuiltExport',
+    ['study', 'kind', 'size', 'modified']
+)
+
+
+class SchedulerState:
+    """Progress of the scheduler through the snapshot change log."""
+
+    def __init__(self, sequence: int = 0,
+            pending: typing.Optional[typing.Dict[str, typing.List[float]]] = None):
+        """Create a new record of scheduler progress.
+
+        @param sequence: The last change log sequence number read.
+        @param pending: Studies waiting to be rebuilt mapped to the times of
+            their first and most recent unbuilt changes.
+        """
+        self.sequence = sequence
+        self.pending = {} if pending == None else pending
+
+
+def get_export_filename(study: str, kind: str) -> str:
+    """Get the name of the file holding a study's prebuilt export.
+
+    @param study: The name of the study.
+    @param kind: One of EXPORT_KINDS.
+    @returns: File name safe for any study name.
+    """
+    return '%s.%s' % (urllib.parse.quote(study, safe=''), kind)
+
+
+def get_export_path(study: str, kind: str) -> str:
+    """Get where a study's prebuilt export is stored.
+
+    @param study: The name of the study.
+    @param kind: One of EXPORT_KINDS.
+    @returns: Path to the export, which may not exist.
+    """
+    return os.path.join(PREBUILT_EXPORT_DIR, get_export_filename(study, kind))
+
+
+def list_prebuilt_exports() -> typing.List[PrebuiltExport]:
+    """List the prebuilt exports available for download.
+
+    @returns: Description of each export sorted by study and kind.
+    """
+    try:
+        names = os.listdir(PREBUILT_EXPORT_DIR)
+    except OSError:
+        return []
+
+    exports = []
+    for name in names:
+        (base, _, kind) = name.rpartition('.')
+        if not base or not kind in EXPORT_KINDS:
+            continue
+
+        try:
+            stat = os.stat(os.path.join(PREBUILT_EXPORT_DIR, name))
+        except OSError:
+            continue
+
+        exports.append(PrebuiltExport(
+            urllib.parse.unquote(base),
+            kind,
+            stat.st_size,
+            stat.st_mtime
+        ))
+
+    return sorted(exports, key=lambda x: (x.study, x.kind))
+
+
+def write_export(path: str, contents: bytes) -> None:
+    """Write an export under a temporary name and then move it into place.
+
+    Readers, including downloads in progress, never see a partial export.
+
+    @param path: Where the export should be stored.
+    @param contents: The rendered export.
+    """
+    (handle, temp_path) = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            f.write(contents)
+        os.replace(temp_path, path)
+    except:
+        os.remove(temp_path)
+        raise
+
+
+def remove_export(path: str) -> None:
+    """Remove a prebuilt export if it exists.
+
+    @param path: Where the export is stored.
+    """
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def build_study_exports(study: str,
+        presentation_format: models.PresentationFormat) -> bool:
+    """Render and store the ZIP and CSV exports for a study.
+
+    Deleted snapshots are left out. If the study no longer has snapshots, its
+    exports are removed.
+
+    @param study: The name of the study.
+    @param presentation_format: The presentation format used to render values.
+    @returns: True if exports were written and False if they were removed.
+    """
+    snapshots = filter_util.run_search_query(
+        [models.Filter('study', 'eq', study)],
+        constants.SNAPSHOTS_DB_TABLE
+    )
+
+    if not snapshots:
+        for kind in EXPORT_KINDS:
+            remove_export(get_export_path(study, kind))
+        return False
+
+    os.makedirs(PREBUILT_EXPORT_DIR, exist_ok=True)
+
+    zip_file = report_util.generate_study_report(snapshots, presentation_format)
+    write_export(get_export_path(study, EXPORT_KIND_ZIP), zip_file.getvalue())
+
+    csv_file = report_util.generate_consolidated_study_report(
+        snapshots,
+        presentation_format
+    )
+    write_export(
+        get_export_path(study, EXPORT_KIND_CSV),
+        csv_file.getvalue().encode('utf-8')
+    )
+
+    return True
+
+
+def load_state() -> SchedulerState:
+    """Load the scheduler's progress saved in the export directory.
+
+    @returns: The saved state or a new state if none was saved, in which case
+        every study in the change log will be rebuilt.
+    """
+    try:
+        with open(os.path.join(PREBUILT_EXPORT_DIR, STATE_FILENAME)) as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        return SchedulerState()
+
+    return SchedulerState(saved['sequence'], saved['pending'])
+
+
+def save_state(state: SchedulerState) -> None:
+    """Save the scheduler's progress in the export directory.
+
+    @param state: The state to save.
+    """
+    os.makedirs(PREBUILT_EXPORT_DIR, exist_ok=True)
+    write_export(
+        os.path.join(PREBUILT_EXPORT_DIR, STATE_FILENAME),
+        json.dumps({
+            'sequence': state.sequence,
+            'pending': state.pending
+        }).encode('utf-8')
+    )
+
+
+def poll_changes(state: SchedulerState, now: float) -> None:
+    """Add studies changed since the last poll to those waiting to be rebuilt.
+
+    @param state: The scheduler state to update.
+    @param now: The current time in seconds since the epoch.
+    """
+    with db_util.get_cursor() as cursor:
+        latest = db_util.get_latest_change_sequence(cursor)
+        if latest <= state.sequence:
+            return
+
+        studies = db_util.load_changed_studies(state.sequence, latest, cursor)
+
+    for study in studies:
+        if study == None:
+            continue
+
+        if study in state.pending:
+            state.pending[study][1] = now
+        else:
+            state.pending[study] = [now, now]
+
+    state.sequence = latest
+
+
+def get_due_studies(state: SchedulerState, now: float) -> typing.List[str]:
+    """Find the studies which have waited long enough to be rebuilt.
+
+    @param state: The scheduler state with the studies waiting to be rebuilt.
+    @param now: The current time in seconds since the epoch.
+    @returns: Names of studies to rebuild.
+    """
+    def is_due(times):
+        (first_change, last_change) = times
+        waited_for_quiet = now - last_change >= PREBUILT_EXPORT_DEBOUNCE
+        waited_too_long = now - first_change >= PREBUILT_EXPORT_MAX_DELAY
+        return waited_for_quiet or waited_too_long
+
+    return sorted(filter(
+        lambda x: is_due(state.pending[x]),
+        state.pending.keys()
+    ))
+
+
+def run_once(state: SchedulerState, now: float, force: bool = False) -> typing.List[str]:
+    """Poll for changes and rebuild the studies which are due.
+
+    @param state: The scheduler state, updated and saved after each rebuild.
+    @param now: The current time in seconds since the epoch.
+    @param force: True if all waiting studies should be rebuilt regardless of
+        how recently they changed.
+    @returns: Names of the studies rebuilt.
+    """
+    if PREBUILT_EXPORT_FORMAT == None:
+        return []
+
+    poll_changes(state, now)
+
+    if force:
+        due_studies = sorted(state.pending.keys())
+    else:
+        due_studies = get_due_studies(state, now)
+
+    if not due_studies:
+        save_state(state)
+        return []
+
+    presentation_format = db_util.load_presentation_model(
+        PREBUILT_EXPORT_FORMAT
+    )
+    if presentation_format == None:
+        raise ValueError(
+            'Unknown presentation format %s.' % PREBUILT_EXPORT_FORMAT
+        )
+
+    for study in due_studies:
+        build_study_exports(study, presentation_format) # type: ignore
+        del state.pending[study]
+        save_state(state)
+
+    return due_studies
+
+
+def run_scheduler(stop_event: threading.Event) -> None:
+    """Rebuild exports as studies change until asked to stop.
+
+    @param stop_event: Event which, once set, ends the scheduler.
+    """
+    state = load_state()
+    while not stop_event.is_set():
+        try:
+            run_once(state, time.time())
+        except Exception as e:
+            sys.stderr.write('Failed to rebuild prebuilt exports: %s\n' % e)
+        stop_event.wait(PREBUILT_EXPORT_POLL_INTERVAL)
+
+
+def start_scheduler() -> threading.Event:
+    """Run the scheduler on a background thread.
+
+    @returns: Event which stops the scheduler when set.
+    """
+    stop_event = threading.Event()
+    thread = threading.Thread(
+        target=run_scheduler,
+        args=(stop_event,),
+        daemon=True
+    )
+    thread.start()
+    return stop_event
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    PREBUILT_EXPORT_FORMAT = next(filter(lambda x: x != ONCE_FLAG, args), None)
+    if PREBUILT_EXPORT_FORMAT == None:
+        sys.stderr.write('Presentation format name required.\n')
+        sys.exit(1)
+
+    if ONCE_FLAG in args:
+        rebuilt = run_once(load_state(), time.time(), force=True)
+        sys.stdout.write('Rebuilt exports for %d studies.\n' % len(rebuilt))
+    else:
+        run_scheduler(threading.Event())
@@ -0,0 +1,213 @@
+"""Tests for keeping per-study exports rendered ahead of download.
+
+Copyright (C) 2014 A. Samuel Pottinger ("Sam Pottinger", gleap.org)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import copy
+import importlib.util
+import io
+import os
+import sys
+import tempfile
+import threading
+import unittest
+import unittest.mock
+
+import flask
+
+from ..struct import models
+
+import prog_code.util.db_util as db_util
+import prog_code.util.db_util_test as db_util_test
+import prog_code.util.filter_util_test as filter_util_test
+import prog_code.util.prebuilt_export_util as prebuilt_export_util
+
+TEST_STUDY = db_util_test.TEST_SNAPSHOT.study
+TEST_APP_CONFIG = {
+    'NO_MAIL': True,
+    'DEBUG_PRINT_EMAIL': False,
+    'PREBUILT_EXPORT_FORMAT': 'test_format'
+}
+CDIBASE_PATH = os.path.join(
+    os.path.dirname(__file__),
+    '..',
+    '..',
+    'cdibase.py'
+)
+TEST_FORMAT_NAME = 'test_format'
+TEST_PRESENTATION_FORMAT = models.PresentationFormat(
+    'Test format',
+    TEST_FORMAT_NAME,
+    'test_format.yaml',
+    {}
+)
+
+
+class PrebuiltExportUtilTests(unittest.TestCase):
+
+    def setUp(self):
+        self.__directory = tempfile.TemporaryDirectory()
+        self.__cursor = db_util_test.create_memory_cursor()
+
+        patches = [
+            unittest.mock.patch(
+                'prog_code.util.prebuilt_export_util.PREBUILT_EXPORT_DIR',
+                self.__directory.name
+            ),
+            unittest.mock.patch(
+                'prog_code.util.prebuilt_export_util.PREBUILT_EXPORT_FORMAT',
+                TEST_FORMAT_NAME
+            ),
+            unittest.mock.patch(
+                'prog_code.util.db_util.get_db_connection',
+                return_value=filter_util_test.TestDBConnection(self.__cursor)
+            ),
+            unittest.mock.patch(
+                'prog_code.util.db_util.load_presentation_model',
+                return_value=TEST_PRESENTATION_FORMAT
+            ),
+            unittest.mock.patch(
+                'prog_code.util.report_util.generate_study_report',
+                side_effect=lambda snapshots, x: io.BytesIO(
+                    ('zip %d' % len(snapshots)).encode('utf-8')
+                )
+            ),
+            unittest.mock.patch(
+                'prog_code.util.report_util.generate_consolidated_study_report',
+                side_effect=lambda snapshots, x: io.StringIO(
+                    'csv %d' % len(snapshots)
+                )
+            )
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        self.__directory.cleanup()
+
+    def __insert_snapshot(self):
+        snapshot = copy.copy(db_util_test.TEST_SNAPSHOT)
+        db_util.insert_snapshot(snapshot, {}, self.__cursor)
+        return snapshot
+
+    def __read_export(self, study, kind):
+        with open(prebuilt_export_util.get_export_path(study, kind)) as f:
+            return f.read()
+
+    def test_get_export_filename(self):
+        self.assertEqual(
+            prebuilt_export_util.get_export_filename('a/b c', 'zip'),
+            'a%2Fb%20c.zip'
+        )
+
+    def test_list_prebuilt_exports(self):
+        for name in ['a%2Fb%20c.zip', 'other.csv', 'state.json', '.csv']:
+            path = os.path.join(self.__directory.name, name)
+            with open(path, 'w') as f:
+                f.write('test')
+
+        exports = prebuilt_export_util.list_prebuilt_exports()
+        self.assertEqual(
+            [(x.study, x.kind, x.size) for x in exports],
+            [('a/b c', 'zip', 4), ('other', 'csv', 4)]
+        )
+
+    def test_run_once_debounces(self):
+        self.__insert_snapshot()
+        state = prebuilt_export_util.load_state()
+
+        rebuilt = prebuilt_export_util.run_once(state, 1000)
+        self.assertEqual(rebuilt, [])
+        self.assertEqual(list(state.pending.keys()), [TEST_STUDY])
+
+        self.__insert_snapshot()
+        rebuilt = prebuilt_export_util.run_once(
+            state,
+            1000 + prebuilt_export_util.PREBUILT_EXPORT_DEBOUNCE
+        )
+        self.assertEqual(rebuilt, [])
+
+        rebuilt = prebuilt_export_util.run_once(
+            state,
+            2000 + prebuilt_export_util.PREBUILT_EXPORT_DEBOUNCE
+        )
+        self.assertEqual(rebuilt, [TEST_STUDY])
+        self.assertEqual(self.__read_export(TEST_STUDY, 'zip'), 'zip 2')
+        self.assertEqual(self.__read_export(TEST_STUDY, 'csv'), 'csv 2')
+
+        saved_state = prebuilt_export_util.load_state()
+        self.assertEqual(saved_state.pending, {})
+        self.assertEqual(
+            saved_state.sequence,
+            db_util.get_latest_change_sequence(self.__cursor)
+        )
+
+    def test_run_once_max_delay(self):
+        state = prebuilt_export_util.load_state()
+        start = 1000
+        now = start
+        while now - start < prebuilt_export_util.PREBUILT_EXPORT_MAX_DELAY:
+            self.__insert_snapshot()
+            self.assertEqual(prebuilt_export_util.run_once(state, now), [])
+            now += prebuilt_export_util.PREBUILT_EXPORT_DEBOUNCE - 1
+
+        self.assertEqual(
+            prebuilt_export_util.run_once(state, now),
+            [TEST_STUDY]
+        )
+
+    def test_run_once_removes_deleted_study(self):
+        snapshot = self.__insert_snapshot()
+        state = prebuilt_export_util.load_state()
+        prebuilt_export_util.run_once(state, 1000, force=True)
+        self.assertEqual(len(prebuilt_export_util.list_prebuilt_exports()), 2)
+
+        db_util.delete_snapshot(snapshot.database_id, self.__cursor)
+        rebuilt = prebuilt_export_util.run_once(state, 1000, force=True)
+        self.assertEqual(rebuilt, [TEST_STUDY])
+        self.assertEqual(prebuilt_export_util.list_prebuilt_exports(), [])
+
+    def test_run_once_without_format(self):
+        self.__insert_snapshot()
+        with unittest.mock.patch('prog_code.util.prebuilt_export_util.PREBUILT_EXPORT_FORMAT', None):
+            state = prebuilt_export_util.load_state()
+            self.assertEqual(
+                prebuilt_export_util.run_once(state, 1000, force=True),
+                []
+            )
+            self.assertEqual(state.pending, {})
+
+    def test_import_starts_no_scheduler(self):
+        spec = importlib.util.spec_from_file_location(
+            'cdibase_import_test',
+            CDIBASE_PATH
+        )
+        module = importlib.util.module_from_spec(spec)
+        num_threads = threading.active_count()
+
+        with unittest.mock.patch.dict(sys.modules, {spec.name: module}):
+            with unittest.mock.patch.object(flask.Config, 'from_pyfile',
+                    autospec=True,
+                    side_effect=lambda config, x: config.update(TEST_APP_CONFIG)):
+                with unittest.mock.patch(
+                        'prog_code.util.prebuilt_export_util.start_scheduler'
+                    ) as mock_start:
+                    spec.loader.exec_module(module)
+                    self.assertFalse(mock_start.called)
+                    self.assertEqual(threading.active_count(), num_threads)
+
+                    module.start_background_tasks()
+                    mock_start.assert_called_once_with()
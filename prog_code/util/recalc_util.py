@@ -18,6 +18,7 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 @author Sam Pottinger
 @license GNU GPL v3
 """
+import collections
 import typing
 
 import prog_code.util.constants as constants
@@ -63,14 +64,58 @@ def realize_cdi_model(
     return model_maybe # type: ignore
 
 
+CompiledCDIFormat = collections.namedtuple(
+    'CompiledCDIFormat',
+    ['words', 'allowed_values', 'count_as_spoken_values']
+)
+
+
+def compile_cdi_model(cdi_model: models.CDIFormat) -> CompiledCDIFormat:
+    """Resolve what is needed to check word values against a CDI format.
+
+    @param cdi_model: The CDI format to compile.
+    @returns: The format's words (lower case without markers), the values a
+        word may take including prefill values, and the values which count as
+        spoken.
+    """
+    words = set()
+    for category in cdi_model.details['categories']:
+        for word in category['words']:
+            words.add(word.replace('*', '').lower())
+
+    allowed_values = set()
+    for option in cdi_model.details['options']:
+        allowed_values.add(option['value'])
+
+        prefill_value = option.get('prefill_value', [])
+        if isinstance(prefill_value, list):
+            allowed_values.update(prefill_value)
+        else:
+            allowed_values.add(prefill_value)
+
+    return CompiledCDIFormat(
+        frozenset(words),
+        frozenset(allowed_values),
+        frozenset(cdi_model.details['count_as_spoken'])
+    )
+
+
 class CachedCDIAdapter:
     """Adapter around db_util that caches CDI information."""
 
-    def __init__(self):
-        """Create an empty adapter."""
-        self.percentiles = {}
-        self.cdi_models = {}
-        self.max_word_counts = {}
+    def __init__(self, cursor_maybe: db_util.OptionalCursor = None):
+        """Create an empty adapter.
+
+        @param cursor_maybe: The cursor to use when loading information not yet
+            cached or None if a new cursor should be created for each load.
+            Provide a cursor if the adapter will be used while that cursor's
+            transaction is open.
+        """
+        self.percentiles: typing.Dict[str, typing.Optional[models.PercentileTable]] = {}
+        self.cdi_models: typing.Dict[str, typing.Optional[models.CDIFormat]] = {}
+        self.max_word_counts: typing.Dict[str, int] = {}
+        self.compiled_cdi_models: typing.Dict[str, typing.Optional[CompiledCDIFormat]] = {}
+        self.cursor_maybe = cursor_maybe
 
     def load_cdi_model(self,
             type_name: str) -> typing.Optional[models.CDIFormat]:
@@ -78,17 +123,46 @@ class CachedCDIAdapter:
         if type_name in self.cdi_models:
             return self.cdi_models[type_name]
 
-        cdi_model = db_util.load_cdi_model(type_name)
+        if self.cursor_maybe == None:
+            cdi_model = db_util.load_cdi_model(type_name)
+        else:
+            cdi_model = db_util.load_cdi_model(type_name, self.cursor_maybe)
+
         self.cdi_models[type_name] = cdi_model
         return cdi_model
 
+    def load_compiled_cdi_model(self,
+            type_name: str) -> typing.Optional[CompiledCDIFormat]:
+        """Load a CDI format and compile it for checking word values.
+
+        @param type_name: The name of the CDI format.
+        @returns: See compile_cdi_model or None if the format is not known.
+        """
+        if type_name in self.compiled_cdi_models:
+            return self.compiled_cdi_models[type_name]
+
+        cdi_model = self.load_cdi_model(type_name)
+        if cdi_model == None:
+            compiled = None
+        else:
+            compiled = compile_cdi_model(cdi_model) # type: ignore
+
+        self.compiled_cdi_models[type_name] = compiled
+        return compiled
+
     def load_percentile_model(self,
             type_name: str) -> typing.Optional[models.PercentileTable]:
         """See db_util.load_percentile_model"""
         if type_name in self.percentiles:
             return self.percentiles[type_name]
 
-        percentile_model = db_util.load_percentile_model(type_name)
+        if self.cursor_maybe == None:
+            percentile_model = db_util.load_percentile_model(type_name)
+        else:
+            percentile_model = db_util.load_percentile_model(
+                type_name,
+                self.cursor_maybe
+            )
         self.percentiles[type_name] = percentile_model
         return percentile_model
 
@@ -126,9 +200,10 @@ def recalculate_age_raw(birthday_str: str, session_date_str: str) -> float:
     @param session_date_str: Date of the session.
     @returns: Age in amoritized months.
     """
-    birthday = interp_util.interpret_date(birthday_str)
-    session_date = interp_util.interpret_date(session_date_str)
-    return interp_util.monthdelta(birthday, session_date)
+    return interp_util.monthdelta_days(
+        interp_util.interpret_day_num(birthday_str),
+        interp_util.interpret_day_num(session_date_str)
+    )
 
 
 def recalculate_percentile(snapshot: models.SnapshotMetadata,
@@ -156,6 +231,21 @@ def recalculate_percentile(snapshot: models.SnapshotMetadata,
     )
 
 
+def get_percentile_table_name(cdi_model: models.CDIFormat, gender: int) -> str:
+    """Determine which percentile table applies to a participant.
+
+    @param cdi_model: The CDI format of the snapshot.
+    @param gender: The gender of the participant.
+    @returns: The name of the percentile table to use.
+    """
+    meta_percentile_info = cdi_model.details['percentiles']
+
+    if gender == constants.MALE or gender == constants.OTHER_GENDER:
+        return meta_percentile_info['male']
+    else:
+        return meta_percentile_info['female']
+
+
 def recalculate_percentile_raw(cached_adapter: CachedCDIAdapter, cdi_type: str,
         gender: int, words_spoken: int, age: float) -> float:
     """Recalculate the percentile for a snapshot.
@@ -172,13 +262,7 @@ def recalculate_percentile_raw(cached_adapter: CachedCDIAdapter, cdi_type: str,
     cdi_model = get_cdi_model_by_name_or_default(cached_adapter, cdi_type)
 
     # Get percentile information
-    meta_percentile_info = cdi_model.details['percentiles']
-
-    percentiles_name = None
-    if gender == constants.MALE or gender == constants.OTHER_GENDER:
-        percentiles_name = meta_percentile_info['male']
-    else:
-        percentiles_name = meta_percentile_info['female']
+    percentiles_name = get_percentile_table_name(cdi_model, gender)
 
     percentiles = cached_adapter.load_percentile_model(percentiles_name)
     assert percentiles != None
@@ -256,15 +340,22 @@ def recalculate_ages_and_percentiles(snapshots: typing.Iterable[models.SnapshotM
         update_snapshots(snapshots)
 
 
-def get_session_number(study: str, study_id: str) -> int:
+def get_session_number(study: str, study_id: str,
+        cursor_maybe: db_util.OptionalCursor = None) -> int:
     """Get the current session number (next to be submitted session number) for a study participant.
 
+    Note that this is only a snapshot of the count. Callers about to insert a
+    new session should prefer db_util.insert_snapshot with
+    assign_session_num=True, which performs the count within the insert.
+
     @param study: The name of the study.
     @param study_id: The ID of the participant in the study.
+    @param cursor_maybe: The cursor to use in executing the operation or None if
+        a new cursor should be created.
     @returns: Next session number (number of previous results + 1).
     """
-    study_filter = models.Filter('study', 'eq', study)
-    study_id_filter = models.Filter('study_id', 'eq', study_id)
-    results = filter_util.run_search_query([study_filter, study_id_filter],
-        'snapshots')
-    return len(results) + 1
+    return db_util.count_participant_sessions(
+        study,
+        study_id,
+        cursor_maybe
+    ) + 1
@@ -133,6 +133,40 @@ class RecalcPercentilesTest(unittest.TestCase):
 
             mock.assert_called_with('test_format')
 
+    def test_load_compiled_cdi_model(self):
+        cdi_model = models.CDIFormat(
+            'human_name',
+            'safe_name',
+            'filename',
+            {
+                'categories': [{'words': ['Word1*', 'word2']}],
+                'options': [
+                    {'value': 0},
+                    {'value': 1, 'prefill_value': [3, 4]},
+                    {'value': 2, 'prefill_value': 5}
+                ],
+                'count_as_spoken': [1, 2]
+            }
+        )
+
+        with unittest.mock.patch('prog_code.util.db_util.load_cdi_model') as mock:
+            mock.side_effect = lambda x: cdi_model if x == 'test_format' else None
+
+            adapter = recalc_util.CachedCDIAdapter()
+            result_1 = adapter.load_compiled_cdi_model('test_format')
+            result_2 = adapter.load_compiled_cdi_model('test_format')
+
+            self.assertEqual(result_1.words, frozenset(['word1', 'word2']))
+            self.assertEqual(
+                result_1.allowed_values,
+                frozenset([0, 1, 2, 3, 4, 5])
+            )
+            self.assertEqual(result_1.count_as_spoken_values, frozenset([1, 2]))
+            self.assertIs(result_1, result_2)
+            self.assertEqual(mock.call_count, 1)
+
+            self.assertEqual(adapter.load_compiled_cdi_model('other'), None)
+
     def test_recalculate_age(self):
         test_snapshot = copy.deepcopy(TEST_SNAPSHOT)
         recalc_util.recalculate_age(test_snapshot)
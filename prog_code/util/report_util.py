@@ -19,14 +19,22 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 @license: GNU GPL v3
 """
 
+import collections
+import concurrent.futures
 import csv
 import io
+import itertools
+import json
+import multiprocessing
+import os
 import typing
 import urllib.parse
 import zipfile
 
 import prog_code.util.constants as constants
 import prog_code.util.db_util as db_util
+import prog_code.util.filter_util as filter_util
+import prog_code.util.type_util as type_util
 
 import prog_code.struct.models as models
 
@@ -53,6 +61,51 @@ PRESENTATION_VALUE_NAME_MAP = {
 
 DEFAULT_CDI = 'fullenglishmcdi'
 
+# Number of snapshots whose words are loaded together when streaming NDJSON.
+NDJSON_BATCH_SIZE = 100
+
+# Names of the snapshot metadata columns in the order of serialize_snapshot.
+REPORT_METADATA_HEADER = [
+    'database id',
+    'child id',
+    'study id',
+    'study',
+    'gender',
+    'age',
+    'birthday',
+    'session date',
+    'session num',
+    'total num sessions',
+    'words spoken',
+    'items excluded',
+    'percentile',
+    'extra categories',
+    'revision',
+    'languages',
+    'num languages',
+    'cdi type',
+    'hard of hearing',
+    'deleted'
+]
+
+LONG_REPORT_HEADER = REPORT_METADATA_HEADER + ['word', 'value']
+
+# Number of processes used to render the studies of a ZIP export. 1 renders
+# them on the calling thread and None uses one process per CPU.
+REPORT_MAX_WORKERS: typing.Optional[int] = 1
+
+# If False, rendered report rows are kept in UNSAVED_REPORT_ROWS for the caller
+# to save instead of being written to the database. Set in worker processes,
+# which only read from the database.
+SAVE_REPORT_ROWS = True
+UNSAVED_REPORT_ROWS: typing.List[
+    typing.Tuple[str, str, typing.List[typing.Tuple[int, int, str]]]] = []
+
+StudyReport = collections.namedtuple(
+    'StudyReport',
+    ['filename', 'contents', 'report_rows']
+)
+
 
 class NotFoundSnapshotContent:
     """A stand-in word snapshot content model.
@@ -93,6 +146,66 @@ def interpret_word_value(value: int,
     return presentation_format_realized.details[name]
 
 
+def compile_value_translation(
+        presentation_format: typing.Optional[models.PresentationFormat]) -> typing.Dict[
+            int, typing.Union[str, int]]:
+    """Build a table translating integer value codes for a presentation format.
+
+    Gives the same results as interpret_word_value for integer values so that
+    each value of an export is translated with a single lookup.
+
+    @param presentation_format: Presentation format information to use to
+        convert values to string descriptions.
+    @return: Mapping from value code to description for every code the format
+        describes. Integer codes not in the table are not translated.
+    """
+    if presentation_format == None:
+        return {}
+
+    details = presentation_format.details # type: ignore
+
+    translation = {}
+    for (code, name) in PRESENTATION_VALUE_NAME_MAP.items():
+        if name in details:
+            translation[code] = details[name]
+
+    for (name, description) in details.items():
+        is_code = isinstance(name, int)
+        if is_code and not name in PRESENTATION_VALUE_NAME_MAP:
+            translation[name] = description
+
+    return translation
+
+
+def translate_word_values(values: typing.Iterable[typing.Any],
+        presentation_format: typing.Optional[models.PresentationFormat],
+        translation: typing.Optional[
+            typing.Dict[int, typing.Union[str, int]]] = None) -> typing.List[
+            typing.Union[str, int]]:
+    """Convert many underlying database values to string descriptions.
+
+    @param values: The values to get string descriptions for.
+    @param presentation_format: Presentation format information to use to
+        convert the values to string descriptions.
+    @param translation: The table from compile_value_translation for
+        presentation_format or None to compile it.
+    @return: Descriptions in the same order as values, matching
+        interpret_word_value for each value.
+    """
+    if translation == None:
+        translation = compile_value_translation(presentation_format)
+
+    translation_realized: typing.Dict = translation # type: ignore
+
+    def translate(value):
+        if isinstance(value, int):
+            return translation_realized.get(value, value)
+        else:
+            return interpret_word_value(value, presentation_format)
+
+    return list(map(translate, values))
+
+
 def summarize_snapshots(snapshot_metas: typing.Iterable[models.SnapshotMetadata]) -> typing.Dict[
         str, typing.Any]:
     """Summarize snapshots as primitives.
@@ -138,7 +251,7 @@ def summarize_snapshots(snapshot_metas: typing.Iterable[models.SnapshotMetadata]
 
 
 def serialize_snapshot(snapshot: models.SnapshotMetadata,
-        presentation_format: models.PresentationFormat = None,
+        presentation_format: typing.Optional[models.PresentationFormat] = None,
         word_listing: typing.List[str] = None,
         report_dict: bool = False,
         include_words: bool = True) -> typing.Union[dict, typing.List]:
@@ -172,10 +285,10 @@ def serialize_snapshot(snapshot: models.SnapshotMetadata,
             word_listing
         )
 
-        word_values = list(map(
-            lambda x: interpret_word_value(x.value, presentation_format),
-            snapshot_contents_sorted
-        ))
+        word_values = translate_word_values(
+            map(lambda x: x.value, snapshot_contents_sorted),
+            presentation_format
+        )
 
     if report_dict:
         gender = interpret_word_value(snapshot.gender, presentation_format)
@@ -239,6 +352,178 @@ def serialize_snapshot(snapshot: models.SnapshotMetadata,
         return return_list
 
 
+def serialize_words(snapshot_contents: typing.Iterable[models.SnapshotContent],
+        presentation_format: typing.Optional[models.PresentationFormat] = None,
+        translation: typing.Optional[
+            typing.Dict[int, typing.Union[str, int]]] = None) -> typing.Dict[
+            str, typing.Union[str, int]]:
+    """Describe the individual word values of a snapshot.
+
+    @param snapshot_contents: The word statuses loaded for the snapshot.
+    @param presentation_format: The presentation format to use to render
+        special values.
+    @param translation: The table from compile_value_translation for
+        presentation_format or None to compile it.
+    @return: Mapping from word to its (possibly interpreted) value.
+    """
+    snapshot_contents_realized = list(snapshot_contents)
+    values = translate_word_values(
+        map(lambda x: x.value, snapshot_contents_realized),
+        presentation_format,
+        translation
+    )
+    return dict(zip(map(lambda x: x.word, snapshot_contents_realized), values))
+
+
+def generate_ndjson_lines(snapshots: typing.Iterable[models.SnapshotMetadata],
+        presentation_format: typing.Optional[models.PresentationFormat] = None,
+        include_words: bool = False,
+        batch_size: int = NDJSON_BATCH_SIZE) -> typing.Iterator[str]:
+    """Serialize snapshots as newline delimited JSON while they are read.
+
+    Snapshots are consumed in batches so that, if requested, word values can be
+    loaded for the whole batch in a single query instead of one per snapshot.
+
+    @param snapshots: The snapshots to serialize. May be a lazy iterator.
+    @param presentation_format: The presentation format to use to render
+        special values.
+    @param include_words: Flag indicating if each record should include a
+        "words" mapping from word to value.
+    @param batch_size: The number of snapshots to serialize at a time.
+    @return: Iterator over lines, one JSON object per snapshot.
+    """
+    snapshots_iter = iter(snapshots)
+    translation = compile_value_translation(presentation_format)
+
+    while True:
+        batch = list(itertools.islice(snapshots_iter, batch_size))
+        if not batch:
+            return
+
+        if include_words:
+            contents = db_util.load_snapshot_contents_batch(
+                map(lambda x: type_util.assert_not_none(x.database_id), batch)
+            )
+
+        for snapshot in batch:
+            record = serialize_snapshot(
+                snapshot,
+                presentation_format=presentation_format,
+                report_dict=True,
+                include_words=False
+            )
+
+            if include_words:
+                record['words'] = serialize_words( # type: ignore
+                    contents[type_util.assert_not_none(snapshot.database_id)],
+                    presentation_format,
+                    translation
+                )
+
+            yield json.dumps(record) + '\n'
+
+
+def normalize_word(word: str) -> str:
+    """Get the form of a word used to match it across CDI formats.
+
+    @param word: The word as stored in snapshot contents or a word listing.
+    @return: Lower case word without asterisks.
+    """
+    return word.lower().replace('*', '')
+
+
+def load_report_records(snapshots: typing.List[models.SnapshotMetadata],
+        presentation_format: models.PresentationFormat) -> typing.List[typing.List]:
+    """Serialize snapshots for a report, reusing rows saved by earlier reports.
+
+    Each record is the snapshot serialized without words followed by the list
+    of its (word, interpreted value) pairs. Records for snapshots which have
+    not changed since they were last exported with the same presentation format
+    are read from the database instead of being rendered again. The rest are
+    rendered with their contents loaded in batches. A rendered row is saved
+    only if the given snapshot still matches the database, and it is saved
+    with the snapshot's latest change sequence number so that a change made
+    while rendering is not hidden by the stale row.
+
+    @param snapshots: The snapshots to serialize.
+    @param presentation_format: The presentation format to use to render the
+        string serialization.
+    @return: Records in the same order as snapshots.
+    """
+    if presentation_format == None:
+        format_name = ''
+        format_version = ''
+    else:
+        format_name = presentation_format.safe_name
+        format_version = str(
+            db_util.get_presentation_format_version(presentation_format)
+        )
+
+    snapshot_ids = list(map(
+        lambda x: type_util.assert_not_none(x.database_id),
+        snapshots
+    ))
+    rows = db_util.load_report_rows(snapshot_ids, format_name, format_version)
+
+    missing = list(filter(lambda x: not x.database_id in rows, snapshots))
+    if missing:
+        sources = db_util.load_report_sources(
+            map(lambda x: type_util.assert_not_none(x.database_id), missing)
+        )
+        saved_snapshots = dict(map(
+            lambda x: (x.database_id, x),
+            filter_util.convert_snapshot_rows(
+                list(sources.snapshot_rows.values())
+            )
+        ))
+
+        translation = compile_value_translation(presentation_format)
+
+        new_rows: typing.Dict[int, str] = {}
+        rows_to_save: typing.List[typing.Tuple[int, int, str]] = []
+        for snapshot in missing:
+            snapshot_id = type_util.assert_not_none(snapshot.database_id)
+            snapshot_contents = sources.contents[snapshot_id]
+            values = translate_word_values(
+                map(lambda x: x.value, snapshot_contents),
+                presentation_format,
+                translation
+            )
+            words = zip(map(lambda x: x.word, snapshot_contents), values)
+            serialized_snapshot = serialize_snapshot(
+                snapshot,
+                presentation_format=presentation_format,
+                include_words=False
+            )
+            row = json.dumps([serialized_snapshot, list(words)])
+            new_rows[snapshot_id] = row
+
+            saved_snapshot = saved_snapshots.get(snapshot_id, None)
+            if saved_snapshot == None:
+                continue
+
+            serialized_saved_snapshot = serialize_snapshot(
+                saved_snapshot,
+                presentation_format=presentation_format,
+                include_words=False
+            )
+            if serialized_saved_snapshot == serialized_snapshot:
+                rows_to_save.append(
+                    (snapshot_id, sources.change_sequences[snapshot_id], row)
+                )
+
+        if SAVE_REPORT_ROWS:
+            db_util.save_report_rows(rows_to_save, format_name, format_version)
+        elif rows_to_save:
+            UNSAVED_REPORT_ROWS.append(
+                (format_name, format_version, rows_to_save)
+            )
+
+        rows.update(new_rows)
+
+    return list(map(lambda x: json.loads(rows[x]), snapshot_ids))
+
+
 def generate_study_report_rows(snapshots_from_study: typing.List[models.SnapshotMetadata],
         presentation_format: models.PresentationFormat) -> typing.List[typing.Tuple[str, typing.Any]]:
     """Serialize a set of snapshots to a collection of lists of strings.
@@ -252,45 +537,32 @@ def generate_study_report_rows(snapshots_from_study: typing.List[models.Snapshot
         header information.
     @rtype: List of list of str.
     """
+    records = load_report_records(snapshots_from_study, presentation_format)
+
     word_listing_set: typing.Set[str] = set()
-    for snapshot in snapshots_from_study:
-        snapshot_contents = db_util.load_snapshot_contents(snapshot)
-        candidate_word_listing = set(map(
-            lambda x: x.word,
-            snapshot_contents
-        ))
-        word_listing_set = word_listing_set.union(candidate_word_listing)
+    for (_, words) in records:
+        word_listing_set.update(map(lambda x: x[0], words))
 
     word_listing = list(word_listing_set)
     word_listing.sort()
+    word_listing_normalized = list(map(normalize_word, word_listing))
 
-    serialized_snapshots = map(
-        lambda x: serialize_snapshot(x, presentation_format, word_listing),
-        snapshots_from_study
+    not_found_value = interpret_word_value(
+        constants.NO_DATA,
+        presentation_format
     )
 
-    header_col = [
-        'database id',
-        'child id',
-        'study id',
-        'study',
-        'gender',
-        'age',
-        'birthday',
-        'session date',
-        'session num',
-        'total num sessions',
-        'words spoken',
-        'items excluded',
-        'percentile',
-        'extra categories',
-        'revision',
-        'languages',
-        'num languages',
-        'cdi type',
-        'hard of hearing',
-        'deleted'
-    ]
+    def assemble_row(record):
+        (metadata, words) = record
+        values = dict(map(lambda x: (normalize_word(x[0]), x[1]), words))
+        return metadata + list(map(
+            lambda x: values.get(x, not_found_value),
+            word_listing_normalized
+        ))
+
+    serialized_snapshots = map(assemble_row, records)
+
+    header_col = list(REPORT_METADATA_HEADER)
     header_col.extend(word_listing)
 
     cols = [header_col]
@@ -299,6 +571,51 @@ def generate_study_report_rows(snapshots_from_study: typing.List[models.Snapshot
     return list(zip(*cols)) # type: ignore
 
 
+def generate_long_report_lines(snapshot_contents: typing.Iterable[
+            typing.Tuple[models.SnapshotMetadata, typing.List[typing.Tuple[str, int]]]],
+        presentation_format: models.PresentationFormat) -> typing.Iterator[str]:
+    """Serialize snapshots as a CSV file with one row per word.
+
+    Unlike the wide reports, no listing of words across snapshots is built so
+    the file can be written while snapshots are read, one snapshot at a time.
+
+    @param snapshot_contents: Pairs of snapshot and its (word, value) pairs
+        like those from filter_util.iter_search_contents_query.
+    @param presentation_format: The presentation format to use to render the
+        string serialization.
+    @return: Iterator over chunks of the CSV file, starting with the header.
+    """
+    translation = compile_value_translation(presentation_format)
+
+    faux_file = io.StringIO()
+    csv_writer = csv.writer(faux_file)
+    csv_writer.writerow(LONG_REPORT_HEADER)
+
+    for (snapshot, contents) in snapshot_contents:
+        metadata = serialize_snapshot(
+            snapshot,
+            presentation_format=presentation_format,
+            include_words=False
+        )
+        values = translate_word_values(
+            map(lambda x: x[1], contents),
+            presentation_format,
+            translation
+        )
+        csv_writer.writerows(map(
+            lambda x: metadata + [x[0][0], x[1]], # type: ignore
+            zip(contents, values)
+        ))
+
+        yield faux_file.getvalue()
+        faux_file.seek(0)
+        faux_file.truncate()
+
+    remaining = faux_file.getvalue()
+    if remaining:
+        yield remaining
+
+
 def sort_by_study_order(rows: typing.List[typing.Any], cdi_format: models.CDIFormat) -> typing.List:
     """Sort report output rows such that they are in the same order as the CDI.
 
@@ -409,21 +726,111 @@ def generate_consolidated_study_report(snapshots_iter: typing.Iterable[models.Sn
     )
 
 
-def generate_study_report(snapshots, presentation_format):
+def init_report_worker() -> None:
+    """Prepare a worker process to render study reports.
+
+    Workers open their own read-only database connections and leave saving
+    the report rows they render to the parent process.
+    """
+    global SAVE_REPORT_ROWS
+
+    db_util.DB_READ_ONLY = True
+    SAVE_REPORT_ROWS = False
+
+
+def render_study_report(study_name: str,
+        snapshots_from_study: typing.List[models.SnapshotMetadata],
+        presentation_format: models.PresentationFormat) -> StudyReport:
+    """Render the CSV file for a single study within a ZIP export.
+
+    @param study_name: The name of the study.
+    @param snapshots_from_study: The snapshots in the study.
+    @param presentation_format: The presentation format to use to render the
+        string serialization.
+    @return: The name and contents of the file in the archive along with any
+        report rows rendered but not yet saved as (format name, format version,
+        rows) tuples.
+    """
+    del UNSAVED_REPORT_ROWS[:]
+
+    report = generate_study_report_csv(
+        snapshots_from_study,
+        presentation_format
+    )
+
+    report_rows = list(UNSAVED_REPORT_ROWS)
+    del UNSAVED_REPORT_ROWS[:]
+
+    return StudyReport('%s.csv' % study_name, report.getvalue(), report_rows)
+
+
+def render_study_reports_parallel(
+        snapshots_by_study: typing.Dict[str, typing.List[models.SnapshotMetadata]],
+        presentation_format: models.PresentationFormat,
+        max_workers: int) -> typing.Iterator[StudyReport]:
+    """Render the CSV files for many studies in worker processes.
+
+    Processes are spawned rather than forked so that they open their own
+    database connections. Report rows rendered by the workers are saved by
+    this process.
+
+    @param snapshots_by_study: The snapshots to report on by study name.
+    @param presentation_format: The presentation format to use to render the
+        string serialization.
+    @param max_workers: The maximum number of processes to use.
+    @return: Iterator over the rendered files in the order they finish.
+    """
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=min(max_workers, len(snapshots_by_study)),
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=init_report_worker) as executor:
+        futures = [
+            executor.submit(
+                render_study_report,
+                study_name,
+                snapshots_by_study[study_name],
+                presentation_format
+            )
+            for study_name in sorted(snapshots_by_study.keys())
+        ]
+
+        for future in concurrent.futures.as_completed(futures):
+            study_report = future.result()
+            for (format_name, format_version, rows) in study_report.report_rows:
+                db_util.save_report_rows(rows, format_name, format_version)
+            yield study_report
+
+
+def generate_study_report(snapshots_iter, presentation_format,
+        max_workers=None):
     """Generate a zip archive for a set of snapshots
 
     Create a zip archive of CSV reports for a set of snapshots where each study
-    gets an individual CSV file in the archive.
+    gets an individual CSV file in the archive. If more than one worker is
+    allowed, studies are rendered in parallel and written to the archive as
+    they finish.
 
-    @param snapshots_from_study: The snapshots to create a CSV report for.
-    @type snapshots_from_study: Iterable over models.SnapshotMetadata
+    @param snapshots_iter: The snapshots to create a CSV report for.
+    @type snapshots_iter: Iterable over models.SnapshotMetadata
     @param presentation_format: The presentation format to use to render the
         string serialization.
     @type: presentation_format: models.PresentationFormat
+    @param max_workers: The maximum number of processes to use or None to use
+        REPORT_MAX_WORKERS.
+    @type max_workers: int
     @return: Contents of the zip archive file.
     @rtype: io.StringIO
     """
-    snapshots.sort(key=lambda x: '%s_%s' % (x.session_num, x.study_id))
+    if max_workers == None:
+        max_workers = REPORT_MAX_WORKERS
+
+    if max_workers == None:
+        max_workers = os.cpu_count() or 1
+
+    snapshots = sorted(
+        snapshots_iter,
+        key=lambda x: '%s_%s' % (x.session_num, x.study_id)
+    )
 
     snapshots_by_study = {}
     for snapshot in snapshots:
@@ -432,17 +839,25 @@ def generate_study_report(snapshots, presentation_format):
             snapshots_by_study[study] = []
         snapshots_by_study[study].append(snapshot)
 
-    faux_files = {}
-    for study_name in sorted(snapshots_by_study.keys()):
-        report = generate_study_report_csv(
-            snapshots_by_study[study_name],
-            presentation_format
+    if max_workers > 1 and len(snapshots_by_study) > 1:
+        study_reports = render_study_reports_parallel(
+            snapshots_by_study,
+            presentation_format,
+            max_workers
+        )
+    else:
+        study_reports = map(
+            lambda x: render_study_report(
+                x,
+                snapshots_by_study[x],
+                presentation_format
+            ),
+            sorted(snapshots_by_study.keys())
         )
-        faux_files['%s.csv' % study_name] = report
 
     faux_zip_file = io.BytesIO()
     zip_file = zipfile.ZipFile(faux_zip_file, mode='w')
-    for (filename, faux_file) in faux_files.items():
-        zip_file.writestr(filename, faux_file.getvalue())
+    for study_report in study_reports:
+        zip_file.writestr(study_report.filename, study_report.contents)
 
     return faux_zip_file
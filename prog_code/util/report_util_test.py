@@ -15,13 +15,22 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
+import concurrent.futures
+import copy
+import csv
+import io
+import json
 import unittest
 import unittest.mock
+import zipfile
 
 from ..struct import models
 from ..util import constants
 
 import prog_code.util.db_util as db_util
+import prog_code.util.db_util_test as db_util_test
+import prog_code.util.filter_util as filter_util
+import prog_code.util.filter_util_test as filter_util_test
 import prog_code.util.report_util as report_util
 
 TEST_SNAPSHOT_ID = 789
@@ -142,107 +151,450 @@ class ReportUtilTest(unittest.TestCase):
                 mock_snapshot.assert_any_call(test_metadata[2])
 
     def test_generate_study_report_csv(self):
-        with unittest.mock.patch('prog_code.util.db_util.load_cdi_model') as mock_cdi:
-            with unittest.mock.patch('prog_code.util.db_util.load_snapshot_contents') as mock_snapshot:
-                test_snap_1 = TEST_SNAPSHOT.clone()
-                test_snap_1.cdi_type = 'cdi_type_1'
-                test_snap_1.session_date = '2015/01/01'
-
-                test_snap_2 = TEST_SNAPSHOT.clone()
-                test_snap_2.cdi_type = 'cdi_type_1'
-                test_snap_2.session_date = '2015/02/01'
-
-                test_snap_3 = TEST_SNAPSHOT.clone()
-                test_snap_3.cdi_type = 'cdi_type_1'
-                test_snap_3.session_date = '2015/03/01'
-
-                test_metadata = [test_snap_1, test_snap_2, test_snap_3]
+        with unittest.mock.patch('prog_code.util.db_util.load_report_rows') as mock_load_rows:
+            with unittest.mock.patch('prog_code.util.db_util.save_report_rows'):
+                mock_load_rows.return_value = {}
+
+                with unittest.mock.patch('prog_code.util.db_util.load_cdi_model') as mock_cdi:
+                    with unittest.mock.patch('prog_code.util.db_util.load_report_sources') as mock_snapshot:
+                        test_snap_1 = TEST_SNAPSHOT.clone()
+                        test_snap_1.database_id = 1
+                        test_snap_1.cdi_type = 'cdi_type_1'
+                        test_snap_1.session_date = '2015/01/01'
+
+                        test_snap_2 = TEST_SNAPSHOT.clone()
+                        test_snap_2.database_id = 2
+                        test_snap_2.cdi_type = 'cdi_type_1'
+                        test_snap_2.session_date = '2015/02/01'
+
+                        test_snap_3 = TEST_SNAPSHOT.clone()
+                        test_snap_3.database_id = 3
+                        test_snap_3.cdi_type = 'cdi_type_1'
+                        test_snap_3.session_date = '2015/03/01'
+
+                        test_metadata = [test_snap_1, test_snap_2, test_snap_3]
+
+                        test_contents_1 = [
+                            models.SnapshotContent(0, 'word1', 1, 1),
+                            models.SnapshotContent(0, 'word2', 0, 1),
+                            models.SnapshotContent(0, 'word3', 0, 1)
+                        ]
+                        test_contents_2 = [
+                            models.SnapshotContent(0, 'word1', 1, 1),
+                            models.SnapshotContent(0, 'word2', 2, 1),
+                            models.SnapshotContent(0, 'word3', 0, 1)
+                        ]
+                        test_contents_3 = [
+                            models.SnapshotContent(0, 'word1', 1, 1),
+                            models.SnapshotContent(0, 'word2', 1, 1),
+                            models.SnapshotContent(0, 'word3', 1, 1)
+                        ]
+
+                        categories = [{
+                            'words': ['word1', 'word2', 'word3']
+                        }]
+
+                        mock_cdi.side_effect = [
+                            models.CDIFormat('', '', '', {'count_as_spoken': [1, 2], 'categories': categories}),
+                        ]
+
+                        mock_snapshot.return_value = db_util.ReportSources(
+                            {
+                                1: test_contents_1,
+                                2: test_contents_2,
+                                3: test_contents_3
+                            },
+                            {},
+                            {1: 0, 2: 0, 3: 0}
+                        )
+
+                        results = report_util.generate_study_report_csv(
+                            test_metadata,
+                            models.CDIFormat('', '', '', {'count_as_spoken': [1, 2], 'categories': categories})
+                        )
+                        self.assertTrue(results != None)
 
-                test_contents_1 = [
-                    models.SnapshotContent(0, 'word1', 1, 1),
-                    models.SnapshotContent(0, 'word2', 0, 1),
-                    models.SnapshotContent(0, 'word3', 0, 1)
-                ]
-                test_contents_2 = [
-                    models.SnapshotContent(0, 'word1', 1, 1),
-                    models.SnapshotContent(0, 'word2', 2, 1),
-                    models.SnapshotContent(0, 'word3', 0, 1)
-                ]
-                test_contents_3 = [
-                    models.SnapshotContent(0, 'word1', 1, 1),
-                    models.SnapshotContent(0, 'word2', 1, 1),
-                    models.SnapshotContent(0, 'word3', 1, 1)
-                ]
+    def test_generate_study_report_zip(self):
+        with unittest.mock.patch('prog_code.util.db_util.load_report_rows') as mock_load_rows:
+            with unittest.mock.patch('prog_code.util.db_util.save_report_rows'):
+                mock_load_rows.return_value = {}
+
+                with unittest.mock.patch('prog_code.util.db_util.load_cdi_model') as mock_cdi:
+                    with unittest.mock.patch('prog_code.util.db_util.load_report_sources') as mock_snapshot:
+                        test_snap_1 = TEST_SNAPSHOT.clone()
+                        test_snap_1.database_id = 1
+                        test_snap_1.cdi_type = 'cdi_type_1'
+                        test_snap_1.session_date = '2015/01/01'
+
+                        test_snap_2 = TEST_SNAPSHOT.clone()
+                        test_snap_2.database_id = 2
+                        test_snap_2.cdi_type = 'cdi_type_1'
+                        test_snap_2.session_date = '2015/02/01'
+
+                        test_snap_3 = TEST_SNAPSHOT.clone()
+                        test_snap_3.database_id = 3
+                        test_snap_3.cdi_type = 'cdi_type_1'
+                        test_snap_3.session_date = '2015/03/01'
+
+                        test_metadata = [test_snap_1, test_snap_2, test_snap_3]
+
+                        test_contents_1 = [
+                            models.SnapshotContent(0, 'word1', 1, 1),
+                            models.SnapshotContent(0, 'word2', 0, 1),
+                            models.SnapshotContent(0, 'word3', 0, 1)
+                        ]
+                        test_contents_2 = [
+                            models.SnapshotContent(0, 'word1', 1, 1),
+                            models.SnapshotContent(0, 'word2', 2, 1),
+                            models.SnapshotContent(0, 'word3', 0, 1)
+                        ]
+                        test_contents_3 = [
+                            models.SnapshotContent(0, 'word1', 1, 1),
+                            models.SnapshotContent(0, 'word2', 1, 1),
+                            models.SnapshotContent(0, 'word3', 1, 1)
+                        ]
+
+                        categories = [{
+                            'words': ['word1', 'word2', 'word3']
+                        }]
+
+                        mock_cdi.side_effect = [
+                            models.CDIFormat('', '', '', {'count_as_spoken': [1, 2], 'categories': categories}),
+                        ]
+
+                        mock_snapshot.return_value = db_util.ReportSources(
+                            {
+                                1: test_contents_1,
+                                2: test_contents_2,
+                                3: test_contents_3
+                            },
+                            {},
+                            {1: 0, 2: 0, 3: 0}
+                        )
+
+                        results = report_util.generate_study_report(
+                            test_metadata,
+                            models.CDIFormat('', '', '', {'count_as_spoken': [1, 2], 'categories': categories})
+                        )
+                        self.assertTrue(results != None)
+
+    def test_translate_word_values(self):
+        presentation_format = models.PresentationFormat(
+            'Test format',
+            'test_format',
+            'test_format.yaml',
+            {'no_data': 'na', 'explicit_true': 'yes', 5: 'five', 'abc': 'ABC'}
+        )
+        values = [constants.NO_DATA, 1, constants.LEGACY_TRUE, 0, 5, 7, '1', 'abc', 'xyz']
 
-                categories = [{
-                    'words': ['word1', 'word2', 'word3']
-                }]
+        self.assertEqual(
+            report_util.translate_word_values(values, presentation_format),
+            ['na', 'yes', 'yes', 0, 'five', 7, 'yes', 'ABC', 'xyz']
+        )
+        self.assertEqual(
+            report_util.translate_word_values(values, presentation_format),
+            list(map(
+                lambda x: report_util.interpret_word_value(x, presentation_format),
+                values
+            ))
+        )
+        self.assertEqual(
+            report_util.translate_word_values(values, None),
+            [constants.NO_DATA, 1, constants.LEGACY_TRUE, 0, 5, 7, 1, 'abc', 'xyz']
+        )
 
-                mock_cdi.side_effect = [
-                    models.CDIFormat('', '', '', {'count_as_spoken': [1, 2], 'categories': categories}),
-                ]
+    def test_generate_study_report_rows_saved(self):
+        cursor = db_util_test.create_memory_cursor()
+        presentation_format = models.PresentationFormat(
+            'Test format',
+            'test_format',
+            'test_format.yaml',
+            {'no_data': 'na', 'explicit_true': 'yes'}
+        )
 
-                mock_snapshot.side_effect = [
-                    test_contents_1,
-                    test_contents_2,
-                    test_contents_3
-                ]
+        db_util.insert_snapshot(
+            copy.copy(db_util_test.TEST_SNAPSHOT),
+            {'word1': 1, 'word2*': 0},
+            cursor
+        )
+        db_util.insert_snapshot(
+            copy.copy(db_util_test.TEST_SNAPSHOT),
+            {'word1': 0},
+            cursor
+        )
 
-                results = report_util.generate_study_report_csv(
-                    test_metadata,
-                    models.CDIFormat('', '', '', {'count_as_spoken': [1, 2], 'categories': categories})
+        with unittest.mock.patch('prog_code.util.db_util.get_db_connection') as mock:
+            mock.return_value = filter_util_test.TestDBConnection(cursor)
+
+            snapshots = filter_util.run_search_query([], 'snapshots')
+            (snapshot, other_snapshot) = snapshots
+
+            rows = report_util.generate_study_report_rows(
+                snapshots,
+                presentation_format
+            )
+            self.assertEqual(
+                rows[0],
+                ('database id', snapshot.database_id, other_snapshot.database_id)
+            )
+            self.assertEqual(rows[-2], ('word1', 'yes', 0))
+            self.assertEqual(rows[-1], ('word2*', 0, 'na'))
+
+            with unittest.mock.patch('prog_code.util.db_util.load_report_sources') as mock_sources:
+                saved_rows = report_util.generate_study_report_rows(
+                    snapshots,
+                    presentation_format
                 )
-                self.assertTrue(results != None)
+                self.assertEqual(saved_rows, rows)
+                self.assertEqual(len(mock_sources.mock_calls), 0)
 
-    def test_generate_study_report_zip(self):
-        with unittest.mock.patch('prog_code.util.db_util.load_cdi_model') as mock_cdi:
-            with unittest.mock.patch('prog_code.util.db_util.load_snapshot_contents') as mock_snapshot:
-                test_snap_1 = TEST_SNAPSHOT.clone()
-                test_snap_1.cdi_type = 'cdi_type_1'
-                test_snap_1.session_date = '2015/01/01'
+            db_util.update_snapshot(snapshot, cursor)
 
-                test_snap_2 = TEST_SNAPSHOT.clone()
-                test_snap_2.cdi_type = 'cdi_type_1'
-                test_snap_2.session_date = '2015/02/01'
-
-                test_snap_3 = TEST_SNAPSHOT.clone()
-                test_snap_3.cdi_type = 'cdi_type_1'
-                test_snap_3.session_date = '2015/03/01'
-
-                test_metadata = [test_snap_1, test_snap_2, test_snap_3]
+            with unittest.mock.patch('prog_code.util.db_util.load_report_sources') as mock_sources:
+                mock_sources.return_value = db_util.ReportSources(
+                    {snapshot.database_id: []},
+                    {},
+                    {snapshot.database_id: 0}
+                )
+                report_util.generate_study_report_rows(
+                    snapshots,
+                    presentation_format
+                )
+                mock_sources.assert_called_once()
+                self.assertEqual(
+                    list(mock_sources.call_args[0][0]),
+                    [snapshot.database_id]
+                )
 
-                test_contents_1 = [
-                    models.SnapshotContent(0, 'word1', 1, 1),
-                    models.SnapshotContent(0, 'word2', 0, 1),
-                    models.SnapshotContent(0, 'word3', 0, 1)
-                ]
-                test_contents_2 = [
-                    models.SnapshotContent(0, 'word1', 1, 1),
-                    models.SnapshotContent(0, 'word2', 2, 1),
-                    models.SnapshotContent(0, 'word3', 0, 1)
-                ]
-                test_contents_3 = [
-                    models.SnapshotContent(0, 'word1', 1, 1),
-                    models.SnapshotContent(0, 'word2', 1, 1),
-                    models.SnapshotContent(0, 'word3', 1, 1)
-                ]
+    def test_load_report_records_changed_while_rendering(self):
+        cursor = db_util_test.create_memory_cursor()
 
-                categories = [{
-                    'words': ['word1', 'word2', 'word3']
-                }]
+        db_util.insert_snapshot(
+            copy.copy(db_util_test.TEST_SNAPSHOT),
+            {'word1': 1},
+            cursor
+        )
 
-                mock_cdi.side_effect = [
-                    models.CDIFormat('', '', '', {'count_as_spoken': [1, 2], 'categories': categories}),
-                ]
+        with unittest.mock.patch('prog_code.util.db_util.get_db_connection') as mock:
+            mock.return_value = filter_util_test.TestDBConnection(cursor)
+
+            snapshots = filter_util.run_search_query([], 'snapshots')
+            snapshot_id = snapshots[0].database_id
+
+            # Changed after being rendered but before the row is saved
+            with unittest.mock.patch('prog_code.util.report_util.SAVE_REPORT_ROWS', False):
+                report_util.load_report_records(snapshots, None)
+            (format_name, format_version, rows) = (
+                report_util.UNSAVED_REPORT_ROWS.pop()
+            )
+            db_util.update_snapshot(snapshots[0], cursor)
+            db_util.save_report_rows(rows, format_name, format_version)
+            self.assertEqual(
+                db_util.load_report_rows([snapshot_id], '', ''),
+                {}
+            )
+
+            # Changed after being found but before being rendered
+            stale_snapshot = snapshots[0].clone()
+            snapshots[0].study = 'other_study'
+            db_util.update_snapshot(snapshots[0], cursor)
+            records = report_util.load_report_records([stale_snapshot], None)
+            self.assertTrue(stale_snapshot.study in records[0][0])
+            self.assertEqual(
+                db_util.load_report_rows([snapshot_id], '', ''),
+                {}
+            )
+
+            report_util.load_report_records(snapshots, None)
+            self.assertEqual(
+                list(db_util.load_report_rows([snapshot_id], '', '').keys()),
+                [snapshot_id]
+            )
+
+    def test_render_study_report_unsaved_rows(self):
+        test_snap = TEST_SNAPSHOT.clone()
+        test_snap.database_id = 1
+        presentation_format = models.PresentationFormat('', '', '', {})
+
+        with unittest.mock.patch('prog_code.util.report_util.generate_study_report_csv') as mock_report:
+            def generate_report(snapshots, presentation_format):
+                report_util.load_report_records(snapshots, presentation_format)
+                return io.StringIO('test CSV file contents')
+
+            mock_report.side_effect = generate_report
+
+            with unittest.mock.patch('prog_code.util.filter_util.convert_snapshot_rows') as mock_convert:
+                mock_convert.return_value = [test_snap]
+
+                with unittest.mock.patch('prog_code.util.db_util.load_report_rows') as mock_load_rows:
+                    with unittest.mock.patch('prog_code.util.db_util.load_report_sources') as mock_sources:
+                        with unittest.mock.patch('prog_code.util.db_util.save_report_rows') as mock_save_rows:
+                            with unittest.mock.patch('prog_code.util.report_util.SAVE_REPORT_ROWS', False):
+                                mock_load_rows.return_value = {}
+                                mock_sources.return_value = db_util.ReportSources(
+                                    {1: []},
+                                    {1: ('row',)},
+                                    {1: 7}
+                                )
+
+                                study_report = report_util.render_study_report(
+                                    'test study',
+                                    [test_snap],
+                                    presentation_format
+                                )
+
+                                self.assertEqual(study_report.filename, 'test study.csv')
+                                self.assertEqual(
+                                    study_report.contents,
+                                    'test CSV file contents'
+                                )
+                                self.assertEqual(len(study_report.report_rows), 1)
+                                self.assertEqual(
+                                    list(map(
+                                        lambda x: x[:2],
+                                        study_report.report_rows[0][2]
+                                    )),
+                                    [(1, 7)]
+                                )
+                                self.assertEqual(report_util.UNSAVED_REPORT_ROWS, [])
+                                self.assertEqual(len(mock_save_rows.mock_calls), 0)
+
+    def test_generate_study_report_parallel(self):
+        snapshots = []
+        for (database_id, study) in [(1, 'study1'), (2, 'study2'), (3, 'study1')]:
+            test_snap = TEST_SNAPSHOT.clone()
+            test_snap.database_id = database_id
+            test_snap.study = study
+            snapshots.append(test_snap)
+
+        def render_study_report(study_name, snapshots_from_study, presentation_format):
+            rows = [(1, 0, 'row')]
+            return report_util.StudyReport(
+                '%s.csv' % study_name,
+                ','.join(map(lambda x: str(x.database_id), snapshots_from_study)),
+                [('test_format', 'version', rows)]
+            )
+
+        def create_executor(max_workers, mp_context, initializer):
+            self.assertEqual(max_workers, 2)
+            self.assertEqual(initializer, report_util.init_report_worker)
+            return concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+
+        with unittest.mock.patch('prog_code.util.report_util.render_study_report') as mock_render:
+            with unittest.mock.patch('concurrent.futures.ProcessPoolExecutor') as mock_executor:
+                with unittest.mock.patch('prog_code.util.db_util.save_report_rows') as mock_save_rows:
+                    mock_render.side_effect = render_study_report
+                    mock_executor.side_effect = create_executor
+
+                    faux_zip_file = report_util.generate_study_report(
+                        snapshots,
+                        None,
+                        max_workers=4
+                    )
+
+                    with zipfile.ZipFile(faux_zip_file) as zip_file:
+                        self.assertEqual(
+                            sorted(zip_file.namelist()),
+                            ['study1.csv', 'study2.csv']
+                        )
+                        self.assertEqual(zip_file.read('study1.csv'), b'1,3')
+                        self.assertEqual(zip_file.read('study2.csv'), b'2')
+
+                    self.assertEqual(len(mock_save_rows.mock_calls), 2)
+                    mock_save_rows.assert_any_call(
+                        [(1, 0, 'row')],
+                        'test_format',
+                        'version'
+                    )
+
+                    report_util.generate_study_report(
+                        snapshots,
+                        None,
+                        max_workers=1
+                    )
+                    self.assertEqual(len(mock_executor.mock_calls), 1)
+
+    def test_generate_long_report_lines(self):
+        test_snap_1 = TEST_SNAPSHOT.clone()
+        test_snap_1.database_id = 1
+
+        test_snap_2 = TEST_SNAPSHOT.clone()
+        test_snap_2.database_id = 2
+
+        presentation_format = models.PresentationFormat(
+            'Test format',
+            'test_format',
+            'test_format.yaml',
+            {'explicit_true': 'yes', 'male': 'm'}
+        )
 
-                mock_snapshot.side_effect = [
-                    test_contents_1,
-                    test_contents_2,
-                    test_contents_3
-                ]
+        lines = list(report_util.generate_long_report_lines(
+            iter([
+                (test_snap_1, [('word1', 1), ('word2', 0)]),
+                (test_snap_2, [('word1', constants.NO_DATA)])
+            ]),
+            presentation_format
+        ))
+        self.assertEqual(len(lines), 2)
+
+        rows = list(csv.reader(io.StringIO(''.join(lines))))
+        self.assertEqual(rows[0], report_util.LONG_REPORT_HEADER)
+        self.assertEqual(
+            list(map(lambda x: (x[0], x[4], x[-2], x[-1]), rows[1:])),
+            [
+                ('1', 'm', 'word1', 'yes'),
+                ('1', 'm', 'word2', '0'),
+                ('2', 'm', 'word1', str(constants.NO_DATA))
+            ]
+        )
 
-                results = report_util.generate_study_report(
-                    test_metadata,
-                    models.CDIFormat('', '', '', {'count_as_spoken': [1, 2], 'categories': categories})
-                )
-                self.assertTrue(results != None)
+        lines = list(report_util.generate_long_report_lines(
+            iter([]),
+            presentation_format
+        ))
+        self.assertEqual(len(lines), 1)
+
+    def test_generate_ndjson_lines(self):
+        with unittest.mock.patch('prog_code.util.db_util.load_snapshot_contents_batch') as mock_contents:
+            test_snap_1 = TEST_SNAPSHOT.clone()
+            test_snap_1.database_id = 1
+
+            test_snap_2 = TEST_SNAPSHOT.clone()
+            test_snap_2.database_id = 2
+
+            test_snap_3 = TEST_SNAPSHOT.clone()
+            test_snap_3.database_id = 3
+
+            mock_contents.side_effect = [
+                {
+                    1: [models.SnapshotContent(1, 'word1', 1, 1)],
+                    2: []
+                },
+                {
+                    3: [models.SnapshotContent(3, 'word1', constants.NO_DATA, 1)]
+                }
+            ]
+
+            lines = list(report_util.generate_ndjson_lines(
+                iter([test_snap_1, test_snap_2, test_snap_3]),
+                models.PresentationFormat('', '', '', {'no_data': 'na'}),
+                include_words=True,
+                batch_size=2
+            ))
+
+            self.assertTrue(all(map(lambda x: x.endswith('\n'), lines)))
+
+            records = list(map(json.loads, lines))
+            self.assertEqual(
+                list(map(lambda x: x['database_id'], records)),
+                [1, 2, 3]
+            )
+            self.assertEqual(
+                list(map(lambda x: x['words'], records)),
+                [{'word1': 1}, {}, {'word1': 'na'}]
+            )
+            self.assertEqual(len(mock_contents.mock_calls), 2)
+
+            lines = list(report_util.generate_ndjson_lines([test_snap_1]))
+            self.assertFalse('words' in json.loads(lines[0]))
+            self.assertEqual(len(mock_contents.mock_calls), 2)
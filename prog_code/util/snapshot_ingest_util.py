@@ -0,0 +1,473 @@
+"""Utility to interpret batches of snapshots sent through the API.
+
+Copyright (C) 2014 A. Samuel Pottinger ("Sam Pottinger", gleap.org)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+@author: Sam Pottinger
+@license: GNU GPL v3
+"""
+import datetime
+import json
+import re
+import typing
+
+import prog_code.util.constants as constants
+import prog_code.util.recalc_util as recalc_util
+
+from ..struct import models
+
+# Maximum number of snapshots accepted in a single batch.
+MAX_BATCH_SIZE = 5000
+
+DEFAULT_MAX_ERRORS = 100
+
+DEFAULT_LANGUAGES = ['english']
+
+ISO_PARSE_STR = '%Y-%m-%d'
+DATE_OUT_STR = '%Y/%m/%d'
+
+INVALID_JSON_MSG = 'Could not parse snapshots as JSON: %s'
+INVALID_NDJSON_MSG = 'Could not parse line %d as JSON: %s'
+NOT_A_LIST_MSG = 'Expected a JSON list of snapshots.'
+EMPTY_BATCH_MSG = 'No snapshots provided.'
+BATCH_TOO_LARGE_MSG = 'At most %d snapshots may be sent at a time.'
+NOT_AN_OBJECT_MSG = 'Expected a JSON object.'
+MISSING_FIELD_MSG = 'Missing required value.'
+INVALID_TEXT_MSG = 'Expected a string.'
+INVALID_INTEGER_MSG = 'Expected a whole number but found %s.'
+INVALID_SESSION_NUM_MSG = 'Expected a positive whole number but found %s.'
+INVALID_DATE_MSG = 'Expected an ISO8601 date (YYYY-MM-DD) but found %s.'
+INVALID_GENDER_MSG = 'Invalid gender value %s for the presentation format.'
+INVALID_HARD_OF_HEARING_MSG = ('Invalid hard of hearing value %s for the '
+    'presentation format.')
+INVALID_LANGUAGES_MSG = 'Expected a non-empty list of language names.'
+UNKNOWN_CDI_TYPE_MSG = '%s not a valid cdi_type.'
+INVALID_WORDS_MSG = 'Expected an object mapping words to values.'
+UNEXPECTED_WORDS_MSG = 'Words not on CDI type %s: %s.'
+MISSING_WORDS_MSG = 'Words on CDI type %s missing: %s.'
+INVALID_WORD_VALUE_MSG = 'Unexpected value %s for word %s.'
+INVALID_CHILD_ID_MSG = 'Expected a whole number child ID but found %s.'
+MISSING_PERCENTILES_MSG = 'Percentile table %s for CDI type %s not found.'
+
+# Child IDs given by clients are either whole numbers or IDs assigned by the
+# database (see db_util.CHILD_ID_TEMPLATE).
+CHILD_ID_PATTERN = re.compile(r'^(auto_)?[0-9]+$')
+
+GENDER_VALUES = [constants.MALE, constants.FEMALE, constants.OTHER_GENDER]
+BOOLEAN_VALUES = [constants.EXPLICIT_TRUE, constants.EXPLICIT_FALSE]
+
+SnapshotRecord = typing.Tuple[models.SnapshotMetadata, typing.Dict[str, int]]
+
+
+class BatchFormatError(Exception):
+    """Error raised when a batch of snapshots cannot be read at all."""
+    pass
+
+
+class SnapshotFieldError(Exception):
+    """Error raised when a single snapshot field is invalid."""
+
+    def __init__(self, field: str, message: str):
+        """Create a new error for a snapshot field.
+
+        @param field: The name of the field with the invalid value.
+        @param message: Description of the problem.
+        """
+        super().__init__(message)
+        self.field = field
+
+
+def load_batch(body: str, is_ndjson: bool) -> typing.List[typing.Any]:
+    """Read the snapshots in a request body.
+
+    @param body: The request body.
+    @param is_ndjson: True if the body has one JSON object per line and False
+        if it is a single JSON list of objects.
+    @returns: The decoded (not yet validated) snapshots.
+    @raises BatchFormatError: Raised if the body could not be decoded or has
+        too few or too many snapshots.
+    """
+    if is_ndjson:
+        raw_records = []
+        for (line_num, line) in enumerate(body.splitlines()):
+            if line.strip() == '':
+                continue
+
+            try:
+                raw_records.append(json.loads(line))
+            except ValueError as e:
+                raise BatchFormatError(INVALID_NDJSON_MSG % (line_num + 1, e))
+
+    else:
+        try:
+            raw_records = json.loads(body)
+        except ValueError as e:
+            raise BatchFormatError(INVALID_JSON_MSG % e)
+
+        if not isinstance(raw_records, list):
+            raise BatchFormatError(NOT_A_LIST_MSG)
+
+    if len(raw_records) == 0:
+        raise BatchFormatError(EMPTY_BATCH_MSG)
+
+    if len(raw_records) > MAX_BATCH_SIZE:
+        raise BatchFormatError(BATCH_TOO_LARGE_MSG % MAX_BATCH_SIZE)
+
+    return raw_records
+
+
+def get_required(raw: typing.Dict, field: str) -> typing.Any:
+    """Get a value which must be provided for every snapshot.
+
+    @param raw: The decoded snapshot.
+    @param field: The name of the value.
+    @returns: The value provided.
+    @raises SnapshotFieldError: Raised if the value is missing or empty.
+    """
+    value = raw.get(field, None)
+    if value == None or value == '':
+        raise SnapshotFieldError(field, MISSING_FIELD_MSG)
+    return value
+
+
+def interpret_text(raw: typing.Dict, field: str) -> str:
+    """Interpret a required value as text.
+
+    @param raw: The decoded snapshot.
+    @param field: The name of the value.
+    @returns: The value as a string. Numbers are accepted as IDs.
+    @raises SnapshotFieldError: Raised if the value is missing or not text.
+    """
+    value = get_required(raw, field)
+    if isinstance(value, bool) or not isinstance(value, (str, int)):
+        raise SnapshotFieldError(field, INVALID_TEXT_MSG)
+    return str(value)
+
+
+def interpret_int(raw: typing.Dict, field: str,
+        default: typing.Optional[int] = None) -> int:
+    """Interpret a value as a whole number.
+
+    @param raw: The decoded snapshot.
+    @param field: The name of the value.
+    @param default: The value to use if not provided or None if required.
+    @returns: The value provided or the default.
+    @raises SnapshotFieldError: Raised if the value is missing without a
+        default or is not a whole number.
+    """
+    if default != None and raw.get(field, None) == None:
+        return default # type: ignore
+
+    value = get_required(raw, field)
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise SnapshotFieldError(field, INVALID_INTEGER_MSG % json.dumps(value))
+    return value
+
+
+def interpret_date(raw: typing.Dict, field: str) -> str:
+    """Interpret a required ISO 8601 date.
+
+    @param raw: The decoded snapshot.
+    @param field: The name of the value.
+    @returns: The date as YYYY/MM/DD as stored in the database.
+    @raises SnapshotFieldError: Raised if the value is missing or not a date.
+    """
+    value = get_required(raw, field)
+    try:
+        date = datetime.datetime.strptime(value, ISO_PARSE_STR)
+    except (TypeError, ValueError):
+        raise SnapshotFieldError(field, INVALID_DATE_MSG % json.dumps(value))
+    return date.strftime(DATE_OUT_STR)
+
+
+def interpret_child_id(raw: typing.Dict) -> typing.Optional[str]:
+    """Interpret the optional ID of an existing participant.
+
+    @param raw: The decoded snapshot.
+    @returns: The child ID as a string or None if a new ID should be assigned.
+    @raises SnapshotFieldError: Raised if the value is not a whole number or
+        an ID assigned by the database.
+    """
+    value = raw.get('child_id', None)
+    if value == None or value == '':
+        return None
+
+    if isinstance(value, bool):
+        valid = False
+    elif isinstance(value, int):
+        valid = value >= 0
+    else:
+        valid = isinstance(value, str) and CHILD_ID_PATTERN.match(value) != None
+
+    if not valid:
+        raise SnapshotFieldError(
+            'child_id',
+            INVALID_CHILD_ID_MSG % json.dumps(value)
+        )
+
+    return str(value)
+
+
+def interpret_gender(raw: typing.Dict, interpretation_vals: typing.Dict) -> int:
+    """Interpret a gender given as a constant or presentation format value.
+
+    @param raw: The decoded snapshot.
+    @param interpretation_vals: The details of the presentation format.
+    @returns: constants.MALE, constants.FEMALE, or constants.OTHER_GENDER.
+    @raises SnapshotFieldError: Raised if the value is missing or unknown.
+    """
+    value = get_required(raw, 'gender')
+
+    if not isinstance(value, bool) and value in GENDER_VALUES:
+        return value
+    elif value == interpretation_vals['male']:
+        return constants.MALE
+    elif value == interpretation_vals['female']:
+        return constants.FEMALE
+    elif value == interpretation_vals['explicit_other']:
+        return constants.OTHER_GENDER
+    else:
+        raise SnapshotFieldError(
+            'gender',
+            INVALID_GENDER_MSG % json.dumps(value)
+        )
+
+
+def interpret_hard_of_hearing(raw: typing.Dict,
+        interpretation_vals: typing.Dict) -> int:
+    """Interpret a hard of hearing flag, defaulting to false.
+
+    @param raw: The decoded snapshot.
+    @param interpretation_vals: The details of the presentation format.
+    @returns: constants.EXPLICIT_TRUE or constants.EXPLICIT_FALSE.
+    @raises SnapshotFieldError: Raised if the value is not recognized.
+    """
+    value = raw.get('hard_of_hearing', None)
+
+    if value == None or value == '':
+        return constants.EXPLICIT_FALSE
+    elif isinstance(value, bool):
+        return constants.EXPLICIT_TRUE if value else constants.EXPLICIT_FALSE
+    elif value in BOOLEAN_VALUES:
+        return value
+    elif value == interpretation_vals['explicit_true']:
+        return constants.EXPLICIT_TRUE
+    elif value == interpretation_vals['explicit_false']:
+        return constants.EXPLICIT_FALSE
+    else:
+        raise SnapshotFieldError(
+            'hard_of_hearing',
+            INVALID_HARD_OF_HEARING_MSG % json.dumps(value)
+        )
+
+
+def interpret_languages(raw: typing.Dict) -> typing.List[str]:
+    """Interpret the languages spoken by the participant.
+
+    @param raw: The decoded snapshot.
+    @returns: The languages provided or DEFAULT_LANGUAGES if not provided.
+    @raises SnapshotFieldError: Raised if not a non-empty list of strings.
+    """
+    value = raw.get('languages', None)
+    if value == None:
+        return list(DEFAULT_LANGUAGES)
+
+    valid = isinstance(value, list) and len(value) > 0 and all(
+        map(lambda x: isinstance(x, str) and x != '', value)
+    )
+    if not valid:
+        raise SnapshotFieldError('languages', INVALID_LANGUAGES_MSG)
+
+    return value
+
+
+def interpret_words(raw: typing.Dict, cdi_type: str,
+        compiled: recalc_util.CompiledCDIFormat) -> typing.Dict[str, int]:
+    """Check a snapshot's word values against its CDI format.
+
+    @param raw: The decoded snapshot.
+    @param cdi_type: The name of the CDI format.
+    @param compiled: The compiled CDI format.
+    @returns: Mapping from word (lower case) to value.
+    @raises SnapshotFieldError: Raised if words are missing, not on the CDI
+        format, or have values not allowed by the format.
+    """
+    value = raw.get('words', None)
+    if not isinstance(value, dict):
+        raise SnapshotFieldError('words', INVALID_WORDS_MSG)
+
+    words = dict(map(lambda x: (x[0].lower(), x[1]), value.items()))
+    provided = frozenset(words.keys())
+
+    unexpected = provided - compiled.words
+    if len(unexpected) > 0:
+        raise SnapshotFieldError('words', UNEXPECTED_WORDS_MSG % (
+            cdi_type,
+            ', '.join(sorted(unexpected))
+        ))
+
+    missing = compiled.words - provided
+    if len(missing) > 0:
+        raise SnapshotFieldError('words', MISSING_WORDS_MSG % (
+            cdi_type,
+            ', '.join(sorted(missing))
+        ))
+
+    for (word, word_value) in words.items():
+        allowed = not isinstance(word_value, bool) and \
+            word_value in compiled.allowed_values
+        if not allowed:
+            raise SnapshotFieldError('words', INVALID_WORD_VALUE_MSG % (
+                json.dumps(word_value),
+                word
+            ))
+
+    return words
+
+
+def interpret_snapshot(raw: typing.Any, interpretation_vals: typing.Dict,
+        cached_adapter: recalc_util.CachedCDIAdapter) -> SnapshotRecord:
+    """Validate a decoded snapshot and calculate its derived values.
+
+    Age, words spoken, and percentile are always calculated here rather than
+    taken from the client.
+
+    @param raw: The decoded snapshot.
+    @param interpretation_vals: The details of the presentation format used to
+        interpret gender and hard of hearing values.
+    @param cached_adapter: Adapter through which to load CDI formats and
+        percentile tables.
+    @returns: Snapshot metadata and words ready for db_util.insert_snapshots.
+    @raises SnapshotFieldError: Raised on the first invalid value found.
+    """
+    if not isinstance(raw, dict):
+        raise SnapshotFieldError(None, NOT_AN_OBJECT_MSG) # type: ignore
+
+    cdi_type = interpret_text(raw, 'cdi_type')
+    compiled = cached_adapter.load_compiled_cdi_model(cdi_type)
+    if compiled == None:
+        raise SnapshotFieldError('cdi_type', UNKNOWN_CDI_TYPE_MSG % cdi_type)
+
+    child_id = interpret_child_id(raw)
+    study_id = interpret_text(raw, 'study_id')
+    study = interpret_text(raw, 'study')
+    gender = interpret_gender(raw, interpretation_vals)
+    birthday = interpret_date(raw, 'birthday')
+    session_date = interpret_date(raw, 'session_date')
+
+    session_num = interpret_int(raw, 'session_num')
+    if session_num < 1:
+        raise SnapshotFieldError(
+            'session_num',
+            INVALID_SESSION_NUM_MSG % session_num
+        )
+
+    total_num_sessions = interpret_int(raw, 'total_num_sessions', session_num)
+    items_excluded = interpret_int(raw, 'items_excluded', 0)
+    extra_categories = interpret_int(raw, 'extra_categories', 0)
+    languages = interpret_languages(raw)
+    hard_of_hearing = interpret_hard_of_hearing(raw, interpretation_vals)
+    words = interpret_words(raw, cdi_type, compiled) # type: ignore
+
+    count_as_spoken_values = compiled.count_as_spoken_values # type: ignore
+    words_spoken = sum(
+        1 for x in words.values() if x in count_as_spoken_values
+    )
+    age = recalc_util.recalculate_age_raw(birthday, session_date)
+
+    percentiles_name = recalc_util.get_percentile_table_name(
+        cached_adapter.load_cdi_model(cdi_type), # type: ignore
+        gender
+    )
+    if cached_adapter.load_percentile_model(percentiles_name) == None:
+        raise SnapshotFieldError('cdi_type', MISSING_PERCENTILES_MSG % (
+            percentiles_name,
+            cdi_type
+        ))
+
+    percentile = recalc_util.recalculate_percentile_raw(
+        cached_adapter,
+        cdi_type,
+        gender,
+        words_spoken,
+        age
+    )
+
+    metadata = models.SnapshotMetadata(
+        None,
+        child_id,
+        study_id,
+        study,
+        gender,
+        age,
+        birthday,
+        session_date,
+        session_num,
+        total_num_sessions,
+        words_spoken,
+        items_excluded,
+        percentile,
+        extra_categories,
+        0,
+        languages,
+        len(languages),
+        cdi_type,
+        hard_of_hearing,
+        False
+    )
+
+    return (metadata, words)
+
+
+def interpret_snapshots(raw_records: typing.List[typing.Any],
+        interpretation_vals: typing.Dict,
+        cached_adapter: typing.Optional[recalc_util.CachedCDIAdapter] = None,
+        max_errors: int = DEFAULT_MAX_ERRORS) -> typing.Dict:
+    """Validate a batch of decoded snapshots.
+
+    @param raw_records: The decoded snapshots.
+    @param interpretation_vals: The details of the presentation format used to
+        interpret gender and hard of hearing values.
+    @param cached_adapter: Adapter through which to load CDI formats or None to
+        create one for this batch.
+    @param max_errors: The number of invalid snapshots after which to stop.
+    @returns: Dictionary with the records ready to save and a list of
+        models.ImportValidationError where row is the index of the snapshot
+        within the batch and field is the name of the invalid field.
+    """
+    if cached_adapter == None:
+        cached_adapter = recalc_util.CachedCDIAdapter()
+
+    records: typing.List[SnapshotRecord] = []
+    errors: typing.List[models.ImportValidationError] = []
+
+    for (index, raw) in enumerate(raw_records):
+        try:
+            records.append(interpret_snapshot(
+                raw,
+                interpretation_vals,
+                cached_adapter # type: ignore
+            ))
+        except SnapshotFieldError as e:
+            errors.append(models.ImportValidationError(
+                index,
+                None,
+                str(e),
+                e.field
+            ))
+            if len(errors) >= max_errors:
+                break
+
+    return {'records': records, 'errors': errors}
@@ -0,0 +1,225 @@
+"""Tests for interpreting batches of snapshots sent through the API.
+
+Copyright (C) 2014 A. Samuel Pottinger ("Sam Pottinger", gleap.org)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import copy
+import unittest
+
+from ..struct import models
+
+import prog_code.util.constants as constants
+import prog_code.util.recalc_util as recalc_util
+import prog_code.util.snapshot_ingest_util as snapshot_ingest_util
+
+TEST_CDI_TYPE = 'test_cdi'
+TEST_PERCENTILES_NAME = 'test_percentiles'
+
+TEST_CDI_MODEL = models.CDIFormat(
+    'Test CDI',
+    TEST_CDI_TYPE,
+    'test_cdi.yaml',
+    {
+        'options': [{'value': 0}, {'value': 1}, {'value': 2}],
+        'categories': [{'words': ['ball', 'Dog*']}, {'words': ['cat']}],
+        'count_as_spoken': [1, 2],
+        'percentiles': {
+            'male': TEST_PERCENTILES_NAME,
+            'female': TEST_PERCENTILES_NAME
+        }
+    }
+)
+
+TEST_PERCENTILES_MODEL = models.PercentileTable(
+    'Test percentiles',
+    TEST_PERCENTILES_NAME,
+    'test_percentiles.csv',
+    [
+        ['percentile', 16, 17, 18],
+        [99, 3, 3, 3],
+        [50, 2, 2, 2],
+        [1, 0, 0, 0]
+    ]
+)
+
+TEST_INTERPRETATION_VALS = {
+    'male': 'male',
+    'female': 'female',
+    'explicit_other': 'other',
+    'explicit_true': 'yes',
+    'explicit_false': 'no'
+}
+
+TEST_RAW_SNAPSHOT = {
+    'study': 'test study',
+    'study_id': 'p1',
+    'gender': 'female',
+    'birthday': '2012-01-01',
+    'session_date': '2013-06-01',
+    'session_num': 1,
+    'cdi_type': TEST_CDI_TYPE,
+    'words': {'ball': 1, 'Dog': 2, 'cat': 0}
+}
+
+
+def create_adapter():
+    """Create an adapter with the test CDI and percentiles pre-cached."""
+    adapter = recalc_util.CachedCDIAdapter()
+    adapter.cdi_models[TEST_CDI_TYPE] = TEST_CDI_MODEL
+    adapter.cdi_models['unknown'] = None
+    adapter.percentiles[TEST_PERCENTILES_NAME] = TEST_PERCENTILES_MODEL
+    return adapter
+
+
+class SnapshotIngestUtilTests(unittest.TestCase):
+
+    def __interpret(self, raw):
+        return snapshot_ingest_util.interpret_snapshot(
+            raw,
+            TEST_INTERPRETATION_VALS,
+            create_adapter()
+        )
+
+    def __assert_field_error(self, changes, field):
+        raw = copy.deepcopy(TEST_RAW_SNAPSHOT)
+        raw.update(changes)
+
+        with self.assertRaises(snapshot_ingest_util.SnapshotFieldError) as context:
+            self.__interpret(raw)
+
+        self.assertEqual(context.exception.field, field)
+
+    def test_load_batch(self):
+        records = snapshot_ingest_util.load_batch('[{"a": 1}, {"a": 2}]', False)
+        self.assertEqual(records, [{'a': 1}, {'a': 2}])
+
+        records = snapshot_ingest_util.load_batch('{"a": 1}\n\n{"a": 2}\n', True)
+        self.assertEqual(records, [{'a': 1}, {'a': 2}])
+
+    def test_load_batch_invalid(self):
+        bodies = [
+            ('{"a": 1}', False),
+            ('[', False),
+            ('[]', False),
+            ('{"a": 1}\n{"a"', True),
+            ('', True)
+        ]
+
+        for (body, is_ndjson) in bodies:
+            with self.assertRaises(snapshot_ingest_util.BatchFormatError):
+                snapshot_ingest_util.load_batch(body, is_ndjson)
+
+    def test_interpret_snapshot(self):
+        (metadata, words) = self.__interpret(TEST_RAW_SNAPSHOT)
+
+        self.assertEqual(metadata.child_id, None)
+        self.assertEqual(metadata.study, 'test study')
+        self.assertEqual(metadata.study_id, 'p1')
+        self.assertEqual(metadata.gender, constants.FEMALE)
+        self.assertEqual(metadata.birthday, '2012/01/01')
+        self.assertEqual(metadata.session_date, '2013/06/01')
+        self.assertTrue(abs(metadata.age - 17) < 0.1)
+        self.assertEqual(metadata.session_num, 1)
+        self.assertEqual(metadata.total_num_sessions, 1)
+        self.assertEqual(metadata.words_spoken, 2)
+        self.assertEqual(metadata.percentile, 50)
+        self.assertEqual(metadata.items_excluded, 0)
+        self.assertEqual(metadata.languages, ['english'])
+        self.assertEqual(metadata.num_languages, 1)
+        self.assertEqual(metadata.hard_of_hearing, constants.EXPLICIT_FALSE)
+        self.assertEqual(words, {'ball': 1, 'dog': 2, 'cat': 0})
+
+    def test_interpret_snapshot_optional_values(self):
+        raw = copy.deepcopy(TEST_RAW_SNAPSHOT)
+        raw.update({
+            'child_id': 'auto_5',
+            'gender': constants.MALE,
+            'total_num_sessions': 3,
+            'extra_categories': 2,
+            'languages': ['english', 'spanish'],
+            'hard_of_hearing': 'yes'
+        })
+
+        (metadata, words) = self.__interpret(raw)
+
+        self.assertEqual(metadata.child_id, 'auto_5')
+        self.assertEqual(metadata.gender, constants.MALE)
+        self.assertEqual(metadata.total_num_sessions, 3)
+        self.assertEqual(metadata.extra_categories, 2)
+        self.assertEqual(metadata.num_languages, 2)
+        self.assertEqual(metadata.hard_of_hearing, constants.EXPLICIT_TRUE)
+
+    def test_interpret_snapshot_invalid(self):
+        self.__assert_field_error({'study': ''}, 'study')
+        self.__assert_field_error({'gender': 'unknown'}, 'gender')
+        self.__assert_field_error({'birthday': '2012/01/01'}, 'birthday')
+        self.__assert_field_error({'session_num': '1'}, 'session_num')
+        self.__assert_field_error({'session_num': 0}, 'session_num')
+        self.__assert_field_error({'languages': []}, 'languages')
+        self.__assert_field_error({'hard_of_hearing': 'maybe'}, 'hard_of_hearing')
+        self.__assert_field_error({'cdi_type': 'unknown'}, 'cdi_type')
+        self.__assert_field_error({'words': {'ball': 1, 'dog': 1}}, 'words')
+        self.__assert_field_error(
+            {'words': {'ball': 1, 'dog': 1, 'cat': 1, 'fish': 1}},
+            'words'
+        )
+        self.__assert_field_error(
+            {'words': {'ball': 1, 'dog': 1, 'cat': 3}},
+            'words'
+        )
+        self.__assert_field_error({'child_id': [5]}, 'child_id')
+        self.__assert_field_error({'child_id': {'id': 5}}, 'child_id')
+        self.__assert_field_error({'child_id': 'five'}, 'child_id')
+        self.__assert_field_error({'child_id': True}, 'child_id')
+
+    def test_interpret_snapshot_child_id(self):
+        raw = copy.deepcopy(TEST_RAW_SNAPSHOT)
+        raw['child_id'] = 5
+        (metadata, words) = self.__interpret(raw)
+        self.assertEqual(metadata.child_id, '5')
+
+        raw['child_id'] = '7'
+        (metadata, words) = self.__interpret(raw)
+        self.assertEqual(metadata.child_id, '7')
+
+    def test_interpret_snapshot_missing_percentiles(self):
+        adapter = create_adapter()
+        adapter.percentiles[TEST_PERCENTILES_NAME] = None
+
+        with self.assertRaises(snapshot_ingest_util.SnapshotFieldError) as context:
+            snapshot_ingest_util.interpret_snapshot(
+                TEST_RAW_SNAPSHOT,
+                TEST_INTERPRETATION_VALS,
+                adapter
+            )
+
+        self.assertEqual(context.exception.field, 'cdi_type')
+
+    def test_interpret_snapshots(self):
+        invalid = copy.deepcopy(TEST_RAW_SNAPSHOT)
+        invalid['gender'] = 'unknown'
+
+        results = snapshot_ingest_util.interpret_snapshots(
+            [TEST_RAW_SNAPSHOT, invalid, 'not a snapshot', invalid],
+            TEST_INTERPRETATION_VALS,
+            create_adapter(),
+            2
+        )
+
+        self.assertEqual(len(results['records']), 1)
+        self.assertEqual(
+            [(x.row, x.column, x.field) for x in results['errors']],
+            [(1, None, 'gender'), (2, None, None)]
+        )
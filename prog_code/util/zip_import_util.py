@@ -0,0 +1,214 @@
+"""Utility to import a ZIP archive of CSV files into the lab database.
+
+Copyright (C) 2014 A. Samuel Pottinger ("Sam Pottinger", gleap.org)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+@author: Sam Pottinger
+@license: GNU GPL v3
+"""
+import collections
+import concurrent.futures
+import multiprocessing
+import os
+import shutil
+import tempfile
+import typing
+import zipfile
+
+import prog_code.util.constants as constants
+import prog_code.util.db_util as db_util
+import prog_code.util.legacy_csv_import_util as legacy_csv_import_util
+import prog_code.util.new_csv_import_util as new_csv_import_util
+
+# Number of processes used to parse the files in an archive or None to use one
+# per CPU.
+ZIP_IMPORT_MAX_WORKERS = None
+
+FORMAT_NEW = 'new'
+FORMAT_LEGACY = 'legacy'
+
+LEGACY_LANGUAGES = ['english']
+
+INVALID_ZIP_ERR = 'The upload is not a valid ZIP archive.'
+NO_CSV_FILES_ERR = 'No CSV files were found in the ZIP archive.'
+
+ZipMember = collections.namedtuple(
+    'ZipMember',
+    ['name', 'path']
+)
+
+ZipMemberResult = collections.namedtuple(
+    'ZipMemberResult',
+    ['name', 'records', 'error']
+)
+
+ZipImportResults = collections.namedtuple(
+    'ZipImportResults',
+    ['num_files', 'file_errors', 'summary']
+)
+
+
+def is_csv_member(info: zipfile.ZipInfo) -> bool:
+    """Determine if an entry in an archive is a CSV file to import.
+
+    @param info: Description of the entry.
+    @returns: True if a CSV file and false if a directory, some other kind of
+        file, or metadata added by the archiving program.
+    """
+    if info.is_dir():
+        return False
+
+    if info.filename.startswith('__MACOSX/'):
+        return False
+
+    return info.filename.lower().endswith('.csv')
+
+
+def spool_zip_members(source: typing.IO[bytes],
+        directory: str) -> typing.List[ZipMember]:
+    """Copy the CSV files in an uploaded archive to temporary files on disk.
+
+    Member names are only used for reporting and never as paths so archives
+    cannot write outside of the given directory.
+
+    @param source: Stream with the contents of the ZIP archive.
+    @param directory: The directory in which to create the files.
+    @returns: The CSV files found in archive order.
+    @raises zipfile.BadZipFile: Raised if the upload is not a ZIP archive.
+    """
+    members = []
+
+    with zipfile.ZipFile(source) as archive:
+        for info in filter(is_csv_member, archive.infolist()):
+            with archive.open(info) as member_file:
+                with tempfile.NamedTemporaryFile(suffix='.csv', dir=directory,
+                        delete=False) as f:
+                    shutil.copyfileobj(member_file, f)
+                    members.append(ZipMember(info.filename, f.name))
+
+    return members
+
+
+def parse_member(member: ZipMember, file_format: str,
+        cdi_type: str) -> ZipMemberResult:
+    """Parse a single CSV file from an archive without saving it.
+
+    Run within worker processes so it only reads from the database.
+
+    @param member: The spooled file to parse.
+    @param file_format: FORMAT_NEW or FORMAT_LEGACY.
+    @param cdi_type: The type of CDI in the file if legacy format.
+    @returns: The records parsed or the error encountered.
+    """
+    if file_format == FORMAT_NEW:
+        try:
+            records = list(new_csv_import_util.process_csv_file(member.path))
+        except new_csv_import_util.CSVParseError as e:
+            return ZipMemberResult(member.name, [], str(e))
+
+        return ZipMemberResult(member.name, records, None)
+
+    else:
+        with open(member.path, newline='', encoding='utf-8') as f:
+            parse_info = legacy_csv_import_util.parse_csv_records(
+                f,
+                cdi_type,
+                LEGACY_LANGUAGES,
+                constants.EXPLICIT_FALSE,
+                True
+            )
+
+        return ZipMemberResult(
+            member.name,
+            parse_info['records'],
+            parse_info['error']
+        )
+
+
+def parse_members(members: typing.List[ZipMember], file_format: str,
+        cdi_type: str,
+        max_workers: typing.Optional[int] = None) -> typing.List[ZipMemberResult]:
+    """Parse the CSV files from an archive in parallel.
+
+    Each file is parsed in a separate process with its own caches of CDI
+    formats and percentile tables. Processes are spawned rather than forked so
+    that they open their own database connections.
+
+    @param members: The spooled files to parse.
+    @param file_format: FORMAT_NEW or FORMAT_LEGACY.
+    @param cdi_type: The type of CDI in the files if legacy format.
+    @param max_workers: The maximum number of processes to use or None to use
+        ZIP_IMPORT_MAX_WORKERS.
+    @returns: Results for each file in the same order as members.
+    """
+    if max_workers == None:
+        max_workers = ZIP_IMPORT_MAX_WORKERS
+
+    if max_workers == None:
+        max_workers = os.cpu_count() or 1
+
+    max_workers = min(max_workers, len(members)) # type: ignore
+
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context('spawn')) as executor:
+        return list(executor.map(
+            parse_member,
+            members,
+            [file_format] * len(members),
+            [cdi_type] * len(members)
+        ))
+
+
+def import_zip(source: typing.IO[bytes], file_format: str, cdi_type: str,
+        max_workers: typing.Optional[int] = None) -> ZipImportResults:
+    """Parse the CSV files in a ZIP archive and save them together.
+
+    Files are parsed in parallel and their records saved in a single
+    transaction. If any file fails to parse or a duplicate snapshot is
+    rejected, nothing is saved and the errors are reported.
+
+    @param source: Stream with the contents of the ZIP archive.
+    @param file_format: FORMAT_NEW or FORMAT_LEGACY.
+    @param cdi_type: The type of CDI in the files if legacy format.
+    @param max_workers: The maximum number of processes to use or None to use
+        ZIP_IMPORT_MAX_WORKERS.
+    @returns: The number of CSV files found, errors as (file name, message)
+        pairs where the file name is None if the error is not specific to one
+        file, and a summary of what was written or None if nothing was
+        written.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            members = spool_zip_members(source, directory)
+        except zipfile.BadZipFile:
+            return ZipImportResults(0, [(None, INVALID_ZIP_ERR)], None)
+
+        if len(members) == 0:
+            return ZipImportResults(0, [(None, NO_CSV_FILES_ERR)], None)
+
+        results = parse_members(members, file_format, cdi_type, max_workers)
+
+    file_errors = [(x.name, x.error) for x in results if x.error]
+    if len(file_errors) > 0:
+        return ZipImportResults(len(results), file_errors, None)
+
+    records = (record for result in results for record in result.records)
+    try:
+        summary = db_util.insert_snapshots(records)
+    except db_util.DuplicateSnapshotError as e:
+        return ZipImportResults(len(results), [(None, str(e))], None)
+
+    return ZipImportResults(len(results), [], summary)
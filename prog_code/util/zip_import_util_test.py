@@ -0,0 +1,200 @@
+"""Tests for importing ZIP archives of CSV files.
+
+Copyright (C) 2014 A. Samuel Pottinger ("Sam Pottinger", gleap.org)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import csv
+import io
+import tempfile
+import unittest
+import unittest.mock
+import zipfile
+
+import prog_code.util.db_util as db_util
+import prog_code.util.zip_import_util as zip_import_util
+
+from prog_code.util.new_csv_import_util_test import CORRECT_TEST_HEADER_VALUES
+from prog_code.util.new_csv_import_util_test import TEST_CDI_FORMAT
+from prog_code.util.new_csv_import_util_test import VALID_TEST_RECORD_VALUES
+
+
+def create_csv(columns):
+    """Create the contents of a "new" format CSV file from its columns."""
+    target = io.StringIO()
+    csv.writer(target).writerows(zip(*columns))
+    return target.getvalue()
+
+
+def create_zip(files):
+    """Create a ZIP archive in memory from (name, contents) pairs."""
+    target = io.BytesIO()
+    with zipfile.ZipFile(target, 'w') as archive:
+        for (name, contents) in files:
+            archive.writestr(name, contents)
+    target.seek(0)
+    return target
+
+
+def parse_members_in_process(members, file_format, cdi_type, max_workers=None):
+    """Stand-in for parse_members which allows mocks to apply to parsing."""
+    return [
+        zip_import_util.parse_member(x, file_format, cdi_type)
+        for x in members
+    ]
+
+
+class ZipImportUtilTests(unittest.TestCase):
+
+    def setUp(self):
+        second_record = list(VALID_TEST_RECORD_VALUES)
+        second_record[1] = 'test_child_id_2'
+
+        bad_header = list(CORRECT_TEST_HEADER_VALUES)
+        bad_header[4] = 'sex'
+
+        self.__valid_csv = create_csv([
+            CORRECT_TEST_HEADER_VALUES,
+            VALID_TEST_RECORD_VALUES
+        ])
+        self.__second_valid_csv = create_csv([
+            CORRECT_TEST_HEADER_VALUES,
+            second_record
+        ])
+        self.__invalid_csv = create_csv([bad_header, VALID_TEST_RECORD_VALUES])
+
+    def __run_with_cdi_mocks(self, callback):
+        with unittest.mock.patch('prog_code.util.db_util.load_cdi_model') as mock_cdi:
+            with unittest.mock.patch('prog_code.util.recalc_util.recalculate_percentile_raw') as mock_percentile:
+                mock_cdi.return_value = TEST_CDI_FORMAT
+                mock_percentile.return_value = 99
+                callback()
+
+    def test_spool_zip_members(self):
+        source = create_zip([
+            ('site_a.csv', 'a'),
+            ('nested/site_b.CSV', 'b'),
+            ('__MACOSX/._site_a.csv', 'ignored'),
+            ('notes.txt', 'ignored')
+        ])
+
+        with tempfile.TemporaryDirectory() as directory:
+            members = zip_import_util.spool_zip_members(source, directory)
+
+            self.assertEqual(
+                [x.name for x in members],
+                ['site_a.csv', 'nested/site_b.CSV']
+            )
+
+            contents = []
+            for member in members:
+                with open(member.path) as f:
+                    contents.append(f.read())
+
+        self.assertEqual(contents, ['a', 'b'])
+
+    def test_import_zip_invalid_archive(self):
+        results = zip_import_util.import_zip(
+            io.BytesIO(b'not a zip'),
+            zip_import_util.FORMAT_NEW,
+            ''
+        )
+        self.assertEqual(results.num_files, 0)
+        self.assertEqual(
+            results.file_errors,
+            [(None, zip_import_util.INVALID_ZIP_ERR)]
+        )
+        self.assertEqual(results.summary, None)
+
+    def test_import_zip_no_csv_files(self):
+        results = zip_import_util.import_zip(
+            create_zip([('notes.txt', 'ignored')]),
+            zip_import_util.FORMAT_NEW,
+            ''
+        )
+        self.assertEqual(
+            results.file_errors,
+            [(None, zip_import_util.NO_CSV_FILES_ERR)]
+        )
+
+    def test_import_zip(self):
+        source = create_zip([
+            ('site_a.csv', self.__valid_csv),
+            ('site_b.csv', self.__second_valid_csv)
+        ])
+
+        def callback():
+            with unittest.mock.patch('prog_code.util.zip_import_util.parse_members') as mock_parse:
+                with unittest.mock.patch('prog_code.util.db_util.insert_snapshots') as mock_insert:
+                    mock_parse.side_effect = parse_members_in_process
+                    mock_insert.side_effect = lambda records: list(records)
+
+                    results = zip_import_util.import_zip(
+                        source,
+                        zip_import_util.FORMAT_NEW,
+                        ''
+                    )
+
+                    self.assertEqual(results.num_files, 2)
+                    self.assertEqual(results.file_errors, [])
+                    self.assertEqual(
+                        [x.meta.child_id for x in results.summary],
+                        ['test_child_id', 'test_child_id_2']
+                    )
+
+        self.__run_with_cdi_mocks(callback)
+
+    def test_import_zip_file_errors(self):
+        source = create_zip([
+            ('site_a.csv', self.__valid_csv),
+            ('site_b.csv', self.__invalid_csv)
+        ])
+
+        def callback():
+            with unittest.mock.patch('prog_code.util.zip_import_util.parse_members') as mock_parse:
+                with unittest.mock.patch('prog_code.util.db_util.insert_snapshots') as mock_insert:
+                    mock_parse.side_effect = parse_members_in_process
+
+                    results = zip_import_util.import_zip(
+                        source,
+                        zip_import_util.FORMAT_NEW,
+                        ''
+                    )
+
+                    self.assertEqual(results.num_files, 2)
+                    self.assertEqual(results.summary, None)
+                    self.assertEqual(len(results.file_errors), 1)
+                    self.assertEqual(results.file_errors[0][0], 'site_b.csv')
+                    self.assertFalse(mock_insert.called)
+
+        self.__run_with_cdi_mocks(callback)
+
+    def test_parse_members(self):
+        source = create_zip([
+            ('site_a.csv', self.__invalid_csv),
+            ('site_b.csv', self.__invalid_csv)
+        ])
+
+        with tempfile.TemporaryDirectory() as directory:
+            members = zip_import_util.spool_zip_members(source, directory)
+            results = zip_import_util.parse_members(
+                members,
+                zip_import_util.FORMAT_NEW,
+                '',
+                2
+            )
+
+        self.assertEqual([x.name for x in results], ['site_a.csv', 'site_b.csv'])
+        self.assertEqual([x.records for x in results], [[], []])
+        self.assertTrue(all(map(lambda x: 'sex' in x.error, results)))
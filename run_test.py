@@ -29,8 +29,10 @@ from prog_code.controller.edit_user_controllers_test import TestEditUserControll
 from prog_code.controller.enter_data_controllers_test import EnterDataControllersTests
 
 from prog_code.util.api_key_util_test import APIKeyUtilTests
+from prog_code.util.cache_util_test import CacheUtilTests
 from prog_code.util.consent_util_test import ConsentUtilTests
 from prog_code.util.legacy_csv_import_util_test import LegacyUploadParserAutomatonTests
+from prog_code.util.legacy_csv_import_util_test import LegacyParseCSVTests
 from prog_code.util.new_csv_import_util_test import NewUploadParserAutomatonTests
 from prog_code.util.db_util_test import DBUtilTests
 from prog_code.util.file_util_test import FileUtilTests
@@ -40,8 +42,11 @@ from prog_code.util.mail_util_test import MailUtilTests
 from prog_code.util.math_util_test import MathUtilTests
 from prog_code.util.oper_interp_test import OperUtilTests
 from prog_code.util.parent_account_util_test import ParentAccountUtilTests
+from prog_code.util.prebuilt_export_util_test import PrebuiltExportUtilTests
 from prog_code.util.recalc_util_test import RecalcPercentilesTest
 from prog_code.util.report_util_test import ReportUtilTest
+from prog_code.util.snapshot_ingest_util_test import SnapshotIngestUtilTests
+from prog_code.util.zip_import_util_test import ZipImportUtilTests
 
 
 if __name__ == '__main__':
@@ -17,4 +17,10 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
 from cdibase import app
-app.run(debug=True, threaded=False, processes=3)
+from cdibase import start_background_tasks
+
+# Guarded so that worker processes spawned for ZIP imports and reports do not
+# start servers or background tasks.
+if __name__ == '__main__':
+    start_background_tasks()
+    app.run(debug=True, threaded=False, processes=3)